@@ -0,0 +1,423 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (cli.py) Traitements en ligne de commande (cartographie par lot, serveur de cartographie local)
+# -----------------------------------------------------------------------------
+
+# Exemples :
+#   python cli.py serveur --gpkg cadastre.gpkg --couche batiments
+#   python cli.py cartographier dossier_photos cadastre.gpkg batiments --decalage 0 [--serveur] [--blocs 2000] [--export geoparquet] [--vues-360] [--calques geojson]
+#   python cli.py campagnes cadastre.gpkg batiments campagne_1 campagne_2 [--liste campagnes.txt] --sortie ville.gpkg
+#   python cli.py recalculer-angles dossier_photos --fov 104.6 --fov-appareil "HERO9 Black=118.2" [--appliquer]
+#   python cli.py calibrer dossier_photos cadastre.gpkg batiments [--appliquer]
+#   python cli.py annotations dossier_photos --creer-base | --exporter-json
+#   python cli.py pre-annoter dossier_photos detecteur.onnx --lot 8 [--appliquer --mode cartographie]
+#   python cli.py doublons dossier_photos --seuil 5 --distance 2 [--rapport doublons.csv]
+#   python cli.py photos-annotees dossier_photos [IMG_0150.JPG ...] [--vues-360]
+#   python cli.py extraire-video GX010042.MP4 dossier_photos --pas-distance 5 [--trace trace.gpx] [--decalage-cap 90]
+
+import os
+import csv
+import json
+import argparse
+from datetime import datetime
+
+
+# Commande "serveur" : démarre le serveur de cartographie (couches gardées en mémoire)
+def commande_serveur(args):
+    from utils.serveur_utils import lancer_serveur
+    precharger = [(args.gpkg, args.couche)] if args.gpkg and args.couche else None
+    lancer_serveur(args.hote, args.port, precharger)
+
+# Commande "cartographier" : équivalent du bouton "Cartographier les éléments" de l'interface
+def commande_cartographier(args):
+    image_folder = args.dossier
+    annotations_json = os.path.join(image_folder, "annotations.json")
+    exif_json = os.path.join(image_folder, "exif_data.json")
+    dossier_resultat = os.path.join(image_folder, 'resultat')
+    os.makedirs(dossier_resultat, exist_ok=True)
+    date_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+    nom_base = os.path.splitext(os.path.basename(args.gpkg))[0]
+    gpkg_output = args.sortie or os.path.join(dossier_resultat, f"{nom_base}_{date_str}.gpkg")
+
+    from utils.stockage_utils import chemin_base_annotations, BaseAnnotations
+    if os.path.exists(chemin_base_annotations(image_folder)):
+        # Base partagée : les traitements lisent annotations.json, exporté depuis la base
+        BaseAnnotations(chemin_base_annotations(image_folder)).exporter_json(annotations_json)
+
+    if not args.sans_images:
+        from utils.image_utils import dessiner_annotations_sur_images
+        dessiner_annotations_sur_images(image_folder, vues_360=args.vues_360, format_sortie=args.calques)
+
+    if args.serveur:
+        from utils.serveur_utils import appeler_serveur
+        reponse = appeler_serveur("/cartographier", {
+            "annotations_json": os.path.abspath(annotations_json),
+            "exif_json": os.path.abspath(exif_json),
+            "gpkg": os.path.abspath(args.gpkg),
+            "gpkg_output": os.path.abspath(gpkg_output),
+            "image_folder": os.path.abspath(image_folder),
+            "couche": args.couche,
+            "decalage_orientation": args.decalage
+        }, url=args.url)
+        print(f"Traitement effectué par le serveur en {reponse['duree_ms']:.0f} ms")
+    elif args.blocs:
+        from utils.flux_utils import creer_gpkg_par_blocs
+        creer_gpkg_par_blocs(annotations_json, exif_json, args.gpkg, gpkg_output, image_folder, args.couche, args.decalage,
+                             taille_bloc=args.blocs)
+    else:
+        from utils.geo_utils import creer_gpkg_complet
+        creer_gpkg_complet(annotations_json, exif_json, args.gpkg, gpkg_output, image_folder, args.couche, args.decalage)
+    print(f"GeoPackage écrit : {gpkg_output}")
+    if args.export != "gpkg":
+        from utils.export_utils import exporter_couches
+        fichiers = exporter_couches(gpkg_output, args.export)
+        print(f"{len(fichiers)} couches exportées en {args.export} : {os.path.dirname(fichiers[0]) if fichiers else '-'}")
+
+# Commande "campagnes" : plusieurs dossiers photo cartographiés en un seul GeoPackage consolidé
+def commande_campagnes(args):
+    dossiers = list(args.dossiers)
+    if args.liste:
+        # Un dossier par ligne (lignes vides et commentaires # ignorés)
+        with open(args.liste, "r", encoding="utf-8") as f:
+            dossiers += [ligne.strip() for ligne in f if ligne.strip() and not ligne.strip().startswith("#")]
+    if not dossiers:
+        raise SystemExit("Aucun dossier de campagne (arguments ou --liste)")
+    date_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+    nom_base = os.path.splitext(os.path.basename(args.gpkg))[0]
+    gpkg_output = args.sortie or f"{nom_base}_campagnes_{date_str}.gpkg"
+
+    if not args.sans_images:
+        from utils.image_utils import dessiner_annotations_sur_images
+        from utils.stockage_utils import chemin_base_annotations, BaseAnnotations
+        for dossier in dossiers:
+            if os.path.exists(chemin_base_annotations(dossier)):
+                BaseAnnotations(chemin_base_annotations(dossier)).exporter_json(os.path.join(dossier, "annotations.json"))
+            dessiner_annotations_sur_images(dossier, format_sortie=args.calques)
+
+    from utils.flux_utils import creer_gpkg_campagnes, TAILLE_BLOC_PHOTOS
+    debut = datetime.now()
+    photos = creer_gpkg_campagnes(dossiers, args.gpkg, gpkg_output, args.couche, args.decalage,
+                                  taille_bloc=args.blocs or TAILLE_BLOC_PHOTOS)
+    for campagne, nb in photos.items():
+        print(f"{campagne} : {nb} photos géolocalisées")
+    print(f"GeoPackage écrit : {gpkg_output} ({len(photos)} campagnes, {(datetime.now() - debut).total_seconds():.1f} s)")
+    if args.export != "gpkg":
+        from utils.export_utils import exporter_couches
+        fichiers = exporter_couches(gpkg_output, args.export)
+        print(f"{len(fichiers)} couches exportées en {args.export} : {os.path.dirname(fichiers[0]) if fichiers else '-'}")
+
+# Commande "recalculer-angles" : recalcul groupé des angles (simulation par défaut)
+def commande_recalculer_angles(args):
+    from utils.catalogue_utils import construire_catalogue
+    from utils.stockage_utils import charger_annotations_campagne, sauvegarder_annotations_campagne
+    from utils.recalcul_utils import modeles_appareils, recalculer_angles, charger_corrections
+
+    image_folder = args.dossier
+    with open(os.path.join(image_folder, "exif_data.json"), "r", encoding="utf-8") as f:
+        exif_data = json.load(f)
+    annotations = charger_annotations_campagne(image_folder)
+    fov_par_appareil = {}
+    for valeur in args.fov_appareil:
+        modele, _, fov = valeur.rpartition("=")
+        fov_par_appareil[modele] = float(fov)
+
+    rapport = recalculer_angles(
+        annotations, exif_data, construire_catalogue(image_folder), args.fov,
+        fov_par_appareil=fov_par_appareil, modeles=modeles_appareils(exif_data, image_folder),
+        corrections_direction=charger_corrections(image_folder), appliquer=args.appliquer
+    )
+    for modif in rapport["modifications"]:
+        print(f"{modif['image']} {modif['uuid']} : {modif['angle_ajuste_avant']} -> {modif['angle_ajuste_apres']:.4f}")
+    verbe = "modifiées" if args.appliquer else "à modifier (simulation, --appliquer pour enregistrer)"
+    print(f"{len(rapport['modifications'])} annotations {verbe} sur {rapport['nb_annotations']}, {len(rapport['ignorees'])} ignorées")
+    if args.rapport:
+        champs = ["image", "uuid", "type_objet", "angle_ajuste_avant", "angle_ajuste_apres", "ecart_horizontal",
+                  "angle_vertical_avant", "angle_vertical_apres"]
+        with open(args.rapport, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=champs)
+            writer.writeheader()
+            writer.writerows(rapport["modifications"])
+        print(f"Rapport écrit : {args.rapport}")
+    if args.appliquer and rapport["modifications"]:
+        sauvegarder_annotations_campagne(image_folder, annotations, [m["image"] for m in rapport["modifications"]])
+
+# Commande "calibrer" : recherche du décalage d'orientation et des corrections de direction par photo
+def commande_calibrer(args):
+    from utils.calibration_utils import calibrer_orientation
+    from utils.stockage_utils import charger_annotations_campagne, sauvegarder_annotations_campagne
+    from utils.recalcul_utils import appliquer_corrections
+
+    image_folder = args.dossier
+    with open(os.path.join(image_folder, "exif_data.json"), "r", encoding="utf-8") as f:
+        exif_data = json.load(f)
+    annotations = charger_annotations_campagne(image_folder)
+    debut, fin = (int(v) for v in args.decalages.split(":"))
+
+    resultat = calibrer_orientation(
+        annotations, exif_data, ancien_gpkg=args.gpkg, selected_layer=args.couche,
+        decalages=range(debut, fin + 1), par_photo=not args.sans_corrections,
+        correction_max=args.correction_max, pas_correction=args.pas, max_workers=args.workers
+    )
+    if resultat["decalage"] is None:
+        print("Aucune ligne de vue exploitable (annotations géolocalisées avec angle).")
+        return
+    print(f"{resultat['nb_rayons']} lignes de vue évaluées")
+    print(f"Décalage d'orientation retenu : {resultat['decalage']} (score {resultat['score_initial']:.3f})")
+    for nom, correction in sorted(resultat["corrections"].items()):
+        print(f"  {nom} : {correction:+.1f}°")
+    print(f"{len(resultat['corrections'])} corrections par photo, score final {resultat['score_final']:.3f}")
+    if args.appliquer and resultat["corrections"]:
+        appliquer_corrections(annotations, resultat["corrections"], image_folder)
+        sauvegarder_annotations_campagne(image_folder, annotations, resultat["corrections"])
+        print(f"Corrections appliquées aux annotations. Utiliser --decalage {resultat['decalage']} pour la cartographie.")
+
+# Commande "annotations" : création de la base partagée (import de annotations.json) ou export JSON
+def commande_annotations(args):
+    from utils.file_utils import charger_annotations
+    from utils.stockage_utils import chemin_base_annotations, BaseAnnotations
+
+    annotations_json = os.path.join(args.dossier, "annotations.json")
+    chemin_base = chemin_base_annotations(args.dossier)
+    if args.creer_base:
+        if os.path.exists(chemin_base):
+            print(f"La base partagée existe déjà : {chemin_base}")
+            return
+        annotations = charger_annotations(annotations_json) if os.path.exists(annotations_json) else {}
+        BaseAnnotations(chemin_base, wal=not args.sans_wal).importer_json(annotations)
+        print(f"Base partagée créée : {chemin_base} ({sum(len(v) for v in annotations.values())} annotations)")
+    elif not os.path.exists(chemin_base):
+        print(f"Pas de base partagée dans {args.dossier}")
+    else:
+        annotations = BaseAnnotations(chemin_base).exporter_json(annotations_json)
+        print(f"annotations.json exporté : {sum(len(v) for v in annotations.values())} annotations")
+
+# Commande "pre-annoter" : détecteur ONNX sur tout le dossier (candidats à valider dans l'interface, ou ajoutés avec --appliquer)
+def commande_pre_annoter(args):
+    from utils.catalogue_utils import construire_catalogue
+    from utils.file_utils import charger_config_annotations
+    from utils.detection_utils import ouvrir_detecteur, detecter_dossier, types_des_classes, candidats_image, valider_candidats
+    from utils.stockage_utils import charger_annotations_campagne, sauvegarder_annotations_campagne
+
+    image_folder = args.dossier
+    catalogue = construire_catalogue(image_folder)
+    session, infos_modele = ouvrir_detecteur(args.modele, nb_threads=args.threads)
+    debut = datetime.now()
+    contenu = detecter_dossier(
+        image_folder, catalogue, session, infos_modele, args.format, args.seuil, taille_lot=args.lot, max_workers=args.workers,
+        progression=lambda n, total: print(f"\r{n}/{total} photos", end="", flush=True)
+    )
+    print(f"\n{sum(len(b) for b in contenu['images'].values())} objets détectés sur {len(contenu['images'])} photos "
+          f"({(datetime.now() - debut).total_seconds():.1f} s)")
+    if not args.appliquer:
+        print("Candidats enregistrés dans detections_onnx.json : à valider dans l'interface (ou --appliquer)")
+        return
+
+    config_file = os.path.join(image_folder, "annotations_config.yaml")
+    config = charger_config_annotations(config_file) if os.path.exists(config_file) else {}
+    with open(os.path.join(image_folder, "exif_data.json"), "r", encoding="utf-8") as f:
+        exif_data = json.load(f)
+    annotations = charger_annotations_campagne(image_folder)
+    types_classes = types_des_classes(contenu["classes"], config, args.type_objet)
+    modifiees, ajoutees = [], 0
+    for nom, infos in catalogue.items():
+        candidats = candidats_image(contenu["images"].get(infos["empreinte"]), infos, exif_data.get(nom), args.fov,
+                                    args.mode, types_classes, contenu["classes"])
+        if candidats:
+            nb = valider_candidats(annotations, nom, candidats)
+            if nb:
+                modifiees.append(nom)
+                ajoutees += nb
+    sauvegarder_annotations_campagne(image_folder, annotations, modifiees)
+    print(f"{ajoutees} annotations ajoutées sur {len(modifiees)} photos")
+
+# Commande "doublons" : empreintes perceptuelles du dossier et groupes de photos quasi identiques
+def commande_doublons(args):
+    from utils.catalogue_utils import construire_catalogue
+    from utils.doublons_utils import indexer_dossier, grouper_doublons
+
+    image_folder = args.dossier
+    catalogue = construire_catalogue(image_folder)
+    debut = datetime.now()
+    empreintes = indexer_dossier(image_folder, catalogue, max_workers=args.workers,
+                                 progression=lambda n, total: print(f"\r{n}/{total} photos", end="", flush=True))
+    exif_json = os.path.join(image_folder, "exif_data.json")
+    exif_data = {}
+    if os.path.exists(exif_json):
+        with open(exif_json, "r", encoding="utf-8") as f:
+            exif_data = json.load(f)
+    groupes = grouper_doublons(catalogue, empreintes, exif_data, args.seuil, args.distance)["groupes"]
+    print(f"\n{len(groupes)} groupes de photos quasi identiques, {sum(len(m) - 1 for m in groupes)} photos redondantes "
+          f"sur {len(catalogue)} ({(datetime.now() - debut).total_seconds():.1f} s)")
+    if args.rapport:
+        with open(args.rapport, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["groupe", "image", "representant"])
+            for g, membres in enumerate(groupes, start=1):
+                writer.writerows([g, nom, membres[0]] for nom in membres)
+        print(f"Rapport écrit : {args.rapport}")
+
+# Commande "photos-annotees" : JPEG annotés pleine résolution, rendus à la demande (la cartographie n'écrit que des calques)
+def commande_photos_annotees(args):
+    from utils.stockage_utils import chemin_base_annotations, BaseAnnotations
+    from utils.image_utils import rendre_photo_annotee
+
+    image_folder = args.dossier
+    if os.path.exists(chemin_base_annotations(image_folder)):
+        annotations, _ = BaseAnnotations(chemin_base_annotations(image_folder)).charger()
+    else:
+        with open(os.path.join(image_folder, "annotations.json"), "r", encoding="utf-8") as f:
+            annotations = json.load(f)
+    images = args.images or [nom for nom, ann_list in annotations.items() if ann_list]
+    for nom in images:
+        if not os.path.exists(os.path.join(image_folder, nom)):
+            print(f"Image {nom} non trouvée, on saute.")
+            continue
+        rendre_photo_annotee(image_folder, nom, annotations.get(nom, []), vues_360=args.vues_360)
+
+# Commande "extraire-video" : images géolocalisées extraites d'une vidéo (télémétrie GoPro, trace GPX ou CSV)
+def commande_extraire_video(args):
+    from utils.video_utils import extraire_images_video
+
+    debut = datetime.now()
+    extraites = extraire_images_video(
+        args.video, args.dossier, chemin_trace=args.trace, pas_temps=args.pas_temps, pas_distance=args.pas_distance,
+        decalage_temps=args.decalage_temps, decalage_cap=args.decalage_cap, max_workers=args.workers, qualite=args.qualite,
+        progression=lambda n, total: print(f"\r{n}/{total} images", end="", flush=True)
+    )
+    sans_cap = sum(1 for e in extraites.values() if e["direction"] is None)
+    print(f"\n{len(extraites)} images extraites dans {args.dossier} ({(datetime.now() - debut).total_seconds():.1f} s)")
+    if sans_cap:
+        print(f"{sans_cap} images sans direction (trace trop courte pour calculer le cap)")
+
+
+def main():
+    from utils.serveur_utils import HOTE_SERVEUR, PORT_SERVEUR, URL_SERVEUR
+
+    parser = argparse.ArgumentParser(description="Photo'Mapon - traitements en ligne de commande")
+    sous_commandes = parser.add_subparsers(dest="commande", required=True)
+
+    p_serveur = sous_commandes.add_parser("serveur", help="Démarre le serveur de cartographie local")
+    p_serveur.add_argument("--hote", default=HOTE_SERVEUR)
+    p_serveur.add_argument("--port", type=int, default=PORT_SERVEUR)
+    p_serveur.add_argument("--gpkg", help="GeoPackage de référence à précharger")
+    p_serveur.add_argument("--couche", help="Couche à précharger")
+    p_serveur.set_defaults(fonction=commande_serveur)
+
+    p_carto = sous_commandes.add_parser("cartographier", help="Cartographie les annotations d'un dossier photo")
+    p_carto.add_argument("dossier", help="Dossier des images (annotations.json et exif_data.json)")
+    p_carto.add_argument("gpkg", help="GeoPackage de référence (EPSG:2154)")
+    p_carto.add_argument("couche", help="Couche du GeoPackage à utiliser")
+    p_carto.add_argument("--decalage", type=int, default=0, help="Décalage d'orientation (0 à 180)")
+    p_carto.add_argument("--sortie", help="Chemin du GeoPackage de sortie (défaut : dossier resultat)")
+    p_carto.add_argument("--sans-images", action="store_true", help="Ne pas générer les photos annotées")
+    p_carto.add_argument("--vues-360", action="store_true",
+                         help="Ajouter une vue perspective recadrée sur chaque annotation des photos 360°")
+    p_carto.add_argument("--calques", choices=["svg", "geojson", "jpeg"], default="svg",
+                         help="Photos annotées : calques SVG ou GeoJSON (la photo n'est pas réencodée) ou JPEG annotés")
+    p_carto.add_argument("--serveur", action="store_true", help="Déléguer le traitement au serveur de cartographie")
+    p_carto.add_argument("--export", choices=["gpkg", "geoparquet", "flatgeobuf"], default="gpkg",
+                         help="Export supplémentaire des couches phm_* (GeoParquet nécessite pyarrow)")
+    p_carto.add_argument("--blocs", type=int, metavar="N",
+                         help="Traitement en flux par blocs de N photos voisines (grandes campagnes : moins de mémoire, "
+                              "annotations, EXIF et points d'impact restent chargés en entier)")
+    p_carto.add_argument("--url", default=URL_SERVEUR, help="Adresse du serveur de cartographie")
+    p_carto.set_defaults(fonction=commande_cartographier)
+
+    p_campagnes = sous_commandes.add_parser("campagnes", help="Cartographie plusieurs dossiers photo en un seul GeoPackage")
+    p_campagnes.add_argument("gpkg", help="GeoPackage de référence (EPSG:2154), chargé une seule fois")
+    p_campagnes.add_argument("couche", help="Couche du GeoPackage à utiliser")
+    p_campagnes.add_argument("dossiers", nargs="*", help="Dossiers des campagnes (annotations et exif_data.json)")
+    p_campagnes.add_argument("--liste", help="Fichier texte des dossiers de campagne, un par ligne")
+    p_campagnes.add_argument("--decalage", type=int, default=0, help="Décalage d'orientation (0 à 180)")
+    p_campagnes.add_argument("--sortie", help="Chemin du GeoPackage consolidé (défaut : <gpkg>_campagnes_<date>.gpkg)")
+    p_campagnes.add_argument("--sans-images", action="store_true", help="Ne pas générer les photos annotées")
+    p_campagnes.add_argument("--calques", choices=["svg", "geojson", "jpeg"], default="svg",
+                             help="Photos annotées : calques SVG ou GeoJSON (la photo n'est pas réencodée) ou JPEG annotés")
+    p_campagnes.add_argument("--blocs", type=int, metavar="N", help="Nombre de photos traitées par bloc")
+    p_campagnes.add_argument("--export", choices=["gpkg", "geoparquet", "flatgeobuf"], default="gpkg",
+                             help="Export supplémentaire des couches phm_*")
+    p_campagnes.set_defaults(fonction=commande_campagnes)
+
+    p_angles = sous_commandes.add_parser("recalculer-angles", help="Recalcule les angles des annotations (FOV, orientation)")
+    p_angles.add_argument("dossier", help="Dossier des images (annotations.json et exif_data.json)")
+    p_angles.add_argument("--fov", type=float, default=104.6, help="FOV horizontal par défaut (degrés)")
+    p_angles.add_argument("--fov-appareil", action="append", default=[], metavar="MODELE=FOV",
+                          help="FOV d'un modèle d'appareil (option répétable)")
+    p_angles.add_argument("--appliquer", action="store_true", help="Enregistrer les angles recalculés (sinon simulation)")
+    p_angles.add_argument("--rapport", help="Fichier CSV du rapport des différences")
+    p_angles.set_defaults(fonction=commande_recalculer_angles)
+
+    p_calib = sous_commandes.add_parser("calibrer", help="Calibre le décalage d'orientation et la direction de chaque photo")
+    p_calib.add_argument("dossier", help="Dossier des images (annotations.json et exif_data.json)")
+    p_calib.add_argument("gpkg", help="GeoPackage de référence (EPSG:2154)")
+    p_calib.add_argument("couche", help="Couche du GeoPackage à utiliser")
+    p_calib.add_argument("--decalages", default="0:180", help="Intervalle des décalages testés (début:fin, pas de 1)")
+    p_calib.add_argument("--sans-corrections", action="store_true", help="Ne pas chercher de correction par photo")
+    p_calib.add_argument("--correction-max", type=float, default=10.0, help="Correction maximale par photo (degrés)")
+    p_calib.add_argument("--pas", type=float, default=0.5, help="Pas des corrections testées (degrés)")
+    p_calib.add_argument("--workers", type=int, help="Nombre de processus (défaut : nombre de cœurs)")
+    p_calib.add_argument("--appliquer", action="store_true", help="Appliquer les corrections par photo aux annotations")
+    p_calib.set_defaults(fonction=commande_calibrer)
+
+    p_annot = sous_commandes.add_parser("annotations", help="Base d'annotations partagée entre plusieurs annotateurs")
+    p_annot.add_argument("dossier", help="Dossier des images (annotations.json, annotations.sqlite)")
+    action_annot = p_annot.add_mutually_exclusive_group(required=True)
+    action_annot.add_argument("--creer-base", action="store_true", help="Crée annotations.sqlite à partir de annotations.json")
+    action_annot.add_argument("--exporter-json", action="store_true", help="Écrit annotations.json à partir de la base")
+    p_annot.add_argument("--sans-wal", action="store_true",
+                         help="Avec --creer-base : journal classique au lieu du mode WAL (base sur un dossier réseau partagé)")
+    p_annot.set_defaults(fonction=commande_annotations)
+
+    p_detect = sous_commandes.add_parser("pre-annoter", help="Pré-annotation des photos standards par un détecteur ONNX (CPU)")
+    p_detect.add_argument("dossier", help="Dossier des images")
+    p_detect.add_argument("modele", help="Modèle de détection ONNX (export YOLO)")
+    p_detect.add_argument("--format", choices=["yolov8", "yolov5"], default="yolov8", help="Format de sortie du modèle")
+    p_detect.add_argument("--seuil", type=float, default=0.25, help="Confiance minimale des détections")
+    p_detect.add_argument("--lot", type=int, default=8, help="Nombre d'images par inférence")
+    p_detect.add_argument("--workers", type=int, help="Threads de préparation des images (défaut : nombre de cœurs, 8 au plus)")
+    p_detect.add_argument("--threads", type=int, help="Threads d'inférence onnxruntime (défaut : nombre de cœurs)")
+    p_detect.add_argument("--appliquer", action="store_true", help="Ajouter directement les détections aux annotations")
+    p_detect.add_argument("--mode", default="cartographie", help="Mode d'annotation des annotations ajoutées")
+    p_detect.add_argument("--type-objet", help="Type d'objet des classes absentes de la configuration YAML")
+    p_detect.add_argument("--fov", type=float, default=104.6, help="FOV horizontal (degrés) pour le calcul des angles")
+    p_detect.set_defaults(fonction=commande_pre_annoter)
+
+    p_doublons = sous_commandes.add_parser("doublons", help="Repère les photos quasi identiques (empreinte perceptuelle et GPS)")
+    p_doublons.add_argument("dossier", help="Dossier des images")
+    p_doublons.add_argument("--seuil", type=int, default=5, help="Écart maximal des empreintes (bits sur 64)")
+    p_doublons.add_argument("--distance", type=float, default=2.0, help="Distance GPS maximale entre doublons (mètres)")
+    p_doublons.add_argument("--workers", type=int, help="Threads de calcul des empreintes (défaut : nombre de cœurs, 8 au plus)")
+    p_doublons.add_argument("--rapport", help="Fichier CSV des groupes (groupe, image, représentant)")
+    p_doublons.set_defaults(fonction=commande_doublons)
+
+    p_annotees = sous_commandes.add_parser("photos-annotees", help="Génère les photos annotées pleine résolution (JPEG)")
+    p_annotees.add_argument("dossier", help="Dossier des images (annotations.json ou annotations.sqlite)")
+    p_annotees.add_argument("images", nargs="*", help="Images à rendre (défaut : toutes les images annotées)")
+    p_annotees.add_argument("--vues-360", action="store_true",
+                            help="Ajoute une vue perspective centrée sur chaque annotation des photos 360°")
+    p_annotees.set_defaults(fonction=commande_photos_annotees)
+
+    p_video = sous_commandes.add_parser("extraire-video", help="Extrait des images géolocalisées d'une vidéo")
+    p_video.add_argument("video", help="Vidéo (MP4 / MOV)")
+    p_video.add_argument("dossier", help="Dossier des images (créé si besoin, exif_data.json complété)")
+    p_video.add_argument("--trace", help="Trace GPX ou CSV (défaut : télémétrie GPS GoPro de la vidéo)")
+    pas_video = p_video.add_mutually_exclusive_group()
+    pas_video.add_argument("--pas-distance", type=float, default=5.0, help="Une image tous les N mètres (défaut : 5)")
+    pas_video.add_argument("--pas-temps", type=float, help="Une image toutes les N secondes")
+    p_video.add_argument("--decalage-temps", type=float, default=0.0,
+                         help="Position du début de la vidéo dans la trace (secondes)")
+    p_video.add_argument("--decalage-cap", type=float, default=0.0,
+                         help="Angle entre la caméra et le sens de déplacement (ex : 90 pour une caméra tournée vers la droite)")
+    p_video.add_argument("--workers", type=int, help="Threads de décodage (défaut : nombre de cœurs, 4 au plus)")
+    p_video.add_argument("--qualite", type=int, default=92, help="Qualité JPEG des images extraites")
+    p_video.set_defaults(fonction=commande_extraire_video)
+
+    args = parser.parse_args()
+    args.fonction(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,16 +8,29 @@
 
 # --- IMPORTS ET FONCTIONS UTILES ---
 # Import des modules nécessaires (traitements, UI, utilitaires, etc.)
+# Les modules lourds (geo_utils : geopandas, shapely, pyproj, scipy...) ne sont importés
+# qu'au moment de la cartographie ou de l'aperçu des lignes de vue pour accélérer le démarrage.
 import os
+import time
 from datetime import datetime
 import streamlit as st
 from streamlit_image_coordinates import streamlit_image_coordinates
 import json
-import fiona
-from utils.file_utils import charger_config_annotations, get_mapping_yaml_if_exists, sauvegarder_annotations, charger_annotations 
-from utils.geo_utils import creer_gpkg_complet, prepare_temp_gpkg
+from utils.file_utils import get_mapping_yaml_if_exists, sauvegarder_annotations, charger_annotations, empreinte_fichier, prepare_temp_gpkg, supprimer_copie_temporaire, lister_couches_gpkg
+from utils.serveur_utils import appeler_serveur, serveur_disponible, lancer_rayons_serveur, URL_SERVEUR
 from utils.exif_utils import charger_exif_depuis_json, extraire_et_sauvegarder_exif 
-from utils.image_utils import dessiner_annotations_sur_images, lister_images, redimens_image, dessiner_overlay, redresser_image_hero9_cached, is_360_photo
+from utils.image_utils import dessiner_annotations_sur_images, redimens_image, dessiner_overlay, redresser_image_hero9_cached, \
+    rendre_photo_annotee, chemin_photo_annotee, FORMATS_PHOTOS_ANNOTEES
+from utils.catalogue_utils import charger_catalogue, mtime_dossier, tranche_verification, image_modifiee
+from utils.recalcul_utils import modeles_appareils, recalculer_angles, charger_corrections, appliquer_corrections
+from utils.recherche_utils import charger_index_noms, rechercher_noms, filtrer_images, paginer, TAILLE_PAGE_RECHERCHE
+from utils.export_utils import exporter_couches, pyarrow_disponible, FORMATS_EXPORT
+from utils.cache_utils import charger_config_partagee, charger_exif_partage, statistiques_caches
+from utils.doublons_utils import indexer_dossier, charger_groupes_doublons, photos_masquees, position_voisine, FICHIER_EMPREINTES_VISUELLES, SEUIL_HAMMING, DISTANCE_DOUBLONS
+from utils.detection_utils import onnxruntime_disponible, charger_detecteur, detecter_dossier, detections_dossier, types_des_classes, candidats_image, valider_candidats, marquer_revue, FORMATS_SORTIE, SEUIL_CONFIANCE_DETECTION
+from utils.grappes_utils import charger_index_carte, vue_ensemble, grappes_vue, photos_grappe, photos_vue, zoom_eclatement, nb_annotations_photos, lonlat_vers_mercator, mercator_vers_lonlat, ZOOM_MIN_CARTE, ZOOM_MAX_CARTE, TAILLE_CARTE
+from utils.perf_utils import debut_rerun, fin_rerun, mesurer, noter_taille, perf_active, synthese_perf, exporter_csv_perf
+from utils.stockage_utils import ouvrir_base_annotations, chemin_base_annotations
 from utils.annotation_utils import ajouter_annotation, modifier_annotation, supprimer_annotation, reinitialiser_annotations_image, pannellum_to_metier, prepare_hotspots_for_pannellum, creer_dataframe_annotations_360,  calculer_angle_objet, calculer_fov_vertical,calculer_angle_elevation, creer_dataframe_annotations
 from PIL import Image
 from visu360.visu360 import pannellum_viewer
@@ -33,13 +46,14 @@ def safe_index(options, value):
 # Responsabilités :
 # - Chargement d'un dossier d'images et des métadonnées EXIF (exif_data.json)
 # - Interface d'annotation (photos 360° via Pannellum et photos standards via streamlit_image_coordinate)
-# - Sauvegarde des annotations dans un fichier JSON (annotations.json)
+# - Sauvegarde des annotations dans un fichier JSON (annotations.json) ou dans la base partagée annotations.sqlite
+#   (plusieurs annotateurs, écritures ligne à ligne, voir utils/stockage_utils.py)
 # - Export cartographique vers un GPKG
 
 # Formats clés :
 # - annotations.json : { "<image_name>": [ { "uuid": str, "x": int, "y": int, "yaw": float, "pitch": float,
 #    "type_objet": str, "fonction_objet": str, "mode_annotation": str, "date": ISO8601, ... }, ... ], ... }
-# - exif_data.json : mapping image_name -> { "lat": float, "lon": float, "direction": float, "format": str, "date_time": str }
+# - exif_data.json : mapping image_name -> { "lat": float, "lon": float, "direction": float, "format": str, "date_time": str, "modele_appareil": str }
 
 # Attention :
 # - st.session_state est utilisé pour stocker l'état UI et commandes JS (cmd_action/cmd_data).
@@ -53,24 +67,59 @@ def safe_index(options, value):
 # - cmd_data: dict|None -> Données associées à cmd_action (ex: {"uuid": "...", "yaw":..., "pitch":..., "hfov":...}).
 # - selected_uuid: str|None -> Clé historique / potentiellement redondante avec selected_annotation.
 # - last_image_folder: str|None -> Dossier chargé précédemment (servir à détecter changement de dossier).
-# - annotations: dict -> Mapping image_name -> list[annotation dict] (in memory, sauvegardé dans annotations.json).
-# - current_image_index: int -> Index de l'image affichée.
+# - annotations: dict -> Mapping image_name -> list[annotation dict] (in memory, sauvegardé dans annotations.json ou annotations.sqlite).
+# - seq_annotations: int -> Dernière séquence de changement lue dans la base partagée (initialisée au chargement du dossier,
+#   avancée à chaque rerun par changements_depuis ; absente sans base partagée).
+# - current_image_index: int -> Index de l'image affichée (dans l'ordre alphabétique du catalogue).
 # - fov_input: float -> Valeur FOV saisie par l'utilisateur (key du number_input).
 # - mode_annotation_selectbox / mode_annotation_selectbox_edit: str -> Valeurs des selectbox (création / édition).
 # - type_objet_selectbox_create / type_objet_selectbox_edit: str
 # - fonction_objet_selectbox_create / fonction_objet_edit: str
 # - decalage_orientation: int ->  Décalage d'orientation utilisateur (key du number_input).
 # - gpkg: UploadedFile (key du file_uploader)
+# - source_gpkg: str -> Origine du GeoPackage de référence ("Téléverser un fichier" ou "Chemin sur le serveur").
+# - gpkg_chemin_serveur: str -> Chemin d'un GeoPackage lu sur place, sans copie (key du text_input).
 # - tmp_gpkg_path: str -> Chemin du gpkg temporaire créé par prepare_temp_gpkg (à nettoyer après usage).
+# - tmp_gpkg_path_source: str -> Identifiant du fichier uploadé ayant servi à créer tmp_gpkg_path.
+# - utiliser_serveur: bool -> Délègue la cartographie au serveur local (python cli.py serveur) s'il répond.
+# - format_export: str -> Export supplémentaire des couches phm_* après la cartographie ("gpkg", "geoparquet", "flatgeobuf").
+# - format_photos_annotees: str -> Sortie des photos annotées de la cartographie ("svg", "geojson" : calques ; "jpeg" : photos réencodées).
+# - photo_annotee_prete: str -> Chemin de la dernière photo annotée rendue à la demande (téléchargeable tant que l'image est affichée).
+# - vues_360: bool -> Photos annotées : ajoute une vue perspective centrée sur chaque annotation des photos 360°.
+# - apercu_lignes_vue: bool -> Affiche la carte des lignes de vue de l'image courante (key du toggle).
 # - pannellum_yaw / pannellum_pitch / pannellum_hfov: float -> État du viewer 360 maintenu entre rerun.
 # - _rerun_once: bool -> Flag temporaire pour éviter boucle rerun lors de MAJ venant du JS.
 # - reset_search_field: bool -> Flag pour réinitialiser proprement le champ de recherche après rerun.
+# - filtre_annotation / filtre_type_photo / filtre_gps_manquant / filtre_direction_manquante / filtre_dates -> Filtres de recherche (keys des widgets).
+# - resultats_recherche: list[str] -> Noms des images de la dernière recherche à plusieurs résultats (supprimée par "Fermer" ou une nouvelle recherche).
+# - page_recherche: int -> Page affichée des résultats (key du number_input, remise à 1 à chaque recherche).
+# - choix_resultat_recherche: str -> Image sélectionnée dans la page de résultats.
+# - fov_appareils: dict -> Modifications du tableau des FOV par appareil (key du data_editor).
+# - rapport_recalcul: dict -> Dernier rapport du recalcul des angles (simulation ou application).
+# - calibration_par_photo / calibration_correction_max -> Options de la calibration (keys des widgets).
+# - resultat_calibration: dict -> Dernier résultat de calibrer_orientation (décalage, scores, corrections par photo).
+# - decalage_calibre: int -> Décalage à reporter dans decalage_orientation au rerun suivant (supprimée aussitôt).
+# - modele_onnx: UploadedFile -> Détecteur ONNX de la pré-annotation (key du file_uploader).
+# - tmp_model_path / tmp_model_path_source: str -> Copie temporaire du modèle uploadé (prepare_temp_gpkg, supprimée par cleanup_temp_files).
+# - format_sortie_onnx / seuil_detection -> Options de la pré-annotation (keys des widgets).
+# - candidats_<image>: list[int] -> Candidats détectés cochés pour validation sur l'image (key du multiselect).
+# - seuil_doublons / distance_doublons -> Seuils du regroupement des photos quasi identiques (keys des widgets).
+# - masquer_doublons: bool -> Navigation sans les photos quasi identiques non annotées (la première de chaque groupe reste visible).
+# - carte_photos_visible: bool -> Affiche la carte des photos (key du toggle).
+# - centre_carte: tuple[float,float] -> Centre de la carte des photos (Web Mercator normalisé), initialisé sur la vue d'ensemble.
+# - zoom_carte: int -> Zoom de la carte des photos, qui fixe le regroupement en grappes (key du slider, modifié par les clics).
+# - selection_carte_photos -> Grappe cliquée sur la carte des photos (key du pydeck_chart, traitée par son callback).
+# - diagnostic_perf: bool -> Active les mesures de durée des sections et des tailles envoyées au navigateur (key du toggle).
+# - mesures_perf: dict -> Mesures du rerun en cours (ouvertes par debut_rerun, versées dans historique_perf au rerun suivant).
+# - historique_perf: list[dict] -> Une ligne par rerun mesuré (HISTORIQUE_PERF dernières), exportable en CSV.
 
 # Notes :
 # - Documenter chaque nouvelle clé, qui l'initialise et quand la supprimer.
 
 # --- CONFIGURATION DE LA PAGE STREAMLIT ---
 st.set_page_config(layout="wide")
+# Diagnostic des performances : clôt les mesures du rerun précédent et ouvre celles de ce rerun
+debut_rerun()
 
 # --- INITIALISATION DES VARIABLES DE SESSION ---
 # Initialisation du session_state pour selected_annotation
@@ -93,6 +142,27 @@ image_folder = st.text_input(
 # --- CHEMIN DU FICHIER D'ANNOTATIONS ---
 annotations_file = os.path.join(image_folder, "annotations.json")
 
+# --- BASE D'ANNOTATIONS PARTAGÉE ---
+# Si annotations.sqlite existe dans le dossier, tous les annotateurs lisent et écrivent dans la base
+# (une transaction par annotation) ; annotations.json n'est plus qu'un export pour les traitements
+base_file = chemin_base_annotations(image_folder)
+base_annotations = ouvrir_base_annotations(base_file) if image_folder and os.path.exists(base_file) else None
+
+def charger_annotations_dossier():
+    if base_annotations is not None:
+        annotations, st.session_state.seq_annotations = base_annotations.charger()
+        return annotations
+    st.session_state.pop("seq_annotations", None)
+    return charger_annotations(annotations_file) if os.path.exists(annotations_file) else {}
+
+# Enregistrement après une modification groupée (les ajouts / modifications / suppressions unitaires passent base=)
+def sauvegarder_images(images):
+    with mesurer("sauvegarde"):
+        if base_annotations is not None:
+            base_annotations.enregistrer_images(st.session_state.annotations, images)
+        else:
+            sauvegarder_annotations(annotations_file, st.session_state.annotations)
+
 # --- GESTION DU RECHARGEMENT DES ANNOTATIONS SI CHANGEMENT DE DOSSIER ---
 if "last_image_folder" not in st.session_state:
     st.session_state.last_image_folder = None
@@ -100,25 +170,25 @@ if "last_image_folder" not in st.session_state:
 if image_folder and os.path.exists(image_folder):
     if image_folder != st.session_state.last_image_folder:
         # Nouveau dossier : on recharge les annotations
-        if os.path.exists(annotations_file):
-            try:
-                st.session_state.annotations = charger_annotations(annotations_file)
-            except Exception as e:
-                st.warning(f"⚠️ Erreur lors du chargement des annotations : {e}")
-                st.session_state.annotations = {}
-        else:
+        try:
+            st.session_state.annotations = charger_annotations_dossier()
+        except Exception as e:
+            st.warning(f"⚠️ Erreur lors du chargement des annotations : {e}")
             st.session_state.annotations = {}
         st.session_state.last_image_folder = image_folder
-    elif "annotations" not in st.session_state:
-        # Premier chargement des annotations si elles n'existent pas encore en session
-        if os.path.exists(annotations_file):
-            try:
-                st.session_state.annotations = charger_annotations(annotations_file)
-            except Exception as e:
-                st.warning(f"⚠️ Erreur lors du chargement des annotations : {e}")
-                st.session_state.annotations = {}
-        else:
+    elif "annotations" not in st.session_state or (base_annotations is not None and "seq_annotations" not in st.session_state):
+        # Premier chargement des annotations si elles n'existent pas encore en session (ou base partagée tout juste créée)
+        try:
+            st.session_state.annotations = charger_annotations_dossier()
+        except Exception as e:
+            st.warning(f"⚠️ Erreur lors du chargement des annotations : {e}")
             st.session_state.annotations = {}
+    elif base_annotations is not None:
+        # Base partagée : on relit seulement les images modifiées depuis le dernier rerun (par soi ou un autre annotateur)
+        with mesurer("relecture_base"):
+            images_modifiees, st.session_state.seq_annotations = base_annotations.changements_depuis(st.session_state.seq_annotations)
+            for img in images_modifiees:
+                st.session_state.annotations[img] = base_annotations.annotations_image(img)
 else:
     # Si le dossier n'existe pas, on réinitialise les annotations
     st.session_state.annotations = {}
@@ -128,17 +198,22 @@ if "annotations" not in st.session_state:
     st.session_state.annotations = {}
 
 # --- LISTE DES FICHIERS IMAGE DU DOSSIER ---
-image_files = lister_images(image_folder)
+# Catalogue des images (dimensions, 360°, empreinte) lu depuis catalogue_images.json et mis à jour
+# uniquement pour les images nouvelles ou modifiées (tailles et dates revérifiées toutes les 30 s, et pour
+# l'image affichée à chaque rerun) ; l'ordre de navigation est alphabétique
+with mesurer("catalogue"):
+    catalogue = charger_catalogue(image_folder, mtime_dossier(image_folder), tranche_verification()) if image_folder else {}
+image_files = list(catalogue)
 
 # --- GÉNÉRATION AUTOMATIQUE DU FICHIER EXIF SI ABSENT ---
 exif_output_file = os.path.join(image_folder, "exif_data.json")
 if image_folder and image_files and not os.path.exists(exif_output_file):
     extraire_et_sauvegarder_exif(image_folder, exif_output_file)
 
-exif_data = {}
-if os.path.exists(exif_output_file):
-    with open(exif_output_file, "r", encoding="utf-8") as f:
-        exif_data = json.load(f)
+# EXIF et configuration lus une fois par processus pour toutes les sessions, relus seulement si le fichier change
+# (objets partagés : ne pas les modifier, voir utils/cache_utils.py)
+with mesurer("exif"):
+    exif_data = charger_exif_partage(exif_output_file)
 
 #if "backup_created" not in st.session_state:
 #    creer_backup_annotations(annotations_file)
@@ -151,7 +226,7 @@ if "current_image_index" not in st.session_state:
 # --- CHARGEMENT DE LA CONFIGURATION YAML DES ANNOTATIONS ---
 config_file = os.path.join(image_folder, "annotations_config.yaml")
 try:
-    config = charger_config_annotations(config_file)
+    config = charger_config_partagee(config_file)
 except Exception:
     config = {}
 
@@ -199,7 +274,127 @@ with st.sidebar:
         st.success("EXIF recalculées et sauvegardées.")
         st.cache_data.clear()  # important pour forcer le rechargement
         st.rerun()
-    
+
+    # --- Base d'annotations partagée entre plusieurs annotateurs ---
+    with st.expander("👥 Annotation à plusieurs"):
+        if base_annotations is None:
+            st.caption("Annotations enregistrées dans annotations.json (un seul annotateur à la fois).")
+            if st.button("Créer la base partagée", width='stretch', disabled=not image_folder or not os.path.exists(image_folder)):
+                # Import de annotations.json : les autres sessions basculent sur la base à leur prochain rerun
+                ouvrir_base_annotations(base_file).importer_json(st.session_state.annotations)
+                st.rerun()
+        else:
+            st.caption(f"Base partagée {os.path.basename(base_file)} : chaque annotation est écrite séparément, "
+                       "les modifications des autres annotateurs sont relues à chaque interaction.")
+            if st.button("Exporter annotations.json", width='stretch'):
+                base_annotations.exporter_json(annotations_file)
+                st.success("annotations.json exporté depuis la base.")
+
+    # --- Pré-annotation par un détecteur d'objets ONNX (candidats validés ensuite par l'opérateur) ---
+    with st.expander("🤖 Pré-annotation (détecteur ONNX)"):
+        if not onnxruntime_disponible():
+            st.caption("La pré-annotation nécessite onnxruntime (pip install onnxruntime).")
+        else:
+            modele_onnx = st.file_uploader("Modèle de détection (.onnx, export YOLO)", type=["onnx"], key="modele_onnx")
+            format_sortie_onnx = st.selectbox("Format de sortie du modèle", FORMATS_SORTIE, key="format_sortie_onnx")
+            seuil_detection = st.slider("Confiance minimale", 0.05, 0.95, SEUIL_CONFIANCE_DETECTION, 0.05, key="seuil_detection")
+            st.caption("Photos standards uniquement ; seules les photos nouvelles ou modifiées sont traitées à chaque lancement.")
+            if st.button("Détecter sur tout le dossier", width='stretch', disabled=modele_onnx is None or not catalogue):
+                chemin_modele = prepare_temp_gpkg(modele_onnx, st.session_state, session_key="tmp_model_path", suffixe=".onnx")
+                try:
+                    session_onnx, infos_modele = charger_detecteur(chemin_modele, empreinte_fichier(chemin_modele))
+                    barre = st.progress(0.0, text="Détection en cours...")
+                    contenu_detections = detecter_dossier(
+                        image_folder, catalogue, session_onnx, infos_modele, format_sortie_onnx, seuil_detection,
+                        progression=lambda n, total: barre.progress(n / total, text=f"Détection : {n}/{total} photos")
+                    )
+                    st.success(f"{sum(len(b) for b in contenu_detections['images'].values())} objets détectés "
+                               f"sur {len(contenu_detections['images'])} photos.")
+                except Exception as e:
+                    st.error("Erreur pendant la détection.")
+                    st.code(str(e))
+
+    # --- Photos quasi identiques (captures denses) : regroupement et navigation sans les doublons ---
+    groupes_doublons = None
+    with st.expander("🪞 Photos quasi identiques"):
+        seuil_doublons = st.slider("Écart maximal des empreintes (bits sur 64)", 0, 12, SEUIL_HAMMING, key="seuil_doublons")
+        distance_doublons = st.number_input("Distance GPS maximale (m)", min_value=0.0, max_value=50.0,
+                                            value=DISTANCE_DOUBLONS, step=0.5, key="distance_doublons")
+        st.caption("Seules les photos nouvelles ou modifiées sont traitées à chaque indexation.")
+        if st.button("Indexer le dossier", width='stretch', disabled=not catalogue):
+            barre = st.progress(0.0, text="Calcul des empreintes...")
+            indexer_dossier(image_folder, catalogue,
+                            progression=lambda n, total: barre.progress(n / total, text=f"Empreintes : {n}/{total} photos"))
+        fichier_empreintes = os.path.join(image_folder, FICHIER_EMPREINTES_VISUELLES)
+        if catalogue and os.path.exists(fichier_empreintes):
+            groupes_doublons = charger_groupes_doublons(
+                image_folder, mtime_dossier(image_folder), os.path.getmtime(fichier_empreintes),
+                os.path.getmtime(exif_output_file) if os.path.exists(exif_output_file) else None,
+                seuil_doublons, distance_doublons, catalogue, exif_data
+            )
+            st.caption(f"{len(groupes_doublons['groupes'])} groupes, "
+                       f"{sum(len(m) - 1 for m in groupes_doublons['groupes'])} photos redondantes.")
+            st.toggle("Masquer les doublons dans la navigation", key="masquer_doublons",
+                      help="La première photo de chaque groupe et les photos annotées restent visibles")
+
+    # --- Diagnostic des performances (durées par section et tailles envoyées au navigateur, par rerun) ---
+    with st.expander("⏱️ Diagnostic des performances"):
+        st.toggle("Mesurer chaque rerun", key="diagnostic_perf",
+                  help="Durée des sections (décodage, overlay, tableau, sauvegarde, visionneuses) et taille des données envoyées aux composants")
+        historique_perf = st.session_state.get("historique_perf", [])
+        if historique_perf:
+            st.caption(f"{len(historique_perf)} reruns mesurés (durées en ms, tailles en octets)")
+            st.dataframe(synthese_perf(historique_perf), hide_index=True)
+            col_p1, col_p2 = st.columns(2)
+            col_p1.download_button("Exporter en CSV", exporter_csv_perf(historique_perf), file_name="diagnostic_performances.csv",
+                                   mime="text/csv", width='stretch')
+            if col_p2.button("Vider", width='stretch', key="vider_historique_perf"):
+                st.session_state.historique_perf = []
+                st.rerun()
+        stats_caches = statistiques_caches()["compteurs"]
+        if stats_caches:
+            st.caption("Cache partagé : " + ", ".join(f"{nom} {c['hits']} lus en mémoire / {c['misses']} depuis le disque"
+                                                      for nom, c in sorted(stats_caches.items())))
+
+    # --- Recalcul groupé des angles (FOV ou orientation corrigés après coup) ---
+    with st.expander("📐 Recalculer les angles des annotations"):
+        modeles = modeles_appareils(exif_data)
+        photos_par_appareil = {}
+        for modele in modeles.values():
+            if modele:
+                photos_par_appareil[modele] = photos_par_appareil.get(modele, 0) + 1
+        fov_par_appareil = {}
+        if photos_par_appareil:
+            st.caption(f"FOV par appareil (défaut : {fov_user}°)")
+            table_fov = st.data_editor(
+                [{"appareil": m, "photos": n, "fov": fov_user} for m, n in sorted(photos_par_appareil.items())],
+                disabled=["appareil", "photos"], hide_index=True, key="fov_appareils"
+            )
+            fov_par_appareil = {ligne["appareil"]: float(ligne["fov"]) for ligne in table_fov}
+        else:
+            st.caption(f"Modèles d'appareils inconnus (EXIF à recalculer) : FOV de {fov_user}° pour toutes les photos")
+        col_r1, col_r2 = st.columns(2)
+        simuler = col_r1.button("Simuler", width='stretch', key="recalcul_simuler")
+        appliquer = col_r2.button("Appliquer", width='stretch', key="recalcul_appliquer")
+        if simuler or appliquer:
+            rapport = recalculer_angles(
+                st.session_state.annotations, exif_data, catalogue, fov_user,
+                fov_par_appareil=fov_par_appareil, modeles=modeles,
+                corrections_direction=charger_corrections(image_folder), appliquer=appliquer
+            )
+            if appliquer and rapport["modifications"]:
+                sauvegarder_images([m["image"] for m in rapport["modifications"]])
+            st.session_state.rapport_recalcul = dict(rapport, applique=appliquer)
+        rapport = st.session_state.get("rapport_recalcul")
+        if rapport:
+            verbe = "modifiées" if rapport["applique"] else "à modifier"
+            st.caption(
+                f"{len(rapport['modifications'])} annotations {verbe} sur {rapport['nb_annotations']}"
+                f" ({len(rapport['ignorees'])} ignorées)"
+            )
+            if rapport["modifications"]:
+                st.dataframe(rapport["modifications"], hide_index=True)
+
     
     st.sidebar.markdown("---")
     st.markdown("### Traitement final")
@@ -207,24 +402,101 @@ with st.sidebar:
     # Initialisation des variables
     #hauteur_cam = None
     decalage_orientation = None
+    # Décalage trouvé par la calibration, appliqué avant la création du widget
+    if "decalage_calibre" in st.session_state:
+        st.session_state.decalage_orientation = st.session_state.pop("decalage_calibre")
     # Definie la valeur du décalage de l'orientation de la photo (parfois 0° = Est donc 90 parfois 0° = Nord donc 0)
     decalage_orientation = st.number_input("**Objectif** : _Appliquer un décalage pour un référentiel 0° = Nord (0 = pas de décalage nécessaire - 90 = passage à 0° au Nord si référentiel à l'Est)_", min_value=0, max_value=180,
                                 value=0, step=1, key="decalage_orientation")
-    ancien_gpkg_file = st.file_uploader("Sélectionner le GeoPackage source (.gpkg, EPSG:2154)", type=["gpkg"], key="gpkg")
+    # Source du GeoPackage : upload (copié par blocs dans un temporaire) ou chemin local lu sur place
+    source_gpkg = st.radio("Source du GeoPackage de référence", ["Téléverser un fichier", "Chemin sur le serveur"], horizontal=True, key="source_gpkg")
+    ancien_gpkg_path = None
+    if source_gpkg == "Téléverser un fichier":
+        ancien_gpkg_file = st.file_uploader("Sélectionner le GeoPackage source (.gpkg, EPSG:2154)", type=["gpkg"], key="gpkg")
+        if ancien_gpkg_file:
+            # Prépare le temporaire via le module utilitaire
+            ancien_gpkg_path = prepare_temp_gpkg(ancien_gpkg_file, st.session_state)
+            nom_gpkg = ancien_gpkg_file.name
+    else:
+        chemin_serveur = st.text_input("Chemin du GeoPackage source (.gpkg, EPSG:2154)", key="gpkg_chemin_serveur").strip()
+        if chemin_serveur:
+            if os.path.isfile(chemin_serveur):
+                ancien_gpkg_path = chemin_serveur
+                nom_gpkg = os.path.basename(chemin_serveur)
+            else:
+                st.warning("⚠️ Le GeoPackage indiqué est introuvable.")
     selected_layer = None
     gdf = None
 
-    if ancien_gpkg_file:
-        # Prépare le temporaire via le module utilitaire
-        ancien_gpkg_path = prepare_temp_gpkg(ancien_gpkg_file, st.session_state)
-        # Lister les couches
-        layers = fiona.listlayers(ancien_gpkg_path)
-        selected_layer = st.selectbox("Choisissez la couche à utiliser", layers)
+    if ancien_gpkg_path:
+        # Lister les couches (métadonnées en cache selon l'empreinte du fichier)
+        couches_gpkg = {c["nom"]: c for c in lister_couches_gpkg(ancien_gpkg_path, empreinte_fichier(ancien_gpkg_path))}
+        selected_layer = st.selectbox(
+            "Choisissez la couche à utiliser", list(couches_gpkg),
+            format_func=lambda nom: f"{nom} ({couches_gpkg[nom]['nb_objets']} objets)"
+        )
+        if selected_layer:
+            st.caption(f"SCR : {couches_gpkg[selected_layer]['crs']} | Emprise : {couches_gpkg[selected_layer]['emprise']}")
+
+    # --- Calibration du décalage d'orientation et des directions par photo ---
+    if ancien_gpkg_path and selected_layer:
+        with st.expander("🎯 Calibrer l'orientation"):
+            calibrer_par_photo = st.checkbox("Corrections de direction par photo", value=True, key="calibration_par_photo")
+            correction_max = st.number_input("Correction maximale par photo (degrés)", min_value=0.5, max_value=45.0,
+                                             value=10.0, step=0.5, key="calibration_correction_max")
+            if st.button("Lancer la calibration", width='stretch'):
+                from utils.calibration_utils import calibrer_orientation
+                with st.spinner("Calibration en cours (lancer de rayons sur tous les cœurs)..."):
+                    st.session_state.resultat_calibration = calibrer_orientation(
+                        st.session_state.annotations, exif_data, ancien_gpkg=ancien_gpkg_path,
+                        selected_layer=selected_layer, par_photo=calibrer_par_photo, correction_max=correction_max
+                    )
+            calibration = st.session_state.get("resultat_calibration")
+            if calibration and calibration["decalage"] is None:
+                st.warning("Aucune ligne de vue exploitable (annotations géolocalisées avec angle).")
+            elif calibration:
+                st.markdown(f"**Décalage retenu : {calibration['decalage']}** (score {calibration['score_initial']:.3f})")
+                st.line_chart({"decalage": list(calibration["scores"]), "score": list(calibration["scores"].values())},
+                              x="decalage", y="score", height=150)
+                if st.button(f"Utiliser le décalage {calibration['decalage']}", width='stretch'):
+                    st.session_state.decalage_calibre = calibration["decalage"]
+                    st.rerun()
+                if calibration["corrections"]:
+                    st.caption(f"{len(calibration['corrections'])} photos à corriger, score {calibration['score_final']:.3f}")
+                    st.dataframe([{"image": nom, "correction": c} for nom, c in sorted(calibration["corrections"].items())], hide_index=True)
+                    if st.button("Appliquer les corrections par photo", width='stretch'):
+                        appliquer_corrections(st.session_state.annotations, calibration["corrections"], image_folder)
+                        sauvegarder_images(calibration["corrections"])
+                        calibration["corrections"] = {}
+                        st.success("Corrections appliquées aux annotations.")
+
+    # Serveur de cartographie local (couches gardées en mémoire entre deux traitements)
+    utiliser_serveur = st.checkbox(f"Utiliser le serveur de cartographie local ({URL_SERVEUR})", key="utiliser_serveur",
+                                   help="Démarrer le serveur avec : python cli.py serveur")
+    if utiliser_serveur and not serveur_disponible():
+        st.warning("⚠️ Le serveur de cartographie ne répond pas : le traitement sera fait dans l'application.")
+        utiliser_serveur = False
+
+    # Export supplémentaire des couches phm_* (lecture rapide par les visionneuses web et les traitements)
+    format_export = st.selectbox(
+        "Export des couches phm_*", list(FORMATS_EXPORT), format_func=FORMATS_EXPORT.get, key="format_export",
+        help="Le GeoPackage est toujours écrit ; les couches phm_* sont en plus exportées dans ce format"
+    )
+    if format_export == "geoparquet" and not pyarrow_disponible():
+        st.warning("⚠️ L'export GeoParquet nécessite pyarrow (pip install pyarrow).")
+
+    format_photos_annotees = st.selectbox(
+        "Photos annotées", list(FORMATS_PHOTOS_ANNOTEES), format_func=FORMATS_PHOTOS_ANNOTEES.get, key="format_photos_annotees",
+        help="Calques : marques vectorielles posées sur la photo originale, sans la réencoder ; "
+             "la photo annotée peut être générée à la demande sous le tableau des annotations"
+    )
+    vues_360 = st.checkbox("Vues recadrées des annotations 360°", key="vues_360",
+                           help="Photos annotées : une vue perspective centrée sur chaque annotation des photos 360°")
 
     st.sidebar.markdown("---")
     # Bouton de lancement du traitement cartographique
     if st.button("🗺️ Cartographier les éléments 🗺️", width='stretch'):
-        if ancien_gpkg_file:
+        if ancien_gpkg_path:
             with st.spinner("Traitement en cours..."):
                 try:
                     # Construction des chemins et lancement des traitements
@@ -232,14 +504,33 @@ with st.sidebar:
                     date_str = datetime.now().strftime("%Y%m%d_%H%M%S")
                     # Définir les chemins nécessaires
                     annotations_json = os.path.join(image_folder, "annotations.json")
+                    if base_annotations is not None:
+                        # Les traitements lisent annotations.json : export de l'état courant de la base
+                        base_annotations.exporter_json(annotations_json)
                     exif_json = os.path.join(image_folder, "exif_data.json")
                     dossier_resultat = os.path.join(image_folder, 'resultat')
-                    nom_base = os.path.splitext(os.path.basename(ancien_gpkg_file.name))[0]
+                    nom_base = os.path.splitext(os.path.basename(nom_gpkg))[0]
                     gpkg_output = os.path.join(dossier_resultat, f"{nom_base}_{date_str}.gpkg")
 
                     # Appel des fonctions
-                    dessiner_annotations_sur_images(image_folder)
-                    creer_gpkg_complet(annotations_json, exif_json, st.session_state["tmp_gpkg_path"], gpkg_output, image_folder, selected_layer, decalage_orientation)
+                    from utils.geo_utils import creer_gpkg_complet
+                    dessiner_annotations_sur_images(image_folder, vues_360=vues_360, format_sortie=format_photos_annotees)
+                    if utiliser_serveur:
+                        # Le serveur lit les fichiers sur place : chemins absolus
+                        appeler_serveur("/cartographier", {
+                            "annotations_json": os.path.abspath(annotations_json),
+                            "exif_json": os.path.abspath(exif_json),
+                            "gpkg": os.path.abspath(ancien_gpkg_path),
+                            "gpkg_output": os.path.abspath(gpkg_output),
+                            "image_folder": os.path.abspath(image_folder),
+                            "couche": selected_layer,
+                            "decalage_orientation": decalage_orientation
+                        })
+                    else:
+                        creer_gpkg_complet(annotations_json, exif_json, ancien_gpkg_path, gpkg_output, image_folder, selected_layer, decalage_orientation)
+                    if format_export != "gpkg":
+                        fichiers_export = exporter_couches(gpkg_output, format_export)
+                        st.info(f"{len(fichiers_export)} couches exportées en {format_export} dans {os.path.splitext(gpkg_output)[0]}_{format_export}")
                     st.success("Traitement terminé avec succès.")
 
                 except Exception as e:
@@ -247,10 +538,8 @@ with st.sidebar:
                     st.code(str(e))
 
                 finally:
-                    # Nettoyage du fichier temporaire
-                    tmp_path = st.session_state.pop("tmp_gpkg_path", None)
-                    if tmp_path and os.path.exists(tmp_path):
-                        os.remove(tmp_path)
+                    # Nettoyage du fichier temporaire (jamais le GeoPackage lu sur le serveur)
+                    supprimer_copie_temporaire(st.session_state.pop("tmp_gpkg_path", None))
         else:
             st.warning("Veuillez sélectionner tous les fichiers requis ci-dessus.")
     # Infos de contact
@@ -262,50 +551,195 @@ with st.sidebar:
 
 # --- AFFICHAGE PRINCIPAL : IMAGE, ANNOTATIONS, TABLEAU ---
 if image_files:
+    # Index ramené dans la liste si le dossier contient moins d'images qu'auparavant
+    if st.session_state.current_image_index >= len(image_files):
+        st.session_state.current_image_index = 0
     current_img_idx = st.session_state.get("current_image_index", 0)
     image_name = image_files[st.session_state.current_image_index]
     total_images = len(image_files)
     current_idx = st.session_state.current_image_index + 1  # pour un affichage humain (1 au lieu de 0)
+    # Photos quasi identiques sautées par Précédente / Suivante
+    masquees = photos_masquees(groupes_doublons, st.session_state.annotations) \
+        if groupes_doublons and st.session_state.get("masquer_doublons") else set()
 
     img_path = os.path.join(image_folder, image_name)
-    img_fullres = Image.open(img_path).convert("RGBA")
-    full_width, full_height = img_fullres.size
+    # Dimensions et type de photo lus dans le catalogue (en-tête seul, sans décoder l'image)
+    if image_modifiee(image_folder, image_name, catalogue[image_name]):
+        # Image réécrite sur place (date du dossier inchangée) : catalogue revérifié sans attendre la tranche suivante
+        charger_catalogue.clear()
+        catalogue = charger_catalogue(image_folder, mtime_dossier(image_folder), tranche_verification())
+    infos_image = catalogue[image_name]
+    full_width, full_height = infos_image["largeur"], infos_image["hauteur"]
+    photo_360 = infos_image["est_360"]
 
-
-    # Redimensionnement de l'image pour affichage (max 800px de large)
-    display_img, ratio = redimens_image(img_fullres, max_width=800)
+    if not photo_360:
+        # Décodage et redimensionnement de l'image pour affichage (max 800px de large), photos standards uniquement
+        with mesurer("decodage_image"):
+            img_fullres = Image.open(img_path).convert("RGBA")
+            full_width, full_height = img_fullres.size
+            display_img, ratio = redimens_image(img_fullres, max_width=800)
     # Initialisation de la liste d'annotations pour l'image si besoin
     if image_name not in st.session_state.annotations:
         st.session_state.annotations[image_name] = []
     
     # --- Barre de recherche directe vers une image ---
+    # Index des noms (trigrammes / préfixes) construit une fois par état du dossier
+    index_noms = charger_index_noms(image_folder, mtime_dossier(image_folder), image_files)
     col_a1, col_a2 = st.columns([2, 4], vertical_alignment="bottom")
     with col_a1:
         # Zone de recherche par nom de photo + nom de la photo + n°x/x photos dans le dossier
         search_term = st.text_input(
-            f"**{image_name} ( {current_idx} / {total_images} )**",
+            f"**{image_name} ( {current_idx} / {total_images} )**" + (f" · {len(masquees)} doublons masqués" if masquees else ""),
             key="image_search_input",
             placeholder=f"Recherche par nom de photo - Exemple : IMG_0150 ou façade_nord"
         )
     with col_a2:
         go_button = st.button("🔍")
+    if groupes_doublons and image_name in groupes_doublons["groupe_de"]:
+        autres = [n for n in groupes_doublons["groupes"][groupes_doublons["groupe_de"][image_name]] if n != image_name]
+        st.caption(f"🪞 {len(autres)} autre(s) photo(s) quasi identique(s) : {', '.join(autres[:5])}{' ...' if len(autres) > 5 else ''}")
+
+    # Filtres combinables avec la recherche par nom
+    with st.expander("Filtres de recherche"):
+        col_f1, col_f2, col_f3 = st.columns(3)
+        with col_f1:
+            filtre_annotation = st.selectbox("Annotation", ["Toutes", "Annotées", "Non annotées"], key="filtre_annotation")
+            filtre_type = st.selectbox("Type de photo", ["Toutes", "360°", "Standard"], key="filtre_type_photo")
+        with col_f2:
+            filtre_gps = st.checkbox("GPS manquant", key="filtre_gps_manquant")
+            filtre_direction = st.checkbox("Direction manquante", key="filtre_direction_manquante")
+        with col_f3:
+            filtre_dates = st.date_input("Prises de vue entre", value=(), key="filtre_dates")
+    filtres_actifs = (filtre_annotation != "Toutes" or filtre_type != "Toutes" or filtre_gps
+                      or filtre_direction or len(filtre_dates) > 0)
 
     # Recherche déclenchée uniquement si bouton pressé
-    if go_button and search_term:
-        term = search_term.strip().lower()
-        matching = [img for img in image_files if term in img.lower()]
+    if go_button and (search_term or filtres_actifs):
+        if search_term.strip():
+            positions = rechercher_noms(index_noms, search_term)
+        else:
+            positions = range(len(image_files))
+        if filtres_actifs:
+            positions = filtrer_images(
+                positions, index_noms, catalogue, exif_data, st.session_state.annotations,
+                annotee={"Toutes": None, "Annotées": True, "Non annotées": False}[filtre_annotation],
+                gps_manquant=filtre_gps,
+                direction_manquante=filtre_direction,
+                date_debut=filtre_dates[0] if len(filtre_dates) > 0 else None,
+                date_fin=filtre_dates[1] if len(filtre_dates) > 1 else None,
+                type_photo={"Toutes": None, "360°": "360", "Standard": "standard"}[filtre_type]
+            )
+        matching = [image_files[pos] for pos in positions]
 
         if len(matching) == 1:
             # une seule correspondance : on met à jour l'image courante
-            target_image = matching[0]
-            st.session_state.current_image_index = image_files.index(target_image)
+            st.session_state.current_image_index = index_noms["positions"][matching[0]]
+            st.session_state.pop("resultats_recherche", None)
             st.session_state["reset_search_field"] = True
             st.rerun()
         elif len(matching) > 1:
-            st.info(f"🔎 {len(matching)} images correspondent, précisez davantage.")
+            # plusieurs correspondances : liste paginée des résultats
+            st.session_state.resultats_recherche = matching
+            st.session_state.page_recherche = 1
         else:
+            st.session_state.pop("resultats_recherche", None)
             st.warning("❌ Aucune image correspondante trouvée.")
 
+    # Résultats de la dernière recherche (noms d'images, par pages)
+    resultats = [nom for nom in st.session_state.get("resultats_recherche", []) if nom in index_noms["positions"]]
+    if resultats:
+        page_resultats, nb_pages = paginer(resultats, st.session_state.get("page_recherche", 1), TAILLE_PAGE_RECHERCHE)
+        col_r1, col_r2, col_r3, col_r4 = st.columns([4, 1, 1, 1], vertical_alignment="bottom")
+        with col_r1:
+            choix_resultat = st.selectbox(
+                f"🔎 {len(resultats)} images correspondent",
+                page_resultats,
+                format_func=lambda nom: f"{nom} ( {index_noms['positions'][nom] + 1} / {total_images} )",
+                key="choix_resultat_recherche"
+            )
+        with col_r2:
+            st.number_input(f"Page (sur {nb_pages})", min_value=1, max_value=nb_pages, step=1, key="page_recherche")
+        with col_r3:
+            if st.button("Afficher", width='stretch'):
+                # saut direct : position lue dans l'index, sans parcourir la liste
+                st.session_state.current_image_index = index_noms["positions"][choix_resultat]
+                st.rerun()
+        with col_r4:
+            if st.button("✖ Fermer", width='stretch'):
+                st.session_state.pop("resultats_recherche", None)
+                st.rerun()
+
+    # --- CARTE DES PHOTOS : positions regroupées selon le zoom (calcul côté serveur), clic pour afficher ou agrandir ---
+    if st.toggle("🗺️ Carte des photos", key="carte_photos_visible",
+                 help="Photos géolocalisées regroupées en grappes ; clic sur une photo pour l'afficher, sur une grappe pour l'agrandir"):
+        with mesurer("carte_photos"):
+            index_carte = charger_index_carte(
+                image_folder, mtime_dossier(image_folder),
+                os.path.getmtime(exif_output_file) if os.path.exists(exif_output_file) else None, image_files, exif_data
+            )
+            if "centre_carte" not in st.session_state:
+                x_vue, y_vue, zoom_vue = vue_ensemble(index_carte)
+                st.session_state.centre_carte = (x_vue, y_vue)
+                st.session_state.zoom_carte = zoom_vue
+
+            def lister_photos(positions):
+                st.session_state.resultats_recherche = [image_files[p] for p in positions]
+                st.session_state.page_recherche = 1
+
+            # Clic : photo seule -> affichée ; grappe -> zoom où elle se sépare, ou liste de ses photos au zoom maximal
+            def selection_carte():
+                objets = st.session_state.selection_carte_photos.selection.get("objects", {}).get("grappes", [])
+                if not objets:
+                    return
+                grappe = objets[0]
+                if grappe["image"] is not None:
+                    st.session_state.current_image_index = index_noms["positions"][grappe["image"]]
+                elif grappe["zoom"] < ZOOM_MAX_CARTE:
+                    x_g, y_g = lonlat_vers_mercator(*grappe["position"])
+                    st.session_state.centre_carte = (float(x_g), float(y_g))
+                    st.session_state.zoom_carte = zoom_eclatement(index_carte, grappe["zoom"], grappe["grappe"])
+                else:
+                    lister_photos(photos_grappe(index_carte, grappe["zoom"], grappe["grappe"]))
+
+            def recentrer(sur_photo):
+                exif_courant = exif_data.get(image_name) or {}
+                if sur_photo and exif_courant.get("latitude") is not None and exif_courant.get("longitude") is not None:
+                    x_p, y_p = lonlat_vers_mercator(exif_courant["longitude"], exif_courant["latitude"])
+                    st.session_state.centre_carte = (float(x_p), float(y_p))
+                    st.session_state.zoom_carte = max(st.session_state.zoom_carte, 17)
+                elif not sur_photo:
+                    x_vue, y_vue, zoom_vue = vue_ensemble(index_carte)
+                    st.session_state.centre_carte = (x_vue, y_vue)
+                    st.session_state.zoom_carte = zoom_vue
+
+            col_c1, col_c2, col_c3, col_c4 = st.columns([3, 1, 1, 1], vertical_alignment="bottom")
+            with col_c1:
+                zoom_carte = st.slider("Zoom", ZOOM_MIN_CARTE, ZOOM_MAX_CARTE, key="zoom_carte")
+            with col_c2:
+                st.button("Vue d'ensemble", width='stretch', on_click=recentrer, args=(False,))
+            with col_c3:
+                st.button("Photo affichée", width='stretch', on_click=recentrer, args=(True,))
+            with col_c4:
+                st.button("Lister la vue", width='stretch', help="Photos comprises dans la vue (sélection rectangulaire)",
+                          on_click=lambda: lister_photos(photos_vue(index_carte, st.session_state.zoom_carte, st.session_state.centre_carte)))
+
+            # Seules les grappes de la vue (et de sa marge) sont envoyées au navigateur, avec les annotations en cours
+            grappes = grappes_vue(index_carte, zoom_carte, st.session_state.centre_carte,
+                                  nb_annotations_photos(index_carte, st.session_state.annotations))
+            from utils.carte_utils import creer_carte_photos
+            exif_courant = exif_data.get(image_name) or {}
+            photo_courante = [exif_courant["longitude"], exif_courant["latitude"]] \
+                if exif_courant.get("latitude") is not None and exif_courant.get("longitude") is not None else None
+            lon_vue, lat_vue = mercator_vers_lonlat(*st.session_state.centre_carte)
+            st.pydeck_chart(creer_carte_photos(grappes, (float(lon_vue), float(lat_vue)), zoom_carte, photo_courante),
+                            height=TAILLE_CARTE[1], key="selection_carte_photos", on_select=selection_carte,
+                            selection_mode="single-object")
+            if perf_active():
+                noter_taille("carte_photos", len(json.dumps(grappes)))
+            st.caption(f"{len(index_carte['noms'])} photos géolocalisées"
+                       + (f", {index_carte['sans_gps']} sans GPS" if index_carte["sans_gps"] else "")
+                       + f" — {len(grappes)} grappes affichées au zoom {zoom_carte}")
+
     # Réinitialisation propre du champ après le rerun
     if "reset_search_field" in st.session_state:
         del st.session_state["reset_search_field"]
@@ -328,34 +762,36 @@ if image_files:
         
         # Condition d'affichage auto si photo 360° ou photo standard
         # VISIONNEUSE PHOTO 360°
-        if is_360_photo(full_width, full_height):
+        if photo_360:
             # Dataframe annotations
-            df_annotations = creer_dataframe_annotations_360(st.session_state.annotations[image_name])
+            with mesurer("dataframe_annotations"):
+                df_annotations = creer_dataframe_annotations_360(st.session_state.annotations[image_name])
             # Préparer la liste des hotspots au format attendu par le composant
             yaw = st.session_state.get("pannellum_yaw", 0)
             pitch = st.session_state.get("pannellum_pitch", 0)
             hfov = st.session_state.get("pannellum_hfov", 110)
             hotspots_for_image = prepare_hotspots_for_pannellum(st.session_state.annotations, image_name)
 
-            # Définission du viewer Pannelum
-            updated_hotspots = pannellum_viewer(
-                image_path=img_path,
-                pitch=pitch,
-                yaw=yaw,
-                hfov=hfov,
-                height=600,
-                mode_annotation=mode_annotation,
-                type_objet=type_objet,
-                fonction_objet=fonction_objet,
-                hotspots=hotspots_for_image,
-                img_width=full_width,
-                img_height=full_height,
-                selected_uuid=st.session_state.get("selected_annotation"),
-                cmd_action=st.session_state.get("cmd_action"),
-                cmd_data=st.session_state.get("cmd_data"),
-                direction=locals().get("direction", 0),
-                key=f"pannellum_{image_name}",
-            )
+            # Définission du viewer Pannelum (la section inclut l'encodage base64, mesuré aussi à part)
+            with mesurer("pannellum"):
+                updated_hotspots = pannellum_viewer(
+                    image_path=img_path,
+                    pitch=pitch,
+                    yaw=yaw,
+                    hfov=hfov,
+                    height=600,
+                    mode_annotation=mode_annotation,
+                    type_objet=type_objet,
+                    fonction_objet=fonction_objet,
+                    hotspots=hotspots_for_image,
+                    img_width=full_width,
+                    img_height=full_height,
+                    selected_uuid=st.session_state.get("selected_annotation"),
+                    cmd_action=st.session_state.get("cmd_action"),
+                    cmd_data=st.session_state.get("cmd_data"),
+                    direction=locals().get("direction", 0),
+                    key=f"pannellum_{image_name}",
+                )
 
             # --- Mise à jour des annotations si changements ---
             if direction is not None:
@@ -366,7 +802,11 @@ if image_files:
                     # On écrase uniquement si les annotations ont vraiment changé
                     if new_annotations != current_annotations:
                         st.session_state.annotations[image_name] = new_annotations
-                        sauvegarder_annotations(annotations_file, st.session_state.annotations)
+                        with mesurer("sauvegarde"):
+                            if base_annotations is not None:
+                                base_annotations.synchroniser_image(image_name, current_annotations, new_annotations)
+                            else:
+                                sauvegarder_annotations(annotations_file, st.session_state.annotations)
 
                         # Mettre à jour la vue Pannellum
                         st.session_state.pannellum_yaw = updated_hotspots.get('yaw', 0)
@@ -389,13 +829,30 @@ if image_files:
         else:
             # VISIONNEUSE PHOTO STANDARD
             # Dataframe annotations
-            df_annotations = creer_dataframe_annotations(st.session_state.annotations[image_name])
+            with mesurer("dataframe_annotations"):
+                df_annotations = creer_dataframe_annotations(st.session_state.annotations[image_name])
+            # Candidats de la pré-annotation pour cette image (ni validés ni ignorés, pas déjà annotés au même pixel)
+            candidats = []
+            detections_onnx = detections_dossier(image_folder)
+            if detections_onnx and infos_image["empreinte"] not in detections_onnx.get("revues", {}):
+                candidats = candidats_image(
+                    detections_onnx["images"].get(infos_image["empreinte"]), infos_image, exif_data.get(image_name), fov_user,
+                    st.session_state.get("mode_annotation_selectbox"),
+                    types_des_classes(detections_onnx["classes"], config, type_objet, fonction_objet), detections_onnx["classes"]
+                )
+                deja_annotes = {(a["x"], a["y"]) for a in st.session_state.annotations[image_name]}
+                candidats = [c for c in candidats if (c["x"], c["y"]) not in deja_annotes]
             # Overlay sur les images
-            overlay = dessiner_overlay(display_img, st.session_state.annotations[image_name], df_annotations, ratio, st.session_state.get("selected_annotation"), fov_user)
-            # Affichage de l'image annotée et récupération du clic utilisateur
-            merged_img = Image.alpha_composite(display_img, overlay)
-            # Visionneuse photo standard
-            coords = streamlit_image_coordinates(merged_img, key="click_key", width=800)
+            with mesurer("overlay"):
+                overlay = dessiner_overlay(display_img, st.session_state.annotations[image_name], df_annotations, ratio, st.session_state.get("selected_annotation"), fov_user, candidats)
+                # Affichage de l'image annotée et récupération du clic utilisateur
+                merged_img = Image.alpha_composite(display_img, overlay)
+            # Visionneuse photo standard (le composant encode l'image en PNG non compressé, puis en base64)
+            with mesurer("visionneuse_photo"):
+                coords = streamlit_image_coordinates(merged_img, key="click_key", width=800)
+            if perf_active():
+                # Estimation de la taille envoyée : pixels RGBA + octet de filtre par ligne, base64 (x 4/3)
+                noter_taille("visionneuse_photo_image", (merged_img.width * 4 + 1) * merged_img.height * 4 // 3)
             # Ajout d'une annotation si clic utilisateur
             if direction is not None:
                 if coords:
@@ -406,23 +863,45 @@ if image_files:
                     fov_vertical = calculer_fov_vertical(fov_user, full_width, full_height)
                     angle_vertical = calculer_angle_elevation(y_orig, full_height, fov_vertical)
                     # Ajoute l'annotation si ce n'est pas un doublon, puis sauvegarde et rafraîchit
-                    if ajouter_annotation(st.session_state.annotations, image_name,x_orig, y_orig, st.session_state.get("type_objet_selectbox_create"), st.session_state.get("fonction_objet_selectbox_create"), st.session_state.get("mode_annotation_selectbox"), angle_ajuste, angle_vertical ,st.session_state["last_click"]):
-                            # Sauvegarder dans le fichier JSON
+                    with mesurer("sauvegarde"):
+                        ajoutee = ajouter_annotation(st.session_state.annotations, image_name,x_orig, y_orig, st.session_state.get("type_objet_selectbox_create"), st.session_state.get("fonction_objet_selectbox_create"), st.session_state.get("mode_annotation_selectbox"), angle_ajuste, angle_vertical ,st.session_state["last_click"], base=base_annotations)
+                        # Sauvegarder dans le fichier JSON (déjà écrite dans la base partagée si elle existe)
+                        if ajoutee and base_annotations is None:
                             sauvegarder_annotations(annotations_file, st.session_state.annotations)
-                            # Mémoriser ce dernier clic comme déjà traité
-                            st.session_state["last_click"] = current_click
-                            st.rerun()
+                    if ajoutee:
+                        # Mémoriser ce dernier clic comme déjà traité
+                        st.session_state["last_click"] = current_click
+                        st.rerun()
             elif direction is None:
                 st.warning(f"La direction n'est pas présente dans les EXIF pour {image_name}. Aucune annotation ne sera enregistrée dans le JSON.")
+            # Validation des candidats détectés (encadrés en vert sur l'image, D0, D1...)
+            if candidats:
+                with st.expander(f"🤖 {len(candidats)} objets détectés à valider", expanded=True):
+                    st.dataframe([{"candidat": f"D{i}", "classe": c["classe"], "confiance": c["confiance"], "type_objet": c["type_objet"],
+                                   "fonction_objet": c["fonction_objet"], "x": c["x"], "y": c["y"]} for i, c in enumerate(candidats)],
+                                 hide_index=True)
+                    choix_candidats = st.multiselect("Candidats à ajouter", list(range(len(candidats))), default=list(range(len(candidats))),
+                                                     format_func=lambda i: f"D{i} {candidats[i]['classe']}", key=f"candidats_{image_name}")
+                    col_d1, col_d2 = st.columns(2)
+                    if col_d1.button("✅ Ajouter aux annotations", width='stretch', disabled=not choix_candidats):
+                        with mesurer("sauvegarde"):
+                            valider_candidats(st.session_state.annotations, image_name, [candidats[i] for i in choix_candidats], base=base_annotations)
+                            if base_annotations is None:
+                                sauvegarder_annotations(annotations_file, st.session_state.annotations)
+                        marquer_revue(image_folder, infos_image["empreinte"], "validee")
+                        st.rerun()
+                    if col_d2.button("Ignorer les candidats", width='stretch'):
+                        marquer_revue(image_folder, infos_image["empreinte"], "ignoree")
+                        st.rerun()
         # Navigation entre les images
         col_nav1, col_nav2 = st.columns(2)
         with col_nav1:
             if st.button("◀️ Précédente", width='stretch') and image_files:
-                st.session_state.current_image_index = (st.session_state.current_image_index - 1) % len(image_files)
+                st.session_state.current_image_index = position_voisine(image_files, st.session_state.current_image_index, -1, masquees)
                 st.rerun()
         with col_nav2:
             if st.button("Suivante ▶️", width='stretch') and image_files:
-                st.session_state.current_image_index = (st.session_state.current_image_index + 1) % len(image_files)
+                st.session_state.current_image_index = position_voisine(image_files, st.session_state.current_image_index, 1, masquees)
                 st.rerun()
             
     # Affichage des informations EXIF si disponibles
@@ -438,10 +917,43 @@ if image_files:
         st.write("Les métadonnées EXIF ne sont pas disponibles pour cette image.")  
   
     with col_b2:
+        # --- APERÇU CARTOGRAPHIQUE DES LIGNES DE VUE DE L'IMAGE COURANTE ---
+        if st.toggle("🗺️ Aperçu des lignes de vue", key="apercu_lignes_vue",
+                     help="Position de la photo, lignes de vue des annotations et points d'impact sur la couche de référence"):
+            if not (ancien_gpkg_path and selected_layer):
+                st.info("Sélectionnez un GeoPackage de référence et une couche dans la barre latérale.")
+            elif lat is None or lon is None:
+                st.info("Position GPS absente des EXIF : aperçu indisponible.")
+            else:
+                from utils.geo_utils import charger_reference_apercu, calculer_apercu_lignes_de_vue
+                from utils.carte_utils import creer_carte_apercu
+                annotations_image = st.session_state.annotations[image_name]
+                if utiliser_serveur:
+                    reference = None
+                    rayons_serveur = lambda xs, ys, angles: lancer_rayons_serveur(ancien_gpkg_path, selected_layer, xs, ys, angles, decalage_orientation)
+                else:
+                    with st.spinner("Chargement de la couche de référence..."):
+                        reference = charger_reference_apercu(ancien_gpkg_path, selected_layer, empreinte_fichier(ancien_gpkg_path))
+                    rayons_serveur = None
+                debut = time.perf_counter()
+                apercu = calculer_apercu_lignes_de_vue(lat, lon, annotations_image, decalage_orientation, reference, rayons_serveur)
+                duree_ms = (time.perf_counter() - debut) * 1000
+                st.pydeck_chart(creer_carte_apercu(apercu), height=300)
+                nb_touches = sum(l["touche"] for l in apercu["lignes"])
+                st.caption(f"{nb_touches} / {len(apercu['lignes'])} lignes de vue touchent un objet — calcul : {duree_ms:.0f} ms")
+
         # --- AFFICHAGE DU TABLEAU DES ANNOTATIONS ---
         st.markdown("### Tableau des annotations")
         if not df_annotations.empty:
             st.dataframe(df_annotations, width='stretch', hide_index=True)
+            # Photo annotée pleine résolution rendue à la demande (la cartographie n'écrit par défaut que des calques)
+            if st.button("🖍️ Générer la photo annotée", key="generer_photo_annotee"):
+                with st.spinner("Rendu de la photo annotée..."):
+                    st.session_state.photo_annotee_prete = rendre_photo_annotee(image_folder, image_name, st.session_state.annotations[image_name])
+            chemin_annotee = st.session_state.get("photo_annotee_prete")
+            if chemin_annotee == chemin_photo_annotee(image_folder, image_name) and os.path.exists(chemin_annotee):
+                with open(chemin_annotee, "rb") as f:
+                    st.download_button("Télécharger la photo annotée", f.read(), file_name=os.path.basename(chemin_annotee))
             # Liste des index avec None pour "aucune sélection"
             index_options = [None] + list(df_annotations['index'])
 
@@ -454,13 +966,15 @@ if image_files:
             
             # Réinitialiser les annotations sur l'image
             if st.button("🗑️ Réinitialiser l'image actuelle", key=f"clearall_{st.session_state.selected_annotation}", width='stretch') and image_files:
-                if is_360_photo(full_width, full_height):
+                if photo_360:
                     st.session_state.cmd_action = "clear_all"
                     st.rerun()
                 else:
                     current_img = image_files[st.session_state.current_image_index]
-                    reinitialiser_annotations_image(current_img, annotations_file, st.session_state)        
-                    sauvegarder_annotations(annotations_file, st.session_state.annotations)
+                    with mesurer("sauvegarde"):
+                        reinitialiser_annotations_image(current_img, annotations_file, st.session_state, base=base_annotations)
+                        if base_annotations is None:
+                            sauvegarder_annotations(annotations_file, st.session_state.annotations)
                     st.rerun()
             # Sélecteur d'annotation à modifier/supprimer
             selected_index = st.selectbox(
@@ -515,7 +1029,7 @@ if image_files:
             with col_c1:
                 if st.button("📝 Modifier", key=f"modify_{st.session_state.selected_annotation}", width='stretch'):
                     # PHOTO 360°
-                    if is_360_photo(full_width, full_height):
+                    if photo_360:
                         # Envoi de la commande "update" au composant JS
                         st.session_state.cmd_action = "update"
                         st.session_state.cmd_data = {
@@ -528,22 +1042,25 @@ if image_files:
                         st.rerun()
                     # PHOTO STANDARD
                     else:
-                        modifier_annotation(
-                            st.session_state.annotations,
-                            image_name,
-                            st.session_state.selected_annotation,
-                            type_objet_edit,
-                            fonction_objet_edit,
-                            mode_annotation_edit
-                        )
-                        sauvegarder_annotations(annotations_file, st.session_state.annotations)
+                        with mesurer("sauvegarde"):
+                            modifier_annotation(
+                                st.session_state.annotations,
+                                image_name,
+                                st.session_state.selected_annotation,
+                                type_objet_edit,
+                                fonction_objet_edit,
+                                mode_annotation_edit,
+                                base=base_annotations
+                            )
+                            if base_annotations is None:
+                                sauvegarder_annotations(annotations_file, st.session_state.annotations)
                         st.success("Modifications appliquées")
                         st.rerun()
 
             with col_c2:
                 if st.button("🗑️ Supprimer", key=f"delete_{st.session_state.selected_annotation}", width='stretch'):
                     # PHOTO 360°
-                    if is_360_photo(full_width, full_height):
+                    if photo_360:
                         st.session_state.cmd_action = "delete"
                         st.session_state.cmd_data = {
                             "uuid": st.session_state.selected_annotation,
@@ -556,13 +1073,19 @@ if image_files:
                         st.rerun()
                     # PHOTO STANDARD
                     else:
-                        supprimer_annotation(
-                                st.session_state.annotations,
-                                image_name,
-                                st.session_state.selected_annotation
-                            )
-                        sauvegarder_annotations(annotations_file, st.session_state.annotations)
+                        with mesurer("sauvegarde"):
+                            supprimer_annotation(
+                                    st.session_state.annotations,
+                                    image_name,
+                                    st.session_state.selected_annotation,
+                                    base=base_annotations
+                                )
+                            if base_annotations is None:
+                                sauvegarder_annotations(annotations_file, st.session_state.annotations)
                         st.success("Annotation supprimée")
                         st.session_state.selected_annotation = None
                         st.rerun()
-    st.markdown("---")
\ No newline at end of file
+    st.markdown("---")
+
+# Fin du rerun (diagnostic des performances)
+fin_rerun()
@@ -0,0 +1,12 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (conftest.py) Racine du projet dans le chemin d'import des tests (import utils.*)
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,69 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_cache.py) Cache des fichiers partagé entre les sessions : invalidation et capacité
+# -----------------------------------------------------------------------------
+
+import json
+import os
+import threading
+
+from utils.cache_utils import CachePartage
+
+
+def _ecrire(chemin, contenu, mtime_ns):
+    with open(chemin, "w", encoding="utf-8") as f:
+        json.dump(contenu, f)
+    os.utime(chemin, ns=(mtime_ns, mtime_ns))
+
+
+def _lecteur(lectures):
+    def lire(chemin):
+        lectures.append(chemin)
+        with open(chemin, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return lire
+
+
+def test_relecture_seulement_si_le_fichier_change(tmp_path):
+    cache, lectures = CachePartage(), []
+    chemin = str(tmp_path / "exif_data.json")
+    _ecrire(chemin, {"a.jpg": {"direction": 10}}, 1_000_000_000)
+    premiere = cache.lire("exif", chemin, _lecteur(lectures))
+    # Même objet partagé tant que le fichier est inchangé
+    assert cache.lire("exif", chemin, _lecteur(lectures)) is premiere
+    assert len(lectures) == 1
+
+    # Réécriture avec la même taille : la date change ; date restaurée : la taille change
+    _ecrire(chemin, {"a.jpg": {"direction": 20}}, 2_000_000_000)
+    assert cache.lire("exif", chemin, _lecteur(lectures))["a.jpg"]["direction"] == 20
+    _ecrire(chemin, {"a.jpg": {"direction": 300}}, 2_000_000_000)
+    assert cache.lire("exif", chemin, _lecteur(lectures))["a.jpg"]["direction"] == 300
+    assert len(lectures) == 3
+    assert cache.statistiques() == {"compteurs": {"exif": {"hits": 1, "misses": 3}}, "entrees": 1}
+
+
+def test_capacite_et_lectures_concurrentes(tmp_path):
+    cache, lectures = CachePartage(capacite=2), []
+    chemins = []
+    for i in range(3):
+        chemins.append(str(tmp_path / f"{i}.json"))
+        _ecrire(chemins[-1], {"i": i}, 1_000_000_000)
+    # Huit sessions demandent le même fichier en même temps : une seule lecture
+    fils = [threading.Thread(target=cache.lire, args=("exif", chemins[0], _lecteur(lectures))) for _ in range(8)]
+    for fil in fils:
+        fil.start()
+    for fil in fils:
+        fil.join()
+    assert lectures == [chemins[0]]
+
+    # Le moins récemment lu est retiré au-delà de la capacité
+    cache.lire("exif", chemins[1], _lecteur(lectures))
+    cache.lire("exif", chemins[0], _lecteur(lectures))
+    cache.lire("exif", chemins[2], _lecteur(lectures))
+    assert cache.statistiques()["entrees"] == 2
+    cache.lire("exif", chemins[0], _lecteur(lectures))
+    cache.lire("exif", chemins[1], _lecteur(lectures))
+    assert lectures == [chemins[0], chemins[1], chemins[2], chemins[1]]
@@ -0,0 +1,65 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_calibration.py) Calibration du décalage d'orientation sur une campagne synthétique
+# -----------------------------------------------------------------------------
+
+import math
+import random
+
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+pyproj = pytest.importorskip("pyproj")
+from shapely.geometry import box
+
+from utils.reference_utils import extraire_contours
+from utils.calibration_utils import calibrer_orientation
+
+DECALAGE = 70
+ERREUR_PHOTO = 6.0
+
+
+# Poteaux de 2 m (Lambert-93) et photos dispersées qui annotent ceux à moins de 50 m ;
+# angle_ajuste tel que les lignes de vue visent le centre des poteaux avec le décalage DECALAGE,
+# la première photo ayant en plus une erreur de direction de ERREUR_PHOTO degrés
+def _campagne():
+    aleatoire = random.Random(2)
+    x0, y0 = 652000, 6862000
+    centres = [(x0 + i * 40 + aleatoire.uniform(-8, 8), y0 + j * 40 + aleatoire.uniform(-8, 8)) for i in range(4) for j in range(3)]
+    batiments = gpd.GeoDataFrame(geometry=[box(cx - 1, cy - 1, cx + 1, cy + 1) for cx, cy in centres], crs="EPSG:2154")
+    vers_wgs84 = pyproj.Transformer.from_crs("EPSG:2154", "EPSG:4326", always_xy=True)
+    annotations, exif = {}, {}
+    for p in range(30):
+        px, py = x0 + aleatoire.uniform(-10, 130), y0 + aleatoire.uniform(-10, 90)
+        lon, lat = vers_wgs84.transform(px, py)
+        nom = f"IMG_{p:04d}.jpg"
+        exif[nom] = {"latitude": lat, "longitude": lon}
+        erreur = ERREUR_PHOTO if p == 0 else 0.0
+        annotations[nom] = [
+            {"uuid": f"{p}-{k}", "mode_annotation": "cartographie", "type_objet": "poteau",
+             "angle_ajuste": (DECALAGE - math.degrees(math.atan2(cy - py, cx - px)) + erreur) % 360}
+            for k, (cx, cy) in enumerate(centres) if 5 < math.hypot(cx - px, cy - py) < 50
+        ]
+    return extraire_contours(batiments), annotations, exif
+
+
+def test_calibration_retrouve_le_decalage_et_la_correction():
+    lignes_bat, annotations, exif = _campagne()
+    resultat = calibrer_orientation(annotations, exif, lignes_bat=lignes_bat, max_workers=1)
+    assert resultat["nb_rayons"] == sum(len(liste) for liste in annotations.values())
+    # Poteaux de 2 m vus à 5-50 m : le décalage est retrouvé au degré près, loin de là les rayons manquent
+    assert abs(resultat["decalage"] - DECALAGE) <= 1
+    assert resultat["scores"][DECALAGE + 30] < resultat["score_initial"] / 2
+    # Seule la photo en erreur est corrigée, d'une correction opposée à son erreur
+    assert list(resultat["corrections"]) == ["IMG_0000.jpg"]
+    assert resultat["corrections"]["IMG_0000.jpg"] == pytest.approx(-ERREUR_PHOTO, abs=1.0)
+    assert resultat["score_final"] > resultat["score_initial"]
+
+
+def test_calibration_sans_rayon():
+    lignes_bat, annotations, exif = _campagne()
+    resultat = calibrer_orientation(annotations, {}, lignes_bat=lignes_bat, max_workers=1)
+    assert resultat["decalage"] is None and resultat["nb_rayons"] == 0
@@ -0,0 +1,62 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_carte.py) Aperçu des lignes de vue d'une image : lancer local ou par le serveur
+# -----------------------------------------------------------------------------
+
+import math
+
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+pyproj = pytest.importorskip("pyproj")
+from shapely.geometry import box
+
+from utils.reference_utils import extraire_contours
+from utils.geo_utils import calculer_apercu_lignes_de_vue, lancer_rayons
+from utils.carte_utils import creer_carte_apercu, COULEUR_NON_TOUCHE, COULEUR_CARTOGRAPHIE
+
+
+# Bâtiment à 10 m à l'est de la photo ; avec un décalage de 90°, angle_ajuste = 90 vise l'est, 270 l'ouest
+def _scene():
+    x0, y0 = 652000.0, 6862000.0
+    batiments = gpd.GeoDataFrame(geometry=[box(x0 + 10, y0 - 5, x0 + 20, y0 + 5)], crs="EPSG:2154")
+    lon, lat = pyproj.Transformer.from_crs("EPSG:2154", "EPSG:4326", always_xy=True).transform(x0, y0)
+    annotations = [
+        {"uuid": "est", "angle_ajuste": 90.0, "mode_annotation": "cartographie", "type_objet": "porte", "fonction_objet": "entrée"},
+        {"uuid": "ouest", "angle_ajuste": 270.0, "mode_annotation": "maj_objet", "type_objet": "fenêtre"},
+        {"uuid": "sans_angle", "angle_ajuste": None},
+    ]
+    return (batiments, batiments, extraire_contours(batiments)), lat, lon, annotations
+
+
+def test_apercu_local_et_serveur_identiques():
+    reference, lat, lon, annotations = _scene()
+    local = calculer_apercu_lignes_de_vue(lat, lon, annotations, 90, reference=reference)
+    assert [l["uuid"] for l in local["lignes"]] == ["est", "ouest"]
+    est, ouest = local["lignes"]
+    assert est["touche"] and est["distance"] == pytest.approx(10.0)
+    assert not ouest["touche"] and ouest["distance"] is None
+    # Extrémité : point d'impact, sinon bout de la ligne de vue (150 m)
+    metres_par_degre = 6371008.8 * math.pi / 180 * math.cos(math.radians(lat))
+    assert (est["chemin"][1][0] - lon) * metres_par_degre == pytest.approx(10.0, abs=0.05)
+    assert (lon - ouest["chemin"][1][0]) * metres_par_degre == pytest.approx(150.0, abs=0.5)
+    assert len(local["polygones"]) == 1 and len(local["polygones"][0]) == 5
+
+    # Lancer délégué au serveur de cartographie : mêmes lignes, sans les polygones
+    serveur = calculer_apercu_lignes_de_vue(
+        lat, lon, annotations, 90, rayons_serveur=lambda x, y, angles: lancer_rayons(reference[2], x, y, angles, 90)
+    )
+    assert serveur["lignes"] == local["lignes"] and serveur["polygones"] == []
+
+
+def test_carte_apercu():
+    reference, lat, lon, annotations = _scene()
+    deck = creer_carte_apercu(calculer_apercu_lignes_de_vue(lat, lon, annotations, 90, reference=reference))
+    polygones, lignes, impacts, photo = deck.layers
+    assert [l["couleur"] for l in lignes.data] == [COULEUR_CARTOGRAPHIE, COULEUR_NON_TOUCHE]
+    # Un seul point d'impact (la ligne vers l'ouest ne touche rien)
+    assert [i["libelle"] for i in impacts.data] == ["porte entrée"]
+    assert photo.data[0]["position"] == [lon, lat]
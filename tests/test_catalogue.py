@@ -0,0 +1,48 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_catalogue.py) Catalogue des images : mise à jour incrémentale et images réécrites sur place
+# -----------------------------------------------------------------------------
+
+import os
+
+from PIL import Image
+
+from utils.catalogue_utils import construire_catalogue, charger_catalogue, image_modifiee, FICHIER_CATALOGUE
+
+
+def _image(chemin, taille, mtime):
+    Image.new("RGB", taille, (120, 80, 40)).save(chemin, "JPEG")
+    os.utime(chemin, (mtime, mtime))
+
+
+def test_catalogue_incremental(tmp_path):
+    _image(tmp_path / "b.jpg", (64, 48), 1_000_000)
+    _image(tmp_path / "a.jpg", (200, 100), 1_000_000)
+    catalogue = construire_catalogue(str(tmp_path))
+    assert list(catalogue) == ["a.jpg", "b.jpg"]
+    assert (catalogue["a.jpg"]["largeur"], catalogue["a.jpg"]["hauteur"], catalogue["a.jpg"]["est_360"]) == (200, 100, True)
+    assert os.path.exists(tmp_path / FICHIER_CATALOGUE)
+
+    # Image réécrite sur place, dossier inchangé : seule cette image est relue
+    mtime_dossier = os.stat(tmp_path).st_mtime_ns
+    _image(tmp_path / "b.jpg", (30, 20), 2_000_000)
+    os.utime(tmp_path, ns=(mtime_dossier, mtime_dossier))
+    assert image_modifiee(str(tmp_path), "b.jpg", catalogue["b.jpg"])
+    assert not image_modifiee(str(tmp_path), "a.jpg", catalogue["a.jpg"])
+    nouveau = construire_catalogue(str(tmp_path))
+    assert (nouveau["b.jpg"]["largeur"], nouveau["b.jpg"]["hauteur"]) == (30, 20)
+    assert nouveau["b.jpg"]["empreinte"] != catalogue["b.jpg"]["empreinte"]
+    assert nouveau["a.jpg"] == catalogue["a.jpg"]
+
+
+def test_charger_catalogue_reverifie_a_chaque_tranche(tmp_path):
+    _image(tmp_path / "a.jpg", (64, 48), 1_000_000)
+    mtime_dossier = os.stat(tmp_path).st_mtime
+    assert charger_catalogue(str(tmp_path), mtime_dossier, 0)["a.jpg"]["largeur"] == 64
+    _image(tmp_path / "a.jpg", (32, 24), 2_000_000)
+    # Même tranche : catalogue gardé en mémoire ; tranche suivante : tailles et dates revérifiées
+    assert charger_catalogue(str(tmp_path), mtime_dossier, 0)["a.jpg"]["largeur"] == 64
+    assert charger_catalogue(str(tmp_path), mtime_dossier, 1)["a.jpg"]["largeur"] == 32
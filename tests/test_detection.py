@@ -0,0 +1,50 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_detection.py) Pré-annotation ONNX : letterbox, décodage de la sortie et NMS par classe
+# -----------------------------------------------------------------------------
+
+import numpy as np
+from PIL import Image
+
+from utils.detection_utils import pretraiter_image, supprimer_doublons, decoder_sortie
+
+
+def test_nms_par_classe():
+    boites = np.array([[10., 10., 60., 60.], [12., 12., 62., 62.], [11., 11., 61., 61.], [200., 200., 260., 260.]])
+    scores = np.array([0.9, 0.8, 0.7, 0.5])
+    # Boîtes 0 et 1 de même classe : la moins sûre est supprimée ; boîte 2 d'une autre classe : gardée
+    assert supprimer_doublons(boites, scores, np.array([0, 0, 1, 0])).tolist() == [0, 2, 3]
+
+
+def test_nms_boites_hors_image_d_autres_classes():
+    # Boîte de classe 1 qui dépasse en haut à gauche de l'image, boîte de classe 0 en bas à droite :
+    # le décalage par classe ne doit pas les superposer
+    boites = np.array([[550., 550., 630., 630.], [-75., -75., 5., 5.]])
+    assert sorted(supprimer_doublons(boites, np.array([0.6, 0.9]), np.array([0, 1])).tolist()) == [0, 1]
+
+
+def test_decodage_revient_aux_pixels_de_l_image(tmp_path):
+    chemin = tmp_path / "photo.jpg"
+    Image.new("RGB", (1280, 640), (90, 90, 90)).save(chemin)
+    tableau, transformation = pretraiter_image(chemin, 640)
+    assert tableau.shape == (3, 640, 640)
+    # Image 2:1 réduite de moitié, bandes grises de 160 pixels en haut et en bas
+    assert transformation == (0.5, 0.5, 0, 160)
+    assert np.allclose(tableau[:, 0, 0], 114 / 255) and np.allclose(tableau[:, 320, 320], 90 / 255, atol=0.01)
+
+    # Colonnes yolov8 : cx, cy, l, h, scores de 2 classes
+    sortie = np.array([
+        [100., 260., 40., 20., 0.1, 0.8],   # classe 1, boîte (80, 250)-(120, 270) dans le carré
+        [101., 261., 40., 20., 0.2, 0.7],   # doublon de la précédente
+        [400., 400., 50., 50., 0.2, 0.1],   # sous le seuil de confiance
+    ], dtype=np.float32)
+    assert decoder_sortie(sortie, transformation) == [[160.0, 180.0, 240.0, 220.0, 0.8, 1]]
+
+    # yolov5 : score objet en colonne 4, multiplié par les scores des classes
+    sortie_v5 = np.insert(sortie, 4, [0.5, 0.5, 1.0], axis=1)
+    assert decoder_sortie(sortie_v5, transformation, format_sortie="yolov5", seuil_confiance=0.3) == [
+        [160.0, 180.0, 240.0, 220.0, 0.4, 1]
+    ]
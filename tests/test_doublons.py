@@ -0,0 +1,85 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_doublons.py) Photos quasi identiques : index par bandes du pHash et seuil de distance GPS
+# -----------------------------------------------------------------------------
+
+import random
+
+from utils.doublons_utils import grouper_doublons, photos_masquees, position_voisine, _distance_gps
+
+
+# Catalogue et empreintes minimaux : une empreinte de fichier par photo, pHash 64 bits en hexadécimal
+def _donnees(phashes):
+    catalogue = {nom: {"empreinte": f"f-{nom}"} for nom in phashes}
+    empreintes = {f"f-{nom}": f"{valeur:016x}" for nom, valeur in phashes.items()}
+    return catalogue, empreintes
+
+
+# Référence : comparaison de chaque photo à tous les représentants (sans index)
+def _grouper_force_brute(noms, valeurs, positions, seuil, distance_max):
+    groupes = []
+    for i, valeur in enumerate(valeurs):
+        retenu = None
+        for g, membres in enumerate(groupes):
+            r = membres[0]
+            ecart = (valeurs[r] ^ valeur).bit_count()
+            if ecart > seuil or (retenu and retenu[0] <= ecart):
+                continue
+            if positions[i] and positions[r] and _distance_gps(positions[i], positions[r]) > distance_max:
+                continue
+            retenu = (ecart, g)
+        if retenu:
+            groupes[retenu[1]].append(i)
+        else:
+            groupes.append([i])
+    return [[noms[i] for i in membres] for membres in groupes if len(membres) > 1]
+
+
+def test_index_par_bandes_identique_a_la_force_brute():
+    aleatoire = random.Random(3)
+    noms, valeurs, positions = [], [], []
+    # 40 scènes : quelques photos chacune, à quelques bits et quelques dizaines de centimètres près
+    for scene in range(40):
+        base = aleatoire.getrandbits(64)
+        lat, lon = 48.85 + scene * 1e-3, 2.35
+        for k in range(aleatoire.randint(1, 4)):
+            valeur = base
+            for bit in aleatoire.sample(range(64), aleatoire.randint(0, 7)):
+                valeur ^= 1 << bit
+            noms.append(f"IMG_{len(noms):04d}.jpg")
+            valeurs.append(valeur)
+            positions.append(None if aleatoire.random() < 0.2 else (lat + aleatoire.uniform(-1e-5, 1e-5), lon))
+    catalogue, empreintes = _donnees(dict(zip(noms, valeurs)))
+    exif = {nom: {"latitude": p[0], "longitude": p[1]} for nom, p in zip(noms, positions) if p}
+
+    for seuil in (0, 3, 5, 8):
+        groupes = grouper_doublons(catalogue, empreintes, exif, seuil_hamming=seuil, distance_max=2.0)
+        assert groupes["groupes"] == _grouper_force_brute(noms, valeurs, positions, seuil, 2.0)
+        assert all(groupes["groupe_de"][nom] == g for g, membres in enumerate(groupes["groupes"]) for nom in membres)
+
+
+def test_seuil_de_distance_gps():
+    catalogue, empreintes = _donnees({"a.jpg": 0xF0F0, "b.jpg": 0xF0F1, "c.jpg": 0xF0F0, "d.jpg": 0xF0F0})
+    # b à environ 1 m de a, c à environ 5,5 m, d sans position GPS
+    exif = {
+        "a.jpg": {"latitude": 48.85, "longitude": 2.35},
+        "b.jpg": {"latitude": 48.85001, "longitude": 2.35},
+        "c.jpg": {"latitude": 48.85005, "longitude": 2.35},
+    }
+    groupes = grouper_doublons(catalogue, empreintes, exif, seuil_hamming=2, distance_max=2.0)
+    assert groupes["groupes"] == [["a.jpg", "b.jpg", "d.jpg"]]
+    assert "c.jpg" not in groupes["groupe_de"]
+    # Distance plus large : c rejoint le groupe
+    assert grouper_doublons(catalogue, empreintes, exif, 2, 10.0)["groupes"] == [["a.jpg", "b.jpg", "c.jpg", "d.jpg"]]
+
+
+def test_navigation_saute_les_doublons_non_annotes():
+    groupes = {"groupes": [["a.jpg", "b.jpg", "c.jpg"]]}
+    masquees = photos_masquees(groupes, {"c.jpg": [{"uuid": "1"}]})
+    assert masquees == {"b.jpg"}
+    images = ["a.jpg", "b.jpg", "c.jpg", "d.jpg"]
+    assert position_voisine(images, 0, 1, masquees) == 2
+    assert position_voisine(images, 2, -1, masquees) == 0
@@ -0,0 +1,59 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_export.py) Export des couches phm_* en GeoParquet et FlatGeobuf
+# -----------------------------------------------------------------------------
+
+import json
+import os
+import random
+
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+from shapely.geometry import Point
+
+from utils.export_utils import exporter_couches, pyarrow_disponible
+
+
+# GeoPackage de sortie : une couche de points dans le désordre, une couche vide, une couche hors export
+def _gpkg_sortie(dossier):
+    aleatoire = random.Random(6)
+    gpkg = os.path.join(dossier, "sortie.gpkg")
+    points = [Point(652000 + aleatoire.uniform(0, 1000), 6862000 + aleatoire.uniform(0, 1000)) for _ in range(300)]
+    gpd.GeoDataFrame({"num": range(300)}, geometry=points, crs="EPSG:2154").to_file(gpkg, layer="phm_point_objet", driver="GPKG")
+    gpd.GeoDataFrame({"num": []}, geometry=[], crs="EPSG:2154").to_file(gpkg, layer="phm_point_ref", driver="GPKG")
+    gpd.GeoDataFrame({"num": [0]}, geometry=[Point(652000, 6862000)], crs="EPSG:2154").to_file(gpkg, layer="autre", driver="GPKG")
+    return gpkg
+
+
+def test_export_flatgeobuf(tmp_path):
+    gpkg = _gpkg_sortie(str(tmp_path))
+    fichiers = exporter_couches(gpkg, "flatgeobuf")
+    assert fichiers == [str(tmp_path / "sortie_flatgeobuf" / "phm_point_objet.fgb")]
+    lu = gpd.read_file(fichiers[0])
+    assert sorted(lu["num"]) == list(range(300)) and lu.crs.to_epsg() == 2154
+    # Lecture par emprise (index spatial) et réécriture d'un export existant
+    emprise = gpd.read_file(fichiers[0], bbox=(652000, 6862000, 652500, 6862500))
+    assert 0 < len(emprise) < 300
+    assert exporter_couches(gpkg, "flatgeobuf") == fichiers
+    assert exporter_couches(gpkg, "gpkg") == []
+
+
+def test_export_geoparquet(tmp_path):
+    if not pyarrow_disponible():
+        pytest.skip("pyarrow absent")
+    import pyarrow.parquet as pq
+    gpkg = _gpkg_sortie(str(tmp_path))
+    dossier = str(tmp_path / "export")
+    fichiers = exporter_couches(gpkg, "geoparquet", dossier=dossier, couches=("phm_point_objet", "phm_point_ref"))
+    assert fichiers == [os.path.join(dossier, "phm_point_objet.parquet")]
+    lu = gpd.read_parquet(fichiers[0])
+    assert sorted(lu["num"]) == list(range(300)) and lu.crs.to_epsg() == 2154
+    # Colonne bbox déclarée comme « covering » de la géométrie (filtrage par emprise à la lecture)
+    metadonnees = json.loads(pq.ParquetFile(fichiers[0]).schema_arrow.metadata[b"geo"])
+    assert metadonnees["columns"]["geometry"]["covering"]["bbox"]["xmin"] == ["bbox", "xmin"]
+    # Objets triés selon la courbe de Hilbert
+    assert list(lu.geometry.hilbert_distance()) == sorted(lu.geometry.hilbert_distance())
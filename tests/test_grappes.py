@@ -0,0 +1,89 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_grappes.py) Carte des photos : grappes et sélection de la vue
+# -----------------------------------------------------------------------------
+
+import random
+
+import numpy as np
+
+from utils.grappes_utils import (
+    construire_index_carte, grappes_vue, photos_vue, photos_grappe, vue_ensemble, zoom_eclatement,
+    lonlat_vers_mercator, TAILLE_CARTE, TAILLE_TUILE, ZOOM_MAX_CARTE
+)
+
+
+# Deux quartiers de photos à quelques kilomètres l'un de l'autre, une photo sur dix sans GPS
+def _campagne():
+    aleatoire = random.Random(7)
+    noms, exif, annotations = [], {}, {}
+    for p in range(300):
+        nom = f"IMG_{p:04d}.jpg"
+        noms.append(nom)
+        if p % 10 == 9:
+            exif[nom] = {}
+            continue
+        lat, lon = (48.85, 2.35) if p % 2 else (48.87, 2.30)
+        exif[nom] = {"latitude": lat + aleatoire.uniform(-0.003, 0.003), "longitude": lon + aleatoire.uniform(-0.003, 0.003)}
+        annotations[nom] = [{"uuid": f"{p}-{k}"} for k in range(aleatoire.choice([0, 0, 1, 3]))]
+    return noms, exif, annotations
+
+
+def _emprise(centre, zoom, marge, taille=TAILLE_CARTE):
+    demi_x = taille[0] * (0.5 + marge) / (TAILLE_TUILE * 2.0 ** zoom)
+    demi_y = taille[1] * (0.5 + marge) / (TAILLE_TUILE * 2.0 ** zoom)
+    return centre[0] - demi_x, centre[1] - demi_y, centre[0] + demi_x, centre[1] + demi_y
+
+
+def test_grappes_couvrent_toutes_les_photos():
+    noms, exif, annotations = _campagne()
+    index = construire_index_carte(noms, exif)
+    assert index["sans_gps"] == 30 and len(index["noms"]) == 270
+    nb_annotations = [len(annotations.get(nom, [])) for nom in index["noms"]]
+    cx, cy, zoom = vue_ensemble(index)
+
+    for z in (zoom - 3, zoom, zoom + 2, ZOOM_MAX_CARTE):
+        # Marge assez large pour voir toute la campagne : chaque photo est dans une grappe et une seule
+        grappes = grappes_vue(index, z, (cx, cy), nb_annotations, marge=2.0 ** max(z - zoom, 0) * 2)
+        assert sum(g["nb"] for g in grappes) == 270
+        assert sum(g["nb_annotations"] for g in grappes) == sum(nb_annotations)
+        assert sum(g["nb_annotees"] for g in grappes) == sum(n > 0 for n in nb_annotations)
+        membres = np.concatenate([photos_grappe(index, z, g["grappe"]) for g in grappes])
+        assert sorted(membres.tolist()) == sorted(index["positions"].tolist())
+        for g in grappes:
+            assert (g["image"] is not None) == (g["nb"] == 1)
+            if g["image"]:
+                assert noms[photos_grappe(index, z, g["grappe"])[0]] == g["image"]
+
+    # Vue d'ensemble : les deux quartiers ; zoom maximal : presque une grappe par photo
+    assert len(grappes_vue(index, zoom - 3, (cx, cy), nb_annotations)) <= 2
+    assert len(grappes_vue(index, ZOOM_MAX_CARTE, (cx, cy), nb_annotations, marge=1e6)) >= 265
+    grappe = grappes_vue(index, zoom - 3, (cx, cy), nb_annotations)[0]
+    assert zoom - 3 < zoom_eclatement(index, zoom - 3, grappe["grappe"]) <= ZOOM_MAX_CARTE
+
+
+def test_vue_limitee_a_l_emprise():
+    noms, exif, annotations = _campagne()
+    index = construire_index_carte(noms, exif)
+    nb_annotations = [len(annotations.get(nom, [])) for nom in index["noms"]]
+    _, _, zoom = vue_ensemble(index)
+    # Vue zoomée sur le premier quartier
+    centre = tuple(float(v) for v in lonlat_vers_mercator(2.30, 48.87))
+    zoom += 3
+
+    x0, y0, x1, y1 = _emprise(centre, zoom, 0.0)
+    attendues = [pos for pos, nom in enumerate(noms) if exif[nom]
+                 and x0 <= lonlat_vers_mercator(exif[nom]["longitude"], exif[nom]["latitude"])[0] <= x1
+                 and y0 <= lonlat_vers_mercator(exif[nom]["longitude"], exif[nom]["latitude"])[1] <= y1]
+    assert 0 < len(attendues) < 270
+    assert photos_vue(index, zoom, centre).tolist() == attendues
+
+    # Grappes : celles dont le centre est dans la vue élargie de la marge
+    niveau = index["niveaux"][zoom]
+    x0, y0, x1, y1 = _emprise(centre, zoom, 0.5)
+    dans_vue = {g for g in range(len(niveau["nb"])) if x0 <= niveau["x"][g] <= x1 and y0 <= niveau["y"][g] <= y1}
+    assert {g["grappe"] for g in grappes_vue(index, zoom, centre, nb_annotations, marge=0.5)} == dans_vue
+    assert grappes_vue(index, zoom, lonlat_vers_mercator(-70.0, 40.0), nb_annotations) == []
@@ -0,0 +1,47 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_import.py) Budget de démarrage de l'interface : chargement différé des piles géo / CV
+# -----------------------------------------------------------------------------
+
+import json
+import os
+import subprocess
+import sys
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules lourds qui ne doivent être chargés qu'à l'utilisation (cartographie, aperçu, pré-annotation)
+MODULES_DIFFERES = ("geopandas", "shapely", "pyproj", "onnxruntime", "fiona", "scipy", "cv2")
+# Budget large (secondes) : on détecte un retour des imports lourds, pas une variation de machine
+BUDGET_IMPORT = 5.0
+
+SCRIPT = """
+import json, sys, time
+debut = time.perf_counter()
+import main
+duree = time.perf_counter() - debut
+print(json.dumps({"duree": duree, "modules": sorted(m for m in sys.modules if m.split(".")[0] in %r)}))
+"""
+
+
+# Import de main.py dans un processus neuf (cache des modules vide), sans lancer Streamlit
+def _importer_main():
+    resultat = subprocess.run(
+        [sys.executable, "-c", SCRIPT % (MODULES_DIFFERES,)],
+        cwd=RACINE, capture_output=True, text=True, timeout=120
+    )
+    assert resultat.returncode == 0, resultat.stderr
+    return json.loads(resultat.stdout.strip().splitlines()[-1])
+
+
+def test_import_sans_piles_lourdes():
+    mesure = _importer_main()
+    assert mesure["modules"] == []
+
+
+def test_import_dans_le_budget():
+    mesure = _importer_main()
+    assert mesure["duree"] < BUDGET_IMPORT, f"import main : {mesure['duree']:.2f} s"
@@ -0,0 +1,62 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_perf.py) Diagnostic de performance : mesures par rerun, synthèse et export CSV
+# -----------------------------------------------------------------------------
+
+import csv
+import io
+
+from streamlit.testing.v1 import AppTest
+
+from utils.perf_utils import mesurer, noter_taille, synthese_perf, exporter_csv_perf
+
+
+def _application():
+    import time
+    from utils.perf_utils import debut_rerun, fin_rerun, mesurer, noter_taille
+    debut_rerun()
+    for _ in range(2):
+        with mesurer("catalogue"):
+            time.sleep(0.01)
+    noter_taille("carte", 1000)
+    noter_taille("carte", 500)
+    fin_rerun()
+
+
+def test_mesures_par_rerun():
+    app = AppTest.from_function(_application)
+    app.run()
+    assert "historique_perf" not in app.session_state
+    # Diagnostic coché : les mesures d'un rerun sont versées dans l'historique au rerun suivant
+    app.session_state["diagnostic_perf"] = True
+    app.run()
+    app.run()
+    historique = app.session_state["historique_perf"]
+    assert len(historique) == 1
+    ligne = historique[0]
+    assert ligne["carte_octets"] == 1500
+    assert 20 <= ligne["catalogue_ms"] <= ligne["total_ms"]
+
+
+def test_sans_interface_aucune_mesure():
+    # Hors de Streamlit (CLI, tests) : sections exécutées normalement, rien n'est enregistré
+    with mesurer("section"):
+        valeur = 1
+    noter_taille("carte", 10)
+    assert valeur == 1
+
+
+def test_synthese_et_csv():
+    historique = [
+        {"horodatage": "2025-01-01T10:00:00", "total_ms": 100.0, "catalogue_ms": 40.0},
+        {"horodatage": "2025-01-01T10:00:05", "total_ms": 50.0, "carte_octets": 2000},
+    ]
+    synthese = {ligne["mesure"]: ligne for ligne in synthese_perf(historique)}
+    assert synthese["total_ms"] == {"mesure": "total_ms", "dernier": 50.0, "moyenne": 75.0, "max": 100.0, "reruns": 2}
+    assert synthese["catalogue_ms"]["dernier"] is None and synthese["catalogue_ms"]["reruns"] == 1
+    lignes = list(csv.DictReader(io.StringIO(exporter_csv_perf(historique))))
+    assert list(lignes[0]) == ["horodatage", "total_ms", "catalogue_ms", "carte_octets"]
+    assert lignes[0]["carte_octets"] == "" and lignes[1]["catalogue_ms"] == ""
@@ -0,0 +1,52 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_projection.py) Projections équirectangulaire et perspective des photos 360°
+# -----------------------------------------------------------------------------
+
+import numpy as np
+import pytest
+
+from utils.projection_utils import (
+    angles_vers_pixels, pixels_vers_angles, perspective_vers_angles, angles_vers_perspective, vue_perspective
+)
+
+
+def test_pixels_et_angles_equirectangulaires():
+    largeur, hauteur = 8000, 4000
+    x, y = np.random.default_rng(1).uniform([0, 0], [largeur, hauteur], size=(200, 2)).T
+    yaw, pitch = pixels_vers_angles(x, y, largeur, hauteur)
+    assert np.all((yaw >= -180) & (yaw < 180)) and np.all((pitch >= -90) & (pitch <= 90))
+    x2, y2 = angles_vers_pixels(yaw, pitch, largeur, hauteur)
+    assert np.allclose(x2, x) and np.allclose(y2, y)
+    # Centre de la photo : yaw 0, horizon
+    assert np.allclose(pixels_vers_angles(largeur / 2, hauteur / 2, largeur, hauteur), (0.0, 0.0))
+
+
+@pytest.mark.parametrize("yaw, pitch", [(0.0, 0.0), (170.0, 30.0), (-95.0, -60.0)])
+def test_perspective_aller_retour(yaw, pitch):
+    largeur, hauteur, fov = 1024, 768, 75.0
+    x, y = np.random.default_rng(2).uniform([0, 0], [largeur, hauteur], size=(200, 2)).T
+    yaw_points, pitch_points = perspective_vers_angles(x, y, largeur, hauteur, fov, yaw, pitch)
+    x2, y2, visible = angles_vers_perspective(yaw_points, pitch_points, largeur, hauteur, fov, yaw, pitch)
+    assert visible.all()
+    assert np.allclose(x2, x, atol=1e-6) and np.allclose(y2, y, atol=1e-6)
+
+    # Centre de la vue : direction de la vue ; direction opposée : derrière la caméra
+    centre = perspective_vers_angles(largeur / 2, hauteur / 2, largeur, hauteur, fov, yaw, pitch)
+    assert np.allclose(centre, (yaw, pitch), atol=1e-9)
+    assert not angles_vers_perspective(yaw + 180.0, -pitch, largeur, hauteur, fov, yaw, pitch)[2]
+
+
+def test_vue_perspective_recadre_la_bonne_direction():
+    pytest.importorskip("cv2")
+    # Photo 360° dont chaque colonne encode son yaw (un niveau de gris pour deux degrés)
+    largeur, hauteur = 720, 360
+    colonnes = np.floor(pixels_vers_angles(np.arange(largeur) + 0.5, 0, largeur, hauteur)[0] / 2 + 90).astype(np.uint8)
+    image = np.repeat(colonnes[None, :], hauteur, axis=0)
+    for yaw in (-120.0, 0.0, 150.0):
+        vue = vue_perspective(image, fov=60.0, yaw=yaw, pitch=0.0, taille=(64, 48))
+        assert vue.shape == (48, 64)
+        assert abs(int(vue[24, 32]) - (yaw / 2 + 90)) <= 1
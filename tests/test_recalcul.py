@@ -0,0 +1,74 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_recalcul.py) Recalcul groupé des angles : mêmes résultats que le calcul à l'annotation
+# -----------------------------------------------------------------------------
+
+import copy
+import random
+
+import pytest
+
+from utils.annotation_utils import calculer_angle_objet, calculer_fov_vertical, calculer_angle_elevation
+from utils.recalcul_utils import recalculer_angles
+
+FOV_APPAREILS = {"GoPro": 118.0, "Pixel": 72.0}
+FOV_DEFAUT = 90.0
+
+
+# Campagne de photos (deux appareils et un inconnu) avec des angles faux à recalculer
+def _campagne():
+    aleatoire = random.Random(5)
+    annotations, exif, catalogue, modeles = {}, {}, {}, {}
+    for p in range(40):
+        nom = f"IMG_{p:04d}.jpg"
+        largeur, hauteur = aleatoire.choice([(4000, 3000), (1920, 1080), (3000, 4000)])
+        catalogue[nom] = {"largeur": largeur, "hauteur": hauteur}
+        exif[nom] = {"direction": aleatoire.uniform(0, 360)}
+        modeles[nom] = aleatoire.choice(["GoPro", "Pixel", None])
+        annotations[nom] = [
+            {"uuid": f"{p}-{k}", "type_objet": "porte", "x": aleatoire.randint(0, largeur), "y": aleatoire.randint(0, hauteur),
+             "angle_ajuste": aleatoire.uniform(0, 360), "angle_vertical": 0.0}
+            for k in range(aleatoire.randint(1, 3))
+        ]
+    return annotations, exif, catalogue, modeles
+
+
+def test_recalcul_identique_au_calcul_a_l_annotation():
+    annotations, exif, catalogue, modeles = _campagne()
+    corrections = {"IMG_0003.jpg": 4.5}
+    avant = copy.deepcopy(annotations)
+    simulation = recalculer_angles(annotations, exif, catalogue, FOV_DEFAUT, FOV_APPAREILS, modeles, corrections)
+    assert annotations == avant
+    assert simulation["nb_annotations"] == sum(len(liste) for liste in annotations.values())
+
+    resultat = recalculer_angles(annotations, exif, catalogue, FOV_DEFAUT, FOV_APPAREILS, modeles, corrections, appliquer=True)
+    assert resultat["modifications"] == simulation["modifications"]
+    for nom, liste in annotations.items():
+        largeur, hauteur = catalogue[nom]["largeur"], catalogue[nom]["hauteur"]
+        fov = FOV_APPAREILS.get(modeles[nom], FOV_DEFAUT)
+        direction = exif[nom]["direction"] + corrections.get(nom, 0.0)
+        for ann in liste:
+            assert ann["angle_ajuste"] == pytest.approx(calculer_angle_objet(ann["x"], largeur, direction, fov), abs=1e-9)
+            fov_vertical = calculer_fov_vertical(fov, largeur, hauteur)
+            assert ann["angle_vertical"] == pytest.approx(calculer_angle_elevation(ann["y"], hauteur, fov_vertical), abs=1e-9)
+
+    # Angles à jour : plus rien à modifier
+    assert recalculer_angles(annotations, exif, catalogue, FOV_DEFAUT, FOV_APPAREILS, modeles, corrections)["modifications"] == []
+
+
+def test_recalcul_photos_360_et_ignorees():
+    annotations = {
+        "pano.jpg": [{"uuid": "a", "yaw_origine": 30.0, "angle_ajuste": 0.0, "angle_vertical": -12.0}],
+        "sans_direction.jpg": [{"uuid": "b", "x": 10, "y": 10, "angle_ajuste": 5.0}],
+        "sans_dimensions.jpg": [{"uuid": "c", "x": 10, "y": 10, "angle_ajuste": 5.0}],
+    }
+    exif = {"pano.jpg": {"direction": 340.0}, "sans_dimensions.jpg": {"direction": 0.0}}
+    resultat = recalculer_angles(annotations, exif, {"pano.jpg": {"largeur": 8000, "hauteur": 4000}}, FOV_DEFAUT, appliquer=True)
+    # Yaw relatif + direction, pitch conservé
+    assert annotations["pano.jpg"][0]["angle_ajuste"] == pytest.approx(10.0)
+    assert annotations["pano.jpg"][0]["angle_vertical"] == -12.0
+    assert sorted(i["uuid"] for i in resultat["ignorees"]) == ["b", "c"]
+    assert annotations["sans_direction.jpg"][0]["angle_ajuste"] == 5.0
@@ -0,0 +1,54 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_recherche.py) Recherche des images par nom, filtres et pagination
+# -----------------------------------------------------------------------------
+
+import random
+from datetime import date
+
+from utils.recherche_utils import construire_index_noms, rechercher_noms, filtrer_images, paginer
+
+
+def test_recherche_identique_a_un_parcours_complet():
+    aleatoire = random.Random(4)
+    noms = [f"{aleatoire.choice(['IMG', 'GOPR', 'Pano'])}_{aleatoire.randint(0, 9999):04d}{aleatoire.choice(['', '_rue'])}.jpg"
+            for _ in range(2000)]
+    noms = list(dict.fromkeys(noms))
+    index = construire_index_noms(noms)
+    assert all(index["positions"][nom] == pos for pos, nom in enumerate(noms))
+    for terme in ["i", "go", "Pa", "img_0", "_RUE", "0042", "pano_9", "zzz", " jpg ", ""]:
+        t = terme.strip().lower()
+        if len(t) < 3:
+            attendu = [pos for pos, nom in enumerate(noms) if t and nom.lower().startswith(t)]
+        else:
+            attendu = [pos for pos, nom in enumerate(noms) if t in nom.lower()]
+        assert rechercher_noms(index, terme) == attendu
+
+
+def test_filtres_et_pagination():
+    noms = ["a.jpg", "b.jpg", "c.jpg", "d.jpg"]
+    index = construire_index_noms(noms)
+    catalogue = {"a.jpg": {"est_360": True}, "b.jpg": {"est_360": False}, "c.jpg": {"est_360": False}}
+    exif = {
+        "a.jpg": {"latitude": 48.8, "longitude": 2.3, "direction": 10.0, "date_time": "2024:05:01 10:00:00"},
+        "b.jpg": {"date_time": "2024:06:15 10:00:00"},
+        "c.jpg": {"latitude": 48.8, "longitude": 2.3, "date_time": "illisible"},
+    }
+    annotations = {"a.jpg": [{"uuid": "1"}], "b.jpg": []}
+    tout = list(range(4))
+    assert filtrer_images(tout, index, catalogue, exif, annotations, annotee=True) == [0]
+    assert filtrer_images(tout, index, catalogue, exif, annotations, annotee=False) == [1, 2, 3]
+    assert filtrer_images(tout, index, catalogue, exif, annotations, gps_manquant=True) == [1, 3]
+    assert filtrer_images(tout, index, catalogue, exif, annotations, direction_manquante=True) == [1, 2, 3]
+    assert filtrer_images(tout, index, catalogue, exif, annotations, date_debut=date(2024, 6, 1)) == [1]
+    assert filtrer_images(tout, index, catalogue, exif, annotations, date_fin=date(2024, 5, 31)) == [0]
+    assert filtrer_images(tout, index, catalogue, exif, annotations, type_photo="standard") == [1, 2]
+
+    elements = list(range(45))
+    assert paginer(elements, 3) == (list(range(40, 45)), 3)
+    assert paginer(elements, 99) == (list(range(40, 45)), 3)
+    assert paginer(elements, 0) == (list(range(20)), 3)
+    assert paginer([], 1) == ([], 1)
@@ -0,0 +1,96 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_reference.py) Préparation de la couche de référence : réparation des géométries invalides
+# -----------------------------------------------------------------------------
+
+import io
+import os
+
+import numpy as np
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+from shapely.geometry import Polygon, box
+
+from utils.file_utils import empreinte_fichier, prepare_temp_gpkg, supprimer_copie_temporaire, limiter_cache
+from utils.reference_utils import charger_reference, cle_cache_reference
+from utils.geo_utils import observer_maj_objet, identifier_objets
+
+
+# Couche avec un polygone auto-intersecté (« nœud papillon ») entre deux bâtiments valides
+def _couche_invalide(dossier):
+    geoms = [box(0, 10, 10, 25), Polygon([(20, 10), (30, 25), (30, 10), (20, 25)]), box(40, 10, 50, 25)]
+    gpkg = os.path.join(dossier, "ref.gpkg")
+    gpd.GeoDataFrame({'id': ["A", "PAPILLON", "B"]}, geometry=geoms, crs='EPSG:2154').to_file(gpkg, layer='bati', driver='GPKG')
+    return gpkg
+
+
+@pytest.mark.parametrize("depuis_cache", [False, True])
+def test_reference_invalide_reparee(tmp_path, monkeypatch, depuis_cache):
+    monkeypatch.setenv("PHOTOMAPON_CACHE", str(tmp_path / "cache"))
+    gpkg = _couche_invalide(str(tmp_path))
+    if depuis_cache:
+        charger_reference(gpkg, 'bati')
+    gdf_geom, gdf_geom_clean, lignes_bat = charger_reference(gpkg, 'bati')
+    assert gdf_geom.is_valid.all() and gdf_geom_clean.is_valid.all()
+    assert gdf_geom.geometry.iloc[1].geom_type == 'MultiPolygon'
+
+    # Lignes de vue vers le nord depuis chaque bâtiment : les intersections avec la couche complète aboutissent
+    objets, _ = observer_maj_objet(gdf_geom, np.array([5.0, 25.0, 45.0]), np.zeros(3), np.zeros(3), 90)
+    assert objets.tolist() == [0, 1, 2]
+    assert identifier_objets(gdf_geom, [25.0], [17.5]) == ["PAPILLON"]
+
+
+def test_empreinte_modification_au_milieu(tmp_path):
+    # Page réécrite au milieu du fichier (checkpoint WAL) : même taille, mêmes premier et dernier blocs
+    chemin = tmp_path / "ref.gpkg"
+    chemin.write_bytes(bytes(3 * 1024 * 1024))
+    os.utime(chemin, ns=(1_000_000_000, 1_000_000_000))
+    avant = empreinte_fichier(str(chemin)), cle_cache_reference(str(chemin), 'bati')
+    with open(chemin, "r+b") as f:
+        f.seek(3 * 1024 * 1024 // 2)
+        f.write(b"modifie")
+    os.utime(chemin, ns=(2_000_000_000, 2_000_000_000))
+    apres = empreinte_fichier(str(chemin)), cle_cache_reference(str(chemin), 'bati')
+    assert avant[0] != apres[0] and avant[1] != apres[1]
+
+
+# Fichier uploadé (interface Streamlit) : flux binaire avec un nom et un identifiant
+class _Upload(io.BytesIO):
+    def __init__(self, contenu, file_id):
+        super().__init__(contenu)
+        self.name = "ref.gpkg"
+        self.file_id = file_id
+
+
+def test_deux_uploads_partagent_le_cache(tmp_path, monkeypatch):
+    cache = tmp_path / "cache"
+    monkeypatch.setenv("PHOTOMAPON_CACHE", str(cache))
+    with open(_couche_invalide(str(tmp_path)), "rb") as f:
+        contenu = f.read()
+    cles = []
+    for essai in range(2):
+        # Chaque traitement recopie l'upload dans un nouveau fichier temporaire, supprimé ensuite
+        session = {}
+        chemin = prepare_temp_gpkg(_Upload(contenu, f"upload-{essai}"), session)
+        cles.append(cle_cache_reference(chemin, 'bati'))
+        charger_reference(chemin, 'bati')
+        supprimer_copie_temporaire(chemin)
+        assert not os.path.exists(chemin)
+    assert cles[0] == cles[1]
+    assert len([f for f in os.listdir(cache) if f.startswith("reference_")]) == 1
+
+
+def test_limiter_cache_supprime_les_plus_anciennes(tmp_path, monkeypatch):
+    monkeypatch.setenv("PHOTOMAPON_CACHE", str(tmp_path))
+    for i in range(4):
+        chemin = tmp_path / f"reference_{i}.npz"
+        chemin.write_bytes(bytes(1024 * 1024))
+        os.utime(chemin, ns=((i + 1) * 10**9, (i + 1) * 10**9))
+    (tmp_path / "serveur_8765.jeton").write_text("x")
+    supprimes = limiter_cache("reference_", taille_max_mo=2.5, garder=str(tmp_path / "reference_0.npz"))
+    assert sorted(os.path.basename(f) for f in supprimes) == ["reference_1.npz", "reference_2.npz"]
+    assert sorted(os.listdir(tmp_path)) == ["reference_0.npz", "reference_3.npz", "serveur_8765.jeton"]
@@ -0,0 +1,64 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_serveur.py) Serveur de cartographie local : refus des requêtes venant d'un navigateur
+# -----------------------------------------------------------------------------
+
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from utils.serveur_utils import _GestionnaireRequetes, appeler_serveur, ENTETE_JETON
+
+JETON = "jeton-de-test"
+
+
+@pytest.fixture
+def serveur():
+    serveur = ThreadingHTTPServer(("127.0.0.1", 0), _GestionnaireRequetes)
+    serveur.jeton = JETON
+    fil = threading.Thread(target=serveur.serve_forever, daemon=True)
+    fil.start()
+    yield serveur.server_address[1]
+    serveur.shutdown()
+    serveur.server_close()
+
+
+def _requete(port, methode, chemin, corps=None, entetes=None):
+    connexion = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    connexion.request(methode, chemin, body=corps, headers=entetes or {})
+    reponse = connexion.getresponse()
+    contenu = json.loads(reponse.read())
+    connexion.close()
+    return reponse.status, contenu
+
+
+def test_etat_avec_jeton(serveur):
+    statut, contenu = _requete(serveur, "GET", "/etat", entetes={ENTETE_JETON: JETON})
+    assert statut == 200 and contenu["couches"] == []
+
+
+@pytest.mark.parametrize("entetes", [
+    {},                                                                    # sans jeton
+    {ENTETE_JETON: "autre"},                                               # jeton invalide
+    {ENTETE_JETON: JETON, "Origin": "https://exemple.org"},                # page web
+    {ENTETE_JETON: JETON, "Host": "attaquant.exemple.org"},                # rebinding DNS
+    {ENTETE_JETON: JETON, "Content-Type": "text/plain"},                   # requête « simple » sans CORS
+])
+def test_cartographier_refuse(serveur, entetes):
+    corps = json.dumps({"gpkg": "/tmp/x.gpkg", "couche": "bati"})
+    statut, contenu = _requete(serveur, "POST", "/cartographier", corps, {"Content-Type": "application/json", **entetes})
+    assert statut == 403 and "erreur" in contenu
+
+
+def test_client_envoie_le_jeton(serveur, monkeypatch):
+    monkeypatch.setenv("PHOTOMAPON_JETON", JETON)
+    assert appeler_serveur("/etat", url=f"http://127.0.0.1:{serveur}", timeout=5)["couches"] == []
+    monkeypatch.setenv("PHOTOMAPON_JETON", "autre")
+    with pytest.raises(RuntimeError):
+        appeler_serveur("/etat", url=f"http://127.0.0.1:{serveur}", timeout=5)
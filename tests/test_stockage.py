@@ -0,0 +1,86 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_stockage.py) Base SQLite des annotations : écritures concurrentes et suivi des changements
+# -----------------------------------------------------------------------------
+
+import threading
+import time
+
+from utils.stockage_utils import BaseAnnotations
+
+
+def _annotation(uuid):
+    return {"uuid": uuid, "x": 10, "y": 20, "type_objet": "porte", "mode_annotation": "cartographie"}
+
+
+def test_changements_deux_annotateurs_concurrents(tmp_path):
+    chemin = str(tmp_path / "annotations.sqlite")
+    # Deux processus d'annotation (une connexion chacun) et un lecteur qui suit les changements
+    annotateurs = [BaseAnnotations(chemin), BaseAnnotations(chemin)]
+    lecteur = BaseAnnotations(chemin)
+    seq = lecteur.derniere_sequence()
+    vues = set()
+    fin = threading.Event()
+
+    def suivre():
+        nonlocal seq
+        while not fin.is_set():
+            images, seq = lecteur.changements_depuis(seq)
+            vues.update(images)
+
+    def annoter(numero, base):
+        for i in range(30):
+            base.ajouter(f"IMG_{numero}_{i}.jpg", _annotation(f"{numero}-{i}"))
+
+    suivi = threading.Thread(target=suivre)
+    suivi.start()
+    ecritures = [threading.Thread(target=annoter, args=(n, b)) for n, b in enumerate(annotateurs)]
+    for fil in ecritures:
+        fil.start()
+    for fil in ecritures:
+        fil.join()
+    fin.set()
+    suivi.join()
+    images, seq = lecteur.changements_depuis(seq)
+    vues.update(images)
+
+    attendues = {f"IMG_{n}_{i}.jpg" for n in range(2) for i in range(30)}
+    assert vues == attendues
+    annotations, derniere = lecteur.charger()
+    assert derniere == seq == 60
+    assert set(annotations) == attendues
+    assert lecteur.annotations_image("IMG_1_3.jpg") == [_annotation("1-3")]
+
+
+def test_lecture_ne_voit_pas_une_transaction_annulee(tmp_path):
+    # Connexion partagée entre sessions (ouvrir_base_annotations) : une lecture pendant une écriture annulée
+    base = BaseAnnotations(str(tmp_path / "annotations.sqlite"))
+    seq = base.derniere_sequence()
+    ecriture_ouverte = threading.Event()
+
+    def operation_annulee(curseur):
+        curseur.execute("INSERT INTO changements (image_name, horodatage) VALUES ('IMG_X.jpg', 0)")
+        ecriture_ouverte.set()
+        time.sleep(0.2)
+        raise RuntimeError("annulation")
+
+    def ecrire():
+        try:
+            base._ecrire(operation_annulee, "IMG_X.jpg")
+        except RuntimeError:
+            pass
+
+    fil = threading.Thread(target=ecrire)
+    fil.start()
+    ecriture_ouverte.wait()
+    images, nouvelle_seq = base.changements_depuis(seq)
+    fil.join()
+    assert images == [] and nouvelle_seq == seq
+
+    # La séquence annulée est réutilisée par l'écriture suivante, qui doit être vue
+    base.ajouter("IMG_Y.jpg", _annotation("y"))
+    images, _ = base.changements_depuis(nouvelle_seq)
+    assert images == ["IMG_Y.jpg"]
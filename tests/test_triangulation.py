@@ -0,0 +1,87 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_triangulation.py) Triangulation des sous-groupes et cartographie avec identifiants manquants
+# -----------------------------------------------------------------------------
+
+import json
+import os
+import random
+
+import numpy as np
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+pyproj = pytest.importorskip("pyproj")
+from shapely.geometry import box
+
+from utils.geo_utils import trianguler_groupes, creer_gpkg_complet
+from utils.flux_utils import creer_gpkg_par_blocs
+
+
+def test_triangulation_ignore_observations_sans_groupe():
+    # Deux lignes de vue du groupe 0 se croisant en (10, 10), une observation sans groupe (-1)
+    x = np.array([0.0, 20.0, 5.0])
+    y = np.array([0.0, 0.0, 5.0])
+    angles = np.array([-45.0, -135.0, 0.0])
+    triang = trianguler_groupes(x, y, angles, np.array([0, 0, -1]), 0)
+    assert triang['valide'].tolist() == [True]
+    assert triang['nb_vues'].tolist() == [2]
+    assert np.allclose([triang['x'][0], triang['y'][0]], [10.0, 10.0])
+
+    # Aucune observation avec groupe : résultat vide
+    vide = trianguler_groupes(x, y, angles, np.array([-1, -1, -1]), 0)
+    assert len(vide['valide']) == 0
+
+
+# Rue de bâtiments (Lambert-93) dont un sur cinq n'a pas d'identifiant, photos annotées le long de la rue
+def _campagne_id_manquants(dossier):
+    random.seed(1)
+    x0, y0 = 652000, 6862000
+    geoms, ids = [], []
+    for i in range(20):
+        geoms.append(box(x0 + i * 12, y0 + 10, x0 + i * 12 + 10, y0 + 25))
+        ids.append(None if i % 5 == 0 else f"B{i}")
+        geoms.append(box(x0 + i * 12, y0 - 25, x0 + i * 12 + 10, y0 - 10))
+        ids.append(f"C{i}")
+    gpkg = os.path.join(dossier, "ref.gpkg")
+    gpd.GeoDataFrame({'id': ids}, geometry=geoms, crs='EPSG:2154').to_file(gpkg, layer='bati', driver='GPKG')
+
+    vers_wgs84 = pyproj.Transformer.from_crs('EPSG:2154', 'EPSG:4326', always_xy=True)
+    annotations, exif = {}, {}
+    for p in range(30):
+        lon, lat = vers_wgs84.transform(x0 - 20 + p * 8 + random.random(), y0 + random.uniform(-3, 3))
+        nom = f"IMG_{p:04d}.jpg"
+        exif[nom] = {'latitude': lat, 'longitude': lon, 'direction': 0.0, 'date_time': '2024:01:01 10:00:00'}
+        annotations[nom] = [{
+            'uuid': f"{p}-{k}", 'x': 100, 'y': 100, 'type_objet': 'porte', 'fonction_objet': 'entrée',
+            'mode_annotation': 'cartographie', 'angle_ajuste': (random.choice([0, 180]) + random.uniform(-40, 40)) % 360,
+            'angle_vertical': 0
+        } for k in range(3)]
+    for nom, contenu in (("annotations.json", annotations), ("exif_data.json", exif)):
+        with open(os.path.join(dossier, nom), "w", encoding="utf-8") as f:
+            json.dump(contenu, f)
+    return gpkg
+
+
+@pytest.mark.parametrize("par_blocs", [False, True])
+def test_cartographie_avec_identifiants_manquants(tmp_path, monkeypatch, par_blocs):
+    monkeypatch.setenv("PHOTOMAPON_CACHE", str(tmp_path / "cache"))
+    dossier = str(tmp_path)
+    gpkg = _campagne_id_manquants(dossier)
+    sortie = os.path.join(dossier, "sortie.gpkg")
+    args = (os.path.join(dossier, "annotations.json"), os.path.join(dossier, "exif_data.json"), gpkg, sortie,
+            dossier, 'bati', 0)
+    if par_blocs:
+        creer_gpkg_par_blocs(*args, taille_bloc=7)
+    else:
+        creer_gpkg_complet(*args)
+
+    points = gpd.read_file(sortie, layer='phm_point_objet_annot')
+    sans_groupe = points['subgroup_id'] < 0
+    # Les points accrochés aux bâtiments sans identifiant restent dans la couche, sans groupe
+    assert sans_groupe.any() and points.loc[sans_groupe, 'group_attr'].isna().all()
+    triangules = gpd.read_file(sortie, layer='phm_point_triangule')
+    assert (triangules['subgroup_id'] >= 0).all()
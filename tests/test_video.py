@@ -0,0 +1,48 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (test_video.py) Extraction d'images d'une vidéo : instants par pas de temps ou de distance
+# -----------------------------------------------------------------------------
+
+import numpy as np
+import pytest
+
+from utils.video_utils import caler_trace, instants_extraction, geolocaliser_instants, RAYON_TERRE
+
+
+# Trace à 1 Hz vers le nord : 20 s à 2 m/s, arrêt de 10 s, puis 30 s à 5 m/s (points dans le désordre)
+def _trace():
+    vitesses = [2.0] * 20 + [0.0] * 10 + [5.0] * 30
+    distance = np.concatenate([[0.0], np.cumsum(vitesses)])
+    temps = np.arange(len(distance), dtype=float)
+    melange = np.random.default_rng(0).permutation(len(temps))
+    latitude = 48.85 + np.degrees(distance / RAYON_TERRE)
+    return {"temps": temps[melange], "latitude": latitude[melange], "longitude": np.full(len(temps), 2.35)}
+
+
+def test_instants_par_pas_de_temps():
+    trace = caler_trace(_trace())
+    assert instants_extraction(trace, 45.0, pas_temps=2.0).tolist() == list(np.arange(0.0, 45.0, 2.0))
+    # Vidéo commencée 50 s après le début de la trace : seules ses 10 premières secondes sont couvertes
+    assert instants_extraction(caler_trace(_trace(), 50.0), 100.0, pas_temps=4.0).tolist() == [0.0, 4.0, 8.0]
+    assert len(instants_extraction(caler_trace(_trace(), 80.0), 100.0, pas_temps=1.0)) == 0
+
+
+def test_instants_par_pas_de_distance():
+    trace = caler_trace(_trace())
+    assert trace["distance"][-1] == pytest.approx(190.0, abs=1e-3)
+    instants = instants_extraction(trace, 59.5, pas_distance=10.0)
+    # Une image tous les 10 m : toutes les 5 s à 2 m/s, aucune pendant l'arrêt, toutes les 2 s à 5 m/s
+    assert len(instants) == 19
+    assert np.allclose(instants[:4], [0.0, 5.0, 10.0, 15.0], atol=1e-6)
+    assert not np.any((instants > 20.0 + 1e-6) & (instants < 30.0 - 1e-6))
+    assert np.allclose(np.diff(instants[5:]), 2.0, atol=1e-6)
+    assert np.allclose(np.diff(np.interp(instants, trace["temps"], trace["distance"])), 10.0, atol=1e-6)
+
+    # Positions interpolées, cap de déplacement calculé sur la trace (vers le nord)
+    latitude, longitude, cap = geolocaliser_instants(trace, instants, decalage_cap=90.0)
+    assert np.allclose(np.radians(latitude - 48.85) * RAYON_TERRE, np.arange(19) * 10.0, atol=1e-3)
+    assert np.allclose(longitude, 2.35)
+    assert np.allclose(cap, 90.0, atol=1e-6)
@@ -7,7 +7,6 @@
 # -----------------------------------------------------------------------------
 
 import uuid
-import pandas as pd
 import math
 import json
 
@@ -97,9 +96,10 @@ def calculer_angle_objet(x_orig, full_width, direction, fov):
     return angle_ajuste
 
 # Fonction d'ajout d'annotation photo classique
-def ajouter_annotation(annotations_dict, image_name, x, y, type_objet, fonction_objet, mode_annotation, angle_ajuste, angle_vertical, last_click):
+def ajouter_annotation(annotations_dict, image_name, x, y, type_objet, fonction_objet, mode_annotation, angle_ajuste, angle_vertical, last_click, base=None):
     """
     Ajoute une annotation si elle n'existe pas encore à ces coordonnées et si ce n'est pas un doublon immédiat.
+    Avec une base partagée (stockage_utils.BaseAnnotations), seule la nouvelle ligne est écrite.
     Retourne un booléen indiquant si une annotation a été ajoutée.
     """
     current_click = (x, y)
@@ -110,7 +110,7 @@ def ajouter_annotation(annotations_dict, image_name, x, y, type_objet, fonction_
     if current_click in [(a["x"], a["y"]) for a in annotations_dict[image_name]]:
         return False  # Déjà annoté à ces coordonnées
 
-    annotations_dict[image_name].append({
+    annotation = {
         "uuid": generate_uuid(),
         "x": x, "y": y,
         "type_objet": type_objet,
@@ -118,15 +118,18 @@ def ajouter_annotation(annotations_dict, image_name, x, y, type_objet, fonction_
         "mode_annotation": mode_annotation,
         "angle_ajuste": angle_ajuste,
         "angle_vertical": angle_vertical
-    })
+    }
+    if base is not None:
+        base.ajouter(image_name, annotation)
+    annotations_dict[image_name].append(annotation)
 
     return True
 
 
 # Fonction de modification de l'annotation
-def modifier_annotation(annotations_dict, image_name, uuid_cible, new_type, new_fonction, new_mode):
+def modifier_annotation(annotations_dict, image_name, uuid_cible, new_type, new_fonction, new_mode, base=None):
     """
-    Modifie une annotation à partir de son UUID. Retourne True si modifié.
+    Modifie une annotation à partir de son UUID (et sa seule ligne dans la base partagée). Retourne True si modifié.
     """
     for ann in annotations_dict[image_name]:
         if ann["uuid"] == uuid_cible:
@@ -135,16 +138,20 @@ def modifier_annotation(annotations_dict, image_name, uuid_cible, new_type, new_
                 "fonction_objet": new_fonction,
                 "mode_annotation": new_mode
             })
+            if base is not None:
+                base.modifier(image_name, ann)
             return True
     return False
 
 # Fonction de suppression de l'annotation
-def supprimer_annotation(annotations_dict, image_name, uuid_cible):
+def supprimer_annotation(annotations_dict, image_name, uuid_cible, base=None):
     """
-    Supprime une annotation à partir de son UUID. Retourne True si supprimée.
+    Supprime une annotation à partir de son UUID (et sa seule ligne dans la base partagée). Retourne True si supprimée.
     """
     for i, ann in enumerate(annotations_dict[image_name]):
         if ann["uuid"] == uuid_cible:
+            if base is not None:
+                base.supprimer(image_name, uuid_cible)
             del annotations_dict[image_name][i]
             return True
     return False
@@ -157,18 +164,22 @@ def get_annotation_by_uuid(annotations_dict, image_name, uuid_cible):
     return next((ann for ann in annotations_dict[image_name] if ann["uuid"] == uuid_cible), None)
 
 # Supprime l'ensemble des annotations d'une image donnée
-def reinitialiser_annotations_image(image_name: str, annotations_file: str, session_state):
+def reinitialiser_annotations_image(image_name: str, annotations_file: str, session_state, base=None):
     """
     Supprime toutes les annotations associées à une image donnée   
     Paramètres :
         image_name (str) : nom de l'image dont on réinitialise les annotations
         annotations_file (str) : chemin vers le fichier annotations.json
         session_state : st.session_state (ou son équivalent passé depuis main)
+        base : base partagée (stockage_utils.BaseAnnotations) éventuelle, seule l'image est réécrite
     """
     session_state.annotations[image_name] = []
+    if base is not None:
+        base.enregistrer_images(session_state.annotations, [image_name])
 
 # Création du Dataframe des annotations pour affichage dans l'interface
 def creer_dataframe_annotations(annotations):
+    import pandas as pd
     df = pd.DataFrame(annotations)
     if not df.empty:
         df.reset_index(drop=True, inplace=True)
@@ -183,6 +194,7 @@ def creer_dataframe_annotations_360(annotations):
     Crée un DataFrame à partir des annotations photos 360°
     avec ajout de la colonne angle_vertical.
     """
+    import pandas as pd
     df = pd.DataFrame(annotations)
     if not df.empty:
         df.reset_index(drop=True, inplace=True)
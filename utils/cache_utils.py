@@ -0,0 +1,85 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (cache_utils.py) Cache partagé entre les sessions pour les fichiers de campagne lus souvent (config, EXIF)
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import threading
+from collections import OrderedDict
+import streamlit as st
+from utils.file_utils import charger_config_annotations
+
+# Nombre maximal de fichiers gardés en mémoire (tous types confondus, le moins récemment lu est retiré)
+CAPACITE_CACHE_PARTAGE = 32
+
+
+class CachePartage:
+    """
+    Contenu de fichiers gardé en mémoire une seule fois par processus et partagé par toutes les sessions Streamlit.
+    Une entrée est valable tant que la date de modification et la taille du fichier sont inchangées ;
+    l'objet retourné est partagé : il ne doit pas être modifié par l'appelant (l'état modifiable reste dans
+    st.session_state, propre à chaque session).
+    """
+
+    def __init__(self, capacite=CAPACITE_CACHE_PARTAGE):
+        self.capacite = capacite
+        self.verrou = threading.Lock()
+        self.entrees = OrderedDict()
+        self.compteurs = {}
+
+    def lire(self, nom, chemin, lecteur):
+        """Retourne lecteur(chemin), relu seulement si le fichier a changé depuis la dernière lecture."""
+        stat = os.stat(chemin)
+        version = (stat.st_mtime_ns, stat.st_size)
+        cle = (nom, os.path.abspath(chemin))
+        # Lecture sous verrou : plusieurs sessions qui demandent le même fichier ne le lisent qu'une fois
+        with self.verrou:
+            compteur = self.compteurs.setdefault(nom, {"hits": 0, "misses": 0})
+            entree = self.entrees.get(cle)
+            if entree is not None and entree[0] == version:
+                compteur["hits"] += 1
+                self.entrees.move_to_end(cle)
+                return entree[1]
+            compteur["misses"] += 1
+            valeur = lecteur(chemin)
+            self.entrees[cle] = (version, valeur)
+            self.entrees.move_to_end(cle)
+            while len(self.entrees) > self.capacite:
+                self.entrees.popitem(last=False)
+            return valeur
+
+    def statistiques(self):
+        """Compteurs hits / misses par type de fichier et nombre d'entrées en mémoire."""
+        with self.verrou:
+            return {
+                "compteurs": {nom: dict(c) for nom, c in self.compteurs.items()},
+                "entrees": len(self.entrees)
+            }
+
+@st.cache_resource(show_spinner=False)
+# Une seule instance par processus (cache_resource : partagée par les sessions, vidée par st.cache_resource.clear())
+def cache_partage():
+    return CachePartage()
+
+def _lire_json(chemin):
+    with open(chemin, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# Configuration YAML des annotations partagée entre les sessions
+def charger_config_partagee(config_path):
+    if not os.path.exists(config_path):
+        return charger_config_annotations(config_path)  # FileNotFoundError, comme sans cache
+    return cache_partage().lire("config", config_path, charger_config_annotations)
+
+# Données EXIF (exif_data.json) partagées entre les sessions ({} si le fichier est absent)
+def charger_exif_partage(exif_file):
+    if not exif_file or not os.path.exists(exif_file):
+        return {}
+    return cache_partage().lire("exif", exif_file, _lire_json)
+
+def statistiques_caches():
+    return cache_partage().statistiques()
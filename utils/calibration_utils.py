@@ -0,0 +1,244 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (calibration_utils.py) Calibration du décalage d'orientation et des corrections de direction par photo
+# -----------------------------------------------------------------------------
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.spatial import cKDTree
+from utils.geo_utils import lancer_rayons, convertir_wgs84_vers_lambert93
+
+# Distance maximale entre deux impacts "cartographie" d'un même objet (même seuil que le regroupement de l'étape 8)
+SEUIL_REGROUPEMENT = 2.0
+
+# -----------------------------------------------------------------------------
+# Faisceau de rayons de la campagne
+# -----------------------------------------------------------------------------
+
+# Tableaux des lignes de vue de toutes les annotations géolocalisées
+def construire_faisceau(annotations, exif_data):
+    """
+    Retourne un dict de tableaux (un élément par annotation maj_objet / cartographie exploitable) :
+    x, y (Lambert-93 de la photo), angle (angle_ajuste), photo (code de l'image), carto (mode cartographie),
+    attr (code type_objet / fonction_objet) et la liste des noms d'images ("photos").
+    """
+    photos, codes_photo, codes_attr = [], {}, {}
+    lat, lon, angle, photo, carto, attr = [], [], [], [], [], []
+    for nom, liste in annotations.items():
+        exif = exif_data.get(nom) or {}
+        if exif.get("latitude") is None or exif.get("longitude") is None:
+            continue
+        for ann in liste:
+            if ann.get("angle_ajuste") is None or ann.get("mode_annotation") not in ("maj_objet", "cartographie"):
+                continue
+            if nom not in codes_photo:
+                codes_photo[nom] = len(photos)
+                photos.append(nom)
+            cle_attr = (ann.get("type_objet"), ann.get("fonction_objet"))
+            lat.append(exif["latitude"])
+            lon.append(exif["longitude"])
+            angle.append(ann["angle_ajuste"])
+            photo.append(codes_photo[nom])
+            carto.append(ann["mode_annotation"] == "cartographie")
+            attr.append(codes_attr.setdefault(cle_attr, len(codes_attr)))
+    x, y = convertir_wgs84_vers_lambert93(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float))
+    return {
+        "x": np.asarray(x, dtype=float), "y": np.asarray(y, dtype=float),
+        "angle": np.asarray(angle, dtype=float), "photo": np.asarray(photo, dtype=np.int64),
+        "carto": np.asarray(carto, dtype=bool), "attr": np.asarray(attr, dtype=np.int64),
+        "photos": photos
+    }
+
+# Proximité d'une distance au voisin : 1 pour des impacts confondus, 0 au-delà du seuil (noyau d'Epanechnikov)
+def proximite(distance, seuil=SEUIL_REGROUPEMENT):
+    return np.clip(1 - (np.asarray(distance) / seuil) ** 2, 0, None)
+
+# Resserrement des impacts "cartographie" : pour chaque impact, proximité du plus proche impact
+# d'une autre photo de même type/fonction (0 s'il n'y en a aucun à moins du seuil)
+def resserrement_impacts(xs, ys, photo, attr, seuil=SEUIL_REGROUPEMENT):
+    valeur = np.zeros(len(xs))
+    if len(xs) < 2:
+        return valeur
+    paires = cKDTree(np.column_stack([xs, ys])).query_pairs(seuil, output_type='ndarray')
+    if len(paires):
+        i, j = paires[:, 0], paires[:, 1]
+        ok = (photo[i] != photo[j]) & (attr[i] == attr[j])
+        i, j = i[ok], j[ok]
+        p = proximite(np.hypot(xs[i] - xs[j], ys[i] - ys[j]), seuil)
+        np.maximum.at(valeur, i, p)
+        np.maximum.at(valeur, j, p)
+    return valeur
+
+# Score de cohérence d'un décalage : rayons qui touchent un bâtiment + resserrement des impacts cartographie,
+# rapporté au nombre de rayons (+ nombre de rayons cartographie)
+def score_decalage(lignes_bat, faisceau, decalage, seuil=SEUIL_REGROUPEMENT):
+    rayons = lancer_rayons(lignes_bat, faisceau["x"], faisceau["y"], faisceau["angle"], decalage)
+    impacts = np.flatnonzero(rayons["touche"] & faisceau["carto"])
+    resserrement = resserrement_impacts(
+        rayons["x"][impacts], rayons["y"][impacts], faisceau["photo"][impacts], faisceau["attr"][impacts], seuil
+    )
+    total = len(faisceau["x"]) + int(faisceau["carto"].sum())
+    return (int(rayons["touche"].sum()) + float(resserrement.sum())) / total if total else 0.0
+
+# -----------------------------------------------------------------------------
+# Évaluation multi-cœurs (chaque processus charge la couche une fois, depuis le cache disque)
+# -----------------------------------------------------------------------------
+
+_lignes_bat_worker = None
+
+def _initialiser_worker(ancien_gpkg, selected_layer):
+    global _lignes_bat_worker
+    from utils.reference_utils import charger_reference
+    _lignes_bat_worker = charger_reference(ancien_gpkg, selected_layer)[2]
+
+def _scores_decalages(faisceau, decalages, seuil):
+    return [score_decalage(_lignes_bat_worker, faisceau, d, seuil) for d in decalages]
+
+def _rayons_bloc(x, y, angles, decalage):
+    rayons = lancer_rayons(_lignes_bat_worker, x, y, angles, decalage)
+    return rayons["touche"], rayons["x"], rayons["y"]
+
+# Découpage d'une séquence en `n` blocs contigus
+def _blocs(sequence, n):
+    taille = -(-len(sequence) // n)
+    return [sequence[i:i + taille] for i in range(0, len(sequence), taille)]
+
+class _Evaluateur:
+    """Lance les rayons dans le processus courant (un seul cœur) ou dans un pool de processus."""
+
+    def __init__(self, lignes_bat=None, ancien_gpkg=None, selected_layer=None, max_workers=None):
+        self.lignes_bat = lignes_bat
+        self.pool = None
+        self.nb_blocs = max_workers or os.cpu_count() or 1
+        if self.nb_blocs <= 1 or ancien_gpkg is None:
+            self.nb_blocs = 1
+            if self.lignes_bat is None:
+                from utils.reference_utils import charger_reference
+                self.lignes_bat = charger_reference(ancien_gpkg, selected_layer)[2]
+        else:
+            # Processus "spawn" : pas de copie de l'état du processus appelant (Streamlit, threads)
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.nb_blocs, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initialiser_worker, initargs=(ancien_gpkg, selected_layer)
+            )
+
+    def scores(self, faisceau, decalages, seuil):
+        if self.pool is None:
+            return [score_decalage(self.lignes_bat, faisceau, d, seuil) for d in decalages]
+        blocs = _blocs(list(decalages), self.nb_blocs)
+        return [s for res in self.pool.map(_scores_decalages, [faisceau] * len(blocs), blocs, [seuil] * len(blocs)) for s in res]
+
+    def rayons(self, x, y, angles, decalage):
+        if self.pool is None:
+            r = lancer_rayons(self.lignes_bat, x, y, angles, decalage)
+            return r["touche"], r["x"], r["y"]
+        morceaux = [np.array_split(t, self.nb_blocs) for t in (x, y, angles)]
+        res = list(self.pool.map(_rayons_bloc, *morceaux, [decalage] * self.nb_blocs))
+        return tuple(np.concatenate([r[k] for r in res]) for k in range(3))
+
+    def fermer(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+# -----------------------------------------------------------------------------
+# Calibration
+# -----------------------------------------------------------------------------
+
+# Corrections de direction par photo, le décalage de campagne étant fixé
+def _corrections_par_photo(evaluateur, faisceau, decalage, corrections_testees, seuil, iterations, gain_min):
+    """
+    Toutes les photos et toutes les corrections testées (grille croissante contenant 0) sont évaluées
+    en un seul lancer groupé (faisceau répété une fois par correction). Score d'une photo pour une
+    correction : rayons qui touchent + proximité de ses impacts cartographie aux impacts des autres photos
+    (de même type/fonction), celles-ci prises avec leur correction courante.
+    Les corrections sont affinées par passes successives (montée coordonnée) ; une photo ne change de correction
+    que si le gain dépasse gain_min (à égalité : la plus petite correction).
+    """
+    n = len(faisceau["x"])
+    nb_photos = len(faisceau["photos"])
+    k = len(corrections_testees)
+    touche, ix, iy = evaluateur.rayons(
+        np.tile(faisceau["x"], k), np.tile(faisceau["y"], k),
+        (faisceau["angle"][None, :] + corrections_testees[:, None]).ravel(), decalage
+    )
+    photo = np.tile(faisceau["photo"], k)
+    attr = np.tile(faisceau["attr"], k)
+    candidats = np.flatnonzero(touche & np.tile(faisceau["carto"], k))
+    lignes = np.repeat(np.arange(k), n)
+    ordre = np.argsort(np.abs(corrections_testees), kind="stable")
+
+    # Indice (dans la grille) de la correction courante de chaque photo : 0 au départ
+    courante = np.full(nb_photos, int(np.flatnonzero(corrections_testees == 0)[0]))
+    for _ in range(iterations):
+        points = touche.astype(float)
+        # Impacts de référence : chaque rayon avec la correction courante de sa photo
+        ref = courante[faisceau["photo"]] * n + np.arange(n)
+        ref = ref[touche[ref] & faisceau["carto"]]
+        if len(ref) and len(candidats):
+            arbre = cKDTree(np.column_stack([ix[ref], iy[ref]]))
+            voisins = arbre.query_ball_point(np.column_stack([ix[candidats], iy[candidats]]), seuil)
+            for c, liste in zip(candidats, voisins):
+                proches = [ref[v] for v in liste if photo[ref[v]] != photo[c] and attr[ref[v]] == attr[c]]
+                if proches:
+                    points[c] += proximite(np.hypot(ix[proches] - ix[c], iy[proches] - iy[c]).min(), seuil)
+        scores = np.zeros((k, nb_photos))
+        np.add.at(scores, (lignes, photo), points)
+        meilleure = ordre[np.argmax(scores[ordre], axis=0)]
+        gain = scores[meilleure, np.arange(nb_photos)] - scores[courante, np.arange(nb_photos)]
+        nouvelle = np.where(gain > gain_min, meilleure, courante)
+        if np.array_equal(nouvelle, courante):
+            break
+        courante = nouvelle
+    return {
+        faisceau["photos"][p]: float(corrections_testees[courante[p]])
+        for p in range(nb_photos) if corrections_testees[courante[p]] != 0
+    }
+
+def calibrer_orientation(annotations, exif_data, lignes_bat=None, ancien_gpkg=None, selected_layer=None,
+                         decalages=range(0, 181), par_photo=True, correction_max=10.0, pas_correction=0.5,
+                         iterations=3, gain_min=0.5, seuil=SEUIL_REGROUPEMENT, max_workers=None):
+    """
+    Recherche le décalage d'orientation de la campagne puis, éventuellement, une correction de direction
+    par photo qui maximisent la cohérence des lignes de vue (rayons maj_objet / cartographie qui touchent
+    un bâtiment et impacts cartographie regroupés entre photos).
+
+    - plusieurs cœurs (max_workers, défaut : tous) et ancien_gpkg fourni : pool de processus, chacun chargeant
+      (ancien_gpkg, selected_layer) depuis le cache disque des géométries préparées
+    - sinon : évaluation dans le processus courant, sur lignes_bat s'il est fourni (couche déjà en mémoire)
+    :return: dict {"decalage", "scores": {decalage: score}, "corrections": {image: degrés},
+             "score_initial", "score_final", "nb_rayons"}
+    """
+    faisceau = construire_faisceau(annotations, exif_data)
+    decalages = list(decalages)
+    resultat = {"decalage": None, "scores": {}, "corrections": {}, "score_initial": None,
+                "score_final": None, "nb_rayons": len(faisceau["x"])}
+    if not len(faisceau["x"]):
+        return resultat
+
+    evaluateur = _Evaluateur(lignes_bat, ancien_gpkg, selected_layer, max_workers)
+    try:
+        scores = evaluateur.scores(faisceau, decalages, seuil)
+        resultat["scores"] = dict(zip(decalages, scores))
+        # À score égal, le plus petit décalage
+        resultat["decalage"] = decalages[int(np.argmax(scores))]
+        resultat["score_initial"] = resultat["score_final"] = max(scores)
+
+        if par_photo and correction_max > 0:
+            pas = np.arange(pas_correction, correction_max + 1e-9, pas_correction)
+            corrections_testees = np.concatenate([-pas[::-1], [0.0], pas])
+            resultat["corrections"] = _corrections_par_photo(
+                evaluateur, faisceau, resultat["decalage"], corrections_testees, seuil, iterations, gain_min
+            )
+            corrige = dict(faisceau)
+            corrige["angle"] = faisceau["angle"] + np.array(
+                [resultat["corrections"].get(nom, 0.0) for nom in faisceau["photos"]]
+            )[faisceau["photo"]]
+            resultat["score_final"] = evaluateur.scores(corrige, [resultat["decalage"]], seuil)[0]
+    finally:
+        evaluateur.fermer()
+    return resultat
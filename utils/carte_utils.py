@@ -0,0 +1,86 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (carte_utils.py) Construction des cartes affichées dans l'interface (pydeck)
+# -----------------------------------------------------------------------------
+
+import pydeck as pdk
+
+# Couleurs des annotations (mêmes conventions que l'overlay des photos)
+COULEUR_CARTOGRAPHIE = [255, 0, 0, 200]
+COULEUR_MAJ_OBJET = [0, 0, 255, 200]
+COULEUR_NON_TOUCHE = [128, 128, 128, 160]
+COULEUR_PHOTO = [255, 200, 0, 255]
+
+def _couleur_ligne(ligne):
+    if not ligne["touche"]:
+        return COULEUR_NON_TOUCHE
+    return COULEUR_CARTOGRAPHIE if ligne["mode_annotation"] == "cartographie" else COULEUR_MAJ_OBJET
+
+# Carte de l'aperçu des lignes de vue d'une image (voir geo_utils.calculer_apercu_lignes_de_vue)
+def creer_carte_apercu(apercu, zoom=18):
+    """Retourne un pdk.Deck : polygones proches, lignes de vue, points d'impact et position de la photo."""
+    lignes = [dict(l, couleur=_couleur_ligne(l)) for l in apercu["lignes"]]
+    impacts = [{"position": l["chemin"][1], "couleur": l["couleur"], "libelle": l["libelle"]} for l in lignes if l["touche"]]
+    couches = [
+        pdk.Layer(
+            "PolygonLayer", [{"contour": p} for p in apercu["polygones"]],
+            get_polygon="contour", get_fill_color=[200, 200, 200, 80], get_line_color=[90, 90, 90, 200],
+            line_width_min_pixels=1, pickable=False
+        ),
+        pdk.Layer(
+            "PathLayer", lignes, get_path="chemin", get_color="couleur",
+            width_min_pixels=2, pickable=True
+        ),
+        pdk.Layer(
+            "ScatterplotLayer", impacts, get_position="position", get_fill_color="couleur",
+            get_radius=0.8, radius_min_pixels=4, pickable=True
+        ),
+        pdk.Layer(
+            "ScatterplotLayer", [{"position": apercu["photo"], "libelle": "Photo"}], get_position="position",
+            get_fill_color=COULEUR_PHOTO, get_line_color=[0, 0, 0, 255], stroked=True,
+            get_radius=1.5, radius_min_pixels=6, line_width_min_pixels=1, pickable=True
+        ),
+    ]
+    vue = pdk.ViewState(longitude=apercu["photo"][0], latitude=apercu["photo"][1], zoom=zoom)
+    return pdk.Deck(layers=couches, initial_view_state=vue, map_style=None, tooltip={"text": "{libelle}"})
+
+# Couleurs des grappes de la carte des photos (sans annotation / avec annotations) et de la photo courante
+COULEUR_GRAPPE = [30, 110, 200, 190]
+COULEUR_GRAPPE_ANNOTEE = [230, 90, 30, 210]
+
+# Carte des photos regroupées en grappes (voir grappes_utils.grappes_vue)
+def creer_carte_photos(grappes, centre_lonlat, zoom, photo_courante=None):
+    """
+    Retourne un pdk.Deck : une pastille par grappe (taille selon le nombre de photos, orange si des annotations),
+    nombre de photos des grappes et position de la photo courante. Le zoom à la molette est désactivé :
+    le regroupement est calculé pour le zoom choisi dans l'interface.
+    """
+    for g in grappes:
+        g["couleur"] = COULEUR_GRAPPE_ANNOTEE if g["nb_annotations"] else COULEUR_GRAPPE
+        g["rayon"] = 6 + 4 * min(g["nb"], 10000) ** 0.25
+        g["texte"] = str(g["nb"]) if g["nb"] > 1 else ""
+    couches = [
+        pdk.Layer(
+            "ScatterplotLayer", grappes, id="grappes", get_position="position", get_fill_color="couleur",
+            get_line_color=[255, 255, 255, 230], stroked=True, line_width_min_pixels=1,
+            get_radius="rayon", radius_units="pixels", pickable=True
+        ),
+        pdk.Layer(
+            "TextLayer", [g for g in grappes if g["texte"]], get_position="position", get_text="texte",
+            get_size=12, get_color=[255, 255, 255, 255], pickable=False
+        ),
+    ]
+    if photo_courante is not None:
+        couches.append(pdk.Layer(
+            "ScatterplotLayer", [{"position": photo_courante, "libelle": "Photo affichée"}], get_position="position",
+            get_fill_color=COULEUR_PHOTO, get_line_color=[0, 0, 0, 255], stroked=True,
+            get_radius=7, radius_units="pixels", line_width_min_pixels=2, pickable=False
+        ))
+    vue = pdk.ViewState(longitude=centre_lonlat[0], latitude=centre_lonlat[1], zoom=zoom)
+    return pdk.Deck(
+        layers=couches, initial_view_state=vue, map_style=None, tooltip={"text": "{libelle}"},
+        views=[pdk.View(type="MapView", controller={"scrollZoom": False, "doubleClickZoom": False, "touchZoom": False})]
+    )
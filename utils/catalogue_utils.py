@@ -0,0 +1,130 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (catalogue_utils.py) Catalogue persistant des images d'un dossier (dimensions, 360°, empreinte)
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import streamlit as st
+from utils.file_utils import empreinte_fichier
+from utils.image_utils import is_360_photo
+
+# Nom du fichier catalogue, enregistré dans le dossier des images (comme exif_data.json)
+FICHIER_CATALOGUE = "catalogue_images.json"
+VERSION_CATALOGUE = 1
+# Période (s) de revérification des tailles et dates des images : une image réécrite sur place
+# ne change pas la date de modification du dossier
+PERIODE_VERIFICATION_CATALOGUE = 30
+EXTENSIONS_IMAGES = ('png', 'jpg', 'jpeg')
+# Taille des blocs lus pour l'empreinte du contenu (début + fin du fichier)
+TAILLE_BLOC_EMPREINTE = 64 * 1024
+
+# Lecture des informations d'une image à partir de son seul en-tête (pas de décodage des pixels)
+def sonder_image(chemin_image, stat=None):
+    """
+    Retourne le dict catalogue d'une image : largeur, hauteur, est_360, taille, mtime, empreinte.
+    Image.open ne lit que l'en-tête : les dimensions sont connues sans décoder l'image.
+    """
+    stat = stat or os.stat(chemin_image)
+    try:
+        with Image.open(chemin_image) as img:
+            largeur, hauteur = img.size
+    except Exception as e:
+        print(f"Erreur de lecture de l'en-tête de {chemin_image} : {e}")
+        largeur = hauteur = None
+    return {
+        "largeur": largeur,
+        "hauteur": hauteur,
+        "est_360": bool(largeur and hauteur and is_360_photo(largeur, hauteur)),
+        "taille": stat.st_size,
+        "mtime": stat.st_mtime,
+        "empreinte": empreinte_fichier(chemin_image, TAILLE_BLOC_EMPREINTE)
+    }
+
+# Chargement du catalogue existant (dict vide si absent ou illisible)
+def lire_catalogue(image_folder):
+    chemin = os.path.join(image_folder, FICHIER_CATALOGUE)
+    if not os.path.exists(chemin):
+        return {}
+    try:
+        with open(chemin, "r", encoding="utf-8") as f:
+            contenu = json.load(f)
+        if contenu.get("version") != VERSION_CATALOGUE:
+            return {}
+        return contenu.get("images", {})
+    except Exception as e:
+        print(f"Catalogue illisible, il sera reconstruit : {e}")
+        return {}
+
+# Écriture atomique du catalogue
+def sauvegarder_catalogue(image_folder, images):
+    chemin = os.path.join(image_folder, FICHIER_CATALOGUE)
+    chemin_tmp = f"{chemin}.tmp"
+    with open(chemin_tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": VERSION_CATALOGUE, "images": images}, f, ensure_ascii=False)
+    os.replace(chemin_tmp, chemin)
+
+# Construction / mise à jour incrémentale du catalogue
+def construire_catalogue(image_folder, max_workers=None):
+    """
+    Met à jour le catalogue du dossier : seules les images nouvelles ou modifiées (taille ou date
+    de modification différente) sont sondées, en parallèle. Les images supprimées sont retirées.
+    Retourne un dict {nom_image: infos} trié par nom (ordre de navigation stable).
+    """
+    if not image_folder or not os.path.isdir(image_folder):
+        return {}
+    ancien = lire_catalogue(image_folder)
+    fichiers = {}
+    with os.scandir(image_folder) as entrees:
+        for entree in entrees:
+            if entree.is_file() and entree.name.lower().endswith(EXTENSIONS_IMAGES):
+                fichiers[entree.name] = entree.stat()
+
+    a_sonder = [
+        nom for nom, stat in fichiers.items()
+        if nom not in ancien or ancien[nom]["taille"] != stat.st_size or ancien[nom]["mtime"] != stat.st_mtime
+    ]
+    nouveaux = {}
+    if a_sonder:
+        # Lecture d'en-têtes : limitée par les entrées/sorties, d'où un pool de threads
+        with ThreadPoolExecutor(max_workers=max_workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+            infos = pool.map(lambda nom: sonder_image(os.path.join(image_folder, nom), fichiers[nom]), a_sonder)
+            nouveaux = dict(zip(a_sonder, infos))
+
+    images = {nom: nouveaux.get(nom) or ancien[nom] for nom in sorted(fichiers)}
+    if nouveaux or len(images) != len(ancien):
+        try:
+            sauvegarder_catalogue(image_folder, images)
+        except Exception as e:
+            print(f"Impossible d'écrire le catalogue des images : {e}")
+    return images
+
+@st.cache_resource(show_spinner="Mise à jour du catalogue des images...", max_entries=4)
+# Catalogue gardé en mémoire tant que le contenu du dossier (date de modification) ne change pas, revérifié
+# à chaque tranche de PERIODE_VERIFICATION_CATALOGUE secondes (seules les images modifiées sont relues)
+# (cache_resource : pas de copie du dict à chaque rerun, il ne doit pas être modifié par l'appelant)
+def charger_catalogue(image_folder, mtime_dossier, tranche):
+    return construire_catalogue(image_folder)
+
+# Tranche de temps courante (clé de charger_catalogue)
+def tranche_verification(periode=PERIODE_VERIFICATION_CATALOGUE):
+    return int(time.time() // periode)
+
+# L'image a-t-elle été réécrite depuis son entrée au catalogue (taille ou date différente) ?
+def image_modifiee(image_folder, image_name, infos):
+    try:
+        stat = os.stat(os.path.join(image_folder, image_name))
+    except OSError:
+        # Image supprimée : la date du dossier a changé, le catalogue sera reconstruit au rerun suivant
+        return False
+    return infos.get("taille") != stat.st_size or infos.get("mtime") != stat.st_mtime
+
+# Date de modification du dossier (change à chaque ajout, suppression ou renommage d'image)
+def mtime_dossier(image_folder):
+    return os.stat(image_folder).st_mtime if image_folder and os.path.isdir(image_folder) else None
@@ -0,0 +1,330 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (detection_utils.py) Pré-annotation des photos par un détecteur d'objets ONNX (CPU, par lots)
+# -----------------------------------------------------------------------------
+
+import os
+import ast
+import json
+import importlib.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+from utils.file_utils import empreinte_fichier
+from utils.annotation_utils import ajouter_annotation, calculer_angle_objet, calculer_fov_vertical, calculer_angle_elevation
+
+# Détections enregistrées dans le dossier des images (comme le catalogue), par empreinte d'image
+FICHIER_DETECTIONS = "detections_onnx.json"
+VERSION_DETECTIONS = 1
+# Taille d'entrée du détecteur (image carrée, format YOLO) si le modèle ne la fixe pas
+TAILLE_ENTREE_DETECTEUR = 640
+# Nombre d'images par inférence (ramené à 1 si le modèle a un lot fixe)
+TAILLE_LOT_DETECTION = 8
+SEUIL_CONFIANCE_DETECTION = 0.25
+SEUIL_NMS_DETECTION = 0.45
+# Nombre maximal de boîtes gardées avant la suppression des doublons (NMS)
+MAX_BOITES_AVANT_NMS = 3000
+# Formats de sortie reconnus : YOLOv8+ (4 coordonnées + scores des classes) et YOLOv5 (+ score d'objet)
+FORMATS_SORTIE = ("yolov8", "yolov5")
+# Intervalle d'enregistrement du cache pendant le traitement (nombre de lots)
+LOTS_ENTRE_SAUVEGARDES = 20
+
+
+# Le détecteur nécessite onnxruntime (dépendance optionnelle)
+def onnxruntime_disponible():
+    return importlib.util.find_spec("onnxruntime") is not None
+
+# Ouverture du modèle ONNX sur CPU
+def ouvrir_detecteur(chemin_modele, nb_threads=None):
+    """
+    Retourne (session onnxruntime, infos) avec infos = nom et taille de l'entrée, lot fixe ou non,
+    noms des classes (métadonnées « names » des exports Ultralytics, sinon numéros) et empreinte du modèle.
+    """
+    if not onnxruntime_disponible():
+        raise ImportError("La pré-annotation nécessite onnxruntime (pip install onnxruntime)")
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = nb_threads or (os.cpu_count() or 1)
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = ort.InferenceSession(chemin_modele, sess_options=options, providers=["CPUExecutionProvider"])
+
+    entree = session.get_inputs()[0]
+    dimensions = list(entree.shape)
+    taille = dimensions[2] if len(dimensions) == 4 and isinstance(dimensions[2], int) else TAILLE_ENTREE_DETECTEUR
+    noms = session.get_modelmeta().custom_metadata_map.get("names")
+    try:
+        classes = ast.literal_eval(noms) if noms else {}
+    except (ValueError, SyntaxError):
+        classes = {}
+    if isinstance(classes, dict):
+        classes = [str(classes[k]) for k in sorted(classes)]
+    return session, {
+        "entree": entree.name,
+        "taille": taille,
+        "lot_fixe": isinstance(dimensions[0], int) and dimensions[0] == 1,
+        "classes": list(classes),
+        "empreinte": empreinte_fichier(chemin_modele)
+    }
+
+@st.cache_resource(show_spinner="Chargement du détecteur...", max_entries=1)
+# Session ONNX gardée en mémoire pour toutes les sessions de l'interface (clé : empreinte du modèle)
+def charger_detecteur(_chemin_modele, empreinte):
+    return ouvrir_detecteur(_chemin_modele)
+
+# Préparation d'une image pour le détecteur (exécutée dans le pool, en parallèle de l'inférence)
+def pretraiter_image(chemin_image, taille=TAILLE_ENTREE_DETECTEUR):
+    """
+    Redimensionne l'image dans un carré taille x taille sans la déformer (bandes grises, « letterbox »).
+    Pour un JPEG, draft() décode directement à une résolution réduite (bien plus rapide qu'un décodage complet).
+    Retourne (tableau float32 3 x taille x taille, (échelle x, échelle y, décalage x, décalage y)).
+    """
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(chemin_image) as img:
+        largeur, hauteur = img.size
+        img.draft("RGB", (taille, taille))
+        img = img.convert("RGB")
+        echelle = min(taille / largeur, taille / hauteur)
+        nouvelle_largeur, nouvelle_hauteur = max(1, round(largeur * echelle)), max(1, round(hauteur * echelle))
+        img = img.resize((nouvelle_largeur, nouvelle_hauteur), Image.BILINEAR)
+        pixels = np.asarray(img)
+    decalage_x, decalage_y = (taille - nouvelle_largeur) // 2, (taille - nouvelle_hauteur) // 2
+    carre = np.full((taille, taille, 3), 114, dtype=np.uint8)
+    carre[decalage_y:decalage_y + nouvelle_hauteur, decalage_x:decalage_x + nouvelle_largeur] = pixels
+    tableau = carre.transpose(2, 0, 1).astype(np.float32) / 255.0
+    return tableau, (nouvelle_largeur / largeur, nouvelle_hauteur / hauteur, decalage_x, decalage_y)
+
+# Suppression des boîtes redondantes (NMS), toutes classes en une passe
+def supprimer_doublons(boites, scores, classes, seuil_nms=SEUIL_NMS_DETECTION):
+    """
+    Les boîtes de classes différentes sont décalées d'un multiple de l'étendue des boîtes pour ne jamais se
+    recouvrir : une seule NMS suffit pour toutes les classes. L'étendue inclut les coordonnées négatives des
+    boîtes qui dépassent du bord de l'image. Retourne les indices gardés.
+    """
+    import numpy as np
+
+    decalees = boites + (classes[:, None] * (boites.max() - boites.min() + 1))
+    x1, y1, x2, y2 = decalees.T
+    aires = (x2 - x1) * (y2 - y1)
+    ordre = scores.argsort()[::-1]
+    garder = []
+    while ordre.size:
+        i = ordre[0]
+        garder.append(i)
+        autres = ordre[1:]
+        largeur = np.clip(np.minimum(x2[i], x2[autres]) - np.maximum(x1[i], x1[autres]), 0, None)
+        hauteur = np.clip(np.minimum(y2[i], y2[autres]) - np.maximum(y1[i], y1[autres]), 0, None)
+        inter = largeur * hauteur
+        iou = inter / (aires[i] + aires[autres] - inter + 1e-9)
+        ordre = autres[iou <= seuil_nms]
+    return np.array(garder, dtype=int)
+
+# Décodage de la sortie du détecteur pour une image
+def decoder_sortie(sortie, transformation, format_sortie="yolov8", seuil_confiance=SEUIL_CONFIANCE_DETECTION,
+                   seuil_nms=SEUIL_NMS_DETECTION):
+    """
+    sortie : tableau (N prédictions, colonnes) ; colonnes = cx, cy, l, h, [score objet si yolov5], scores des classes.
+    Retourne la liste [x1, y1, x2, y2, score, classe] en pixels de l'image d'origine.
+    """
+    import numpy as np
+
+    if format_sortie == "yolov5":
+        scores_classes = sortie[:, 5:] * sortie[:, 4:5]
+    else:
+        scores_classes = sortie[:, 4:]
+    classes = scores_classes.argmax(axis=1)
+    scores = scores_classes[np.arange(len(classes)), classes]
+    retenus = np.flatnonzero(scores >= seuil_confiance)
+    if not retenus.size:
+        return []
+    retenus = retenus[np.argsort(scores[retenus])[::-1][:MAX_BOITES_AVANT_NMS]]
+    cx, cy, l, h = sortie[retenus, :4].T
+    boites = np.column_stack([cx - l / 2, cy - h / 2, cx + l / 2, cy + h / 2])
+    garder = supprimer_doublons(boites, scores[retenus], classes[retenus], seuil_nms)
+
+    # Retour aux pixels de l'image d'origine (inverse du letterbox)
+    echelle_x, echelle_y, decalage_x, decalage_y = transformation
+    boites = boites[garder]
+    boites[:, [0, 2]] = (boites[:, [0, 2]] - decalage_x) / echelle_x
+    boites[:, [1, 3]] = (boites[:, [1, 3]] - decalage_y) / echelle_y
+    return [
+        [round(float(v), 1) for v in boite] + [round(float(score), 4), int(classe)]
+        for boite, score, classe in zip(boites, scores[retenus][garder], classes[retenus][garder])
+    ]
+
+# Cache des détections : {empreinte image: boîtes}, invalidé si le modèle ou les paramètres changent
+def lire_detections(image_folder, infos_modele=None, parametres=None):
+    chemin = os.path.join(image_folder, FICHIER_DETECTIONS)
+    vide = {"version": VERSION_DETECTIONS, "modele": None, "parametres": None, "classes": [], "images": {}, "revues": {}}
+    if not os.path.exists(chemin):
+        return vide
+    try:
+        with open(chemin, "r", encoding="utf-8") as f:
+            contenu = json.load(f)
+    except Exception as e:
+        print(f"Détections illisibles, elles seront recalculées : {e}")
+        return vide
+    if contenu.get("version") != VERSION_DETECTIONS:
+        return vide
+    if infos_modele is not None and (contenu.get("modele") != infos_modele["empreinte"] or contenu.get("parametres") != parametres):
+        return vide
+    return contenu
+
+# Détections du dossier pour l'interface (lues une fois par processus, relues si le fichier change ; None si absentes)
+def detections_dossier(image_folder):
+    from utils.cache_utils import cache_partage
+    chemin = os.path.join(image_folder, FICHIER_DETECTIONS)
+    if not image_folder or not os.path.exists(chemin):
+        return None
+    return cache_partage().lire("detections", chemin, lambda _: lire_detections(image_folder))
+
+# Candidats d'une image validés ou ignorés par l'opérateur : ils ne sont plus proposés
+def marquer_revue(image_folder, empreinte_image, statut):
+    contenu = lire_detections(image_folder)
+    contenu.setdefault("revues", {})[empreinte_image] = statut
+    sauvegarder_detections(image_folder, contenu)
+
+# Écriture atomique du cache des détections
+def sauvegarder_detections(image_folder, contenu):
+    chemin = os.path.join(image_folder, FICHIER_DETECTIONS)
+    chemin_tmp = f"{chemin}.tmp"
+    with open(chemin_tmp, "w", encoding="utf-8") as f:
+        json.dump(contenu, f, ensure_ascii=False)
+    os.replace(chemin_tmp, chemin)
+
+# Détection sur toutes les photos standards d'un dossier
+def detecter_dossier(image_folder, catalogue, session, infos_modele, format_sortie="yolov8",
+                     seuil_confiance=SEUIL_CONFIANCE_DETECTION, seuil_nms=SEUIL_NMS_DETECTION,
+                     taille_lot=TAILLE_LOT_DETECTION, max_workers=None, progression=None):
+    """
+    Lance le détecteur sur les photos standards du catalogue (les photos 360° sont ignorées) :
+    - seules les images dont l'empreinte n'est pas déjà dans detections_onnx.json sont traitées
+      (même modèle, mêmes paramètres) : une relance ne traite que les photos nouvelles ou modifiées ;
+    - un pool de threads décode et redimensionne les lots suivants pendant l'inférence du lot courant
+      (onnxruntime libère le GIL) ; la file est bornée à deux lots d'avance pour limiter la mémoire ;
+    - l'inférence est faite par lots de taille_lot images (1 si le modèle a un lot fixe).
+    progression(traitees, total) est appelée après chaque lot. Retourne le contenu du cache des détections.
+    """
+    import numpy as np
+
+    parametres = {"format": format_sortie, "taille": infos_modele["taille"],
+                  "seuil_confiance": seuil_confiance, "seuil_nms": seuil_nms}
+    contenu = lire_detections(image_folder, infos_modele, parametres)
+    contenu.update({"modele": infos_modele["empreinte"], "parametres": parametres, "classes": infos_modele["classes"]})
+    detections = contenu["images"]
+
+    a_traiter = list({
+        infos["empreinte"]: nom for nom, infos in catalogue.items()
+        if not infos.get("est_360") and infos.get("largeur") and infos["empreinte"] not in detections
+    }.items())
+    taille_lot = 1 if infos_modele["lot_fixe"] else max(1, taille_lot)
+    total = len(a_traiter)
+    if not total:
+        return contenu
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 1)) as pool:
+        en_attente = deque()
+        suivantes = iter(a_traiter)
+
+        def remplir():
+            # Deux lots d'avance au plus dans le pool
+            for empreinte, nom in suivantes:
+                en_attente.append((empreinte, pool.submit(pretraiter_image, os.path.join(image_folder, nom), infos_modele["taille"])))
+                if len(en_attente) >= 2 * taille_lot:
+                    break
+
+        remplir()
+        traitees = 0
+        nb_lots = 0
+        while en_attente:
+            lot = [en_attente.popleft() for _ in range(min(taille_lot, len(en_attente)))]
+            remplir()
+            tableaux, transformations, empreintes = [], [], []
+            for empreinte, futur in lot:
+                try:
+                    tableau, transformation = futur.result()
+                except Exception as e:
+                    print(f"Image illisible pour la détection ({empreinte}) : {e}")
+                    detections[empreinte] = []
+                    continue
+                tableaux.append(tableau)
+                transformations.append(transformation)
+                empreintes.append(empreinte)
+            if tableaux:
+                sortie = session.run(None, {infos_modele["entree"]: np.stack(tableaux)})[0]
+                # YOLOv8 : (lot, colonnes, prédictions) -> (lot, prédictions, colonnes)
+                if sortie.shape[1] < sortie.shape[2]:
+                    sortie = sortie.transpose(0, 2, 1)
+                for empreinte, transformation, sortie_image in zip(empreintes, transformations, sortie):
+                    detections[empreinte] = decoder_sortie(sortie_image, transformation, format_sortie, seuil_confiance, seuil_nms)
+            traitees += len(lot)
+            nb_lots += 1
+            if nb_lots % LOTS_ENTRE_SAUVEGARDES == 0:
+                sauvegarder_detections(image_folder, contenu)
+            if progression:
+                progression(traitees, total)
+
+    sauvegarder_detections(image_folder, contenu)
+    return contenu
+
+# Type d'objet et fonction proposés pour chaque classe du détecteur
+def types_des_classes(classes, config, type_defaut=None, fonction_defaut=None):
+    """
+    Une classe est associée au type d'objet de la configuration YAML de même nom (sans tenir compte de la casse)
+    ou indiqué dans la rubrique `detection` ({classe: type_objet}) ; sinon au type par défaut.
+    La fonction retenue est la fonction par défaut si elle existe pour ce type, sinon la première du type.
+    """
+    types_config = (config or {}).get("annotations", {})
+    par_nom = {t.lower(): t for t in types_config}
+    correspondance = (config or {}).get("detection") or {}
+    resultat = []
+    for classe in classes:
+        type_objet = correspondance.get(classe) or par_nom.get(str(classe).lower()) or type_defaut
+        fonctions = types_config.get(type_objet, {}).get("fonction_objet") or []
+        fonction = fonction_defaut if fonction_defaut in fonctions or not fonctions else fonctions[0]
+        resultat.append((type_objet, fonction))
+    return resultat
+
+# Annotations candidates d'une image (mêmes champs et mêmes angles qu'une annotation saisie au clic)
+def candidats_image(detections, infos_image, exif, fov, mode_annotation, types_classes, classes=()):
+    """
+    Chaque boîte devient une annotation candidate au centre de la boîte : x, y en pixels de l'image,
+    angle_ajuste et angle_vertical calculés comme pour un clic (calculer_angle_objet, calculer_angle_elevation).
+    Sans direction EXIF aucun angle n'est calculable : pas de candidat (comme l'interface qui refuse le clic).
+    """
+    direction = (exif or {}).get("direction")
+    if direction is None or not detections:
+        return []
+    largeur, hauteur = infos_image["largeur"], infos_image["hauteur"]
+    fov_vertical = calculer_fov_vertical(fov, largeur, hauteur)
+    candidats = []
+    for x1, y1, x2, y2, score, classe in detections:
+        x = int(round(min(max((x1 + x2) / 2, 0), largeur - 1)))
+        y = int(round(min(max((y1 + y2) / 2, 0), hauteur - 1)))
+        type_objet, fonction_objet = types_classes[classe] if classe < len(types_classes) else (None, None)
+        candidats.append({
+            "x": x, "y": y,
+            "type_objet": type_objet,
+            "fonction_objet": fonction_objet,
+            "mode_annotation": mode_annotation,
+            "angle_ajuste": calculer_angle_objet(x, largeur, direction, fov),
+            "angle_vertical": calculer_angle_elevation(y, hauteur, fov_vertical),
+            "classe": classes[classe] if classe < len(classes) else str(classe),
+            "confiance": score,
+            "boite": [x1, y1, x2, y2]
+        })
+    return candidats
+
+# Validation de candidats : ajoutés comme des annotations saisies (doublons de coordonnées ignorés)
+def valider_candidats(annotations, image_name, candidats, base=None):
+    annotations.setdefault(image_name, [])
+    ajoutes = 0
+    for c in candidats:
+        ajoutes += ajouter_annotation(annotations, image_name, c["x"], c["y"], c["type_objet"], c["fonction_objet"],
+                                      c["mode_annotation"], c["angle_ajuste"], c["angle_vertical"], None, base=base)
+    return ajoutes
@@ -0,0 +1,180 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (doublons_utils.py) Repérage des photos quasi identiques (empreinte perceptuelle + distance GPS)
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import streamlit as st
+
+# Empreintes perceptuelles enregistrées dans le dossier des images (comme le catalogue), par empreinte de fichier
+FICHIER_EMPREINTES_VISUELLES = "empreintes_visuelles.json"
+VERSION_EMPREINTES_VISUELLES = 1
+# Image réduite (niveaux de gris) sur laquelle est calculée la DCT, et bloc de basses fréquences gardé (8 x 8 = 64 bits)
+TAILLE_REDUITE = 32
+TAILLE_BLOC_DCT = 8
+# Nombre maximal de bits différents entre deux photos quasi identiques
+SEUIL_HAMMING = 5
+# Distance GPS maximale (mètres) entre deux photos quasi identiques (ignorée si une des photos n'a pas de GPS)
+DISTANCE_DOUBLONS = 2.0
+# Intervalle d'enregistrement des empreintes pendant le calcul (nombre d'images)
+IMAGES_ENTRE_SAUVEGARDES = 500
+
+
+def _matrice_dct(n):
+    import numpy as np
+    k = np.arange(n)[:, None]
+    matrice = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * math.sqrt(2 / n)
+    matrice[0] /= math.sqrt(2)
+    return matrice.astype(np.float32)
+
+# Empreinte perceptuelle (pHash 64 bits, en hexadécimal) d'une image
+def empreinte_visuelle(chemin_image):
+    """
+    DCT de l'image réduite à 32 x 32 en niveaux de gris ; chaque bit indique si un coefficient de basse fréquence
+    est au-dessus de la médiane. Les JPEG sont décodés directement à taille réduite (draft).
+    """
+    import numpy as np
+    with Image.open(chemin_image) as img:
+        img.draft("L", (TAILLE_REDUITE * 2, TAILLE_REDUITE * 2))
+        reduite = img.convert("L").resize((TAILLE_REDUITE, TAILLE_REDUITE), Image.Resampling.BILINEAR)
+    dct = _matrice_dct(TAILLE_REDUITE)
+    coefficients = (dct @ np.asarray(reduite, dtype=np.float32) @ dct.T)[:TAILLE_BLOC_DCT, :TAILLE_BLOC_DCT].ravel()
+    # Composante continue exclue de la médiane (elle ne dépend que de la luminosité moyenne)
+    bits = coefficients > np.median(coefficients[1:])
+    return np.packbits(bits).tobytes().hex()
+
+# Chargement des empreintes déjà calculées (dict vide si absent, illisible ou d'une autre version)
+def lire_empreintes_visuelles(image_folder):
+    chemin = os.path.join(image_folder, FICHIER_EMPREINTES_VISUELLES)
+    if not os.path.exists(chemin):
+        return {}
+    try:
+        with open(chemin, "r", encoding="utf-8") as f:
+            contenu = json.load(f)
+        return contenu.get("images", {}) if contenu.get("version") == VERSION_EMPREINTES_VISUELLES else {}
+    except Exception as e:
+        print(f"Empreintes visuelles illisibles, elles seront recalculées : {e}")
+        return {}
+
+# Écriture atomique des empreintes
+def sauvegarder_empreintes_visuelles(image_folder, empreintes):
+    chemin = os.path.join(image_folder, FICHIER_EMPREINTES_VISUELLES)
+    chemin_tmp = f"{chemin}.tmp"
+    with open(chemin_tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": VERSION_EMPREINTES_VISUELLES, "images": empreintes}, f, ensure_ascii=False)
+    os.replace(chemin_tmp, chemin)
+
+# Calcul des empreintes de toutes les images du catalogue
+def indexer_dossier(image_folder, catalogue, max_workers=None, progression=None):
+    """
+    Calcule en parallèle (pool de threads : décodage réduit et DCT libèrent le GIL) l'empreinte perceptuelle
+    des images du catalogue qui n'en ont pas encore : une relance ne traite que les images nouvelles ou modifiées.
+    progression(traitees, total) est appelée après chaque image. Retourne {empreinte du fichier: pHash}.
+    """
+    empreintes = lire_empreintes_visuelles(image_folder)
+    a_traiter = list({
+        infos["empreinte"]: nom for nom, infos in catalogue.items()
+        if infos.get("largeur") and infos["empreinte"] not in empreintes
+    }.items())
+    if not a_traiter:
+        return empreintes
+
+    def calculer(element):
+        empreinte, nom = element
+        try:
+            return empreinte, empreinte_visuelle(os.path.join(image_folder, nom))
+        except Exception as e:
+            print(f"Image illisible pour l'empreinte visuelle ({nom}) : {e}")
+            return empreinte, None
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 1)) as pool:
+        for traitees, (empreinte, valeur) in enumerate(pool.map(calculer, a_traiter), start=1):
+            if valeur is not None:
+                empreintes[empreinte] = valeur
+            if traitees % IMAGES_ENTRE_SAUVEGARDES == 0:
+                sauvegarder_empreintes_visuelles(image_folder, empreintes)
+            if progression:
+                progression(traitees, len(a_traiter))
+    sauvegarder_empreintes_visuelles(image_folder, empreintes)
+    return empreintes
+
+def _distance_gps(a, b):
+    lat = math.radians((a[0] + b[0]) / 2)
+    dx = math.radians(b[1] - a[1]) * math.cos(lat) * 6371008.8
+    dy = math.radians(b[0] - a[0]) * 6371008.8
+    return math.hypot(dx, dy)
+
+# Regroupement des photos quasi identiques
+def grouper_doublons(catalogue, empreintes, exif_data, seuil_hamming=SEUIL_HAMMING, distance_max=DISTANCE_DOUBLONS):
+    """
+    Parcourt les photos dans l'ordre de navigation : une photo rejoint le groupe dont la première photo
+    (représentant) a un pHash à au plus seuil_hamming bits et, quand les deux ont une position GPS, est à moins
+    de distance_max mètres (à écart égal, le groupe le plus ancien) ; sinon elle devient le représentant d'un
+    nouveau groupe. La comparaison au seul représentant évite qu'une suite de photos voisines (une photo par
+    mètre) ne forme un groupe sans fin.
+    Recherche par index multiple : le pHash est découpé en seuil_hamming + 1 bandes ; deux empreintes assez
+    proches ont au moins une bande identique (principe des tiroirs), seuls les représentants qui partagent
+    une bande avec la photo sont comparés.
+    Retourne {"groupes": [[noms dans l'ordre de navigation], ...], "groupe_de": {nom: indice du groupe}}
+    (groupes d'au moins deux photos).
+    """
+    noms = [nom for nom, infos in catalogue.items() if infos.get("empreinte") in empreintes]
+    valeurs = [int(empreintes[catalogue[nom]["empreinte"]], 16) for nom in noms]
+    positions = []
+    for nom in noms:
+        exif = (exif_data or {}).get(nom) or {}
+        lat, lon = exif.get("latitude"), exif.get("longitude")
+        positions.append((lat, lon) if lat is not None and lon is not None else None)
+
+    nb_bits = TAILLE_BLOC_DCT * TAILLE_BLOC_DCT
+    nb_bandes = min(seuil_hamming + 1, nb_bits)
+    bornes = [nb_bits * b // nb_bandes for b in range(nb_bandes + 1)]
+    masques = [(1 << (bornes[b + 1] - bornes[b])) - 1 for b in range(nb_bandes)]
+    seaux = {}
+    groupes = []
+    for i, valeur in enumerate(valeurs):
+        bandes = [(b, (valeur >> bornes[b]) & masques[b]) for b in range(nb_bandes)]
+        retenu = None
+        for cle in bandes:
+            for g in seaux.get(cle, ()):
+                r = groupes[g][0]
+                ecart = (valeurs[r] ^ valeur).bit_count()
+                if ecart > seuil_hamming or (retenu and retenu <= (ecart, g)):
+                    continue
+                if positions[i] and positions[r] and _distance_gps(positions[i], positions[r]) > distance_max:
+                    continue
+                retenu = (ecart, g)
+        if retenu:
+            groupes[retenu[1]].append(i)
+        else:
+            groupes.append([i])
+            for cle in bandes:
+                seaux.setdefault(cle, []).append(len(groupes) - 1)
+
+    groupes = [[noms[i] for i in membres] for membres in groupes if len(membres) > 1]
+    return {"groupes": groupes, "groupe_de": {nom: g for g, membres in enumerate(groupes) for nom in membres}}
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+# Groupes gardés en mémoire tant que le dossier, les empreintes, les EXIF et les seuils sont inchangés
+def charger_groupes_doublons(image_folder, mtime_dossier, mtime_empreintes, mtime_exif, seuil_hamming, distance_max, _catalogue, _exif_data):
+    return grouper_doublons(_catalogue, lire_empreintes_visuelles(image_folder), _exif_data, seuil_hamming, distance_max)
+
+# Photos masquées dans la navigation : les doublons non annotés, la première photo de chaque groupe reste visible
+def photos_masquees(groupes, annotations):
+    return {nom for membres in groupes["groupes"] for nom in membres[1:] if not annotations.get(nom)}
+
+# Position suivante (pas = 1) ou précédente (pas = -1) dans la navigation, en sautant les photos masquées
+def position_voisine(image_files, position, pas, masquees):
+    n = len(image_files)
+    for k in range(1, n + 1):
+        candidate = (position + pas * k) % n
+        if image_files[candidate] not in masquees:
+            return candidate
+    return position
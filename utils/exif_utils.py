@@ -69,6 +69,18 @@ def extraire_metadonnees(chemin_image):
         print(f"Erreur d'extraction EXIF: {e}")
         return None, None, None, None, None
 
+# Lecture du modèle d'appareil (Tag EXIF : 272), utilisé pour le FOV par appareil
+def lire_modele_appareil(chemin_image):
+    try:
+        with Image.open(chemin_image) as img:
+            modele = img.getexif().get(272)
+        if modele is None:
+            return None
+        return str(modele).strip("\x00 ") or None
+    except Exception as e:
+        print(f"Erreur de lecture du modèle d'appareil : {e}")
+        return None
+
 # Fonction d'extraction des EXIF et sauvegarde dans un fichier JSON
 def extraire_et_sauvegarder_exif(image_folder, exif_output_file, reset=False):
     # Vérifier si le fichier JSON existe déjà
@@ -95,7 +107,8 @@ def extraire_et_sauvegarder_exif(image_folder, exif_output_file, reset=False):
                 "longitude": lon,
                 "direction": direction,
                 "image_format": image_format,
-                "date_time": str(date_time) if date_time is not None else None
+                "date_time": str(date_time) if date_time is not None else None,
+                "modele_appareil": lire_modele_appareil(img_path)
             }
         # Écriture des éléments dans le JSON
         with open(exif_output_file, "w", encoding="utf-8") as f:
@@ -104,12 +117,12 @@ def extraire_et_sauvegarder_exif(image_folder, exif_output_file, reset=False):
         print(f"Les données EXIF ont été sauvegardées dans le fichier {exif_output_file}.")
         return exif_data
 
-@st.cache_data
 # Fonction pour charger les EXIF depuis le fichier JSON
+# (fichier lu une fois par processus et relu seulement s'il change, voir cache_utils)
 def charger_exif_depuis_json(image_name, exif_output_file):
+    from utils.cache_utils import charger_exif_partage
     try:
-        with open(exif_output_file, "r", encoding="utf-8") as f:
-            exif_data = json.load(f)
+        exif_data = charger_exif_partage(exif_output_file)
         # Retourner les données EXIF pour l'image spécifiée
         if image_name in exif_data:
             return exif_data[image_name]["latitude"], exif_data[image_name]["longitude"], exif_data[image_name]["direction"], exif_data[image_name]["image_format"], exif_data[image_name]["date_time"]
@@ -0,0 +1,67 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (export_utils.py) Export des couches phm_* en GeoParquet ou FlatGeobuf (lecture rapide par emprise)
+# -----------------------------------------------------------------------------
+
+import os
+import importlib.util
+
+# Couches produites par la cartographie et exportées
+COUCHES_EXPORT = ('phm_photo', 'phm_point_geom', 'phm_point_objet_annot', 'phm_point_ref', 'phm_ligne_vue', 'phm_point_objet')
+# Formats d'export proposés (en plus du GeoPackage, toujours écrit)
+FORMATS_EXPORT = {
+    "gpkg": "GeoPackage seul",
+    "geoparquet": "GeoParquet (colonne bbox, tri spatial)",
+    "flatgeobuf": "FlatGeobuf (index R-tree Hilbert)"
+}
+EXTENSIONS_EXPORT = {"geoparquet": ".parquet", "flatgeobuf": ".fgb"}
+# Nombre d'objets par groupe de lignes Parquet (granularité du filtrage par emprise à la lecture)
+TAILLE_GROUPE_PARQUET = 10000
+
+
+# GeoParquet nécessite pyarrow (dépendance optionnelle)
+def pyarrow_disponible():
+    return importlib.util.find_spec("pyarrow") is not None
+
+# Export des couches phm_* d'un GeoPackage de sortie
+def exporter_couches(gpkg_output, format_export, dossier=None, couches=COUCHES_EXPORT, logger=None):
+    """
+    Écrit chaque couche phm_* du GeoPackage dans un fichier séparé :
+    - geoparquet : objets triés selon la courbe de Hilbert et colonne bbox (covering) : un lecteur ne lit que les
+      groupes de lignes qui recoupent son emprise
+    - flatgeobuf : index spatial R-tree Hilbert intégré au fichier (SPATIAL_INDEX=YES)
+    Les fichiers sont écrits dans `dossier` (défaut : <nom du GPKG>_<format> à côté du GPKG).
+    Retourne la liste des fichiers écrits.
+    """
+    if format_export not in EXTENSIONS_EXPORT:
+        return []
+    if format_export == "geoparquet" and not pyarrow_disponible():
+        raise ImportError("L'export GeoParquet nécessite pyarrow (pip install pyarrow)")
+    import fiona
+    import geopandas as gpd
+
+    dossier = dossier or f"{os.path.splitext(gpkg_output)[0]}_{format_export}"
+    os.makedirs(dossier, exist_ok=True)
+    presentes = set(fiona.listlayers(gpkg_output))
+    fichiers = []
+    for couche in couches:
+        if couche not in presentes:
+            continue
+        gdf = gpd.read_file(gpkg_output, layer=couche)
+        if gdf.empty:
+            continue
+        chemin = os.path.join(dossier, couche + EXTENSIONS_EXPORT[format_export])
+        if format_export == "geoparquet":
+            gdf = gdf.iloc[gdf.geometry.hilbert_distance().argsort(kind="stable")]
+            gdf.to_parquet(chemin, index=False, write_covering_bbox=True, row_group_size=TAILLE_GROUPE_PARQUET)
+        else:
+            if os.path.exists(chemin):
+                os.remove(chemin)
+            gdf.to_file(chemin, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+        fichiers.append(chemin)
+        if logger:
+            logger.info(f"Couche '{couche}' exportée en {format_export} : {chemin}")
+    return fichiers
@@ -9,10 +9,21 @@
 import json
 import yaml
 import os
+import sys
 import shutil
+import tempfile
 from datetime import datetime
 import logging
-import streamlit
+import hashlib
+import streamlit as st
+
+# Taille des blocs lus pour les copies et empreintes de fichiers volumineux (1 Mo)
+TAILLE_BLOC = 1024 * 1024
+# Fichier voisin d'une copie temporaire (upload) contenant l'empreinte de son contenu
+SUFFIXE_EMPREINTE = ".empreinte"
+# Taille maximale du cache disque (Mo, variable PHOTOMAPON_CACHE_MAX_MO) : les entrées les moins
+# récemment utilisées sont supprimées au-delà
+TAILLE_MAX_CACHE_MO = 2048
 
 # Configuration du logger global
 def setup_logger(log_dir):
@@ -87,12 +98,167 @@ def get_mapping_yaml_if_exists(nom_fichier="mapping.yaml", dossier=None):
     chemin = os.path.join(dossier, nom_fichier)
     return chemin if os.path.exists(chemin) else None
 
+# Dossier du cache disque de Photo'Mapon (données préparées réutilisées d'un traitement à l'autre)
+def dossier_cache():
+    """
+    Retourne le dossier de cache (variable d'environnement PHOTOMAPON_CACHE, sinon ~/.photomapon/cache).
+    """
+    dossier = os.environ.get("PHOTOMAPON_CACHE") or os.path.join(os.path.expanduser("~"), ".photomapon", "cache")
+    os.makedirs(dossier, exist_ok=True)
+    return dossier
+
+# Éviction des entrées du cache disque les moins récemment utilisées (date de modification, rafraîchie à chaque lecture)
+def limiter_cache(prefixe, taille_max_mo=None, garder=None):
+    """
+    Supprime les fichiers `prefixe*` du dossier de cache, du plus ancien au plus récent, jusqu'à ce que
+    leur taille totale passe sous taille_max_mo (PHOTOMAPON_CACHE_MAX_MO, sinon TAILLE_MAX_CACHE_MO).
+    Le fichier `garder` (entrée qui vient d'être écrite) n'est jamais supprimé. Retourne les fichiers supprimés.
+    """
+    if taille_max_mo is None:
+        taille_max_mo = float(os.environ.get("PHOTOMAPON_CACHE_MAX_MO") or TAILLE_MAX_CACHE_MO)
+    dossier = dossier_cache()
+    entrees = []
+    with os.scandir(dossier) as contenu:
+        for entree in contenu:
+            if entree.name.startswith(prefixe) and entree.is_file():
+                stat = entree.stat()
+                entrees.append((stat.st_mtime_ns, stat.st_size, entree.path))
+    total = sum(taille for _, taille, _ in entrees)
+    supprimes = []
+    for _, taille, chemin in sorted(entrees):
+        if total <= taille_max_mo * 1024 * 1024:
+            break
+        if garder and os.path.abspath(chemin) == os.path.abspath(garder):
+            continue
+        try:
+            os.remove(chemin)
+            total -= taille
+            supprimes.append(chemin)
+        except OSError:
+            pass
+    return supprimes
+
+# Empreinte du contenu d'une copie temporaire, si la copie n'a pas été modifiée depuis (None sinon)
+def _empreinte_copie(chemin, stat):
+    try:
+        with open(chemin + SUFFIXE_EMPREINTE, encoding="utf-8") as f:
+            copie = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if copie.get("taille") == stat.st_size and copie.get("mtime_ns") == stat.st_mtime_ns:
+        return copie.get("empreinte")
+    return None
+
+# Empreinte rapide d'un fichier (sans relire l'intégralité du contenu)
+def empreinte_fichier(chemin, taille_bloc=TAILLE_BLOC):
+    """
+    Calcule une empreinte d'un fichier à partir de sa taille, de sa date de modification (ns) et de ses
+    premier/dernier blocs. La date couvre les écritures au milieu du fichier à taille constante (pages
+    SQLite réécrites lors d'un checkpoint WAL, par exemple par QGIS), que les blocs lus ne voient pas.
+    Pour une copie temporaire d'upload (prepare_temp_gpkg), l'empreinte est celle du contenu complet,
+    calculée pendant la copie : deux copies du même fichier partagent les mêmes entrées de cache.
+    """
+    stat = os.stat(chemin)
+    empreinte_copie = _empreinte_copie(chemin, stat)
+    if empreinte_copie:
+        return empreinte_copie
+    taille = stat.st_size
+    h = hashlib.blake2b(str((taille, stat.st_mtime_ns)).encode(), digest_size=16)
+    with open(chemin, "rb") as f:
+        h.update(f.read(taille_bloc))
+        if taille > taille_bloc:
+            f.seek(max(taille - taille_bloc, taille_bloc))
+            h.update(f.read(taille_bloc))
+    return h.hexdigest()
+
+# Mémoire maximale utilisée par le processus depuis son lancement
+def memoire_pic_mo():
+    """
+    Retourne le pic de mémoire résidente du processus en Mo (resource sous Linux/macOS,
+    psutil s'il est installé sous Windows), ou None si la mesure n'est pas disponible.
+    """
+    try:
+        import resource
+        pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Ko sous Linux, octets sous macOS
+        return pic / (1024 * 1024) if sys.platform == "darwin" else pic / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        infos = psutil.Process().memory_info()
+        return getattr(infos, "peak_wset", infos.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+# Préparation du fichier temporaire avant traitement
+def prepare_temp_gpkg(uploaded_file, session_state, session_key="tmp_gpkg_path", suffixe=".gpkg"):
+    """
+    Crée un fichier temporaire pour le GeoPackage uploadé, seulement s’il n’existe pas encore
+    pour ce même fichier. La copie est faite par blocs pour ne pas dupliquer le fichier en mémoire ;
+    l'empreinte du contenu est calculée au passage et écrite à côté de la copie (voir empreinte_fichier).
+    Sert aussi au modèle de détection uploadé (session_key="tmp_model_path", suffixe=".onnx").
+    """
+    source_id = getattr(uploaded_file, "file_id", uploaded_file.name)
+    if (session_key in session_state and os.path.exists(session_state[session_key])
+            and session_state.get(f"{session_key}_source") == source_id):
+        # Le fichier temporaire existe déjà, on ne le recrée pas
+        return session_state[session_key]
+    # Un autre GeoPackage a été uploadé : suppression de l'ancien temporaire
+    supprimer_copie_temporaire(session_state.get(session_key))
+    # Création du nouveau fichier temporaire (copie par blocs, empreinte du contenu au passage)
+    uploaded_file.seek(0)
+    h = hashlib.blake2b(digest_size=16)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffixe) as tmp:
+        while bloc := uploaded_file.read(TAILLE_BLOC):
+            h.update(bloc)
+            tmp.write(bloc)
+    stat = os.stat(tmp.name)
+    with open(tmp.name + SUFFIXE_EMPREINTE, "w", encoding="utf-8") as f:
+        json.dump({"taille": stat.st_size, "mtime_ns": stat.st_mtime_ns, "empreinte": f"contenu-{h.hexdigest()}"}, f)
+    # Enregistre dans le session_state Streamlit
+    session_state[session_key] = tmp.name
+    session_state[f"{session_key}_source"] = source_id
+    return tmp.name
+
+@st.cache_data(show_spinner=False)
+# Lecture des métadonnées des couches d'un GeoPackage (mise en cache par empreinte du fichier)
+def lister_couches_gpkg(_chemin_gpkg, empreinte):
+    """
+    Retourne la liste des couches du GeoPackage avec leurs métadonnées :
+    nom, nombre d'objets, emprise (xmin, ymin, xmax, ymax) et SCR.
+    Le chemin n'entre pas dans la clé du cache (préfixe "_") : seule l'empreinte du fichier
+    compte, ce qui évite de rouvrir le fichier à chaque rerun.
+    """
+    couches = []
+    import fiona
+
+    for nom in fiona.listlayers(_chemin_gpkg):
+        with fiona.open(_chemin_gpkg, layer=nom) as src:
+            try:
+                emprise = tuple(src.bounds)
+            except Exception:
+                emprise = None
+            couches.append({
+                "nom": nom,
+                "nb_objets": len(src),
+                "emprise": emprise,
+                "crs": src.crs.to_string() if src.crs else None
+            })
+    return couches
+
+# Suppression d'une copie temporaire et de son fichier d'empreinte
+def supprimer_copie_temporaire(chemin):
+    for fichier in (chemin, f"{chemin}{SUFFIXE_EMPREINTE}" if chemin else None):
+        if fichier and os.path.exists(fichier):
+            os.remove(fichier)
+
 def cleanup_temp_files():
-    # Supprimer le modèle YOLO temporaire
+    # Supprimer le modèle de détection (ONNX) temporaire
     tmp_model = st.session_state.get("tmp_model_path")
     if tmp_model and os.path.exists(tmp_model):
         try:
-            os.remove(tmp_model)
+            supprimer_copie_temporaire(tmp_model)
             print(f"🧹 Modèle temporaire supprimé : {tmp_model}")
         except Exception as e:
             print(f"❌ Erreur suppression modèle : {e}")
@@ -101,7 +267,7 @@ def cleanup_temp_files():
     tmp_gpkg = st.session_state.get("tmp_gpkg_path")
     if tmp_gpkg and os.path.exists(tmp_gpkg):
         try:
-            os.remove(tmp_gpkg)
+            supprimer_copie_temporaire(tmp_gpkg)
             print(f"🧹 GeoPackage temporaire supprimé : {tmp_gpkg}")
         except Exception as e:
             print(f"❌ Erreur suppression GPKG : {e}")
\ No newline at end of file
@@ -0,0 +1,376 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (flux_utils.py) Cartographie en flux par blocs de photos (campagnes plus grandes que la mémoire)
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from utils.file_utils import setup_logger, memoire_pic_mo
+from utils.reference_utils import charger_reference
+from utils.geo_utils import (
+    convertir_wgs84_vers_lambert93, extraire_points, preparer_colonnes_maj_objet, collecter_observations_maj,
+    appliquer_maj_objet, lancer_rayons, identifier_objets, regrouper_sous_groupes, orienter_sous_groupes,
+    creer_lignes_de_vue, trianguler_groupes, copier_couches_source
+)
+
+# Nombre de photos traitées par bloc
+TAILLE_BLOC_PHOTOS = 2000
+# Côté (m) des tuiles servant à ordonner les photos : un bloc regroupe des photos proches
+TAILLE_TUILE_BLOC = 500.0
+# Colonnes numériques des couches écrites par bloc (un bloc sans valeur ne doit pas créer un champ texte)
+COLONNES_NUMERIQUES = ('latitude', 'longitude', 'x_lambert93', 'y_lambert93', 'direction', 'angle_ajuste')
+
+
+# Ordre de traitement des photos géolocalisées : par tuiles, en serpentin
+def ordonner_photos(annotations, exif_data, taille_tuile=TAILLE_TUILE_BLOC):
+    """
+    Retourne les noms des images géolocalisées triés par tuile de `taille_tuile` mètres (colonnes parcourues
+    en serpentin), puis dans l'ordre des annotations : des blocs consécutifs couvrent des zones compactes.
+    """
+    noms, lats, lons = [], [], []
+    for img in annotations:
+        exif = exif_data.get(img, {})
+        if exif.get('latitude') is None or exif.get('longitude') is None:
+            continue
+        noms.append(img)
+        lats.append(exif['latitude'])
+        lons.append(exif['longitude'])
+    if not noms:
+        return []
+    x, y = convertir_wgs84_vers_lambert93(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float))
+    tuile_x = np.floor(np.asarray(x) / taille_tuile).astype(np.int64)
+    tuile_y = np.floor(np.asarray(y) / taille_tuile).astype(np.int64)
+    tuile_y = np.where(tuile_x % 2 == 0, tuile_y, -tuile_y)
+    ordre = np.lexsort((np.arange(len(noms)), tuile_y, tuile_x))
+    return [noms[i] for i in ordre]
+
+# Étape "découpage" : blocs de photos consécutives
+def decouper_blocs(noms, taille_bloc=TAILLE_BLOC_PHOTOS):
+    for debut in range(0, len(noms), taille_bloc):
+        yield noms[debut:debut + taille_bloc]
+
+# Étape "extraction" : photos et points annotés de chaque bloc (colonne campagne en traitement multi-campagnes)
+def extraire_blocs(blocs, annotations, exif_data, image_folder, campagne=None):
+    for noms in blocs:
+        photos_records, points_data = extraire_points(annotations, exif_data, image_folder, noms)
+        gdf_photos, gdf_points = _geodataframe(photos_records), _geodataframe(points_data)
+        if campagne is not None:
+            gdf_photos['campagne'] = campagne
+            gdf_points['campagne'] = campagne
+        yield gdf_photos, gdf_points
+
+def _geodataframe(records):
+    if not records:
+        return gpd.GeoDataFrame(geometry=gpd.GeoSeries([], crs='EPSG:2154'), crs='EPSG:2154')
+    return gpd.GeoDataFrame(records, geometry='geometry', crs='EPSG:2154')
+
+# Étape "lancer" : lignes de vue de chaque bloc contre la couche de référence
+def lancer_blocs(blocs_extraits, gdf_geom, lignes_bat, decalage_orientation, rang_images):
+    """
+    Pour chaque bloc, produit un dict :
+    - photos / points : GeoDataFrames des couches phm_photo et phm_point_geom, à écrire tels quels
+    - observations : observations maj_objet (voir collecter_observations_maj), votées en fin de traitement
+    - impacts : tableaux des points cartographiques (impact, photo d'origine, attributs, rang dans les annotations),
+      gardés jusqu'au regroupement, qui doit voir les points de tous les blocs
+    """
+    for gdf_photos, gdf_points in blocs_extraits:
+        bloc = {'photos': gdf_photos, 'points': gdf_points, 'observations': None, 'impacts': None, 'types_maj': {}}
+        if gdf_points.empty:
+            yield bloc
+            continue
+        # Rang de chaque annotation dans annotations.json (ordre du traitement complet)
+        rang_image = gdf_points['image_name'].map(rang_images).to_numpy(dtype=np.int64)
+        rang_annotation = gdf_points.groupby('image_name', sort=False).cumcount().to_numpy(dtype=np.int64)
+
+        maj = (gdf_points['mode_annotation'] == 'maj_objet').to_numpy()
+        points_maj_objet = gdf_points[maj]
+        # Première apparition de chaque type d'objet maj_objet (ordre des colonnes ajoutées à la couche)
+        for type_objet, ri, ra in zip(points_maj_objet['type_objet'], rang_image[maj], rang_annotation[maj]):
+            bloc['types_maj'][type_objet] = min(bloc['types_maj'].get(type_objet, (ri, ra)), (ri, ra))
+        bloc['observations'] = collecter_observations_maj(gdf_geom, points_maj_objet, decalage_orientation)
+        if 'campagne' in gdf_points.columns and not bloc['observations'].empty:
+            # Photos de même nom dans deux campagnes : comptées séparément dans les votes
+            bloc['observations']['image_name'] = _identifiants_photos(
+                gdf_points['campagne'].iloc[0], bloc['observations']['image_name'].to_numpy())
+
+        carto = ((gdf_points['mode_annotation'] == 'cartographie') & gdf_points['angle_ajuste'].notna()).to_numpy()
+        src = gdf_points[carto]
+        x_photo = src.geometry.x.to_numpy()
+        y_photo = src.geometry.y.to_numpy()
+        angles = src['angle_ajuste'].to_numpy(dtype=float)
+        rayons = lancer_rayons(lignes_bat, x_photo, y_photo, angles, decalage_orientation)
+        touches = np.flatnonzero(rayons['touche'])
+        bloc['impacts'] = {
+            'x': rayons['x'][touches],
+            'y': rayons['y'][touches],
+            'x_photo': x_photo[touches],
+            'y_photo': y_photo[touches],
+            'angle_ajuste': angles[touches],
+            'image_name': src['image_name'].to_numpy()[touches],
+            'type_objet': src['type_objet'].to_numpy()[touches],
+            'fonction_objet': src['fonction_objet'].to_numpy()[touches],
+            'ID': src['ID'].to_numpy()[touches],
+            'objet_id': np.array(identifier_objets(gdf_geom, rayons['x'][touches], rayons['y'][touches]), dtype=object),
+            'rang_image': rang_image[carto][touches],
+            'rang_annotation': rang_annotation[carto][touches]
+        }
+        if 'campagne' in gdf_points.columns:
+            bloc['impacts']['campagne'] = src['campagne'].to_numpy()[touches]
+        yield bloc
+
+def _identifiants_photos(campagnes, noms):
+    """Identifiant unique d'une photo sur plusieurs campagnes : "campagne/nom"."""
+    return (pd.Series(campagnes, index=range(len(noms)), dtype=object).astype(str) + "/" + pd.Series(noms, dtype=object)).to_numpy()
+
+# Écriture d'une tranche de couche : création au premier bloc, ajout ensuite
+class EcrivainCouches:
+    def __init__(self, gpkg_output, logger):
+        self.gpkg_output = gpkg_output
+        self.logger = logger
+        self.nb_objets = {}
+
+    def ajouter(self, gdf, couche):
+        if gdf is None or gdf.empty:
+            return
+        for colonne in COLONNES_NUMERIQUES:
+            if colonne in gdf.columns and gdf[colonne].dtype == object and gdf[colonne].isna().all():
+                gdf[colonne] = gdf[colonne].astype(float)
+        try:
+            mode = 'a' if couche in self.nb_objets else 'w'
+            gdf.to_file(self.gpkg_output, layer=couche, driver='GPKG', mode=mode)
+            self.nb_objets[couche] = self.nb_objets.get(couche, 0) + len(gdf)
+        except Exception as e:
+            self.logger.info(f"Erreur lors de l'écriture de la couche '{couche}' : {e}")
+
+    def ajouter_par_tranches(self, couche, nb, construire, taille=TAILLE_BLOC_PHOTOS):
+        """Écrit `nb` objets par tranches : construire(debut, fin) retourne le GeoDataFrame de la tranche."""
+        for debut in range(0, nb, taille):
+            self.ajouter(construire(debut, min(debut + taille, nb)), couche)
+
+# Fonction principale du mode par blocs
+def creer_gpkg_par_blocs(annotations_json, exif_json, ancien_gpkg, gpkg_output, image_folder, selected_layer,
+                         decalage_orientation, taille_bloc=TAILLE_BLOC_PHOTOS, utiliser_cache=True, reference=None):
+    """
+    Même résultat que creer_gpkg_complet (mêmes couches, mêmes valeurs ; l'ordre des objets peut différer),
+    mais les photos sont traitées par blocs spatialement compacts (extraction -> lancer -> collecte) et les
+    couches phm_photo / phm_point_geom sont écrites au fil des blocs : les GeoDataFrames de photos, de points
+    et de lignes de vue ne dépendent que de la taille des blocs.
+    La mémoire n'est pas bornée pour autant, elle reste proportionnelle à la campagne pour :
+    - annotations.json et exif_data.json, lus en entier (environ 0,7 Ko par annotation) : l'ordre des blocs
+      (tuiles) a besoin de la position de toutes les photos ;
+    - les tableaux compacts par point cartographique (impact, photo, attributs, environ 0,2 Ko) et les
+      observations maj_objet, gardés jusqu'à la fin pour que le regroupement spatial, les moyennes et les
+      votes voient les points de tous les blocs (un sous-groupe peut être à cheval) ;
+    - la couche de référence complète (gdf_geom), mise à jour puis réécrite.
+    """
+    with open(annotations_json, encoding='utf-8') as f:
+        annotations = json.load(f)
+    with open(exif_json, encoding='utf-8') as f:
+        exif_data = json.load(f)
+    logger = setup_logger(os.path.join(image_folder, 'resultat'))
+    gdf_geom, lignes_bat = _reference_blocs(ancien_gpkg, selected_layer, utiliser_cache, reference, logger)
+
+    # --- Pipeline par blocs : découpage -> extraction -> lancer -> collecte ---
+    rang_images = {img: rang for rang, img in enumerate(annotations)}
+    noms = ordonner_photos(annotations, exif_data)
+    blocs = lancer_blocs(
+        extraire_blocs(decouper_blocs(noms, taille_bloc), annotations, exif_data, image_folder),
+        gdf_geom, lignes_bat, decalage_orientation, rang_images
+    )
+    _cartographier_blocs(blocs, gdf_geom, lignes_bat, ancien_gpkg, gpkg_output, selected_layer, decalage_orientation,
+                         taille_bloc, logger)
+
+# Nom de chaque campagne (nom du dossier, numéroté si plusieurs dossiers ont le même nom)
+def noms_campagnes(dossiers):
+    noms = []
+    for dossier in dossiers:
+        nom = os.path.basename(os.path.normpath(dossier)) or dossier
+        noms.append(nom if nom not in noms else f"{nom}_{len(noms) + 1}")
+    return noms
+
+# Cartographie de plusieurs campagnes (dossiers photo) en un seul traitement
+def creer_gpkg_campagnes(dossiers, ancien_gpkg, gpkg_output, selected_layer, decalage_orientation,
+                         taille_bloc=TAILLE_BLOC_PHOTOS, utiliser_cache=True, reference=None):
+    """
+    Traite les campagnes les unes après les autres contre la couche de référence chargée et indexée une seule
+    fois, et écrit un seul GeoPackage consolidé (colonne campagne dans phm_photo, phm_point_geom et
+    phm_point_objet_annot). Le regroupement des points cartographiques, les points de référence, la
+    triangulation et les votes maj_objet portent sur toutes les campagnes à la fois : un objet vu lors de
+    plusieurs campagnes n'est cartographié qu'une fois. Les annotations et EXIF d'une campagne ne sont lus
+    qu'au moment de la traiter (base partagée annotations.sqlite si elle existe, sinon annotations.json).
+    Retourne {campagne: nombre de photos géolocalisées traitées}.
+    """
+    from utils.stockage_utils import charger_annotations_campagne
+    logger = setup_logger(os.path.dirname(os.path.abspath(gpkg_output)))
+    gdf_geom, lignes_bat = _reference_blocs(ancien_gpkg, selected_layer, utiliser_cache, reference, logger)
+    campagnes = list(zip(noms_campagnes(dossiers), dossiers))
+    photos_par_campagne = {}
+
+    def blocs_campagnes():
+        # Rangs des images continus d'une campagne à l'autre : ordre des campagnes, puis des annotations
+        rang_depart = 0
+        for campagne, dossier in campagnes:
+            annotations = charger_annotations_campagne(dossier)
+            with open(os.path.join(dossier, "exif_data.json"), encoding='utf-8') as f:
+                exif_data = json.load(f)
+            noms = ordonner_photos(annotations, exif_data)
+            photos_par_campagne[campagne] = len(noms)
+            logger.info(f"Campagne {campagne} ({dossier}) : {len(annotations)} images annotées, {len(noms)} géolocalisées")
+            rang_images = {img: rang_depart + rang for rang, img in enumerate(annotations)}
+            rang_depart += len(annotations)
+            yield from lancer_blocs(
+                extraire_blocs(decouper_blocs(noms, taille_bloc), annotations, exif_data, dossier, campagne),
+                gdf_geom, lignes_bat, decalage_orientation, rang_images
+            )
+
+    _cartographier_blocs(blocs_campagnes(), gdf_geom, lignes_bat, ancien_gpkg, gpkg_output, selected_layer,
+                         decalage_orientation, taille_bloc, logger)
+    return photos_par_campagne
+
+def _reference_blocs(ancien_gpkg, selected_layer, utiliser_cache, reference, logger):
+    if reference is not None:
+        gdf_geom, gdf_geom_clean, lignes_bat = reference
+        return gdf_geom.copy(deep=False), lignes_bat
+    gdf_geom, gdf_geom_clean, lignes_bat = charger_reference(ancien_gpkg, selected_layer, utiliser_cache, logger)
+    return gdf_geom, lignes_bat
+
+# Collecte des blocs, regroupement global et écriture des couches
+def _cartographier_blocs(blocs, gdf_geom, lignes_bat, ancien_gpkg, gpkg_output, selected_layer, decalage_orientation,
+                         taille_bloc, logger):
+    ecrivain = EcrivainCouches(gpkg_output, logger)
+    observations, impacts, types_maj = [], [], {}
+    for numero, bloc in enumerate(blocs, start=1):
+        ecrivain.ajouter(bloc['photos'], 'phm_photo')
+        ecrivain.ajouter(bloc['points'], 'phm_point_geom')
+        if bloc['observations'] is not None and not bloc['observations'].empty:
+            observations.append(bloc['observations'])
+        if bloc['impacts'] is not None and len(bloc['impacts']['x']):
+            impacts.append(bloc['impacts'])
+        for type_objet, rang in bloc['types_maj'].items():
+            types_maj[type_objet] = min(types_maj.get(type_objet, rang), rang)
+        pic = memoire_pic_mo()
+        logger.info(f"Bloc {numero} : {len(bloc['photos'])} photos, {len(bloc['points'])} points"
+                    + (f", mémoire maximale : {pic:.0f} Mo" if pic is not None else ""))
+
+    # --- Regroupement et points de référence (tous les blocs) ---
+    nb_ref = nb_triangules = 0
+    if impacts:
+        impacts = {cle: np.concatenate([bloc[cle] for bloc in impacts]) for cle in impacts[0]}
+        # Ordre des annotations : mêmes références de sous-groupe que le traitement complet
+        ordre = np.lexsort((impacts['rang_annotation'], impacts['rang_image']))
+        impacts = {cle: valeurs[ordre] for cle, valeurs in impacts.items()}
+        # Type des identifiants déduit sur l'ensemble des blocs (entiers si la couche en a), comme en une passe
+        impacts['objet_id'] = pd.Series(impacts['objet_id']).infer_objects().to_numpy()
+        attributs = pd.DataFrame({cle: impacts[cle] for cle in ('objet_id', 'type_objet', 'fonction_objet')})
+        # Attribut manquant : pas de groupe (NaN, sous-groupe -1, ignoré par la triangulation)
+        group_attr = attributs.groupby(['objet_id', 'type_objet', 'fonction_objet']).ngroup().to_numpy(dtype=float)
+        sous_groupes = regrouper_sous_groupes(impacts['x'], impacts['y'], group_attr)
+        # Plusieurs campagnes : photos identifiées par campagne et nom (un même nom de fichier peut revenir)
+        photos = _identifiants_photos(impacts['campagne'], impacts['image_name']) if 'campagne' in impacts else impacts['image_name']
+        ids_groupes, premiers, orientation_moyenne = orienter_sous_groupes(
+            impacts['x'], impacts['y'], impacts['x_photo'], impacts['y_photo'], impacts['angle_ajuste'],
+            photos, sous_groupes
+        )
+        nb_ref = len(ids_groupes)
+
+        # Points cartographiques (phm_point_objet_annot)
+        ecrivain.ajouter_par_tranches('phm_point_objet_annot', len(sous_groupes), lambda d, f: gpd.GeoDataFrame({
+            'image_name': impacts['image_name'][d:f],
+            **({'campagne': impacts['campagne'][d:f]} if 'campagne' in impacts else {}),
+            'x_lambert93': impacts['x'][d:f],
+            'y_lambert93': impacts['y'][d:f],
+            'angle_ajuste': impacts['angle_ajuste'][d:f],
+            'type_objet': impacts['type_objet'][d:f],
+            'fonction_objet': impacts['fonction_objet'][d:f],
+            'ID': impacts['ID'][d:f],
+            'objet_id': impacts['objet_id'][d:f],
+            'geometry': shapely.points(impacts['x'][d:f], impacts['y'][d:f]),
+            'group_attr': pd.array(group_attr[d:f], dtype='Int64'),
+            'subgroup_id': sous_groupes[d:f]
+        }, geometry='geometry', crs='EPSG:2154'), taille_bloc)
+
+        # Points de référence, lignes de vue et points d'extrémité, par tranches de sous-groupes
+        x_ref = impacts['x_photo'][premiers]
+        y_ref = impacts['y_photo'][premiers]
+        ecrivain.ajouter_par_tranches('phm_point_ref', nb_ref, lambda d, f: gpd.GeoDataFrame({
+            'geometry': shapely.points(x_ref[d:f], y_ref[d:f]),
+            'objet_id': impacts['objet_id'][premiers[d:f]],
+            'type_objet': impacts['type_objet'][premiers[d:f]],
+            'fonction_objet': impacts['fonction_objet'][premiers[d:f]],
+            'group_attr': pd.array(group_attr[premiers[d:f]], dtype='Int64'),
+            'subgroup_id': ids_groupes[d:f],
+            'angle_ajuste_ref': impacts['angle_ajuste'][premiers[d:f]],
+            'orientation_moyenne': orientation_moyenne[d:f]
+        }, geometry='geometry', crs='EPSG:2154'), taille_bloc)
+        ecrivain.ajouter_par_tranches('phm_ligne_vue', nb_ref, lambda d, f: gpd.GeoDataFrame({
+            'geometry': creer_lignes_de_vue(x_ref[d:f], y_ref[d:f], orientation_moyenne[d:f], decalage_orientation, longueur=150),
+            'objet_id': impacts['objet_id'][premiers[d:f]],
+            'subgroup_id': ids_groupes[d:f],
+            'angle_utilise': orientation_moyenne[d:f]
+        }, geometry='geometry', crs='EPSG:2154'), taille_bloc)
+
+        x_ext = np.full(nb_ref, np.nan)
+        y_ext = np.full(nb_ref, np.nan)
+        for debut in range(0, nb_ref, taille_bloc):
+            tranche = slice(debut, min(debut + taille_bloc, nb_ref))
+            rayons = lancer_rayons(lignes_bat, x_ref[tranche], y_ref[tranche], orientation_moyenne[tranche],
+                                   decalage_orientation, longueur=150)
+            touche = np.flatnonzero(rayons['touche'])
+            x_ext[tranche][touche] = rayons['x'][touche]
+            y_ext[tranche][touche] = rayons['y'][touche]
+            refs = premiers[tranche][touche]
+            ecrivain.ajouter(gpd.GeoDataFrame({
+                'geometry': shapely.points(rayons['x'][touche], rayons['y'][touche]),
+                'objet_id': impacts['objet_id'][refs],
+                'subgroup_id': ids_groupes[tranche][touche],
+                'angle_utilise': orientation_moyenne[tranche][touche],
+                'type_objet': impacts['type_objet'][refs],
+                'fonction_objet': impacts['fonction_objet'][refs]
+            }, geometry='geometry', crs='EPSG:2154'), 'phm_point_objet')
+
+        # Triangulation des sous-groupes vus depuis plusieurs photos (phm_point_triangule)
+        triang = trianguler_groupes(impacts['x_photo'], impacts['y_photo'], impacts['angle_ajuste'],
+                                    sous_groupes, decalage_orientation)
+        nb_photos = pd.DataFrame({'s': sous_groupes, 'i': photos}).groupby('s')['i'].nunique()
+        valides = np.flatnonzero(triang['valide'])
+        nb_triangules = len(valides)
+        position = np.searchsorted(ids_groupes, valides)
+        ecarts = np.hypot(triang['x'][valides] - x_ext[position], triang['y'][valides] - y_ext[position])
+        ecrivain.ajouter_par_tranches('phm_point_triangule', nb_triangules, lambda d, f: gpd.GeoDataFrame({
+            'geometry': shapely.points(triang['x'][valides[d:f]], triang['y'][valides[d:f]]),
+            'objet_id': impacts['objet_id'][premiers[position[d:f]]],
+            'type_objet': impacts['type_objet'][premiers[position[d:f]]],
+            'fonction_objet': impacts['fonction_objet'][premiers[position[d:f]]],
+            'subgroup_id': valides[d:f],
+            'nb_vues': triang['nb_vues'][valides[d:f]].astype(int),
+            'nb_photos': nb_photos.reindex(valides[d:f]).to_numpy(dtype=int),
+            'residu_rms': triang['residu_rms'][valides[d:f]],
+            'incertitude': triang['incertitude'][valides[d:f]],
+            'angle_max': triang['angle_max'][valides[d:f]],
+            'ecart_point_objet': ecarts[d:f]
+        }, geometry='geometry', crs='EPSG:2154'), taille_bloc)
+
+    # --- Mise à jour des objets (votes de tous les blocs) et couches de la référence ---
+    types_ordonnes = sorted(types_maj, key=types_maj.get)
+    gdf_geom = preparer_colonnes_maj_objet(gdf_geom, pd.DataFrame({'type_objet': types_ordonnes}))
+    accords_maj = appliquer_maj_objet(
+        gdf_geom, pd.concat(observations, ignore_index=True) if observations else pd.DataFrame()
+    )
+    ecrivain.ajouter(gdf_geom, selected_layer)
+    copier_couches_source(ancien_gpkg, gpkg_output, selected_layer, logger)
+    if len(accords_maj):
+        ecrivain.ajouter(gpd.GeoDataFrame(accords_maj, geometry='geometry', crs=gdf_geom.crs), 'phm_maj_objet_accord')
+
+    for couche, nb in ecrivain.nb_objets.items():
+        logger.info(f"Couche '{couche}' : {nb} objets écrits")
+    logger.info(f"Nombre de points de référence : {nb_ref}, points triangulés : {nb_triangules}")
+    pic = memoire_pic_mo()
+    if pic is not None:
+        logger.info(f"Mémoire maximale du processus : {pic:.0f} Mo")
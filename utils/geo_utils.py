@@ -7,27 +7,37 @@
 # -----------------------------------------------------------------------------
 
 import json
-import tempfile
 import math
+from functools import lru_cache
 import pyproj
 from shapely.geometry import LineString, Point
 import os
 import geopandas as gpd
 import numpy as np
+import pandas as pd
 import fiona
-from scipy.spatial.distance import pdist, squareform
+import shapely
+import streamlit as st
 from shapely.geometry import LineString, Point
-from utils.file_utils import setup_logger
+from utils.file_utils import setup_logger, memoire_pic_mo
+from utils.reference_utils import charger_reference
+from utils.image_utils import chemin_photo_annotee
 
 
+# Transformateurs pyproj réutilisés (leur création coûte plusieurs millisecondes)
+@lru_cache(maxsize=None)
+def _transformer(crs_source, crs_cible):
+    return pyproj.Transformer.from_crs(pyproj.CRS(crs_source), pyproj.CRS(crs_cible), always_xy=True)
+
 # Fonction de conversion WGS84 → Lambert-93
 def convertir_wgs84_vers_lambert93(lat, lon):
-    wgs84 = pyproj.CRS('EPSG:4326')
-    lambert93 = pyproj.CRS('EPSG:2154')
-    transformer = pyproj.Transformer.from_crs(wgs84, lambert93, always_xy=True)
-    x, y = transformer.transform(lon, lat)
+    x, y = _transformer('EPSG:4326', 'EPSG:2154').transform(lon, lat)
     return x, y
 
+# Fonction de conversion Lambert-93 → WGS84 (accepte des tableaux), retourne (lon, lat)
+def convertir_lambert93_vers_wgs84(x, y):
+    return _transformer('EPSG:2154', 'EPSG:4326').transform(x, y)
+
 # Création de la ligne de vue (segment) à partir d’un point, d’un angle et d’une longueur
 def creer_ligne_de_vue(x, y, angle_deg, decalage_orientation, longueur=150):
     """
@@ -47,21 +57,390 @@ def creer_ligne_de_vue(x, y, angle_deg, decalage_orientation, longueur=150):
     dy = math.sin(angle_rad) * longueur
     return LineString([(x, y), (x + dx, y + dy)])
 
-# Préparation du fichier temporaire avant traitement
-def prepare_temp_gpkg(uploaded_file, session_state, session_key="tmp_gpkg_path"):
+# Création vectorisée des lignes de vue (même convention d'angle que creer_ligne_de_vue)
+def creer_lignes_de_vue(x, y, angles_deg, decalage_orientation, longueur=150):
+    """
+    Version vectorisée de creer_ligne_de_vue : x, y et angles_deg sont des tableaux de même taille.
+    Retourne un tableau shapely de LineString.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    angles_deg = np.asarray(angles_deg, dtype=float)
+    angles_rad = np.radians(decalage_orientation - angles_deg) if decalage_orientation > 0 else np.radians(-angles_deg)
+    coords = np.empty((len(x), 2, 2))
+    coords[:, 0, 0] = x
+    coords[:, 0, 1] = y
+    coords[:, 1, 0] = x + np.cos(angles_rad) * longueur
+    coords[:, 1, 1] = y + np.sin(angles_rad) * longueur
+    return shapely.linestrings(coords)
+
+# Lancer de rayons groupé contre les contours des bâtiments (index spatial)
+def lancer_rayons(lignes_bat, x, y, angles_deg, decalage_orientation, longueur=150):
+    """
+    Lance toutes les lignes de vue en une seule requête sur l'index spatial des contours
+    et retient, pour chaque ligne, le point d'intersection le plus proche de son origine.
+
+    :param lignes_bat: GeoDataFrame des contours (colonne 'bat_id')
+    :param x, y: Tableaux des coordonnées des points de départ (Lambert-93)
+    :param angles_deg: Tableau des angles des lignes de vue
+    :return: dict de tableaux de même taille que x : 'touche' (bool), 'x', 'y', 'distance', 'bat_id'
+             (NaN / -1 pour les lignes sans intersection)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    resultat = {
+        'touche': np.zeros(n, dtype=bool),
+        'x': np.full(n, np.nan),
+        'y': np.full(n, np.nan),
+        'distance': np.full(n, np.nan),
+        'bat_id': np.full(n, -1, dtype=np.int64)
+    }
+    if n == 0 or lignes_bat.empty:
+        return resultat
+
+    lignes = creer_lignes_de_vue(x, y, angles_deg, decalage_orientation, longueur)
+    # Couples (ligne de vue, contour) qui s'intersectent, triés par ligne puis par contour
+    idx_rayon, idx_contour = lignes_bat.sindex.query(lignes, predicate='intersects')
+    if len(idx_rayon) == 0:
+        return resultat
+    ordre = np.lexsort((idx_contour, idx_rayon))
+    idx_rayon, idx_contour = idx_rayon[ordre], idx_contour[ordre]
+
+    inters = shapely.intersection(lignes[idx_rayon], lignes_bat.geometry.values[idx_contour])
+    # Seuls les points (et multipoints) sont retenus, comme dans le traitement d'origine
+    type_ids = shapely.get_type_id(inters)
+    garder = (type_ids == 0) | (type_ids == 4)
+    coords, idx_part = shapely.get_coordinates(inters[garder], return_index=True)
+    if len(coords) == 0:
+        return resultat
+    rayon_pt = idx_rayon[garder][idx_part]
+    contour_pt = idx_contour[garder][idx_part]
+    dist = np.hypot(coords[:, 0] - x[rayon_pt], coords[:, 1] - y[rayon_pt])
+
+    # Pour chaque ligne : le point le plus proche (à égalité, le premier rencontré)
+    ordre = np.lexsort((np.arange(len(dist)), dist, rayon_pt))
+    premier = ordre[np.r_[True, rayon_pt[ordre][1:] != rayon_pt[ordre][:-1]]]
+    r = rayon_pt[premier]
+    resultat['touche'][r] = True
+    resultat['x'][r] = coords[premier, 0]
+    resultat['y'][r] = coords[premier, 1]
+    resultat['distance'][r] = dist[premier]
+    resultat['bat_id'][r] = lignes_bat['bat_id'].to_numpy()[contour_pt[premier]]
+    return resultat
+
+# Angle minimal entre les lignes de vue d'un objet pour que sa triangulation soit retenue
+ANGLE_MIN_TRIANGULATION = 2.0
+
+# Triangulation par moindres carrés des objets vus depuis plusieurs photos
+def trianguler_groupes(x, y, angles_deg, groupes, decalage_orientation, angle_min=ANGLE_MIN_TRIANGULATION):
+    """
+    Pour chaque groupe d'observations (origine x/y, angle de la ligne de vue), calcule le point minimisant
+    la somme des carrés des distances aux lignes de vue : A p = b avec A = Σ (I - d dᵀ), b = Σ (I - d dᵀ) o.
+    Toutes les matrices 2x2 sont accumulées et résolues en une fois (np.linalg.solve groupé).
+
+    :param groupes: tableau d'entiers 0..G-1 (identifiant de groupe de chaque observation) ; les observations
+                    sans groupe (-1 : objet_id, type ou fonction manquant) sont ignorées
+    :return: dict de tableaux de taille G : 'valide', 'x', 'y', 'nb_vues', 'residu_rms' (m),
+             'incertitude' (m, écart-type de position, NaN si seulement 2 vues), 'angle_max' (degrés)
+    """
+    groupes = np.asarray(groupes, dtype=np.int64)
+    avec_groupe = groupes >= 0
+    groupes = groupes[avec_groupe]
+    x = np.asarray(x, dtype=float)[avec_groupe]
+    y = np.asarray(y, dtype=float)[avec_groupe]
+    angles_deg = np.asarray(angles_deg, dtype=float)[avec_groupe]
+    nb_groupes = int(groupes.max()) + 1 if len(groupes) else 0
+    angles_rad = np.radians(decalage_orientation - angles_deg) if decalage_orientation > 0 \
+        else np.radians(-angles_deg)
+    d = np.column_stack([np.cos(angles_rad), np.sin(angles_rad)])
+    o = np.column_stack([x, y])
+
+    # Projecteurs orthogonaux aux lignes de vue et accumulation par groupe
+    m = np.eye(2)[None, :, :] - d[:, :, None] * d[:, None, :]
+    a = np.zeros((nb_groupes, 2, 2))
+    b = np.zeros((nb_groupes, 2))
+    np.add.at(a, groupes, m)
+    np.add.at(b, groupes, np.einsum('nij,nj->ni', m, o))
+    nb_vues = np.bincount(groupes, minlength=nb_groupes)
+
+    # Écart angulaire maximal entre les lignes de vue d'un groupe (via les bornes de l'axe moyen)
+    axe = np.arctan2(d[:, 1], d[:, 0])
+    s = np.zeros(nb_groupes); c = np.zeros(nb_groupes)
+    np.add.at(s, groupes, np.sin(axe)); np.add.at(c, groupes, np.cos(axe))
+    ecart = (axe - np.arctan2(s, c)[groupes] + np.pi) % (2 * np.pi) - np.pi
+    ecart_min = np.full(nb_groupes, np.inf); ecart_max = np.full(nb_groupes, -np.inf)
+    np.minimum.at(ecart_min, groupes, ecart); np.maximum.at(ecart_max, groupes, ecart)
+    angle_max = np.degrees(np.where(nb_vues > 0, ecart_max - ecart_min, 0.0))
+
+    # Résolution groupée des systèmes bien conditionnés (lignes non parallèles)
+    valide = (nb_vues >= 2) & (np.linalg.det(a) > math.sin(math.radians(angle_min)) ** 2)
+    p = np.full((nb_groupes, 2), np.nan)
+    if valide.any():
+        p[valide] = np.linalg.solve(a[valide], b[valide][:, :, None])[:, :, 0]
+
+    # Résidus : distance de chaque observation à sa ligne de vue ; le point doit être devant chaque photo
+    ecart_p = p[groupes] - o
+    residus = np.einsum('nij,nj->ni', m, ecart_p)
+    r2 = np.einsum('ni,ni->n', residus, residus)
+    devant = np.einsum('ni,ni->n', d, ecart_p) > 0
+    somme_r2 = np.bincount(groupes, weights=np.nan_to_num(r2), minlength=nb_groupes)
+    valide &= np.bincount(groupes, weights=~devant, minlength=nb_groupes) == 0
+
+    # Incertitude : σ² (A)⁻¹ avec σ² = Σ r² / (n - 2), trace -> écart-type de position
+    incertitude = np.full(nb_groupes, np.nan)
+    redondant = valide & (nb_vues > 2)
+    if redondant.any():
+        sigma2 = somme_r2[redondant] / (nb_vues[redondant] - 2)
+        incertitude[redondant] = np.sqrt(sigma2 * np.trace(np.linalg.inv(a[redondant]), axis1=1, axis2=2))
+    return {
+        'valide': valide,
+        'x': p[:, 0],
+        'y': p[:, 1],
+        'nb_vues': nb_vues,
+        'residu_rms': np.where(valide, np.sqrt(somme_r2 / np.maximum(nb_vues, 1)), np.nan),
+        'incertitude': incertitude,
+        'angle_max': angle_max
+    }
+
+# Distance maximale (m) entre deux points cartographiques d'un même sous-groupe spatial
+SEUIL_SOUS_GROUPE = 2.0
+
+# Regroupement spatial des points cartographiques (étape 8)
+def regrouper_sous_groupes(x, y, groupes, seuil=SEUIL_SOUS_GROUPE):
+    """
+    Composantes connexes des points d'un même groupe d'attributs reliés de proche en proche (distance < seuil).
+    Numérotation identique à un parcours groupe par groupe (groupes croissants), en partant de chaque point
+    non visité dans l'ordre des lignes. Les points sans groupe (NaN ou négatif) gardent -1.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    from scipy.spatial import cKDTree
+
+    groupes = np.asarray(groupes, dtype=float)
+    n = len(groupes)
+    sous_groupes = np.full(n, -1, dtype=np.int64)
+    avec_groupe = np.flatnonzero(~np.isnan(groupes) & (groupes >= 0))
+    if len(avec_groupe) == 0:
+        return sous_groupes
+    coords = np.column_stack((np.asarray(x, dtype=float)[avec_groupe], np.asarray(y, dtype=float)[avec_groupe]))
+    paires = cKDTree(coords).query_pairs(seuil, output_type='ndarray')
+    g = groupes[avec_groupe]
+    if len(paires):
+        garder = (g[paires[:, 0]] == g[paires[:, 1]]) & (
+            np.hypot(*(coords[paires[:, 0]] - coords[paires[:, 1]]).T) < seuil
+        )
+        paires = paires[garder]
+    m = len(avec_groupe)
+    graphe = coo_matrix((np.ones(len(paires)), (paires[:, 0], paires[:, 1])), shape=(m, m))
+    _, composantes = connected_components(graphe, directed=False)
+    # Ordre des composantes : groupe d'attributs, puis premier point (ordre des lignes)
+    premier = np.full(composantes.max() + 1, m)
+    np.minimum.at(premier, composantes, np.arange(m))
+    ordre = np.lexsort((premier, g[premier]))
+    numero = np.empty_like(ordre)
+    numero[ordre] = np.arange(len(ordre))
+    sous_groupes[avec_groupe] = numero[composantes]
+    return sous_groupes
+
+# Orientation moyenne de chaque sous-groupe (étape 9)
+def orienter_sous_groupes(x, y, x_photo, y_photo, angles_deg, images, sous_groupes):
+    """
+    Référence = premier point de chaque sous-groupe (ordre des lignes). Orientation moyenne = moyenne circulaire
+    de l'angle de la référence et des azimuts, depuis la photo de référence, des points des autres photos.
+    Retourne (identifiants des sous-groupes, position de leur référence, orientation moyenne en degrés).
+    """
+    ids_groupes, premiers = np.unique(sous_groupes, return_index=True)
+    rang = np.searchsorted(ids_groupes, sous_groupes)
+    x0 = np.asarray(x_photo, dtype=float)[premiers]
+    y0 = np.asarray(y_photo, dtype=float)[premiers]
+    images = np.asarray(images)
+    raw_ref = np.radians(90 - np.asarray(angles_deg, dtype=float)[premiers])  # base Est, sens trigonométrique
+    # Azimuts vers les points des autres photos du sous-groupe
+    autres = images != images[premiers][rang]
+    raws = np.arctan2(np.asarray(y, dtype=float) - y0[rang], np.asarray(x, dtype=float) - x0[rang])
+    n = len(ids_groupes)
+    sin_sum = np.sin(raw_ref) + np.bincount(rang, weights=np.where(autres, np.sin(raws), 0.0), minlength=n)
+    cos_sum = np.cos(raw_ref) + np.bincount(rang, weights=np.where(autres, np.cos(raws), 0.0), minlength=n)
+    # Moyenne circulaire, conversion unique vers Nord=0°, sens horaire
+    return ids_groupes, premiers, (90 - np.degrees(np.arctan2(sin_sum, cos_sum))) % 360
+
+# Recherche de l'identifiant de l'objet contenant chaque point (buffer de tolérance)
+def identifier_objets(gdf_geom, xs, ys, tolerance=0.1):
+    """
+    Pour chaque point, retourne l'identifiant du premier objet de gdf_geom intersectant un buffer
+    de `tolerance` autour du point. Priorités : 'id' (minuscule), 'ID' (majuscules), sinon index (fid).
+    """
+    n = len(xs)
+    objets_id = [None] * n
+    if n == 0 or gdf_geom.empty:
+        return objets_id
+    buffers = shapely.buffer(shapely.points(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)), tolerance)
+    idx_pt, idx_objet = gdf_geom.sindex.query(buffers, predicate='intersects')
+    # Premier objet (ordre de la couche) pour chaque point
+    premier_objet = np.full(n, np.iinfo(np.int64).max)
+    np.minimum.at(premier_objet, idx_pt, idx_objet)
+    valeurs = _identifiants_objets(gdf_geom)
+    for i in np.unique(idx_pt):
+        objets_id[i] = valeurs.iloc[premier_objet[i]]
+    return objets_id
+
+# Identifiant des objets de la couche : 'id' (minuscule), 'ID' (majuscules), sinon index (fid)
+def _identifiants_objets(gdf_geom):
+    if 'id' in gdf_geom.columns:
+        return gdf_geom['id']
+    if 'ID' in gdf_geom.columns:
+        return gdf_geom['ID']
+    # fallback : retourne l'index (feature id) pour garder une référence
+    return gdf_geom.index.to_series()
+
+# Objet touché en premier par chaque ligne de vue "maj_objet"
+def observer_maj_objet(gdf_geom, x, y, angles_deg, decalage_orientation, longueur=150):
+    """
+    Lance toutes les lignes de vue en une seule requête sur l'index spatial des objets.
+    Retourne (objets, distances) : position (iloc) de l'objet le plus proche de la photo parmi ceux
+    que la ligne intersecte, et distance photo -> objet le long de la ligne (-1 et NaN si rien n'est touché).
     """
-    Crée un fichier temporaire pour le GeoPackage uploadé, seulement s’il n’existe pas encore.
+    n = len(x)
+    objets = np.full(n, -1, dtype=np.int64)
+    distances = np.full(n, np.nan)
+    if n == 0 or gdf_geom.empty:
+        return objets, distances
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    lignes = creer_lignes_de_vue(x, y, angles_deg, decalage_orientation, longueur)
+    idx_ligne, idx_objet = gdf_geom.sindex.query(lignes, predicate='intersects')
+    if len(idx_ligne) == 0:
+        return objets, distances
+    dist = shapely.distance(
+        shapely.intersection(lignes[idx_ligne], gdf_geom.geometry.values[idx_objet]),
+        shapely.points(x[idx_ligne], y[idx_ligne])
+    )
+    # Tri par ligne puis distance (à égalité, ordre de la couche) : le premier de chaque ligne est retenu
+    ordre = np.lexsort((idx_objet, dist, idx_ligne))
+    idx_ligne, idx_objet, dist = idx_ligne[ordre], idx_objet[ordre], dist[ordre]
+    premier = np.r_[True, idx_ligne[1:] != idx_ligne[:-1]]
+    objets[idx_ligne[premier]] = idx_objet[premier]
+    distances[idx_ligne[premier]] = dist[premier]
+    return objets, distances
+
+# Résolution des observations contradictoires d'un même attribut d'un même objet
+def voter_maj_objet(observations):
     """
-    if session_key in session_state and os.path.exists(session_state[session_key]):
-        # Le fichier temporaire existe déjà, on ne le recrée pas
-        return session_state[session_key]
-    # Création du nouveau fichier temporaire
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".gpkg")
-    tmp.write(uploaded_file.read())
-    tmp.close()
-    # Enregistre dans le session_state Streamlit
-    session_state["tmp_gpkg_path"] = tmp.name
-    return tmp.name
+    observations : DataFrame (objet, attribut, valeur, distance, image_name), une ligne par ligne de vue qui touche.
+    Pour chaque couple (objet, attribut), la valeur retenue est la plus observée ; à égalité de votes,
+    celle vue de plus près en moyenne. Retourne un DataFrame (une ligne par couple) avec la valeur retenue,
+    nb_observations, nb_votes, taux_accord (nb_votes / nb_observations), nb_valeurs, nb_photos,
+    distance_moyenne (de la valeur retenue) et valeurs_observees ("valeur (votes)", par votes décroissants).
+    """
+    cles = ['objet', 'attribut']
+    votes = (
+        observations
+        .groupby(cles + ['valeur'], sort=False, dropna=False)
+        .agg(nb_votes=('distance', 'size'), distance_moyenne=('distance', 'mean'))
+        .reset_index()
+        .sort_values(cles + ['nb_votes', 'distance_moyenne'], ascending=[True, True, False, True], kind='stable')
+    )
+    votes['detail'] = votes['valeur'].astype(str) + ' (' + votes['nb_votes'].astype(str) + ')'
+    par_couple = votes.groupby(cles, sort=False)
+    retenues = votes.drop_duplicates(cles).set_index(cles)
+    retenues['nb_valeurs'] = par_couple.size()
+    retenues['valeurs_observees'] = par_couple['detail'].agg('; '.join)
+    totaux = observations.groupby(cles).agg(nb_observations=('valeur', 'size'), nb_photos=('image_name', 'nunique'))
+    retenues = retenues.join(totaux)
+    retenues['taux_accord'] = retenues['nb_votes'] / retenues['nb_observations']
+    colonnes = ['valeur', 'taux_accord', 'nb_votes', 'nb_observations', 'nb_valeurs', 'nb_photos',
+                'distance_moyenne', 'valeurs_observees']
+    return retenues[colonnes].reset_index()
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+# Couche de référence gardée en mémoire pour l'aperçu des lignes de vue (une par empreinte/couche)
+def charger_reference_apercu(_chemin_gpkg, selected_layer, empreinte):
+    """Charge la couche (cache disque compris) et construit ses index spatiaux une seule fois par processus."""
+    gdf_geom, gdf_geom_clean, lignes_bat = charger_reference(_chemin_gpkg, selected_layer)
+    gdf_geom_clean.sindex
+    return gdf_geom, gdf_geom_clean, lignes_bat
+
+# Aperçu des lignes de vue d'une seule image (interface d'annotation)
+def calculer_apercu_lignes_de_vue(lat, lon, annotations, decalage_orientation, reference=None, rayons_serveur=None, longueur=150):
+    """
+    Calcule, pour les annotations d'une image, les lignes de vue et leurs points d'impact, en WGS84.
+    - reference : tuple (gdf_geom, gdf_geom_clean, lignes_bat) en mémoire (lancer de rayons local)
+    - rayons_serveur : fonction(x, y, angles) -> dict de lancer_rayons (lancer via le serveur de cartographie)
+    Les polygones autour de la photo ne sont renvoyés qu'avec une référence locale.
+    """
+    x0, y0 = convertir_wgs84_vers_lambert93(lat, lon)
+    annots = [a for a in annotations if a.get('angle_ajuste') is not None]
+    n = len(annots)
+    angles = np.array([a['angle_ajuste'] for a in annots], dtype=float)
+    xs, ys = np.full(n, x0), np.full(n, y0)
+    if rayons_serveur is not None:
+        rayons = rayons_serveur(xs, ys, angles)
+    else:
+        rayons = lancer_rayons(reference[2], xs, ys, angles, decalage_orientation, longueur)
+
+    # Extrémités : point d'impact si touché, sinon bout de la ligne de vue
+    lignes = creer_lignes_de_vue(xs, ys, angles, decalage_orientation, longueur)
+    fins = shapely.get_coordinates(shapely.get_point(lignes, 1)) if n else np.empty((0, 2))
+    fins[rayons['touche']] = np.column_stack((rayons['x'], rayons['y']))[rayons['touche']]
+    lons, lats = convertir_lambert93_vers_wgs84(fins[:, 0], fins[:, 1])
+
+    apercu = {"photo": [lon, lat], "lignes": [], "polygones": []}
+    for i, a in enumerate(annots):
+        apercu["lignes"].append({
+            "uuid": a.get('uuid'),
+            "chemin": [[lon, lat], [float(lons[i]), float(lats[i])]],
+            "touche": bool(rayons['touche'][i]),
+            "distance": float(rayons['distance'][i]) if rayons['touche'][i] else None,
+            "mode_annotation": a.get('mode_annotation', ''),
+            "libelle": f"{a.get('type_objet', '')} {a.get('fonction_objet', '')}"
+        })
+
+    # Polygones de la couche dans le rayon d'action des lignes de vue (contexte de la carte)
+    if reference is not None:
+        gdf_geom_clean = reference[1]
+        emprise = shapely.box(x0 - longueur, y0 - longueur, x0 + longueur, y0 + longueur)
+        proches = gdf_geom_clean.geometry.values[gdf_geom_clean.sindex.query(emprise, predicate='intersects')]
+        anneaux = shapely.get_exterior_ring(proches[shapely.get_type_id(proches) == 3])
+        for anneau in anneaux:
+            coords = shapely.get_coordinates(anneau)
+            lons_p, lats_p = convertir_lambert93_vers_wgs84(coords[:, 0], coords[:, 1])
+            apercu["polygones"].append(np.column_stack((lons_p, lats_p)).tolist())
+    return apercu
+
+# Observations (objet, attribut, valeur, distance, image) des annotations "maj_objet" qui touchent un objet
+def collecter_observations_maj(gdf_geom, points_maj_objet, decalage_orientation):
+    pts_maj_src = points_maj_objet[points_maj_objet['angle_ajuste'].notna() & points_maj_objet['type_objet'].notna()]
+    objets_touches, distances_maj = observer_maj_objet(
+        gdf_geom, pts_maj_src.geometry.x.to_numpy(), pts_maj_src.geometry.y.to_numpy(),
+        pts_maj_src['angle_ajuste'].to_numpy(dtype=float), decalage_orientation
+    )
+    touche_maj = objets_touches >= 0
+    return pd.DataFrame({
+        'objet': objets_touches[touche_maj],
+        'attribut': pts_maj_src['type_objet'].to_numpy()[touche_maj],
+        'valeur': pts_maj_src['fonction_objet'].to_numpy()[touche_maj],
+        'distance': distances_maj[touche_maj],
+        'image_name': pts_maj_src['image_name'].to_numpy()[touche_maj]
+    })
+
+# Écriture des valeurs votées dans la couche et rapport d'accord
+def appliquer_maj_objet(gdf_geom, observations):
+    """
+    Vote les observations (voir voter_maj_objet) et écrit les valeurs retenues dans gdf_geom, en une affectation
+    par attribut (les colonnes sont remplacées, pas modifiées en place). Retourne le rapport d'accord
+    (couche phm_maj_objet_accord, avec la géométrie de l'objet) ou une liste vide sans observation.
+    """
+    if observations.empty:
+        return []
+    retenues = voter_maj_objet(observations)
+    for attribut, bloc in retenues.groupby('attribut', sort=False):
+        colonne = gdf_geom[attribut].to_numpy(dtype=object, copy=True)
+        colonne[bloc['objet'].to_numpy()] = bloc['valeur'].to_numpy()
+        gdf_geom[attribut] = colonne
+    retenues.insert(0, 'objet_id', _identifiants_objets(gdf_geom).iloc[retenues['objet']].to_numpy())
+    retenues['geometry'] = gdf_geom.geometry.values[retenues['objet'].to_numpy()]
+    return retenues.drop(columns='objet').rename(columns={'valeur': 'valeur_retenue'})
 
 # Préparer les colonnes du GeoDataFrame (gdf) pour le GPKG de sortie lors d'une maj_objet
 def preparer_colonnes_maj_objet(gdf_geom, points_maj_objet):
@@ -75,28 +454,19 @@ def preparer_colonnes_maj_objet(gdf_geom, points_maj_objet):
             gdf_geom[type_objet] = None
     return gdf_geom
 
-# Fonction principale
-def creer_gpkg_complet(annotations_json, exif_json, ancien_gpkg, gpkg_output, image_folder, selected_layer, decalage_orientation):
+# Extraction des points annotés et des photos géolocalisées (étape 2 du traitement)
+def extraire_points(annotations, exif_data, image_folder, images=None):
     """
-    Fonction principale de traitement géomatique :
-    - Prend en entrée des annotations d'images, des données EXIF, un GeoPackage source et un dossier d'images.
-    - Produit un GeoPackage complet avec plusieurs couches géographiques enrichies.
+    Retourne (photos_records, points_data) : un enregistrement par photo géolocalisée (couche phm_photo)
+    et un par annotation de ces photos (couche phm_point_geom). images : sous-ensemble des images à traiter
+    (dans cet ordre), toutes les images des annotations par défaut.
     """
-    # --- 1. Chargement des données d'entrée ---
-    with open(annotations_json, encoding='utf-8') as f:
-        annotations = json.load(f)
-    with open(exif_json, encoding='utf-8') as f:
-        exif_data = json.load(f)
-    log_dir = os.path.join(image_folder, 'resultat')
-    logger = setup_logger(log_dir)
-
     # Listes pour stocker les données intermédiaires
     points_data = [] # Points annotés (tous types)
-    points_carto = [] # Points pour la cartographie (mode cartographie)
     photos_records = [] # Infos sur chaque photo
 
-    # --- 2. Extraction des points et informations depuis les annotations ---
-    for img, annots in annotations.items():
+    for img in (annotations if images is None else images):
+        annots = annotations[img]
         exif = exif_data.get(img, {})
         lat = exif.get('latitude'); lon = exif.get('longitude')
         direction = exif.get('direction')
@@ -105,15 +475,19 @@ def creer_gpkg_complet(annotations_json, exif_json, ancien_gpkg, gpkg_output, im
         x, y = convertir_wgs84_vers_lambert93(lat, lon)
         pt_geom = Point(x, y)
 
-        # Chemins des photos (originale et annotée)
+        # Chemins des photos (originale et annotée, rendue à la demande) et du calque des annotations s'il existe
         photo_originale = os.path.join(image_folder, img)
-        photo_annotee = os.path.join(image_folder, 'resultat', img)
+        photo_annotee = chemin_photo_annotee(image_folder, img)
+        calque_annotations = next((chemin for chemin in (chemin_photo_annotee(image_folder, img, "svg"),
+                                                         chemin_photo_annotee(image_folder, img, "geojson"))
+                                   if os.path.exists(chemin)), None)
 
         # Enregistrement pour la table "photo"  
         photos_records.append({
             'image_name': img,
             'photo_original': photo_originale,
             'photo_annotee': photo_annotee,
+            'calque_annotations': calque_annotations,
             'latitude': lat,
             'longitude': lon,
             'x_lambert93': x,
@@ -138,110 +512,99 @@ def creer_gpkg_complet(annotations_json, exif_json, ancien_gpkg, gpkg_output, im
                 'ID': ann.get('ID'),
                 'geometry': pt_geom
             })
+    return photos_records, points_data
+
+# Copie des autres couches du GPKG source dans le GPKG de sortie
+def copier_couches_source(ancien_gpkg, gpkg_output, selected_layer, logger):
+    try:
+        layers = fiona.listlayers(ancien_gpkg)
+        for layer in layers:
+            # On saute la couche déjà traitée si besoin
+            if layer == selected_layer:
+                continue
+            gdf = gpd.read_file(ancien_gpkg, layer=layer)
+            if not gdf.empty:
+                gdf.to_file(gpkg_output, layer=layer, driver='GPKG', mode='a')
+                logger.info(f"Couche existante '{layer}' copiée dans le GPKG de sortie")
+    except Exception as e:
+        logger.info(f"Erreur lors de la copie des couches existantes : {e}")
+
+# Fonction principale
+def creer_gpkg_complet(annotations_json, exif_json, ancien_gpkg, gpkg_output, image_folder, selected_layer, decalage_orientation, utiliser_cache=True, reference=None):
+    """
+    Fonction principale de traitement géomatique :
+    - Prend en entrée des annotations d'images, des données EXIF, un GeoPackage source et un dossier d'images.
+    - Produit un GeoPackage complet avec plusieurs couches géographiques enrichies.
+    - utiliser_cache : réutilise les géométries préparées de la couche (cache disque, voir reference_utils)
+    - reference : tuple (gdf_geom, gdf_geom_clean, lignes_bat) déjà chargé (serveur de cartographie),
+      dans ce cas la couche n'est pas relue et gdf_geom n'est pas modifié
+    """
+    # --- 1. Chargement des données d'entrée ---
+    with open(annotations_json, encoding='utf-8') as f:
+        annotations = json.load(f)
+    with open(exif_json, encoding='utf-8') as f:
+        exif_data = json.load(f)
+    log_dir = os.path.join(image_folder, 'resultat')
+    logger = setup_logger(log_dir)
+
+    # --- 2. Extraction des points et informations depuis les annotations ---
+    photos_records, points_data = extraire_points(annotations, exif_data, image_folder)
             
     # --- 3. Création des GeoDataFrames principaux ---
     gdf_photos = gpd.GeoDataFrame(photos_records, geometry='geometry', crs='EPSG:2154')
     gdf_points = gpd.GeoDataFrame(points_data, geometry='geometry', crs='EPSG:2154')
 
     # --- 4. Lecture et préparation de la couche utilisateur ---
-    gdf_geom = gpd.read_file(ancien_gpkg, layer=selected_layer).copy()
+    # --- 5. Extraction des contours de bâtiments (pour les intersections) ---
+    # Nettoyage des géométries (explosion des multipolygones, suppression des invalides) et contours,
+    # relus depuis le cache disque si la même couche du même GPKG a déjà été préparée
+    if reference is not None:
+        gdf_geom, gdf_geom_clean, lignes_bat = reference
+        # Copie superficielle : les colonnes mises à jour sont remplacées (pas modifiées en place),
+        # la couche partagée n'est donc pas touchée et ses géométries ne sont pas dupliquées
+        gdf_geom = gdf_geom.copy(deep=False)
+    else:
+        gdf_geom, gdf_geom_clean, lignes_bat = charger_reference(ancien_gpkg, selected_layer, utiliser_cache, logger)
 
     # Ajout dynamique des colonnes selon les types d'objets annotés (pour la mise à jour)
     points_maj_objet = gdf_points[gdf_points['mode_annotation'] == 'maj_objet']
     gdf_geom = preparer_colonnes_maj_objet(gdf_geom, points_maj_objet)
 
-    # Nettoyage des géométries (explosion des multipolygones, suppression des invalides)
-    gdf_geom_clean = gdf_geom.copy().explode(ignore_index=True)
-    gdf_geom_clean = gdf_geom_clean[gdf_geom_clean.is_valid]
-
-    # --- 5. Extraction des contours de bâtiments (pour les intersections) ---
-    lignes_records = []
-    for idx, geom in gdf_geom_clean.geometry.items():
-        if geom is None or geom.is_empty:
-            continue
-        boundary = geom.boundary
-        if boundary.geom_type == 'LineString':
-            lignes_records.append({'geometry': boundary, 'bat_id': idx})
-        elif boundary.geom_type == 'MultiLineString':
-            for part in boundary.geoms:
-                lignes_records.append({'geometry': part, 'bat_id': idx})
-
-    lignes_bat = gpd.GeoDataFrame(lignes_records, geometry='geometry', crs=gdf_geom.crs)
-
     # --- 6. Mise à jour des objets (mode "maj_objet") ---
-    modifs = set()
-    for _, pt in gdf_points[gdf_points['mode_annotation'] == 'maj_objet'].iterrows():
-        ang = pt['angle_ajuste']
-        if ang is None:
-            continue
-        lv = creer_ligne_de_vue(pt.geometry.x, pt.geometry.y, ang, decalage_orientation)
-        inters = gdf_geom[gdf_geom.geometry.intersects(lv)].copy()
-        if inters.empty:
-            continue
-        inters['pt_int'] = inters.geometry.intersection(lv)
-        inters['dist'] = inters['pt_int'].distance(pt.geometry)
-        closest = inters.sort_values('dist').iloc[0]
-        gdf_geom.loc[closest.name, pt.get('type_objet')] = pt.get('fonction_objet')
-        modifs.add(closest.name)
-    
-    # On garde une copie des objets modifiés pour l'écriture finale
-    gdf_geom_modif = gdf_geom.copy()
+    # Toutes les observations (objet, attribut, valeur) sont collectées avant l'écriture : quand plusieurs photos
+    # renseignent le même attribut d'un objet, la valeur est votée (voir voter_maj_objet) au lieu que la
+    # dernière photo traitée l'emporte. Les valeurs retenues sont écrites en une affectation par attribut.
+    observations_maj = collecter_observations_maj(gdf_geom, points_maj_objet, decalage_orientation)
+    accords_maj = appliquer_maj_objet(gdf_geom, observations_maj)
+
+    # Objets modifiés pour l'écriture finale (gdf_geom n'est plus modifié ensuite : pas de copie)
+    gdf_geom_modif = gdf_geom
 
     # --- 7. Traitement des points cartographiques (mode "cartographie") ---
-    points_carto = []
-    for _, pt in gdf_points[gdf_points['mode_annotation'] == 'cartographie'].iterrows():
-        ang = pt['angle_ajuste']
-        if ang is None:
-            continue
-        lv = creer_ligne_de_vue(pt.geometry.x, pt.geometry.y, ang, decalage_orientation)
-        inters = lignes_bat[lignes_bat.geometry.intersects(lv)]
-        if inters.empty:
-            continue
-
-        # Recherche des intersections entre la ligne de vue et les bâtiments
-        pts = []
-        for _, br in inters.iterrows():
-            inter = lv.intersection(br.geometry)
-            if inter.is_empty:
-                continue
-            if inter.geom_type == 'Point':
-                pts.append(inter)
-            elif inter.geom_type == 'MultiPoint':
-                pts.extend(inter.geoms)
-
-        if not pts:
-            continue
-
-        # Sélectionner le point d'intersection le plus proche
-        dists = [pt.geometry.distance(p) for p in pts]
-        pf = pts[dists.index(min(dists))]
-
-        # Recherche du bâtiment associé (par buffer autour du point d'intersection)
-        buffer = pf.buffer(0.1)  # Utilise une tolérance de 0.1 unité
-        objet_contenant = gdf_geom[
-            gdf_geom.geometry.intersects(buffer)
-        ]
-        if not objet_contenant.empty:
-            # Priorités : 'id' (minuscule), 'ID' (majuscules), sinon index (fid)
-            if 'id' in objet_contenant.columns:
-                objet_id = objet_contenant['id'].iloc[0]
-            elif 'ID' in objet_contenant.columns:
-                objet_id = objet_contenant['ID'].iloc[0]
-            else:
-                # fallback : retourne le premier index (feature id) pour garder une référence
-                try:
-                    objet_id = objet_contenant.index[0]
-                except Exception:
-                    objet_id = None
-        else:
-            objet_id = None
+    # Toutes les lignes de vue sont lancées en une fois contre l'index spatial des contours
+    pts_carto_src = gdf_points[(gdf_points['mode_annotation'] == 'cartographie') & gdf_points['angle_ajuste'].notna()]
+    rayons = lancer_rayons(
+        lignes_bat, pts_carto_src.geometry.x.to_numpy(), pts_carto_src.geometry.y.to_numpy(),
+        pts_carto_src['angle_ajuste'].to_numpy(dtype=float), decalage_orientation
+    )
+    touches = np.flatnonzero(rayons['touche'])
+
+    # Recherche du bâtiment associé (par buffer de 0.1 unité autour du point d'intersection)
+    objets_id = identifier_objets(gdf_geom, rayons['x'][touches], rayons['y'][touches])
 
+    points_carto = []
+    # Position de la photo de chaque point cartographique (origine de sa ligne de vue, pour la triangulation)
+    origines_carto = []
+    for i, objet_id in zip(touches, objets_id):
+        pt = pts_carto_src.iloc[i]
+        pf = Point(rayons['x'][i], rayons['y'][i])
+        origines_carto.append((pt.geometry.x, pt.geometry.y))
         # Ajouter le point ajusté à la liste des points cartographiques
         points_carto.append({
             'image_name': pt['image_name'],
             'x_lambert93': pf.x,
             'y_lambert93': pf.y,
-            'angle_ajuste': ang,
+            'angle_ajuste': pt['angle_ajuste'],
             'type_objet': pt.get('type_objet'),
             'fonction_objet': pt.get('fonction_objet'),
             'ID': pt.get('ID'),
@@ -260,40 +623,10 @@ def creer_gpkg_complet(annotations_json, exif_json, ancien_gpkg, gpkg_output, im
             .ngroup()
         )
 
-        # Initialisation de la colonne pour les sous-groupes spatiaux
-        gdf_carto['subgroup_id'] = -1
-        group_counter = 0
-
-        # Pour chaque groupe d'attributs, on cherche les sous-groupes spatiaux (points proches < 2m)
-        for attr_val, group_df in gdf_carto.groupby('group_attr'):
-            idxs = group_df.index.to_numpy()
-            coords = np.array([(pt.x, pt.y) for pt in group_df.geometry])
-            dist_matrix = squareform(pdist(coords))
-            
-            n = len(coords)
-            visited = np.zeros(n, dtype=bool)
-            
-            for i in range(n):
-                if visited[i]:
-                    continue
-                # BFS pour composer la composante connexe à partir de i
-                to_visit = [i]
-                component = []
-                while to_visit:
-                    j = to_visit.pop()
-                    if visited[j]:
-                        continue
-                    # Parcours en largeur pour trouver les composantes connexes (sous-groupes)
-                    visited[j] = True
-                    component.append(j)
-                    # voisins à < 2 m
-                    neighbors = np.where(dist_matrix[j] < 2.0)[0]
-                    to_visit.extend([k for k in neighbors if not visited[k]])
-                
-                # Attribution d'un ID unique à chaque sous-groupe spatial
-                for j in component:
-                    gdf_carto.at[idxs[j], 'subgroup_id'] = group_counter
-                group_counter += 1
+        # Sous-groupes spatiaux : points d'un même groupe d'attributs à moins de 2 m (de proche en proche)
+        gdf_carto['subgroup_id'] = regrouper_sous_groupes(
+            gdf_carto.geometry.x.to_numpy(), gdf_carto.geometry.y.to_numpy(), gdf_carto['group_attr'].to_numpy(dtype=float)
+        )
 
         # À ce stade :
         # - gdf_carto['group_attr'] indique le groupe d’attributs
@@ -301,54 +634,27 @@ def creer_gpkg_complet(annotations_json, exif_json, ancien_gpkg, gpkg_output, im
         # Log des regroupements pour vérification
         logger.info(gdf_carto[['objet_id','type_objet','fonction_objet','group_attr','subgroup_id']])
         # --- 9. Calcul des points de référence enrichis pour chaque sous-groupe ---
-        reference_records = []
-
-        for sub_id, sub_df in gdf_carto.groupby('subgroup_id'):
-            # Prend le premier point du sous-groupe comme référence
-            ref_objet = sub_df.iloc[0]
-            angle_ajuste_ref = ref_objet['angle_ajuste']
-            image_ref = ref_objet['image_name']
-            base = decalage_orientation
-            # Récupère le point photo associé
-            pt_photo = gdf_points[gdf_points['image_name'] == image_ref]
-            if pt_photo.empty:
-                logger.info(f"[WARN] pas de point_photo pour {image_ref}")
-                continue
-            pt_photo_geom = pt_photo.iloc[0].geometry
-            x0, y0 = pt_photo_geom.x, pt_photo_geom.y
-
-            # Calcule les azimuts vers les autres objets du sous-groupe
-            raw_ref = math.radians(90 - angle_ajuste_ref)  # base Est, sens trigonométrique
-            raws = [raw_ref]
-            # 2) Ajoute les autres angles bruts
-            for _, row in sub_df.iterrows():
-                if row['image_name'] == image_ref:
-                    continue
-                dx = row.geometry.x - x0
-                dy = row.geometry.y - y0
-                raws.append(math.atan2(dy, dx))
-
-            # Moyenne circulaire des angles
-            if raws:
-                sin_sum = sum(math.sin(r) for r in raws)
-                cos_sum = sum(math.cos(r) for r in raws)
-                mean_raw = math.atan2(sin_sum, cos_sum) # reste en radians, base Est
-                # conversion unique vers Nord=0°, sens horaire
-                orientation_moyenne = (90 - math.degrees(mean_raw)) % 360
-            else:
-                orientation_moyenne = angle_ajuste_ref
-
-            # Enregistrement du point de référence enrichi
-            reference_records.append({
-                'geometry': pt_photo_geom,
-                'objet_id': ref_objet['objet_id'],
-                'type_objet': ref_objet['type_objet'],
-                'fonction_objet': ref_objet['fonction_objet'],
-                'group_attr': ref_objet['group_attr'],
-                'subgroup_id': sub_id,
-                'angle_ajuste_ref': angle_ajuste_ref,
-                'orientation_moyenne': orientation_moyenne
-            })
+        # Référence = premier point du sous-groupe ; orientation moyenne = moyenne circulaire de son angle
+        # et des azimuts (depuis la photo de référence) des points des autres photos du sous-groupe
+        origines = np.array(origines_carto)
+        ids_groupes, premiers, orientation_moyenne = orienter_sous_groupes(
+            gdf_carto.geometry.x.to_numpy(), gdf_carto.geometry.y.to_numpy(), origines[:, 0], origines[:, 1],
+            gdf_carto['angle_ajuste'].to_numpy(dtype=float), gdf_carto['image_name'].to_numpy(),
+            gdf_carto['subgroup_id'].to_numpy()
+        )
+        refs = gdf_carto.iloc[premiers]
+        angles_ref = refs['angle_ajuste'].to_numpy(dtype=float)
+
+        reference_records = {
+            'geometry': shapely.points(origines[premiers]),
+            'objet_id': refs['objet_id'].to_numpy(),
+            'type_objet': refs['type_objet'].to_numpy(),
+            'fonction_objet': refs['fonction_objet'].to_numpy(),
+            'group_attr': refs['group_attr'].to_numpy(),
+            'subgroup_id': ids_groupes,
+            'angle_ajuste_ref': angles_ref,
+            'orientation_moyenne': orientation_moyenne
+        }
 
         # Construction du GeoDataFrame des points de référence
         gdf_reference_points = gpd.GeoDataFrame(reference_records, crs=gdf_carto.crs)
@@ -391,61 +697,71 @@ def creer_gpkg_complet(annotations_json, exif_json, ancien_gpkg, gpkg_output, im
         mode = 'w'
 
     # --- 10. Tracé des lignes de vue depuis les points de référence ---
-    lines_records = []
-    for _, ref in gdf_reference_points.iterrows():
-        x_ref, y_ref = ref.geometry.x, ref.geometry.y
-        # On utilise l'orientation moyenne comme angle de vue
-        angle = ref['orientation_moyenne']
-        # Génération de la ligne de vue
-        lv = creer_ligne_de_vue(x_ref, y_ref, angle, decalage_orientation, longueur=150)
-        lines_records.append({
-            'geometry': lv,
-            'objet_id': ref['objet_id'],
-            'subgroup_id': ref['subgroup_id'],
-            'angle_utilise': angle
-        })
-        # Création de la GeoDataFrame des lignes de vue
-        gdf_lignes_vue = gpd.GeoDataFrame(lines_records, geometry='geometry', crs=gdf_reference_points.crs)
+    # On utilise l'orientation moyenne comme angle de vue (toutes les lignes créées en une fois)
+    if points_carto:
+        gdf_lignes_vue = gpd.GeoDataFrame(
+            {
+                'geometry': creer_lignes_de_vue(
+                    gdf_reference_points.geometry.x.to_numpy(), gdf_reference_points.geometry.y.to_numpy(),
+                    gdf_reference_points['orientation_moyenne'].to_numpy(dtype=float), decalage_orientation, longueur=150
+                ),
+                'objet_id': gdf_reference_points['objet_id'].to_numpy(),
+                'subgroup_id': gdf_reference_points['subgroup_id'].to_numpy(),
+                'angle_utilise': gdf_reference_points['orientation_moyenne'].to_numpy()
+            },
+            geometry='geometry', crs=gdf_reference_points.crs
+        )
     
     # --- 11. Calcul des points d'extrémité des lignes de vue ---
+    # Intersection avec les lignes de bâtiments : point le plus proche du point de référence
+    rayons_ref = lancer_rayons(
+        lignes_bat, gdf_reference_points.geometry.x.to_numpy(), gdf_reference_points.geometry.y.to_numpy(),
+        gdf_reference_points['orientation_moyenne'].to_numpy(dtype=float), decalage_orientation, longueur=150
+    )
     points_extremites = []
-
-    for _, ref in gdf_reference_points.iterrows():
-        x_ref, y_ref = ref.geometry.x, ref.geometry.y
-        angle = ref['orientation_moyenne']
-        lv = creer_ligne_de_vue(x_ref, y_ref, angle, decalage_orientation, longueur=150)
-        
-        # Recherche des intersections avec les lignes de bâtiments
-        inters = lignes_bat[lignes_bat.geometry.intersects(lv)]
-        if inters.empty:
-            continue
-
-        pts = []
-        for _, br in inters.iterrows():
-            inter = lv.intersection(br.geometry)
-            if inter.is_empty:
-                continue
-            if inter.geom_type == 'Point':
-                pts.append(inter)
-            elif inter.geom_type == 'MultiPoint':
-                pts.extend(inter.geoms)
-
-        if not pts:
-            continue
-        
-        # Choisir le point d’intersection le plus proche du point de référence
-        dists = [ref.geometry.distance(p) for p in pts]
-        pf = pts[dists.index(min(dists))]
-        
+    for i in np.flatnonzero(rayons_ref['touche']):
+        ref = gdf_reference_points.iloc[i]
         points_extremites.append({
-            'geometry': pf,
+            'geometry': Point(rayons_ref['x'][i], rayons_ref['y'][i]),
             'objet_id': ref['objet_id'],
             'subgroup_id': ref['subgroup_id'],
-            'angle_utilise': angle,
+            'angle_utilise': ref['orientation_moyenne'],
             'type_objet': ref['type_objet'],
             'fonction_objet': ref['fonction_objet']
         })
     
+    # --- 11 bis. Triangulation des objets vus depuis plusieurs photos ---
+    # Intersection par moindres carrés de toutes les lignes de vue de chaque sous-groupe (couche phm_point_triangule)
+    points_triangules = []
+    if points_carto:
+        origines = np.array(origines_carto)
+        sous_groupes = gdf_carto['subgroup_id'].to_numpy()
+        triang = trianguler_groupes(
+            origines[:, 0], origines[:, 1], gdf_carto['angle_ajuste'].to_numpy(dtype=float),
+            sous_groupes, decalage_orientation
+        )
+        nb_photos = gdf_carto.groupby('subgroup_id')['image_name'].nunique()
+        premiers = gdf_carto.drop_duplicates('subgroup_id').set_index('subgroup_id')
+        # Écart avec le point accroché au bâtiment (phm_point_objet) du même sous-groupe
+        objets_accroches = {p['subgroup_id']: p['geometry'] for p in points_extremites}
+        for sub_id in np.flatnonzero(triang['valide']):
+            ref = premiers.loc[sub_id]
+            pt_triangule = Point(triang['x'][sub_id], triang['y'][sub_id])
+            accroche = objets_accroches.get(sub_id)
+            points_triangules.append({
+                'geometry': pt_triangule,
+                'objet_id': ref['objet_id'],
+                'type_objet': ref['type_objet'],
+                'fonction_objet': ref['fonction_objet'],
+                'subgroup_id': sub_id,
+                'nb_vues': int(triang['nb_vues'][sub_id]),
+                'nb_photos': int(nb_photos.loc[sub_id]),
+                'residu_rms': float(triang['residu_rms'][sub_id]),
+                'incertitude': float(triang['incertitude'][sub_id]),
+                'angle_max': float(triang['angle_max'][sub_id]),
+                'ecart_point_objet': pt_triangule.distance(accroche) if accroche is not None else None
+            })
+
     # --- 12. Logs de contrôle pour le debug ---
     # Ajoutez des impressions pour vérifier les données d'entrée
     logger.info(f"Chargement des annotations depuis {annotations_json}")
@@ -459,6 +775,8 @@ def creer_gpkg_complet(annotations_json, exif_json, ancien_gpkg, gpkg_output, im
     logger.info(f"Nombre de points de référence dans gdf_reference_points : {len(gdf_reference_points)}")
     logger.info(f"Nombre de lignes de vue dans gdf_lignes_vue : {len(gdf_lignes_vue)}")
     logger.info(f"Nombre de points d'extrémité dans points_extremites : {len(points_extremites)}")
+    logger.info(f"Nombre de points triangulés dans points_triangules : {len(points_triangules)}")
+    logger.info(f"Nombre d'attributs mis à jour (maj_objet) : {len(accords_maj)}")
 
     # --- 13. Écriture des couches dans le GeoPackage de sortie ---
     
@@ -471,18 +789,7 @@ def creer_gpkg_complet(annotations_json, exif_json, ancien_gpkg, gpkg_output, im
         logger.info(f"Erreur lors de l'écriture de la couche 'toiture' : {e}")
 
     # Copie de toutes les couches existantes du GPKG source
-    try:
-        layers = fiona.listlayers(ancien_gpkg)
-        for layer in layers:
-            # On saute la couche déjà traitée si besoin
-            if layer == selected_layer:
-                continue
-            gdf = gpd.read_file(ancien_gpkg, layer=layer)
-            if not gdf.empty:
-                gdf.to_file(gpkg_output, layer=layer, driver='GPKG', mode='a')
-                logger.info(f"Couche existante '{layer}' copiée dans le GPKG de sortie")
-    except Exception as e:
-        logger.info(f"Erreur lors de la copie des couches existantes : {e}")
+    copier_couches_source(ancien_gpkg, gpkg_output, selected_layer, logger)
 
     # Couche des points pour chaque photo annotée
     try:
@@ -530,4 +837,27 @@ def creer_gpkg_complet(annotations_json, exif_json, ancien_gpkg, gpkg_output, im
             gdf_extremites.to_file(gpkg_output, layer='phm_point_objet', driver='GPKG', mode='a')
             logger.info(f"Couche 'phm_point_objet' écrite avec succès")
     except Exception as e:
-        logger.info(f"Erreur lors de l'écriture de la couche 'point_extremite' : {e}")
\ No newline at end of file
+        logger.info(f"Erreur lors de l'écriture de la couche 'point_extremite' : {e}")
+
+    # Couche des objets triangulés (intersection par moindres carrés des lignes de vue, avec incertitude)
+    try:
+        if points_triangules:
+            gdf_triangules = gpd.GeoDataFrame(points_triangules, geometry='geometry', crs='EPSG:2154')
+            gdf_triangules.to_file(gpkg_output, layer='phm_point_triangule', driver='GPKG', mode='a')
+            logger.info(f"Couche 'phm_point_triangule' écrite avec succès")
+    except Exception as e:
+        logger.info(f"Erreur lors de l'écriture de la couche 'point_triangule' : {e}")
+
+    # Couche du taux d'accord des mises à jour d'attributs (une ligne par objet et attribut mis à jour)
+    try:
+        if len(accords_maj):
+            gdf_accords = gpd.GeoDataFrame(accords_maj, geometry='geometry', crs=gdf_geom.crs)
+            gdf_accords.to_file(gpkg_output, layer='phm_maj_objet_accord', driver='GPKG', mode='a')
+            logger.info(f"Couche 'phm_maj_objet_accord' écrite avec succès")
+    except Exception as e:
+        logger.info(f"Erreur lors de l'écriture de la couche 'maj_objet_accord' : {e}")
+
+    # Pic de mémoire du traitement (contrôle du budget mémoire sur les grandes couches)
+    pic = memoire_pic_mo()
+    if pic is not None:
+        logger.info(f"Mémoire maximale du processus : {pic:.0f} Mo")
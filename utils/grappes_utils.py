@@ -0,0 +1,157 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (grappes_utils.py) Carte des photos : index spatial et regroupement des positions par niveau de zoom
+# -----------------------------------------------------------------------------
+
+import math
+import numpy as np
+import streamlit as st
+
+# Côté (pixels à l'écran) des cellules de regroupement : les photos d'une même cellule forment une grappe
+TAILLE_GRAPPE_PX = 60
+# Niveaux de zoom regroupés (au-delà du dernier, une grappe est listée au lieu d'être agrandie)
+ZOOM_MIN_CARTE = 0
+ZOOM_MAX_CARTE = 20
+# Taille de la carte dans l'interface (pixels) et marge autour de la vue (en largeurs / hauteurs de vue) :
+# les grappes de la marge restent visibles quand la carte est déplacée à la souris
+TAILLE_CARTE = (1000, 450)
+MARGE_VUE = 1.0
+TAILLE_TUILE = 256
+
+
+# Coordonnées Web Mercator normalisées (0 à 1, y vers le sud) depuis des degrés WGS84
+def lonlat_vers_mercator(lon, lat):
+    lon = np.asarray(lon, dtype=float)
+    lat = np.clip(np.asarray(lat, dtype=float), -85.05112878, 85.05112878)
+    x = (lon + 180.0) / 360.0
+    y = 0.5 - np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) / (2 * np.pi)
+    return x, y
+
+def mercator_vers_lonlat(x, y):
+    lon = np.asarray(x, dtype=float) * 360.0 - 180.0
+    lat = np.degrees(2 * np.arctan(np.exp((0.5 - np.asarray(y, dtype=float)) * 2 * np.pi)) - np.pi / 2)
+    return lon, lat
+
+def _taille_monde(zoom):
+    return TAILLE_TUILE * 2.0 ** zoom
+
+# Construction de l'index spatial des photos géolocalisées
+def construire_index_carte(noms, exif_data):
+    """
+    noms : images dans l'ordre de navigation. Retourne un dict :
+    - positions : position dans la navigation de chaque photo géolocalisée, noms, x / y (Mercator normalisé)
+    - niveaux : un regroupement par niveau de zoom (grille de TAILLE_GRAPPE_PX pixels à ce zoom) :
+      etiquettes (grappe de chaque photo), x / y (centre des photos de la grappe), nb (photos), tri par x
+      des grappes (recherche de la vue par dichotomie)
+    - sans_gps : nombre de photos sans position
+    """
+    positions, lons, lats = [], [], []
+    for pos, nom in enumerate(noms):
+        exif = exif_data.get(nom) or {}
+        if exif.get("latitude") is None or exif.get("longitude") is None:
+            continue
+        positions.append(pos)
+        lons.append(exif["longitude"])
+        lats.append(exif["latitude"])
+    x, y = lonlat_vers_mercator(lons, lats)
+    index = {
+        "positions": np.asarray(positions, dtype=np.int64),
+        "noms": [noms[p] for p in positions],
+        "x": x, "y": y,
+        "sans_gps": len(noms) - len(positions),
+        "niveaux": []
+    }
+    for zoom in range(ZOOM_MAX_CARTE + 1):
+        cellule = TAILLE_GRAPPE_PX / _taille_monde(zoom)
+        colonnes = np.floor(x / cellule).astype(np.int64)
+        lignes = np.floor(y / cellule).astype(np.int64)
+        # Une clé par cellule (moins de 2^31 cellules par côté jusqu'au zoom maximal)
+        cles = colonnes * (1 << 31) + lignes
+        _, etiquettes, nb = np.unique(cles, return_inverse=True, return_counts=True)
+        centre_x = np.bincount(etiquettes, weights=x) / nb
+        centre_y = np.bincount(etiquettes, weights=y) / nb
+        ordre = np.argsort(centre_x, kind="stable")
+        index["niveaux"].append({
+            "etiquettes": etiquettes.astype(np.int32), "x": centre_x, "y": centre_y, "nb": nb,
+            "ordre": ordre, "x_trie": centre_x[ordre]
+        })
+    return index
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+# Index gardé en mémoire tant que le dossier et les EXIF sont inchangés (partagé entre les sessions)
+def charger_index_carte(image_folder, mtime_dossier, mtime_exif, _noms, _exif_data):
+    return construire_index_carte(_noms, _exif_data)
+
+# Vue englobant toutes les photos : (centre x, centre y, zoom)
+def vue_ensemble(index, taille=TAILLE_CARTE):
+    if not len(index["x"]):
+        return 0.5, 0.5, ZOOM_MIN_CARTE
+    x0, x1 = index["x"].min(), index["x"].max()
+    y0, y1 = index["y"].min(), index["y"].max()
+    etendue = max((x1 - x0) / taille[0], (y1 - y0) / taille[1], 1e-12)
+    zoom = int(np.clip(math.floor(math.log2(1.0 / (etendue * TAILLE_TUILE))), ZOOM_MIN_CARTE, ZOOM_MAX_CARTE))
+    return float((x0 + x1) / 2), float((y0 + y1) / 2), zoom
+
+def _emprise(centre, zoom, taille, marge):
+    demi_x = taille[0] * (0.5 + marge) / _taille_monde(zoom)
+    demi_y = taille[1] * (0.5 + marge) / _taille_monde(zoom)
+    return centre[0] - demi_x, centre[1] - demi_y, centre[0] + demi_x, centre[1] + demi_y
+
+# Grappes visibles dans la vue (et sa marge) au niveau de zoom demandé
+def grappes_vue(index, zoom, centre, nb_annotations, taille=TAILLE_CARTE, marge=MARGE_VUE):
+    """
+    nb_annotations : nombre d'annotations de chaque photo géolocalisée (ordre de index["noms"]), relu à chaque
+    rerun pour suivre le travail en cours. Retourne une liste de dicts pour la carte : position (lon, lat),
+    grappe, zoom, nb (photos), nb_annotations, nb_annotees (photos annotées), image (photo seule) et libelle.
+    """
+    niveau = index["niveaux"][int(np.clip(zoom, ZOOM_MIN_CARTE, ZOOM_MAX_CARTE))]
+    x0, y0, x1, y1 = _emprise(centre, zoom, taille, marge)
+    debut, fin = np.searchsorted(niveau["x_trie"], [x0, x1])
+    candidates = niveau["ordre"][debut:fin]
+    grappes = candidates[(niveau["y"][candidates] >= y0) & (niveau["y"][candidates] <= y1)]
+    if not len(grappes):
+        return []
+    nb_annotations = np.asarray(nb_annotations, dtype=np.int64)
+    total_annotations = np.bincount(niveau["etiquettes"], weights=nb_annotations, minlength=len(niveau["nb"]))
+    annotees = np.bincount(niveau["etiquettes"], weights=nb_annotations > 0, minlength=len(niveau["nb"]))
+    # Première photo de chaque grappe (nom affiché pour une photo seule)
+    premiere = np.empty(len(niveau["nb"]), dtype=np.int64)
+    premiere[niveau["etiquettes"][::-1]] = np.arange(len(niveau["etiquettes"]))[::-1]
+    lon, lat = mercator_vers_lonlat(niveau["x"][grappes], niveau["y"][grappes])
+    resultat = []
+    for g, lo, la in zip(grappes.tolist(), lon.tolist(), lat.tolist()):
+        nb = int(niveau["nb"][g])
+        nb_annot = int(total_annotations[g])
+        image = index["noms"][premiere[g]] if nb == 1 else None
+        resultat.append({
+            "position": [lo, la], "grappe": g, "zoom": int(zoom), "nb": nb, "nb_annotations": nb_annot,
+            "nb_annotees": int(annotees[g]), "image": image,
+            "libelle": (image if image else f"{nb} photos ({int(annotees[g])} annotées)") + f" · {nb_annot} annotation(s)"
+        })
+    return resultat
+
+# Positions (ordre de navigation) des photos d'une grappe
+def photos_grappe(index, zoom, grappe):
+    niveau = index["niveaux"][int(zoom)]
+    return index["positions"][niveau["etiquettes"] == grappe]
+
+# Positions des photos dans la vue (sans la marge) : sélection rectangulaire
+def photos_vue(index, zoom, centre, taille=TAILLE_CARTE):
+    x0, y0, x1, y1 = _emprise(centre, zoom, taille, 0.0)
+    dans_vue = (index["x"] >= x0) & (index["x"] <= x1) & (index["y"] >= y0) & (index["y"] <= y1)
+    return np.sort(index["positions"][dans_vue])
+
+# Premier zoom où les photos d'une grappe ne sont plus toutes regroupées (zoom maximal sinon)
+def zoom_eclatement(index, zoom, grappe):
+    membres = index["niveaux"][int(zoom)]["etiquettes"] == grappe
+    for z in range(int(zoom) + 1, ZOOM_MAX_CARTE + 1):
+        if len(np.unique(index["niveaux"][z]["etiquettes"][membres])) > 1:
+            return z
+    return ZOOM_MAX_CARTE
+
+# Nombre d'annotations de chaque photo géolocalisée de l'index
+def nb_annotations_photos(index, annotations):
+    return np.fromiter((len(annotations.get(nom) or ()) for nom in index["noms"]), dtype=np.int64, count=len(index["noms"]))
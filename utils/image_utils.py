@@ -9,8 +9,11 @@
 from PIL import Image, ImageDraw, ImageFont
 import os
 import json
-import cv2
-import numpy as np
+import math
+import shutil
+import subprocess
+import tempfile
+from functools import lru_cache
 import streamlit as st
 
 # Calcul du ratio de la photo pour définir la visionneuse à utiliser dans l'interface
@@ -34,17 +37,254 @@ def couleur_rgba(couleur_nom, alpha=255):
 def lister_images(image_folder):
     return [f for f in os.listdir(image_folder) if f.lower().endswith(('png', 'jpg', 'jpeg'))] if os.path.isdir(image_folder) else []
 
-# Création des photos annotées (images avec annotations)
-def dessiner_annotations_sur_images(image_folder):
+# Position des annotations sur la photo : x / y des photos standards, yaw / pitch projetés pour les photos 360°
+def positions_annotations(ann_list, largeur, hauteur):
+    from utils.projection_utils import angles_vers_pixels
+    est_360 = [ann.get('yaw_origine') is not None for ann in ann_list]
+    # Projection de toutes les annotations 360° de la photo en un seul calcul
+    x_360, y_360 = angles_vers_pixels(
+        [ann['yaw_origine'] for ann, a_360 in zip(ann_list, est_360) if a_360],
+        [ann.get('angle_vertical') or 0 for ann, a_360 in zip(ann_list, est_360) if a_360],
+        largeur, hauteur
+    )
+    positions, i = [], 0
+    for ann, a_360 in zip(ann_list, est_360):
+        if a_360:
+            positions.append((float(x_360[i]), float(y_360[i])))
+            i += 1
+        elif ann.get('x') is not None and ann.get('y') is not None:
+            positions.append((ann['x'], ann['y']))
+        else:
+            positions.append(None)
+    return positions
+
+# Sorties des photos annotées : calques légers (SVG / GeoJSON en pixels) ou JPEG annoté pleine résolution
+FORMATS_PHOTOS_ANNOTEES = {
+    "svg": "Calques SVG (légers)",
+    "geojson": "Calques GeoJSON (pixels)",
+    "jpeg": "JPEG annotés (pleine résolution)"
+}
+RAYON_MARQUE = 20
+TAILLE_TEXTE_MARQUE = 40
+
+def _police_marques():
+    try:
+        return ImageFont.truetype("bahnschrift.ttf", TAILLE_TEXTE_MARQUE)
+    except:
+        return ImageFont.load_default()
+
+# Éléments dessinés pour les annotations d'une photo (cercles et textes, en pixels de la photo, avec leur emprise)
+def marques_annotations(ann_list, largeur, hauteur, font):
+    marques = []
+    for ann, position in zip(ann_list, positions_annotations(ann_list, largeur, hauteur)):
+        if position is None:
+            continue
+        x, y = position
+        type_objet = ann.get('type_objet', '')
+        type_util = ann.get('fonction_objet', '')
+        # Texte combiné
+        texte = f"{type_objet} - {type_util}" if type_util else type_objet
+        couleur = "red" if ann.get('mode_annotation', '') == "cartographie" else "blue"
+        # Photo 360° : marque répétée de l'autre côté de la couture si elle la chevauche
+        decalages = [0]
+        if ann.get('yaw_origine') is not None:
+            decalages += [d for d, proche in ((largeur, x < RAYON_MARQUE), (-largeur, x > largeur - RAYON_MARQUE)) if proche]
+        for d in decalages:
+            marques.append({"type": "cercle", "x": x + d, "y": y, "couleur": couleur, "uuid": ann.get('uuid'),
+                            "boite": (x + d - RAYON_MARQUE - 1, y - RAYON_MARQUE - 1, x + d + RAYON_MARQUE + 1, y + RAYON_MARQUE + 1)})
+        if texte:
+            gauche, haut, droite, bas = font.getbbox(texte)
+            marques.append({"type": "texte", "x": x + 50, "y": y - 50, "texte": texte, "couleur": couleur, "uuid": ann.get('uuid'),
+                            "boite": (x + 50 + gauche - 1, y - 50 + haut - 1, x + 50 + droite + 1, y - 50 + bas + 1)})
+    return marques
+
+def _dessiner_marques(draw, marques, font, origine=(0, 0)):
+    ox, oy = origine
+    for m in marques:
+        if m["type"] == "cercle":
+            draw.ellipse([(m["x"] - ox - RAYON_MARQUE, m["y"] - oy - RAYON_MARQUE),
+                          (m["x"] - ox + RAYON_MARQUE, m["y"] - oy + RAYON_MARQUE)], fill=m["couleur"], outline=m["couleur"])
+        else:
+            draw.text((m["x"] - ox, m["y"] - oy), m["texte"], fill=m["couleur"], font=font)
+
+# Calque SVG : marques vectorielles sur la photo originale (référencée, pas copiée)
+def ecrire_calque_svg(chemin_sortie, chemin_image, largeur, hauteur, marques):
+    from xml.sax.saxutils import escape, quoteattr
+    lien = quoteattr(os.path.relpath(chemin_image, os.path.dirname(chemin_sortie)).replace(os.sep, "/"))
+    lignes = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+        f'width="{largeur}" height="{hauteur}" viewBox="0 0 {largeur} {hauteur}">',
+        f'  <image href={lien} xlink:href={lien} x="0" y="0" width="{largeur}" height="{hauteur}"/>',
+        f'  <g font-family="bahnschrift, sans-serif" font-size="{TAILLE_TEXTE_MARQUE}">'
+    ]
+    for m in marques:
+        uuid_attr = f' data-uuid={quoteattr(str(m["uuid"]))}' if m["uuid"] else ""
+        if m["type"] == "cercle":
+            lignes.append(f'    <circle cx="{m["x"]:.1f}" cy="{m["y"]:.1f}" r="{RAYON_MARQUE}" fill="{m["couleur"]}"{uuid_attr}/>')
+        else:
+            lignes.append(f'    <text x="{m["x"]:.1f}" y="{m["y"]:.1f}" dominant-baseline="hanging" fill="{m["couleur"]}"{uuid_attr}>'
+                          f'{escape(m["texte"])}</text>')
+    lignes += ['  </g>', '</svg>']
+    with open(chemin_sortie, "w", encoding="utf-8") as f:
+        f.write("\n".join(lignes) + "\n")
+
+# Calque GeoJSON en coordonnées pixels de la photo (origine en haut à gauche, y vers le bas)
+def ecrire_calque_geojson(chemin_sortie, chemin_image, largeur, hauteur, ann_list):
+    features = []
+    for ann, position in zip(ann_list, positions_annotations(ann_list, largeur, hauteur)):
+        if position is None:
+            continue
+        proprietes = {cle: ann.get(cle) for cle in ("uuid", "mode_annotation", "type_objet", "fonction_objet")}
+        proprietes["couleur"] = "red" if ann.get('mode_annotation', '') == "cartographie" else "blue"
+        if ann.get('yaw_origine') is not None:
+            proprietes.update({"yaw": ann['yaw_origine'], "pitch": ann.get('angle_vertical')})
+        features.append({"type": "Feature", "geometry": {"type": "Point", "coordinates": [round(position[0], 2), round(position[1], 2)]},
+                         "properties": proprietes})
+    with open(chemin_sortie, "w", encoding="utf-8") as f:
+        json.dump({
+            "type": "FeatureCollection",
+            "photo": os.path.relpath(chemin_image, os.path.dirname(chemin_sortie)).replace(os.sep, "/"),
+            "largeur": largeur, "hauteur": hauteur, "repere": "pixels",
+            "features": features
+        }, f, ensure_ascii=False)
+
+# Chemin du calque ou du JPEG annoté d'une image dans le dossier resultat
+def chemin_photo_annotee(image_folder, image_name, format_sortie="jpeg"):
+    nom_base, ext = os.path.splitext(image_name)
+    return os.path.join(image_folder, 'resultat', f"{nom_base}_annot{ext if format_sortie == 'jpeg' else '.' + format_sortie}")
+
+@lru_cache(maxsize=1)
+# jpegtran avec l'option -drop (insertion sans perte d'une région réencodée), None sinon
+def _jpegtran_drop():
+    chemin = shutil.which("jpegtran")
+    if not chemin:
+        return None
+    try:
+        aide = subprocess.run([chemin, "-help"], capture_output=True, text=True, timeout=10)
+    except Exception:
+        return None
+    return chemin if "-drop" in aide.stdout + aide.stderr else None
+
+def _regions_mcu(boites, mcu_largeur, mcu_hauteur, largeur, hauteur):
+    """Emprises alignées sur les blocs MCU du JPEG, fusionnées quand elles se chevauchent."""
+    regions = []
+    for x0, y0, x1, y1 in boites:
+        x0 = max(0, int(x0 // mcu_largeur) * mcu_largeur)
+        y0 = max(0, int(y0 // mcu_hauteur) * mcu_hauteur)
+        x1 = min(largeur, math.ceil(x1 / mcu_largeur) * mcu_largeur)
+        y1 = min(hauteur, math.ceil(y1 / mcu_hauteur) * mcu_hauteur)
+        if x1 > x0 and y1 > y0:
+            regions.append([x0, y0, x1, y1])
+    fusion = True
+    while fusion:
+        fusion = False
+        for a in range(len(regions)):
+            for b in range(a + 1, len(regions)):
+                ra, rb = regions[a], regions[b]
+                if ra[0] < rb[2] and rb[0] < ra[2] and ra[1] < rb[3] and rb[1] < ra[3]:
+                    regions[a] = [min(ra[0], rb[0]), min(ra[1], rb[1]), max(ra[2], rb[2]), max(ra[3], rb[3])]
+                    del regions[b]
+                    fusion = True
+                    break
+            if fusion:
+                break
+    return regions
+
+def _reencoder_regions(jpegtran, chemin_image, sortie_path, marques, font):
+    """
+    JPEG annoté sans perte hors des marques : chaque région touchée (alignée sur les MCU) est extraite sans perte
+    (jpegtran -crop), annotée, réencodée avec les tables de quantification d'origine puis réinsérée (jpegtran -drop).
+    """
+    with Image.open(chemin_image) as img:
+        largeur, hauteur = img.size
+        mcu_largeur = 8 * max(h for _, h, _, _ in img.layer)
+        mcu_hauteur = 8 * max(v for _, _, v, _ in img.layer)
+    regions = _regions_mcu([m["boite"] for m in marques], mcu_largeur, mcu_hauteur, largeur, hauteur)
+    with tempfile.TemporaryDirectory() as dossier_tmp:
+        courant = chemin_image
+        for k, (x0, y0, x1, y1) in enumerate(regions):
+            extrait = os.path.join(dossier_tmp, f"extrait_{k}.jpg")
+            depot = os.path.join(dossier_tmp, f"depot_{k}.jpg")
+            suivant = os.path.join(dossier_tmp, f"etape_{k}.jpg")
+            subprocess.run([jpegtran, "-crop", f"{x1 - x0}x{y1 - y0}+{x0}+{y0}", "-copy", "none", "-outfile", extrait, courant],
+                           check=True, capture_output=True)
+            with Image.open(extrait) as region:
+                # Les régions fusionnées sont disjointes : chaque marque est entière dans la région qu'elle touche
+                _dessiner_marques(ImageDraw.Draw(region), [m for m in marques if m["boite"][0] < x1 and x0 < m["boite"][2]
+                                                           and m["boite"][1] < y1 and y0 < m["boite"][3]], font, (x0, y0))
+                region.save(depot, quality="keep", subsampling="keep")
+            subprocess.run([jpegtran, "-drop", f"+{x0}+{y0}", depot, "-copy", "all", "-outfile", suivant, courant],
+                           check=True, capture_output=True)
+            courant = suivant
+        shutil.copyfile(courant, sortie_path)
+
+# Vues perspectives centrées sur chaque annotation 360° (plus lisibles que la photo équirectangulaire)
+def _enregistrer_vues_360(img, image_folder, image_name, ann_list):
+    if not is_360_photo(img.width, img.height):
+        return
+    from utils.projection_utils import vue_perspective
+    nom_base, ext = os.path.splitext(image_name)
+    for idx, ann in enumerate(ann_list, start=1):
+        if ann.get('yaw_origine') is None:
+            continue
+        vue = vue_perspective(img, yaw=ann['yaw_origine'], pitch=ann.get('angle_vertical') or 0)
+        vue_path = os.path.join(image_folder, 'resultat', f"{nom_base}_annot_{idx:02d}{ext}")
+        vue.save(vue_path)
+        print(f"Vue annotée enregistrée : {vue_path}")
+
+# JPEG annoté d'une image, rendu à la demande
+def rendre_photo_annotee(image_folder, image_name, ann_list, vues_360=False, enregistrer_photo=True):
+    """
+    Écrit resultat/<image>_annot<ext> et retourne son chemin. Pour une source JPEG, seules les régions des marques
+    sont réencodées quand jpegtran (avec -drop) est disponible ; sinon l'image est réencodée avec ses tables de
+    quantification d'origine (quality="keep", sans perte de qualité supplémentaire) et ses EXIF.
+    enregistrer_photo=False : seules les vues 360° sont écrites.
+    """
+    chemin_image = os.path.join(image_folder, image_name)
+    sortie_path = chemin_photo_annotee(image_folder, image_name)
+    os.makedirs(os.path.dirname(sortie_path), exist_ok=True)
+    font = _police_marques()
+
+    with Image.open(chemin_image) as img:
+        marques = marques_annotations(ann_list, img.width, img.height, font)
+        region_seule = (enregistrer_photo and not vues_360 and bool(marques)
+                        and img.format == "JPEG" and img.mode in ("RGB", "L") and _jpegtran_drop() is not None)
+    if region_seule:
+        try:
+            _reencoder_regions(_jpegtran_drop(), chemin_image, sortie_path, marques, font)
+            print(f"Image annotée enregistrée (régions réencodées) : {sortie_path}")
+            return sortie_path
+        except Exception as e:
+            print(f"Réencodage par régions impossible pour {image_name}, réencodage complet : {e}")
+
+    img = Image.open(chemin_image)
+    jpeg_source = img.format == "JPEG" and img.mode in ("RGB", "L")
+    if not jpeg_source:
+        img = img.convert("RGB")
+    _dessiner_marques(ImageDraw.Draw(img), marques, font)
+    if enregistrer_photo:
+        if jpeg_source:
+            # Image JPEG d'origine : ses tables de quantification et son sous-échantillonnage sont réutilisés
+            img.save(sortie_path, quality="keep", subsampling="keep", exif=img.info.get("exif", b""))
+        else:
+            img.save(sortie_path)
+        print(f"Image annotée enregistrée : {sortie_path}")
+    if vues_360:
+        _enregistrer_vues_360(img.convert("RGB"), image_folder, image_name, ann_list)
+    return sortie_path if enregistrer_photo else None
+
+# Création des photos annotées : calques SVG / GeoJSON (par défaut, la photo n'est pas réencodée) ou JPEG annotés
+def dessiner_annotations_sur_images(image_folder, vues_360=False, format_sortie="jpeg"):
     # Images + annotations
     chemin_annotations = os.path.join(image_folder, 'annotations.json')
-    dossier_resultat = os.path.join(image_folder, 'resultat')
-    os.makedirs(dossier_resultat, exist_ok=True)
+    os.makedirs(os.path.join(image_folder, 'resultat'), exist_ok=True)
 
     # Charger les annotations
     with open(chemin_annotations, 'r', encoding='utf-8') as f:
         annotations = json.load(f)
 
+    font = _police_marques()
     # Itérer les images
     for image_name, ann_list in annotations.items():
         chemin_image = os.path.join(image_folder, image_name)
@@ -52,39 +292,28 @@ def dessiner_annotations_sur_images(image_folder):
             print(f"Image {image_name} non trouvée, on saute.")
             continue
 
-        # Charger l'image
-        img = Image.open(chemin_image).convert("RGB")
-        draw = ImageDraw.Draw(img)
-        font = ImageFont.load_default()
+        # Anciennes sorties dans un autre format (elles ne correspondent plus aux annotations)
+        for autre_format in FORMATS_PHOTOS_ANNOTEES:
+            ancien = chemin_photo_annotee(image_folder, image_name, autre_format)
+            if autre_format != format_sortie and os.path.exists(ancien):
+                os.remove(ancien)
+                print(f"Suppression de l'ancienne version : {ancien}")
 
-        for ann in ann_list:
-            x, y = ann['x'], ann['y']
-            type_objet = ann.get('type_objet', '')
-            mode_annotation = ann.get('mode_annotation', '')
-            type_util = ann.get('fonction_objet', '')
-
-            # Texte combiné
-            texte = f"{type_objet} - {type_util}" if type_util else type_objet
-
-            couleur = "red" if mode_annotation == "cartographie" else "blue"
-            try:
-                font = ImageFont.truetype("bahnschrift.ttf", 40)
-            except:
-                font = ImageFont.load_default()
-            draw.ellipse([(x - 20, y - 20), (x + 20, y + 20)], fill=couleur, outline=couleur)
-            draw.text((x + 50, y - 50), texte, fill=couleur, font=font)
-
-        # Sauvegarder l’image annotée
-        nom_base, ext = os.path.splitext(image_name)
-        image_annot_name = f"{nom_base}_annot{ext}"
-        sortie_path = os.path.join(dossier_resultat, image_annot_name)        
-        
-        # Si l'image existe déjà dans le dossier résultat, la supprimer
-        if os.path.exists(sortie_path):
-            os.remove(sortie_path)
-            print(f"Suppression de l'ancienne version : {sortie_path}")
-        img.save(sortie_path)
-        print(f"Image annotée enregistrée : {sortie_path}")
+        if format_sortie == "jpeg":
+            rendre_photo_annotee(image_folder, image_name, ann_list, vues_360)
+            continue
+
+        # Calque : dimensions lues dans l'en-tête, la photo n'est ni décodée ni réencodée
+        with Image.open(chemin_image) as img:
+            largeur, hauteur = img.size
+        sortie_path = chemin_photo_annotee(image_folder, image_name, format_sortie)
+        if format_sortie == "svg":
+            ecrire_calque_svg(sortie_path, chemin_image, largeur, hauteur, marques_annotations(ann_list, largeur, hauteur, font))
+        else:
+            ecrire_calque_geojson(sortie_path, chemin_image, largeur, hauteur, ann_list)
+        print(f"Calque des annotations enregistré : {sortie_path}")
+        if vues_360 and any(ann.get('yaw_origine') is not None for ann in ann_list):
+            rendre_photo_annotee(image_folder, image_name, ann_list, vues_360, enregistrer_photo=False)
 
 # Redimenssionnement de l'image
 def redimens_image(img, max_width=800):
@@ -93,7 +322,7 @@ def redimens_image(img, max_width=800):
     return img.resize((int(full_width * ratio), int(full_height * ratio))), ratio
 
 # Overlay + annotations
-def dessiner_overlay(display_img, annotations, df_annotations, ratio, selected_uuid, fov_user):
+def dessiner_overlay(display_img, annotations, df_annotations, ratio, selected_uuid, fov_user, candidats=None):
     from PIL import ImageDraw, ImageFont, Image
     overlay = Image.new("RGBA", display_img.size, (255, 255, 255, 0))
     draw = ImageDraw.Draw(overlay)
@@ -125,6 +354,12 @@ def dessiner_overlay(display_img, annotations, df_annotations, ratio, selected_u
         else:
             draw.ellipse((x_disp - 3, y_disp - 3, x_disp + 3, y_disp + 3), fill=color)
             draw.text((x_disp + 10, y_disp - 10), text, fill=text_color, font=font,stroke_width=1.1,stroke_fill="white")
+    # Candidats de la pré-annotation (boîtes du détecteur, numérotées comme dans le tableau de validation)
+    for i, c in enumerate(candidats or []):
+        x1, y1, x2, y2 = (int(v * ratio) for v in c["boite"])
+        draw.rectangle([(x1, y1), (x2, y2)], outline=(0, 200, 0, 220), width=2)
+        draw.text((x1 + 2, y1 + 2), f"D{i} {c['classe']} {c['confiance']:.2f}", fill=(0, 200, 0, 255), font=font,
+                  stroke_width=1, stroke_fill="white")
     return overlay
 
 # Fonction test, en cours de développement
@@ -133,6 +368,9 @@ def redresser_image_hero9_cached(image_path):
     """
     Redresse une image GoPro HERO9 (cached).
     """
+    # OpenCV n'est chargé que si le redressement est utilisé
+    import cv2
+    import numpy as np
     img = cv2.imread(image_path)
     if img is None:
         raise FileNotFoundError(f"Image introuvable : {image_path}")
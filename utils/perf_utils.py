@@ -0,0 +1,99 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (perf_utils.py) Diagnostic des performances de l'interface (durée des sections et taille des données par rerun)
+# -----------------------------------------------------------------------------
+
+import io
+import csv
+import time
+from datetime import datetime
+from contextlib import contextmanager
+import streamlit as st
+from streamlit import runtime
+
+# Nombre de reruns gardés dans l'historique de la session
+HISTORIQUE_PERF = 200
+
+
+# Mesures actives seulement dans l'interface, quand le diagnostic est coché (sans coût sinon)
+def perf_active():
+    return runtime.exists() and st.session_state.get("diagnostic_perf", False)
+
+# À appeler en début de script : clôt les mesures du rerun précédent (même interrompu par st.rerun) et en ouvre de nouvelles
+def debut_rerun():
+    courant = st.session_state.pop("mesures_perf", None)
+    if courant is not None:
+        historique = st.session_state.setdefault("historique_perf", [])
+        historique.append(_cloturer(courant))
+        del historique[:-HISTORIQUE_PERF]
+    if perf_active():
+        st.session_state.mesures_perf = {
+            "horodatage": datetime.now().isoformat(timespec="seconds"),
+            "debut": time.perf_counter(), "fin": time.perf_counter(),
+            "sections": {}, "tailles": {}
+        }
+
+# À appeler en fin de script (les reruns interrompus gardent la fin de leur dernière section)
+def fin_rerun():
+    mesures = st.session_state.get("mesures_perf") if perf_active() else None
+    if mesures is not None:
+        mesures["fin"] = time.perf_counter()
+
+def _cloturer(mesures):
+    ligne = {"horodatage": mesures["horodatage"], "total_ms": round((mesures["fin"] - mesures["debut"]) * 1000, 2)}
+    ligne.update({f"{nom}_ms": round(duree * 1000, 2) for nom, duree in mesures["sections"].items()})
+    ligne.update({f"{nom}_octets": taille for nom, taille in mesures["tailles"].items()})
+    return ligne
+
+@contextmanager
+# Durée d'une section nommée du rerun courant (cumulée si la section est exécutée plusieurs fois)
+def mesurer(nom):
+    mesures = st.session_state.get("mesures_perf") if perf_active() else None
+    if mesures is None:
+        yield
+        return
+    debut = time.perf_counter()
+    try:
+        yield
+    finally:
+        fin = time.perf_counter()
+        mesures["sections"][nom] = mesures["sections"].get(nom, 0.0) + fin - debut
+        mesures["fin"] = fin
+
+# Taille (octets) des données envoyées à un composant du navigateur pendant le rerun courant
+def noter_taille(nom, octets):
+    mesures = st.session_state.get("mesures_perf") if perf_active() else None
+    if mesures is not None:
+        mesures["tailles"][nom] = mesures["tailles"].get(nom, 0) + int(octets)
+
+# Synthèse par colonne de l'historique : dernier rerun, moyenne, maximum
+def synthese_perf(historique):
+    colonnes = _colonnes(historique)[1:]
+    synthese = []
+    for col in colonnes:
+        valeurs = [ligne[col] for ligne in historique if col in ligne]
+        synthese.append({
+            "mesure": col,
+            "dernier": historique[-1].get(col),
+            "moyenne": round(sum(valeurs) / len(valeurs), 2),
+            "max": max(valeurs),
+            "reruns": len(valeurs)
+        })
+    return synthese
+
+def _colonnes(historique):
+    colonnes = ["horodatage", "total_ms"]
+    for ligne in historique:
+        colonnes += [c for c in ligne if c not in colonnes]
+    return colonnes
+
+# Historique au format CSV (une ligne par rerun, colonnes vides si la section n'a pas été exécutée)
+def exporter_csv_perf(historique):
+    sortie = io.StringIO()
+    writer = csv.DictWriter(sortie, fieldnames=_colonnes(historique))
+    writer.writeheader()
+    writer.writerows(historique)
+    return sortie.getvalue()
@@ -0,0 +1,116 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (projection_utils.py) Projections équirectangulaire ↔ perspective des photos 360° (calcul vectorisé NumPy / OpenCV)
+# -----------------------------------------------------------------------------
+
+import numpy as np
+import streamlit as st
+from PIL import Image
+
+# Conventions (identiques à la visionneuse Pannellum) :
+# - yaw en degrés dans [-180, 180], 0 = centre de la photo, positif vers la droite
+# - pitch en degrés dans [-90, 90], 0 = horizon, positif vers le haut
+# - x = (yaw + 180) / 360 * largeur, y = (90 - pitch) / 180 * hauteur sur la photo équirectangulaire
+
+# Nombre de grilles de reprojection gardées en mémoire (≈ 6 Mo par grille en 1024 x 768)
+GRILLES_EN_CACHE = 16
+# Vue perspective par défaut (recadrages des annotations 360°)
+FOV_VUE = 60.0
+TAILLE_VUE = (1024, 768)
+
+
+# Angles (yaw, pitch) → pixels de la photo équirectangulaire, pour des tableaux d'angles
+def angles_vers_pixels(yaw, pitch, largeur, hauteur):
+    yaw = np.asarray(yaw, dtype=float)
+    pitch = np.asarray(pitch, dtype=float)
+    x = np.mod(yaw + 180.0, 360.0) * largeur / 360.0
+    y = (90.0 - np.clip(pitch, -90.0, 90.0)) * hauteur / 180.0
+    return x, y
+
+# Pixels de la photo équirectangulaire → angles (yaw, pitch)
+def pixels_vers_angles(x, y, largeur, hauteur):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    yaw = np.mod(x * 360.0 / largeur, 360.0) - 180.0
+    pitch = 90.0 - y * 180.0 / hauteur
+    return yaw, pitch
+
+def _focale(largeur, fov):
+    return (largeur / 2.0) / np.tan(np.radians(fov) / 2.0)
+
+def _rotations(yaw, pitch):
+    y, p = np.radians(yaw), np.radians(pitch)
+    return np.cos(y), np.sin(y), np.cos(p), np.sin(p)
+
+def _perspective_vers_angles(dx, dy, focale, yaw, pitch):
+    """
+    Rayons d'une vue perspective (dx vers la droite, dy vers le bas depuis le centre, en pixels)
+    → angles (yaw, pitch) dans la photo 360°, pour une vue orientée en (yaw, pitch).
+    """
+    cy, sy, cp, sp = _rotations(yaw, pitch)
+    droite, haut = dx, -dy
+    # Inclinaison de la vue (pitch) puis rotation autour de la verticale (yaw)
+    haut_p = haut * cp + focale * sp
+    avant_p = focale * cp - haut * sp
+    droite_m = droite * cy + avant_p * sy
+    avant_m = avant_p * cy - droite * sy
+    angle_h = np.degrees(np.arctan2(droite_m, avant_m))
+    angle_v = np.degrees(np.arctan2(haut_p, np.hypot(droite_m, avant_m)))
+    return angle_h, angle_v
+
+# Pixels d'une vue perspective → angles (yaw, pitch) de la photo 360° (ex : centre d'une boîte détectée)
+def perspective_vers_angles(x, y, largeur, hauteur, fov, yaw, pitch):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    return _perspective_vers_angles(x - largeur / 2.0, y - hauteur / 2.0, _focale(largeur, fov), yaw, pitch)
+
+# Angles (yaw, pitch) → pixels d'une vue perspective ; visible = devant la caméra et dans le cadre
+def angles_vers_perspective(yaw_points, pitch_points, largeur, hauteur, fov, yaw, pitch):
+    lon = np.radians(np.asarray(yaw_points, dtype=float))
+    lat = np.radians(np.asarray(pitch_points, dtype=float))
+    droite, haut, avant = np.cos(lat) * np.sin(lon), np.sin(lat), np.cos(lat) * np.cos(lon)
+    cy, sy, cp, sp = _rotations(yaw, pitch)
+    # Rotations inverses de _perspective_vers_angles
+    droite_v = droite * cy - avant * sy
+    avant_p = avant * cy + droite * sy
+    haut_v = haut * cp - avant_p * sp
+    avant_v = avant_p * cp + haut * sp
+    focale = _focale(largeur, fov)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = largeur / 2.0 + focale * droite_v / avant_v
+        y = hauteur / 2.0 - focale * haut_v / avant_v
+    visible = (avant_v > 0) & (x >= 0) & (x < largeur) & (y >= 0) & (y < hauteur)
+    return x, y, visible
+
+@st.cache_resource(show_spinner=False, max_entries=GRILLES_EN_CACHE)
+# Grilles de cv2.remap d'une vue perspective dans une photo équirectangulaire (partagées, en lecture seule)
+def grille_perspective(largeur_equi, hauteur_equi, largeur, hauteur, fov, yaw, pitch):
+    dx = np.arange(largeur, dtype=np.float32) + 0.5 - largeur / 2.0
+    dy = np.arange(hauteur, dtype=np.float32) + 0.5 - hauteur / 2.0
+    dx, dy = np.meshgrid(dx, dy)
+    angle_h, angle_v = _perspective_vers_angles(dx, dy, np.float32(_focale(largeur, fov)), yaw, pitch)
+    map_x, map_y = angles_vers_pixels(angle_h, angle_v, largeur_equi, hauteur_equi)
+    # Coordonnées de centres de pixels pour cv2.remap
+    map_x = (map_x - 0.5).astype(np.float32)
+    map_y = np.clip(map_y - 0.5, 0, hauteur_equi - 1).astype(np.float32)
+    map_x.setflags(write=False)
+    map_y.setflags(write=False)
+    return map_x, map_y
+
+# Vue perspective (largeur x hauteur, FOV horizontal) extraite d'une photo 360° (tableau NumPy ou image PIL)
+def vue_perspective(image_equi, fov=FOV_VUE, yaw=0.0, pitch=0.0, taille=TAILLE_VUE):
+    # OpenCV n'est chargé que si une vue est calculée
+    import cv2
+    est_pil = isinstance(image_equi, Image.Image)
+    tableau = np.asarray(image_equi)
+    hauteur_equi, largeur_equi = tableau.shape[:2]
+    largeur, hauteur = taille
+    # Angles arrondis au centième de degré : les vues voisines réutilisent la même grille
+    map_x, map_y = grille_perspective(largeur_equi, hauteur_equi, int(largeur), int(hauteur),
+                                      round(float(fov), 2), round(float(yaw), 2), round(float(pitch), 2))
+    # BORDER_WRAP : continuité de part et d'autre de la couture yaw = ±180°
+    vue = cv2.remap(tableau, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
+    return Image.fromarray(vue) if est_pil else vue
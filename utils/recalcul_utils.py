@@ -0,0 +1,154 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (recalcul_utils.py) Recalcul groupé des angles des annotations (FOV par appareil, orientation)
+# -----------------------------------------------------------------------------
+
+import os
+import json
+from utils.exif_utils import lire_modele_appareil
+
+# Écart minimal (en degrés) pour qu'un angle recalculé soit considéré comme modifié
+TOLERANCE_ANGLE = 1e-6
+# Corrections de direction par photo (calibration), enregistrées dans le dossier des images
+FICHIER_CORRECTIONS = "corrections_direction.json"
+
+# Modèle d'appareil de chaque image (exif_data.json, sinon lu dans l'en-tête de l'image)
+def modeles_appareils(exif_data, image_folder=None):
+    modeles = {}
+    for nom, exif in exif_data.items():
+        if "modele_appareil" in exif:
+            modeles[nom] = exif["modele_appareil"]
+        elif image_folder:
+            modeles[nom] = lire_modele_appareil(os.path.join(image_folder, nom))
+        else:
+            modeles[nom] = None
+    return modeles
+
+# Corrections de direction déjà appliquées (dict image -> degrés)
+def charger_corrections(image_folder):
+    chemin = os.path.join(image_folder, FICHIER_CORRECTIONS)
+    if not os.path.exists(chemin):
+        return {}
+    with open(chemin, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# Application des corrections aux angles des annotations et mise à jour du fichier des corrections
+def appliquer_corrections(annotations, corrections, image_folder=None):
+    """
+    Ajoute la correction de chaque photo à angle_ajuste (yaw_origine, relatif à la direction EXIF, est inchangé).
+    Si image_folder est donné, les corrections cumulées sont enregistrées dans corrections_direction.json
+    (utilisé par le recalcul des angles pour ne pas les perdre). Retourne le nombre d'annotations modifiées.
+    """
+    nb = 0
+    for nom, correction in corrections.items():
+        for ann in annotations.get(nom, []):
+            if ann.get("angle_ajuste") is not None:
+                ann["angle_ajuste"] = (ann["angle_ajuste"] + correction) % 360
+                nb += 1
+    if image_folder and corrections:
+        cumul = charger_corrections(image_folder)
+        for nom, correction in corrections.items():
+            cumul[nom] = cumul.get(nom, 0.0) + correction
+        with open(os.path.join(image_folder, FICHIER_CORRECTIONS), "w", encoding="utf-8") as f:
+            json.dump(cumul, f, ensure_ascii=False, indent=2)
+    return nb
+
+# Écart angulaire signé ramené dans [-180, 180)
+def ecart_angulaire(nouveau, ancien):
+    import numpy as np
+    return (np.asarray(nouveau) - np.asarray(ancien) + 180) % 360 - 180
+
+# Recalcul des angles de toutes les annotations d'une campagne en une passe
+def recalculer_angles(annotations, exif_data, catalogue, fov_par_defaut, fov_par_appareil=None,
+                      modeles=None, corrections_direction=None, appliquer=False, tolerance=TOLERANCE_ANGLE):
+    """
+    Recalcule angle_ajuste et angle_vertical de toutes les annotations à partir des pixels x/y enregistrés,
+    des dimensions du catalogue, de la direction EXIF et du FOV de l'appareil (mêmes formules que
+    calculer_angle_objet / calculer_fov_vertical / calculer_angle_elevation, appliquées sur des tableaux).
+    Les annotations 360° (yaw_origine) sont recalculées à partir du yaw et de la direction, leur pitch est inchangé.
+
+    :param fov_par_appareil: dict modèle d'appareil -> FOV horizontal (degrés), fov_par_defaut sinon
+    :param modeles: dict image -> modèle d'appareil (voir modeles_appareils)
+    :param corrections_direction: dict image -> correction (degrés) ajoutée à la direction EXIF
+    :param appliquer: False = simulation (rien n'est modifié), True = mise à jour du dict annotations
+    :return: dict {"modifications": [...], "ignorees": [...], "nb_annotations": int}
+    """
+    import numpy as np
+
+    fov_par_appareil = fov_par_appareil or {}
+    modeles = modeles or {}
+    corrections_direction = corrections_direction or {}
+
+    # Aplatissement des annotations exploitables en listes parallèles
+    refs, ignorees = [], []
+    x, y, largeur, hauteur, direction, fov, yaw, ancien_h, ancien_v = ([] for _ in range(9))
+    for nom, liste in annotations.items():
+        if not liste:
+            continue
+        exif = exif_data.get(nom) or {}
+        infos = catalogue.get(nom) or {}
+        if exif.get("direction") is None:
+            ignorees.extend({"image": nom, "uuid": a.get("uuid"), "raison": "direction absente"} for a in liste)
+            continue
+        dir_image = exif["direction"] + corrections_direction.get(nom, 0.0)
+        fov_image = fov_par_appareil.get(modeles.get(nom), fov_par_defaut)
+        for ann in liste:
+            est_360 = ann.get("yaw_origine") is not None
+            if not est_360 and (ann.get("x") is None or not infos.get("largeur") or not infos.get("hauteur")):
+                ignorees.append({"image": nom, "uuid": ann.get("uuid"), "raison": "pixel ou dimensions absents"})
+                continue
+            refs.append((nom, ann))
+            x.append(ann.get("x") if not est_360 else np.nan)
+            y.append(ann.get("y") if not est_360 and ann.get("y") is not None else np.nan)
+            largeur.append(infos.get("largeur") or np.nan)
+            hauteur.append(infos.get("hauteur") or np.nan)
+            direction.append(dir_image)
+            fov.append(fov_image)
+            yaw.append(ann["yaw_origine"] if est_360 else np.nan)
+            ancien_h.append(ann.get("angle_ajuste", np.nan))
+            ancien_v.append(ann.get("angle_vertical", np.nan))
+
+    resultat = {"modifications": [], "ignorees": ignorees, "nb_annotations": len(refs)}
+    if not refs:
+        return resultat
+
+    x, y, largeur, hauteur, direction, fov, yaw, ancien_h, ancien_v = (
+        np.asarray(t, dtype=float) for t in (x, y, largeur, hauteur, direction, fov, yaw, ancien_h, ancien_v)
+    )
+    est_360 = ~np.isnan(yaw)
+
+    # Photos standards : angle horizontal et élévation
+    centre_x = largeur / 2
+    centre_y = hauteur / 2
+    angle_h = (direction + (x - centre_x) / centre_x * (fov / 2)) % 360
+    fov_vertical = np.degrees(2 * np.arctan(hauteur / largeur * np.tan(np.radians(fov / 2))))
+    angle_v = -(y - centre_y) / centre_y * (fov_vertical / 2)
+    # Photos 360° : yaw relatif + direction, pitch conservé
+    angle_h = np.where(est_360, (yaw + direction) % 360, angle_h)
+    angle_v = np.where(est_360 | np.isnan(y), ancien_v, angle_v)
+
+    ecart_h = ecart_angulaire(angle_h, ancien_h)
+    ecart_v = angle_v - ancien_v
+    modifiees = np.flatnonzero(
+        np.isnan(ancien_h) | (np.abs(ecart_h) > tolerance) | (np.abs(np.nan_to_num(ecart_v)) > tolerance)
+    )
+    for i in modifiees:
+        nom, ann = refs[i]
+        resultat["modifications"].append({
+            "image": nom,
+            "uuid": ann.get("uuid"),
+            "type_objet": ann.get("type_objet"),
+            "angle_ajuste_avant": None if np.isnan(ancien_h[i]) else float(ancien_h[i]),
+            "angle_ajuste_apres": float(angle_h[i]),
+            "ecart_horizontal": None if np.isnan(ancien_h[i]) else float(ecart_h[i]),
+            "angle_vertical_avant": None if np.isnan(ancien_v[i]) else float(ancien_v[i]),
+            "angle_vertical_apres": None if np.isnan(angle_v[i]) else float(angle_v[i]),
+        })
+        if appliquer:
+            ann["angle_ajuste"] = float(angle_h[i])
+            if not np.isnan(angle_v[i]):
+                ann["angle_vertical"] = float(angle_v[i])
+    return resultat
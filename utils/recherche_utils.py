@@ -0,0 +1,119 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (recherche_utils.py) Index de recherche des photos (préfixe / trigrammes), filtres et pagination
+# -----------------------------------------------------------------------------
+
+import bisect
+from datetime import datetime
+import streamlit as st
+
+# Nombre de résultats affichés par page
+TAILLE_PAGE_RECHERCHE = 20
+
+# Construction de l'index des noms d'images
+def construire_index_noms(noms):
+    """
+    Construit l'index de recherche d'une liste de noms (dans l'ordre de navigation) :
+    - positions : nom -> position dans la liste (saut direct en O(1))
+    - prefixes : liste triée des (nom en minuscules, position) pour la recherche par préfixe
+    - trigrammes : trigramme -> liste croissante des positions des noms qui le contiennent
+    """
+    positions = {}
+    trigrammes = {}
+    for pos, nom in enumerate(noms):
+        positions[nom] = pos
+        nom_min = nom.lower()
+        for tri in {nom_min[i:i + 3] for i in range(len(nom_min) - 2)}:
+            trigrammes.setdefault(tri, []).append(pos)
+    return {
+        "noms": list(noms),
+        "positions": positions,
+        "prefixes": sorted((nom.lower(), pos) for pos, nom in enumerate(noms)),
+        "trigrammes": trigrammes
+    }
+
+@st.cache_resource(max_entries=4)
+# Index gardé en mémoire tant que le contenu du dossier ne change pas (même clé que le catalogue,
+# la liste des noms n'est pas hachée à chaque rerun)
+def charger_index_noms(image_folder, mtime_dossier, _noms):
+    return construire_index_noms(_noms)
+
+# Recherche des images dont le nom contient le terme
+def rechercher_noms(index, terme):
+    """
+    Retourne les positions (croissantes) des images dont le nom contient `terme` (insensible à la casse).
+    - 3 caractères et plus : intersection des listes de trigrammes, puis vérification du nom
+    - 1 ou 2 caractères : recherche par préfixe (dichotomie sur les noms triés)
+    """
+    terme = terme.strip().lower()
+    if not terme:
+        return []
+    noms = index["noms"]
+    if len(terme) < 3:
+        prefixes = index["prefixes"]
+        debut = bisect.bisect_left(prefixes, (terme,))
+        resultat = []
+        for nom_min, pos in prefixes[debut:]:
+            if not nom_min.startswith(terme):
+                break
+            resultat.append(pos)
+        return sorted(resultat)
+
+    listes = [index["trigrammes"].get(terme[i:i + 3], []) for i in range(len(terme) - 2)]
+    listes.sort(key=len)
+    candidats = set(listes[0])
+    for liste in listes[1:]:
+        candidats.intersection_update(liste)
+        if not candidats:
+            return []
+    return sorted(pos for pos in candidats if terme in noms[pos].lower())
+
+# Conversion de la date EXIF ("AAAA:MM:JJ HH:MM:SS") en date
+def date_exif(valeur):
+    if not valeur:
+        return None
+    try:
+        return datetime.strptime(str(valeur)[:10], "%Y:%m:%d").date()
+    except ValueError:
+        return None
+
+# Filtres sur les images (annotation, EXIF, type de photo)
+def filtrer_images(positions, index, catalogue, exif_data, annotations, annotee=None, gps_manquant=False,
+                   direction_manquante=False, date_debut=None, date_fin=None, type_photo=None):
+    """
+    Filtre une liste de positions :
+    - annotee : True (au moins une annotation), False (aucune), None (indifférent)
+    - gps_manquant / direction_manquante : ne garder que les images sans latitude-longitude / sans direction
+    - date_debut / date_fin : intervalle (datetime.date) sur la date de prise de vue EXIF
+    - type_photo : "360" ou "standard" (None : indifférent)
+    """
+    noms = index["noms"]
+    resultat = []
+    for pos in positions:
+        nom = noms[pos]
+        if annotee is not None and bool(annotations.get(nom)) != annotee:
+            continue
+        exif = exif_data.get(nom, {})
+        if gps_manquant and exif.get("latitude") is not None and exif.get("longitude") is not None:
+            continue
+        if direction_manquante and exif.get("direction") is not None:
+            continue
+        if date_debut or date_fin:
+            date_image = date_exif(exif.get("date_time"))
+            if date_image is None or (date_debut and date_image < date_debut) or (date_fin and date_image > date_fin):
+                continue
+        if type_photo is not None and catalogue.get(nom, {}).get("est_360") != (type_photo == "360"):
+            continue
+        resultat.append(pos)
+    return resultat
+
+# Découpage d'une liste de résultats en pages
+def paginer(elements, page, taille_page=TAILLE_PAGE_RECHERCHE):
+    """Retourne (éléments de la page, nombre de pages). `page` commence à 1 et est ramenée dans les bornes."""
+    nb_pages = max(1, -(-len(elements) // taille_page))
+    page = min(max(1, page), nb_pages)
+    debut = (page - 1) * taille_page
+    return elements[debut:debut + taille_page], nb_pages
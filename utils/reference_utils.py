@@ -0,0 +1,212 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (reference_utils.py) Préparation et mise en cache disque de la couche de référence (GPKG utilisateur)
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import numpy as np
+import shapely
+import geopandas as gpd
+from utils.file_utils import empreinte_fichier, dossier_cache, limiter_cache, memoire_pic_mo
+
+# Version du format du cache : à incrémenter dès que la préparation de la couche change
+VERSION_CACHE_REFERENCE = 4
+# Nombre de géométries traitées à la fois lors de la préparation (borne la mémoire des tableaux intermédiaires)
+TAILLE_BLOC_PREPARATION = 50000
+
+# Clé du cache : empreinte du GPKG + couche + paramètres de préparation
+def cle_cache_reference(ancien_gpkg, selected_layer, parametres=None):
+    """Calcule la clé du cache des données préparées d'une couche de référence."""
+    contenu = json.dumps({
+        "version": VERSION_CACHE_REFERENCE,
+        "empreinte": empreinte_fichier(ancien_gpkg),
+        "couche": selected_layer,
+        "parametres": parametres or {}
+    }, sort_keys=True)
+    return hashlib.blake2b(contenu.encode("utf-8"), digest_size=16).hexdigest()
+
+# Sérialisation compacte d'un tableau de géométries (WKB concaténés + décalages)
+def _geometries_vers_tableaux(geometries):
+    wkb = shapely.to_wkb(np.asarray(geometries, dtype=object))
+    longueurs = np.fromiter((len(w) for w in wkb), dtype=np.int64, count=len(wkb))
+    decalages = np.concatenate(([0], np.cumsum(longueurs)))
+    octets = np.frombuffer(b"".join(wkb), dtype=np.uint8)
+    return octets, decalages
+
+def _tableaux_vers_geometries(octets, decalages):
+    brut = octets.tobytes()
+    wkb = [brut[decalages[i]:decalages[i + 1]] for i in range(len(decalages) - 1)]
+    return shapely.from_wkb(np.array(wkb, dtype=object))
+
+# Explosion des géométries multiples et des collections en parties simples
+def _parties_simples(geometries):
+    """Retourne (parties, index de la géométrie source de chaque partie)."""
+    parties, source = shapely.get_parts(geometries, return_index=True)
+    # make_valid peut produire des collections contenant des multipolygones : on explose jusqu'au bout
+    while len(parties) and np.isin(shapely.get_type_id(parties), (4, 5, 6, 7)).any():
+        parties, sous_source = shapely.get_parts(parties, return_index=True)
+        source = source[sous_source]
+    return parties, source
+
+# Extraction des contours des géométries nettoyées (pour les intersections)
+def extraire_contours(gdf_geom_clean):
+    """
+    Découpe le contour de chaque polygone en LineString.
+    Retourne un GeoDataFrame avec la colonne 'bat_id' (index du polygone dans gdf_geom_clean).
+    """
+    geometries = gdf_geom_clean.geometry.values
+    index = gdf_geom_clean.index.to_numpy()
+    blocs_lignes, blocs_bat_id = [], []
+    for debut in range(0, len(geometries), TAILLE_BLOC_PREPARATION):
+        bloc = geometries[debut:debut + TAILLE_BLOC_PREPARATION]
+        lignes, source = shapely.get_parts(shapely.boundary(np.asarray(bloc, dtype=object)), return_index=True)
+        # Les contours de points ou de lignes (points) sont ignorés
+        garder = shapely.get_type_id(lignes) == 1
+        blocs_lignes.append(lignes[garder])
+        blocs_bat_id.append(index[debut:debut + TAILLE_BLOC_PREPARATION][source[garder]])
+    lignes = np.concatenate(blocs_lignes) if blocs_lignes else np.empty(0, dtype=object)
+    bat_id = np.concatenate(blocs_bat_id) if blocs_bat_id else np.empty(0, dtype=np.int64)
+    return gpd.GeoDataFrame({'bat_id': bat_id}, geometry=gpd.GeoSeries(lignes, crs=gdf_geom_clean.crs), crs=gdf_geom_clean.crs)
+
+# Géométrie surfacique d'un objet réparé (Polygon, MultiPolygon, polygone vide si rien de surfacique ne reste)
+def _surface_reparee(polygones):
+    if not polygones:
+        return shapely.Polygon()
+    return polygones[0] if len(polygones) == 1 else shapely.MultiPolygon(polygones)
+
+# Nettoyage de la couche : réparation des invalides, explosion des multipolygones, puis contours
+def preparer_geometries(gdf_geom, logger=None):
+    """
+    Retourne (gdf_geom_clean, lignes_bat, reparations) à partir de la couche utilisateur.
+    Travaille directement sur le tableau des géométries, par blocs de TAILLE_BLOC_PREPARATION (sans copie
+    de la couche) : les géométries invalides sont réparées (make_valid, seules les parties surfaciques
+    d'un polygone réparé sont gardées) au lieu d'être supprimées.
+    reparations : (positions, géométries) des objets réparés, à reporter dans gdf_geom (voir appliquer_reparations)
+    """
+    geometries = gdf_geom.geometry.values
+    blocs = []
+    reparees = {}
+    nb_reparees = 0
+    for debut in range(0, len(geometries), TAILLE_BLOC_PREPARATION):
+        bloc = np.asarray(geometries[debut:debut + TAILLE_BLOC_PREPARATION], dtype=object)
+        invalides = ~shapely.is_valid(bloc) & ~shapely.is_missing(bloc)
+        if invalides.any():
+            bloc = bloc.copy()
+            bloc[invalides] = shapely.make_valid(bloc[invalides])
+            nb_reparees += int(invalides.sum())
+        parties, source = _parties_simples(bloc)
+        garder = ~shapely.is_empty(parties) & (~invalides[source] | (shapely.get_type_id(parties) == 3))
+        blocs.append(parties[garder])
+        for i in np.flatnonzero(invalides):
+            reparees[debut + i] = []
+        for i, partie in zip(source[garder & invalides[source]], parties[garder & invalides[source]]):
+            reparees[debut + i].append(partie)
+    parties = np.concatenate(blocs) if blocs else np.empty(0, dtype=object)
+    if logger and nb_reparees:
+        logger.info(f"{nb_reparees} géométrie(s) invalide(s) réparée(s) (make_valid)")
+    gdf_geom_clean = gpd.GeoDataFrame(geometry=gpd.GeoSeries(parties, crs=gdf_geom.crs), crs=gdf_geom.crs)
+    lignes_bat = extraire_contours(gdf_geom_clean)
+    positions = np.fromiter(reparees.keys(), dtype=np.int64, count=len(reparees))
+    surfaces = np.array([_surface_reparee(polygones) for polygones in reparees.values()], dtype=object)
+    return gdf_geom_clean, lignes_bat, (positions, surfaces)
+
+# Report des géométries réparées dans la couche : la mise à jour des objets (maj_objet) et l'identification
+# des objets touchés intersectent gdf_geom, qui ne doit plus contenir de géométrie invalide
+def appliquer_reparations(gdf_geom, reparations):
+    positions, surfaces = reparations
+    if len(positions):
+        geometries = gdf_geom.geometry.values.copy()
+        geometries[positions] = surfaces
+        gdf_geom[gdf_geom.geometry.name] = gpd.GeoSeries(geometries, index=gdf_geom.index, crs=gdf_geom.crs)
+    return gdf_geom
+
+# Écriture du cache disque
+def sauvegarder_cache_reference(chemin_cache, gdf_geom_clean, lignes_bat, reparations):
+    poly_octets, poly_decalages = _geometries_vers_tableaux(gdf_geom_clean.geometry.values)
+    lig_octets, lig_decalages = _geometries_vers_tableaux(lignes_bat.geometry.values)
+    rep_octets, rep_decalages = _geometries_vers_tableaux(reparations[1])
+    chemin_tmp = f"{chemin_cache}.tmp.npz"
+    np.savez(
+        chemin_tmp,
+        poly_octets=poly_octets, poly_decalages=poly_decalages,
+        poly_index=gdf_geom_clean.index.to_numpy(dtype=np.int64),
+        lig_octets=lig_octets, lig_decalages=lig_decalages,
+        lig_bat_id=lignes_bat['bat_id'].to_numpy(dtype=np.int64) if not lignes_bat.empty else np.zeros(0, dtype=np.int64),
+        rep_positions=reparations[0], rep_octets=rep_octets, rep_decalages=rep_decalages,
+        crs=np.array(gdf_geom_clean.crs.to_wkt() if gdf_geom_clean.crs else "")
+    )
+    # Remplacement atomique : un cache à moitié écrit n'est jamais relu
+    os.replace(chemin_tmp, chemin_cache)
+
+# Lecture du cache disque
+def charger_cache_reference(chemin_cache):
+    with np.load(chemin_cache, allow_pickle=False) as data:
+        crs = str(data["crs"]) or None
+        gdf_geom_clean = gpd.GeoDataFrame(
+            geometry=gpd.GeoSeries(_tableaux_vers_geometries(data["poly_octets"], data["poly_decalages"]),
+                                   index=data["poly_index"], crs=crs),
+            crs=crs
+        )
+        lignes_bat = gpd.GeoDataFrame(
+            {'bat_id': data["lig_bat_id"]},
+            geometry=gpd.GeoSeries(_tableaux_vers_geometries(data["lig_octets"], data["lig_decalages"]), crs=crs),
+            crs=crs
+        )
+        reparations = (data["rep_positions"], _tableaux_vers_geometries(data["rep_octets"], data["rep_decalages"]))
+    return gdf_geom_clean, lignes_bat, reparations
+
+# Fonction principale : lecture de la couche + données préparées (depuis le cache si possible)
+def charger_reference(ancien_gpkg, selected_layer, utiliser_cache=True, logger=None):
+    """
+    Lit la couche utilisateur et fournit ses données préparées (étapes 4 et 5 du traitement) :
+    - gdf_geom : couche complète (attributs + géométries, invalides réparées), à mettre à jour puis à réécrire
+    - gdf_geom_clean : polygones explosés et valides
+    - lignes_bat : contours des polygones avec leur index spatial (sindex) déjà construit
+    Les données préparées sont mises en cache sur disque selon l'empreinte du GPKG et la couche.
+    """
+    gdf_geom = gpd.read_file(ancien_gpkg, layer=selected_layer)
+
+    chemin_cache = None
+    if utiliser_cache:
+        cle = cle_cache_reference(ancien_gpkg, selected_layer)
+        chemin_cache = os.path.join(dossier_cache(), f"reference_{cle}.npz")
+
+    gdf_geom_clean = lignes_bat = None
+    if chemin_cache and os.path.exists(chemin_cache):
+        try:
+            gdf_geom_clean, lignes_bat, reparations = charger_cache_reference(chemin_cache)
+            # Entrée récemment utilisée : gardée en priorité par limiter_cache
+            os.utime(chemin_cache)
+            if logger:
+                logger.info(f"Données préparées de la couche '{selected_layer}' lues depuis le cache : {chemin_cache}")
+        except Exception as e:
+            if logger:
+                logger.info(f"Cache de référence illisible, recalcul : {e}")
+
+    if gdf_geom_clean is None:
+        gdf_geom_clean, lignes_bat, reparations = preparer_geometries(gdf_geom, logger)
+        pic = memoire_pic_mo()
+        if logger and pic is not None:
+            logger.info(f"Couche '{selected_layer}' préparée ({len(gdf_geom_clean)} polygones, {len(lignes_bat)} contours), "
+                        f"mémoire maximale du processus : {pic:.0f} Mo")
+        if chemin_cache:
+            try:
+                sauvegarder_cache_reference(chemin_cache, gdf_geom_clean, lignes_bat, reparations)
+                if logger:
+                    logger.info(f"Données préparées de la couche '{selected_layer}' mises en cache : {chemin_cache}")
+                for supprime in limiter_cache("reference_", garder=chemin_cache):
+                    if logger:
+                        logger.info(f"Cache de référence plein, entrée la plus ancienne supprimée : {supprime}")
+            except Exception as e:
+                if logger:
+                    logger.info(f"Impossible d'écrire le cache de référence : {e}")
+
+    appliquer_reparations(gdf_geom, reparations)
+    # Construction de l'index spatial des contours (chargement en masse, rapide)
+    lignes_bat.sindex
+    return gdf_geom, gdf_geom_clean, lignes_bat
@@ -0,0 +1,257 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (serveur_utils.py) Serveur local de cartographie (couches de référence gardées en mémoire) et client HTTP
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import hmac
+import secrets
+import threading
+import urllib.parse
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Adresse par défaut du serveur (localhost uniquement)
+HOTE_SERVEUR = "127.0.0.1"
+PORT_SERVEUR = 8765
+URL_SERVEUR = os.environ.get("PHOTOMAPON_SERVEUR", f"http://{HOTE_SERVEUR}:{PORT_SERVEUR}")
+# En-tête portant le jeton d'accès tiré à chaque lancement du serveur
+ENTETE_JETON = "X-Photomapon-Jeton"
+
+# Fichier du jeton d'un serveur (dossier de cache de l'utilisateur, lisible par lui seul)
+def chemin_jeton(port):
+    from utils.file_utils import dossier_cache
+    return os.path.join(dossier_cache(), f"serveur_{port}.jeton")
+
+# -----------------------------------------------------------------------------
+# Côté serveur
+# -----------------------------------------------------------------------------
+
+# Couches de référence chargées : (chemin gpkg, couche) -> {"empreinte", "reference", "charge_le"}
+_references = {}
+_verrou_references = threading.Lock()
+
+# Chargement (ou réutilisation) d'une couche de référence en mémoire
+def obtenir_reference(ancien_gpkg, selected_layer):
+    """
+    Retourne le tuple (gdf_geom, gdf_geom_clean, lignes_bat) de la couche, chargé une seule fois
+    tant que l'empreinte du GPKG ne change pas.
+    """
+    from utils.file_utils import empreinte_fichier
+    from utils.reference_utils import charger_reference
+
+    cle = (os.path.abspath(ancien_gpkg), selected_layer)
+    empreinte = empreinte_fichier(ancien_gpkg)
+    with _verrou_references:
+        entree = _references.get(cle)
+        if entree is None or entree["empreinte"] != empreinte:
+            reference = charger_reference(ancien_gpkg, selected_layer)
+            # Construction anticipée de l'index spatial de la couche complète
+            reference[0].sindex
+            entree = {"empreinte": empreinte, "reference": reference, "charge_le": time.time()}
+            _references[cle] = entree
+        return entree["reference"]
+
+# Traitement d'une requête "charger cette couche"
+def traiter_chargement(donnees):
+    obtenir_reference(donnees["gpkg"], donnees["couche"])
+    return {"charge": True}
+
+# Traitement d'une requête "lancer ces rayons"
+def traiter_rayons(donnees):
+    from utils.geo_utils import lancer_rayons
+
+    _, _, lignes_bat = obtenir_reference(donnees["gpkg"], donnees["couche"])
+    rayons = donnees.get("rayons", [])
+    resultat = lancer_rayons(
+        lignes_bat,
+        [r["x"] for r in rayons], [r["y"] for r in rayons], [r["angle"] for r in rayons],
+        donnees.get("decalage_orientation", 0), donnees.get("longueur", 150)
+    )
+    return {
+        "touches": [
+            {"touche": bool(t), "x": float(x), "y": float(y), "distance": float(d), "bat_id": int(b)} if t else {"touche": False}
+            for t, x, y, d, b in zip(resultat["touche"], resultat["x"], resultat["y"], resultat["distance"], resultat["bat_id"])
+        ]
+    }
+
+# Traitement d'une requête "cartographier ces annotations"
+def traiter_cartographie(donnees):
+    from utils.geo_utils import creer_gpkg_complet
+
+    reference = obtenir_reference(donnees["gpkg"], donnees["couche"])
+    creer_gpkg_complet(
+        donnees["annotations_json"], donnees["exif_json"], donnees["gpkg"], donnees["gpkg_output"],
+        donnees["image_folder"], donnees["couche"], donnees.get("decalage_orientation", 0),
+        reference=reference
+    )
+    return {"gpkg_output": donnees["gpkg_output"]}
+
+# Routes du serveur : chemin -> fonction(donnees) -> dict
+ROUTES = {
+    "/charger": traiter_chargement,
+    "/rayons": traiter_rayons,
+    "/cartographier": traiter_cartographie,
+}
+
+class _GestionnaireRequetes(BaseHTTPRequestHandler):
+    """
+    Gestionnaire HTTP : GET /etat, POST /charger, /rayons, /cartographier (JSON).
+    Le serveur lit et écrit des fichiers aux chemins reçus : une page web ouverte dans le navigateur ne doit
+    pas pouvoir l'appeler. Sont refusées (403) les requêtes avec un en-tête Origin (navigateur), un Host autre
+    que localhost / 127.0.0.1 sur le port du serveur (rebinding DNS), un corps qui n'est pas application/json
+    (requêtes « simples » sans pré-vérification CORS) ou sans le jeton d'accès du lancement.
+    """
+
+    def _refus(self, avec_corps):
+        port = self.server.server_address[1]
+        hotes = {f"{h}:{port}" for h in ("localhost", "127.0.0.1", self.server.server_address[0])}
+        if self.headers.get("Origin") is not None:
+            return "requête d'un navigateur (en-tête Origin) refusée"
+        if self.headers.get("Host", "").lower() not in hotes:
+            return f"hôte non autorisé : {self.headers.get('Host')}"
+        if avec_corps and self.headers.get("Content-Type", "").split(";")[0].strip().lower() != "application/json":
+            return "Content-Type application/json attendu"
+        if not hmac.compare_digest(self.headers.get(ENTETE_JETON, ""), self.server.jeton):
+            return "jeton d'accès absent ou invalide"
+        return None
+
+    def _repondre(self, code, contenu):
+        corps = json.dumps(contenu, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(corps)))
+        self.end_headers()
+        self.wfile.write(corps)
+
+    def do_GET(self):
+        refus = self._refus(avec_corps=False)
+        if refus:
+            self._repondre(403, {"erreur": refus})
+            return
+        if self.path != "/etat":
+            self._repondre(404, {"erreur": f"Route inconnue : {self.path}"})
+            return
+        with _verrou_references:
+            couches = [{"gpkg": c[0], "couche": c[1], "charge_le": e["charge_le"]} for c, e in _references.items()]
+        self._repondre(200, {"pid": os.getpid(), "couches": couches})
+
+    def do_POST(self):
+        refus = self._refus(avec_corps=True)
+        if refus:
+            self._repondre(403, {"erreur": refus})
+            return
+        route = ROUTES.get(self.path)
+        if route is None:
+            self._repondre(404, {"erreur": f"Route inconnue : {self.path}"})
+            return
+        try:
+            longueur = int(self.headers.get("Content-Length", 0))
+            donnees = json.loads(self.rfile.read(longueur) or b"{}")
+            debut = time.perf_counter()
+            resultat = route(donnees)
+            resultat["duree_ms"] = (time.perf_counter() - debut) * 1000
+            self._repondre(200, resultat)
+        except Exception as e:
+            self._repondre(500, {"erreur": str(e)})
+
+    def log_message(self, format, *args):
+        print(f"[serveur] {self.address_string()} - {format % args}")
+
+# Lancement du serveur (bloquant)
+def lancer_serveur(hote=HOTE_SERVEUR, port=PORT_SERVEUR, precharger=None):
+    """
+    Démarre le serveur de cartographie local.
+    :param precharger: liste de (chemin gpkg, couche) à charger dès le démarrage
+    Un jeton d'accès est tiré à chaque lancement, affiché et écrit dans chemin_jeton(port) (droits 600)
+    où les clients du même utilisateur le relisent ; il est supprimé à l'arrêt du serveur (Ctrl+C), remplacé au lancement suivant sinon.
+    """
+    # Imports lourds faits une seule fois, au démarrage du serveur
+    import utils.geo_utils  # noqa: F401
+    for ancien_gpkg, selected_layer in precharger or []:
+        obtenir_reference(ancien_gpkg, selected_layer)
+        print(f"Couche '{selected_layer}' de {ancien_gpkg} chargée en mémoire.")
+    serveur = ThreadingHTTPServer((hote, port), _GestionnaireRequetes)
+    serveur.jeton = secrets.token_urlsafe(32)
+    fichier_jeton = chemin_jeton(port)
+    if os.path.exists(fichier_jeton):
+        os.remove(fichier_jeton)
+    with os.fdopen(os.open(fichier_jeton, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as f:
+        f.write(serveur.jeton)
+    print(f"Serveur de cartographie Photo'Mapon à l'écoute sur http://{hote}:{port}")
+    print(f"Jeton d'accès (en-tête {ENTETE_JETON}, aussi écrit dans {fichier_jeton}) : {serveur.jeton}")
+    try:
+        serveur.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        serveur.server_close()
+        if os.path.exists(fichier_jeton):
+            os.remove(fichier_jeton)
+
+# -----------------------------------------------------------------------------
+# Côté client (application Streamlit, CLI)
+# -----------------------------------------------------------------------------
+
+# Jeton d'accès du serveur : variable PHOTOMAPON_JETON, sinon fichier écrit par le serveur au lancement
+def lire_jeton(url=URL_SERVEUR):
+    jeton = os.environ.get("PHOTOMAPON_JETON")
+    if jeton:
+        return jeton
+    try:
+        with open(chemin_jeton(urllib.parse.urlsplit(url).port or PORT_SERVEUR), encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+# Appel d'une route du serveur
+def appeler_serveur(route, donnees=None, url=URL_SERVEUR, timeout=600):
+    """Envoie une requête JSON au serveur et retourne la réponse décodée (RuntimeError si erreur)."""
+    entetes = {ENTETE_JETON: lire_jeton(url)}
+    if donnees is None:
+        requete = urllib.request.Request(f"{url}{route}", headers=entetes)
+    else:
+        requete = urllib.request.Request(
+            f"{url}{route}", data=json.dumps(donnees).encode("utf-8"),
+            headers={**entetes, "Content-Type": "application/json"}, method="POST"
+        )
+    try:
+        with urllib.request.urlopen(requete, timeout=timeout) as reponse:
+            return json.loads(reponse.read())
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read()).get("erreur", str(e))
+        except Exception:
+            message = str(e)
+        raise RuntimeError(f"Erreur du serveur de cartographie : {message}")
+
+# Lancer de rayons délégué au serveur (même résultat que geo_utils.lancer_rayons)
+def lancer_rayons_serveur(gpkg, couche, x, y, angles_deg, decalage_orientation, longueur=150, url=URL_SERVEUR):
+    import numpy as np
+    reponse = appeler_serveur("/rayons", {
+        "gpkg": os.path.abspath(gpkg), "couche": couche,
+        "rayons": [{"x": float(a), "y": float(b), "angle": float(c)} for a, b, c in zip(x, y, angles_deg)],
+        "decalage_orientation": decalage_orientation, "longueur": longueur
+    }, url=url, timeout=5)
+    touches = reponse["touches"]
+    return {
+        'touche': np.array([t["touche"] for t in touches], dtype=bool),
+        'x': np.array([t.get("x", np.nan) for t in touches], dtype=float),
+        'y': np.array([t.get("y", np.nan) for t in touches], dtype=float),
+        'distance': np.array([t.get("distance", np.nan) for t in touches], dtype=float),
+        'bat_id': np.array([t.get("bat_id", -1) for t in touches], dtype=np.int64)
+    }
+
+# Vérifie qu'un serveur répond à l'adresse donnée
+def serveur_disponible(url=URL_SERVEUR, timeout=0.5):
+    try:
+        appeler_serveur("/etat", url=url, timeout=timeout)
+        return True
+    except Exception:
+        return False
@@ -0,0 +1,228 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (stockage_utils.py) Base SQLite (WAL) des annotations partagée entre plusieurs annotateurs
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import streamlit as st
+from utils.file_utils import charger_annotations, sauvegarder_annotations
+
+# Base partagée, à côté de annotations.json dans le dossier des images
+FICHIER_BASE_ANNOTATIONS = "annotations.sqlite"
+# Attente maximale (ms) d'un verrou d'écriture tenu par un autre annotateur
+DELAI_VERROU_MS = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    image_name TEXT PRIMARY KEY,
+    rang INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS annotations (
+    uuid TEXT PRIMARY KEY,
+    image_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    donnees TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS annotations_image ON annotations (image_name, position);
+CREATE TABLE IF NOT EXISTS changements (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_name TEXT NOT NULL,
+    horodatage REAL NOT NULL
+);
+"""
+
+
+def chemin_base_annotations(image_folder):
+    return os.path.join(image_folder, FICHIER_BASE_ANNOTATIONS)
+
+# Base d'annotations d'un dossier : une ligne par annotation, une transaction par modification
+class BaseAnnotations:
+    """
+    Stockage des annotations d'une campagne dans SQLite en mode WAL : les lectures ne bloquent pas les
+    écritures, chaque ajout / modification / suppression est une transaction sur une seule ligne (plus de
+    réécriture complète de annotations.json ni de « dernier enregistrement gagnant » entre annotateurs).
+    Chaque écriture ajoute une ligne à la table `changements` : un annotateur retrouve les images modifiées
+    par les autres en lisant les séquences postérieures à la sienne (voir changements_depuis).
+    Le mode WAL suppose que la base est sur un disque local du serveur ; sur un dossier réseau partagé entre
+    plusieurs machines, créer la base avec wal=False (journal classique, verrouillage par fichier).
+    Le mode est enregistré dans le fichier : wal=None conserve celui de la base existante (WAL pour une nouvelle base).
+    """
+
+    def __init__(self, chemin, wal=None):
+        self.chemin = chemin
+        self.verrou = threading.Lock()
+        if wal is None and not os.path.exists(chemin):
+            wal = True
+        self.connexion = sqlite3.connect(chemin, timeout=DELAI_VERROU_MS / 1000, check_same_thread=False,
+                                         isolation_level=None)
+        self.connexion.execute(f"PRAGMA busy_timeout = {DELAI_VERROU_MS}")
+        if wal is not None:
+            self.connexion.execute(f"PRAGMA journal_mode = {'WAL' if wal else 'DELETE'}")
+        self.connexion.execute("PRAGMA synchronous = NORMAL")
+        self.connexion.executescript(SCHEMA)
+
+    # Transaction d'écriture (BEGIN IMMEDIATE : le verrou est pris avant la lecture des positions)
+    def _ecrire(self, operation, *images):
+        with self.verrou:
+            curseur = self.connexion.cursor()
+            curseur.execute("BEGIN IMMEDIATE")
+            try:
+                operation(curseur)
+                maintenant = time.time()
+                curseur.executemany("INSERT INTO changements (image_name, horodatage) VALUES (?, ?)",
+                                    [(img, maintenant) for img in images])
+                curseur.execute("COMMIT")
+            except Exception:
+                curseur.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _declarer_image(curseur, image_name):
+        curseur.execute(
+            "INSERT OR IGNORE INTO images (image_name, rang) VALUES (?, (SELECT COALESCE(MAX(rang), -1) + 1 FROM images))",
+            (image_name,)
+        )
+
+    @staticmethod
+    def _remplacer_image(curseur, image_name, liste):
+        BaseAnnotations._declarer_image(curseur, image_name)
+        curseur.execute("DELETE FROM annotations WHERE image_name = ?", (image_name,))
+        curseur.executemany(
+            "INSERT INTO annotations (uuid, image_name, position, donnees) VALUES (?, ?, ?, ?)",
+            [(ann["uuid"], image_name, pos, json.dumps(ann, ensure_ascii=False)) for pos, ann in enumerate(liste)]
+        )
+
+    # --- Écritures ligne à ligne (appelées par annotation_utils) ---
+    def ajouter(self, image_name, annotation):
+        def operation(curseur):
+            self._declarer_image(curseur, image_name)
+            curseur.execute(
+                "INSERT INTO annotations (uuid, image_name, position, donnees) VALUES "
+                "(?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM annotations WHERE image_name = ?), ?)",
+                (annotation["uuid"], image_name, image_name, json.dumps(annotation, ensure_ascii=False))
+            )
+        self._ecrire(operation, image_name)
+
+    def modifier(self, image_name, annotation):
+        self._ecrire(lambda curseur: curseur.execute(
+            "UPDATE annotations SET donnees = ? WHERE uuid = ?", (json.dumps(annotation, ensure_ascii=False), annotation["uuid"])
+        ), image_name)
+
+    def supprimer(self, image_name, uuid):
+        self._ecrire(lambda curseur: curseur.execute("DELETE FROM annotations WHERE uuid = ?", (uuid,)), image_name)
+
+    def synchroniser_image(self, image_name, avant, apres):
+        """
+        Reporte le passage de la liste `avant` à la liste `apres` (visionneuse 360° qui renvoie toute la liste)
+        ligne à ligne : seules les annotations ajoutées, modifiées ou supprimées sont écrites, celles ajoutées
+        entre-temps par un autre annotateur sur la même image sont conservées.
+        """
+        anciennes = {ann["uuid"]: ann for ann in avant}
+        nouvelles = {ann["uuid"]: ann for ann in apres}
+
+        def operation(curseur):
+            self._declarer_image(curseur, image_name)
+            curseur.executemany("DELETE FROM annotations WHERE uuid = ?", [(u,) for u in anciennes if u not in nouvelles])
+            for u, ann in nouvelles.items():
+                donnees = json.dumps(ann, ensure_ascii=False)
+                if u not in anciennes:
+                    curseur.execute(
+                        "INSERT OR REPLACE INTO annotations (uuid, image_name, position, donnees) VALUES "
+                        "(?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM annotations WHERE image_name = ?), ?)",
+                        (u, image_name, image_name, donnees)
+                    )
+                elif ann != anciennes[u]:
+                    curseur.execute("UPDATE annotations SET donnees = ? WHERE uuid = ?", (donnees, u))
+        self._ecrire(operation, image_name)
+
+    # --- Écritures groupées (recalcul des angles, corrections, import JSON) ---
+    def enregistrer_images(self, annotations, images):
+        """Remplace les annotations des images données par celles du dict, en une seule transaction."""
+        images = [img for img in dict.fromkeys(images) if img in annotations]
+        if images:
+            self._ecrire(lambda curseur: [self._remplacer_image(curseur, img, annotations[img]) for img in images], *images)
+
+    def importer_json(self, annotations):
+        """Remplace tout le contenu de la base par le dict (format annotations.json)."""
+        def operation(curseur):
+            curseur.execute("DELETE FROM annotations")
+            curseur.execute("DELETE FROM images")
+            for img, liste in annotations.items():
+                self._remplacer_image(curseur, img, liste)
+        self._ecrire(operation, *annotations)
+
+    # --- Lectures ---
+    # La connexion est partagée par toutes les sessions (ouvrir_base_annotations) : chaque lecture prend le verrou,
+    # sinon elle pourrait voir les lignes d'une transaction d'écriture encore ouverte (puis annulée) d'un autre thread
+    def annotations_image(self, image_name):
+        with self.verrou:
+            lignes = self.connexion.execute(
+                "SELECT donnees FROM annotations WHERE image_name = ? ORDER BY position", (image_name,)
+            ).fetchall()
+        return [json.loads(donnees) for (donnees,) in lignes]
+
+    def charger(self):
+        """Retourne (annotations au format annotations.json, dernière séquence de changement lue)."""
+        with self.verrou:
+            curseur = self.connexion.cursor()
+            curseur.execute("BEGIN")
+            seq = self._derniere_sequence(curseur)
+            annotations = {img: [] for (img,) in curseur.execute("SELECT image_name FROM images ORDER BY rang")}
+            for img, donnees in curseur.execute(
+                "SELECT a.image_name, a.donnees FROM annotations a JOIN images i USING (image_name) ORDER BY i.rang, a.position"
+            ):
+                annotations[img].append(json.loads(donnees))
+            curseur.execute("COMMIT")
+        return annotations, seq
+
+    @staticmethod
+    def _derniere_sequence(curseur):
+        return curseur.execute("SELECT COALESCE(MAX(seq), 0) FROM changements").fetchone()[0]
+
+    def derniere_sequence(self):
+        with self.verrou:
+            return self._derniere_sequence(self.connexion.cursor())
+
+    def changements_depuis(self, seq):
+        """Retourne (images modifiées depuis la séquence seq, nouvelle séquence) : une requête sur l'index de seq."""
+        with self.verrou:
+            lignes = self.connexion.execute(
+                "SELECT seq, image_name FROM changements WHERE seq > ? ORDER BY seq", (seq,)
+            ).fetchall()
+        if not lignes:
+            return [], seq
+        return list(dict.fromkeys(img for _, img in lignes)), lignes[-1][0]
+
+    def exporter_json(self, annotations_file):
+        """Écrit annotations.json à partir de la base (traitements qui lisent le JSON, compatibilité)."""
+        annotations, _ = self.charger()
+        sauvegarder_annotations(annotations_file, annotations)
+        return annotations
+
+@st.cache_resource(show_spinner=False)
+# Une connexion par base et par processus, partagée par les sessions Streamlit (écritures sérialisées par un verrou)
+def ouvrir_base_annotations(chemin):
+    return BaseAnnotations(chemin)
+
+# Lecture des annotations d'un dossier : base partagée si elle existe, sinon annotations.json
+def charger_annotations_campagne(image_folder):
+    chemin = chemin_base_annotations(image_folder)
+    if os.path.exists(chemin):
+        return BaseAnnotations(chemin).charger()[0]
+    return charger_annotations(os.path.join(image_folder, "annotations.json"))
+
+# Écriture des annotations d'un dossier (traitements en ligne de commande)
+def sauvegarder_annotations_campagne(image_folder, annotations, images=None):
+    """Base partagée : seules les images données (toutes par défaut) sont réécrites ; sinon annotations.json."""
+    chemin = chemin_base_annotations(image_folder)
+    if os.path.exists(chemin):
+        BaseAnnotations(chemin).enregistrer_images(annotations, annotations if images is None else images)
+    else:
+        sauvegarder_annotations(os.path.join(image_folder, "annotations.json"), annotations)
@@ -0,0 +1,459 @@
+# -----------------------------------------------------------------------------
+# Version 1.1 PhotoMapon
+# Auteur      : Joseph Jacquet | Carte et Liens
+# Contact     : contact@carteetliens.fr | www.carteetliens.fr
+# Licence     : Ce projet est publié sous la licence GNU GPL v3.
+# Description : (video_utils.py) Extraction d'images géolocalisées depuis une vidéo (télémétrie GoPro, trace GPX ou CSV)
+# -----------------------------------------------------------------------------
+
+import os
+import csv
+import json
+import math
+import struct
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import xml.etree.ElementTree as ET
+from PIL import Image
+
+FORMATS_VIDEO = (".mp4", ".mov")
+# Intervalle d'extraction par défaut (mètres parcourus)
+PAS_DISTANCE_DEFAUT = 5.0
+# Demi-longueur de trace (mètres) utilisée pour calculer le cap de déplacement
+DISTANCE_CAP = 3.0
+# Au-delà de cet écart (images) entre deux images extraites, repositionnement dans la vidéo au lieu du décodage continu
+SAUT_MAX_IMAGES = 150
+QUALITE_JPEG = 92
+RAYON_TERRE = 6371008.8
+
+# Colonnes reconnues dans les traces CSV (noms en minuscules, séparateur , ; ou tabulation)
+COLONNES_TEMPS = ("temps", "t", "secondes", "seconds", "time_s")
+COLONNES_HORODATAGE = ("horodatage", "date", "datetime", "timestamp", "time")
+COLONNES_LATITUDE = ("latitude", "lat")
+COLONNES_LONGITUDE = ("longitude", "lon", "lng")
+COLONNES_DIRECTION = ("direction", "cap", "heading", "course")
+
+
+# Trace : dict {"temps": secondes depuis le début de la trace ou None, "horodatage": secondes epoch ou None,
+#               "latitude", "longitude", "direction" (ou None) : listes, "modele": nom de l'appareil ou None}
+
+# ----------------------------------------------------------------------------- Traces GPX / CSV
+
+def _horodatage(texte, utc_par_defaut):
+    date = datetime.fromisoformat(texte.strip())
+    if date.tzinfo is None and utc_par_defaut:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+def _nom_balise(element):
+    return element.tag.rsplit("}", 1)[-1].lower()
+
+# Trace GPX (points de trace ou de route, heure UTC ; cap lu dans <course> / <heading> s'il est présent)
+def lire_trace_gpx(chemin):
+    horodatage, latitude, longitude, direction = [], [], [], []
+    for element in ET.parse(chemin).getroot().iter():
+        if _nom_balise(element) not in ("trkpt", "rtept"):
+            continue
+        enfants = {_nom_balise(e): e.text for e in element.iter() if e is not element and e.text}
+        if "time" not in enfants:
+            continue
+        horodatage.append(_horodatage(enfants["time"], utc_par_defaut=True))
+        latitude.append(float(element.get("lat")))
+        longitude.append(float(element.get("lon")))
+        cap = enfants.get("course", enfants.get("heading"))
+        direction.append(float(cap) if cap is not None else None)
+    if not horodatage:
+        raise ValueError(f"Aucun point horodaté dans la trace GPX : {chemin}")
+    return {"temps": None, "horodatage": horodatage, "latitude": latitude, "longitude": longitude,
+            "direction": direction if None not in direction else None, "modele": None}
+
+# Trace CSV : temps en secondes depuis le début (colonne temps) ou date ISO (colonne horodatage, heure locale si sans fuseau)
+def lire_trace_csv(chemin):
+    with open(chemin, "r", encoding="utf-8-sig", newline="") as f:
+        dialecte = csv.Sniffer().sniff(f.readline(), delimiters=",;\t")
+        f.seek(0)
+        lignes = list(csv.DictReader(f, dialect=dialecte))
+    if not lignes:
+        raise ValueError(f"Trace CSV vide : {chemin}")
+    colonnes = {c.strip().lower(): c for c in lignes[0]}
+
+    def colonne(noms, obligatoire=True):
+        for nom in noms:
+            if nom in colonnes:
+                return colonnes[nom]
+        if obligatoire:
+            raise ValueError(f"Colonne manquante dans {chemin} : {' / '.join(noms)}")
+        return None
+
+    col_lat, col_lon = colonne(COLONNES_LATITUDE), colonne(COLONNES_LONGITUDE)
+    col_temps = colonne(COLONNES_TEMPS, obligatoire=False)
+    col_horodatage = None if col_temps else colonne(COLONNES_HORODATAGE)
+    col_direction = colonne(COLONNES_DIRECTION, obligatoire=False)
+    lignes = [l for l in lignes if l[col_lat] and l[col_lon]]
+    return {
+        "temps": [float(l[col_temps]) for l in lignes] if col_temps else None,
+        "horodatage": [_horodatage(l[col_horodatage], utc_par_defaut=False) for l in lignes] if col_horodatage else None,
+        "latitude": [float(l[col_lat]) for l in lignes],
+        "longitude": [float(l[col_lon]) for l in lignes],
+        "direction": [float(l[col_direction]) for l in lignes] if col_direction and all(l[col_direction] for l in lignes) else None,
+        "modele": None
+    }
+
+# ----------------------------------------------------------------------------- Télémétrie GoPro (GPMF)
+
+def _boites(donnees, debut=0, fin=None):
+    """Boîtes MP4 (type, début des données, fin) contenues dans donnees[debut:fin]."""
+    fin = len(donnees) if fin is None else fin
+    while debut + 8 <= fin:
+        taille, type_boite = struct.unpack(">I4s", donnees[debut:debut + 8])
+        entete = 8
+        if taille == 1:
+            taille = struct.unpack(">Q", donnees[debut + 8:debut + 16])[0]
+            entete = 16
+        elif taille == 0:
+            taille = fin - debut
+        if taille < entete:
+            return
+        yield type_boite.decode("latin-1"), debut + entete, debut + taille
+        debut += taille
+
+def _lire_moov(chemin_video):
+    """Contenu de la boîte moov, sans lire les données vidéo (mdat est sauté)."""
+    with open(chemin_video, "rb") as f:
+        while True:
+            entete = f.read(8)
+            if len(entete) < 8:
+                return None
+            taille, type_boite = struct.unpack(">I4s", entete)
+            lu = 8
+            if taille == 1:
+                taille = struct.unpack(">Q", f.read(8))[0]
+                lu = 16
+            if type_boite == b"moov":
+                return f.read(taille - lu)
+            if taille == 0:
+                return None
+            f.seek(taille - lu, os.SEEK_CUR)
+
+def _enfant(donnees, chemin_boites, debut=0, fin=None):
+    for nom in chemin_boites:
+        for type_boite, d, f in _boites(donnees, debut, fin):
+            if type_boite == nom:
+                debut, fin = d, f
+                break
+        else:
+            return None
+    return debut, fin
+
+def _echantillons_gpmd(moov):
+    """(position dans le fichier, taille, début en s, durée en s) des échantillons de la piste de métadonnées GoPro."""
+    for type_boite, debut, fin in _boites(moov):
+        if type_boite != "trak":
+            continue
+        stbl = _enfant(moov, ("mdia", "minf", "stbl"), debut, fin)
+        mdhd = _enfant(moov, ("mdia", "mdhd"), debut, fin)
+        stsd = stbl and _enfant(moov, ("stsd",), *stbl)
+        if not stsd or not mdhd or moov[stsd[0] + 12:stsd[0] + 16] != b"gpmd":
+            continue
+        version = moov[mdhd[0]]
+        echelle = struct.unpack(">I", moov[mdhd[0] + (20 if version == 1 else 12):][:4])[0]
+        tables = {t: (d, f) for t, d, f in _boites(moov, *stbl)}
+        # Durées (stts)
+        d = tables["stts"][0]
+        durees = []
+        for i in range(struct.unpack(">I", moov[d + 4:d + 8])[0]):
+            nombre, delta = struct.unpack(">II", moov[d + 8 + 8 * i:d + 16 + 8 * i])
+            durees += [delta] * nombre
+        # Tailles (stsz)
+        d = tables["stsz"][0]
+        taille_fixe, nombre = struct.unpack(">II", moov[d + 4:d + 12])
+        tailles = [taille_fixe] * nombre if taille_fixe else list(struct.unpack(f">{nombre}I", moov[d + 12:d + 12 + 4 * nombre]))
+        # Positions des blocs (stco / co64) et nombre d'échantillons par bloc (stsc)
+        if "co64" in tables:
+            d = tables["co64"][0]
+            n = struct.unpack(">I", moov[d + 4:d + 8])[0]
+            blocs = struct.unpack(f">{n}Q", moov[d + 8:d + 8 + 8 * n])
+        else:
+            d = tables["stco"][0]
+            n = struct.unpack(">I", moov[d + 4:d + 8])[0]
+            blocs = struct.unpack(f">{n}I", moov[d + 8:d + 8 + 4 * n])
+        d = tables["stsc"][0]
+        entrees = [struct.unpack(">III", moov[d + 8 + 12 * i:d + 20 + 12 * i])[:2]
+                   for i in range(struct.unpack(">I", moov[d + 4:d + 8])[0])]
+        echantillons, numero, temps = [], 0, 0
+        for b, position in enumerate(blocs, start=1):
+            par_bloc = [n for premier, n in entrees if premier <= b][-1]
+            for _ in range(par_bloc):
+                if numero >= len(tailles):
+                    break
+                echantillons.append((position, tailles[numero], temps / echelle, durees[numero] / echelle))
+                position += tailles[numero]
+                temps += durees[numero]
+                numero += 1
+        return echantillons
+    return []
+
+_FORMATS_GPMF = {"b": "b", "B": "B", "s": "h", "S": "H", "l": "i", "L": "I", "f": "f", "d": "d", "j": "q", "J": "Q"}
+
+def _klv(donnees):
+    """Entrées GPMF (clé, type, taille d'une structure, répétitions, données) ; type "\\x00" = entrées imbriquées."""
+    debut = 0
+    while debut + 8 <= len(donnees):
+        cle = donnees[debut:debut + 4].decode("latin-1")
+        type_klv, taille, repetitions = chr(donnees[debut + 4]), donnees[debut + 5], struct.unpack(">H", donnees[debut + 6:debut + 8])[0]
+        longueur = taille * repetitions
+        yield cle, type_klv, taille, repetitions, donnees[debut + 8:debut + 8 + longueur]
+        debut += 8 + (longueur + 3) // 4 * 4
+
+def _valeurs(type_klv, taille, repetitions, donnees):
+    fmt = _FORMATS_GPMF[type_klv]
+    nombre = taille // struct.calcsize(fmt)
+    return [struct.unpack(f">{nombre}{fmt}", donnees[i * taille:(i + 1) * taille]) for i in range(repetitions)]
+
+def _gps_echantillon(donnees):
+    """Points GPS5 (lat, lon) d'un échantillon GPMF, date UTC du premier point (GPSU) et nom de l'appareil (DVNM)."""
+    points, date_utc, modele = [], None, None
+    for cle, type_klv, taille, repetitions, contenu in _klv(donnees):
+        if cle != "DEVC" or type_klv != "\x00":
+            continue
+        for cle_d, type_d, taille_d, rep_d, contenu_d in _klv(contenu):
+            if cle_d == "DVNM" and type_d == "c":
+                modele = contenu_d.decode("latin-1").strip("\x00 ") or None
+            if cle_d != "STRM" or type_d != "\x00":
+                continue
+            echelle, fix, gps = None, 3, None
+            for cle_s, type_s, taille_s, rep_s, contenu_s in _klv(contenu_d):
+                if cle_s == "SCAL" and type_s in _FORMATS_GPMF:
+                    echelle = [v[0] for v in _valeurs(type_s, taille_s, rep_s, contenu_s)]
+                elif cle_s == "GPSF" and type_s in _FORMATS_GPMF:
+                    fix = _valeurs(type_s, taille_s, rep_s, contenu_s)[0][0]
+                elif cle_s == "GPSU" and type_s == "U":
+                    date_utc = datetime.strptime(contenu_s[:16].decode("ascii"), "%y%m%d%H%M%S.%f").replace(tzinfo=timezone.utc).timestamp()
+                elif cle_s == "GPS5" and type_s == "l":
+                    gps = _valeurs(type_s, taille_s, rep_s, contenu_s)
+            # Points retenus seulement avec un fix 2D ou 3D
+            if gps and echelle and fix >= 2:
+                echelle = echelle if len(echelle) >= 2 else echelle * 2
+                points += [(v[0] / echelle[0], v[1] / echelle[1]) for v in gps]
+    return points, date_utc, modele
+
+# Trace GPS enregistrée dans la vidéo par les caméras GoPro (flux GPMF GPS5), None si la vidéo n'en contient pas
+def lire_telemetrie_gopro(chemin_video):
+    moov = _lire_moov(chemin_video)
+    echantillons = _echantillons_gpmd(moov) if moov else []
+    if not echantillons:
+        return None
+    temps, latitude, longitude = [], [], []
+    debut_utc, modele = None, None
+    with open(chemin_video, "rb") as f:
+        for position, taille, debut, duree in echantillons:
+            f.seek(position)
+            points, date_utc, modele_echantillon = _gps_echantillon(f.read(taille))
+            modele = modele or modele_echantillon
+            if points and date_utc is not None and debut_utc is None:
+                debut_utc = date_utc - debut
+            # Points répartis uniformément sur la durée de l'échantillon
+            for i, (lat, lon) in enumerate(points):
+                temps.append(debut + duree * i / len(points))
+                latitude.append(lat)
+                longitude.append(lon)
+    if not temps:
+        return None
+    return {"temps": temps, "horodatage": None, "debut": debut_utc, "latitude": latitude, "longitude": longitude,
+            "direction": None, "modele": modele}
+
+# Trace de la vidéo : fichier GPX / CSV fourni, sinon télémétrie GoPro intégrée
+def lire_trace(chemin_video, chemin_trace=None):
+    if chemin_trace:
+        extension = os.path.splitext(chemin_trace)[1].lower()
+        return lire_trace_gpx(chemin_trace) if extension == ".gpx" else lire_trace_csv(chemin_trace)
+    trace = lire_telemetrie_gopro(chemin_video)
+    if trace is None:
+        raise ValueError(f"Pas de télémétrie GPS dans {os.path.basename(chemin_video)} : fournir une trace GPX ou CSV")
+    return trace
+
+# ----------------------------------------------------------------------------- Géolocalisation des images
+
+def caler_trace(trace, decalage=0.0):
+    """
+    Trace exprimée en secondes depuis le début de la vidéo (tableaux NumPy triés par temps).
+    decalage : position (s) du début de la vidéo dans la trace (0 = la vidéo commence avec la trace).
+    """
+    import numpy as np
+    if trace.get("temps") is not None:
+        temps = np.asarray(trace["temps"], dtype=float)
+        debut = trace.get("debut")
+    else:
+        horodatage = np.asarray(trace["horodatage"], dtype=float)
+        debut = float(horodatage.min())
+        temps = horodatage - debut
+    ordre = np.argsort(temps, kind="stable")
+    temps, indices = np.unique(temps[ordre], return_index=True)
+    ordre = ordre[indices]
+    latitude = np.asarray(trace["latitude"], dtype=float)[ordre]
+    longitude = np.asarray(trace["longitude"], dtype=float)[ordre]
+    # Distance parcourue (projection locale, suffisante pour quelques kilomètres)
+    lat0 = math.radians(float(np.mean(latitude)))
+    x = np.radians(longitude - longitude[0]) * RAYON_TERRE * math.cos(lat0)
+    y = np.radians(latitude - latitude[0]) * RAYON_TERRE
+    distance = np.concatenate([[0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))])
+    return {
+        "temps": temps - decalage, "latitude": latitude, "longitude": longitude, "x": x, "y": y,
+        # Strictement croissante pour l'interpolation (arrêts du véhicule)
+        "distance": distance + np.arange(len(distance)) * 1e-9,
+        "direction": np.asarray(trace["direction"], dtype=float)[ordre] if trace.get("direction") is not None else None,
+        "debut": debut + decalage if debut is not None else None,
+        "modele": trace.get("modele")
+    }
+
+# Instants (s) des images à extraire : tous les pas_temps secondes ou tous les pas_distance mètres
+def instants_extraction(trace, duree_video, pas_temps=None, pas_distance=PAS_DISTANCE_DEFAUT):
+    import numpy as np
+    debut = max(0.0, float(trace["temps"][0]))
+    fin = min(float(duree_video), float(trace["temps"][-1]))
+    if fin <= debut:
+        return np.empty(0)
+    if pas_temps:
+        return np.arange(debut, fin, pas_temps)
+    d_debut, d_fin = np.interp([debut, fin], trace["temps"], trace["distance"])
+    return np.interp(np.arange(d_debut, d_fin, pas_distance), trace["distance"], trace["temps"])
+
+# Position et cap interpolés aux instants donnés (cap de déplacement calculé sur la trace si elle n'en fournit pas)
+def geolocaliser_instants(trace, instants, decalage_cap=0.0):
+    import numpy as np
+    latitude = np.interp(instants, trace["temps"], trace["latitude"])
+    longitude = np.interp(instants, trace["temps"], trace["longitude"])
+    if trace["direction"] is not None:
+        cap = np.interp(instants, trace["temps"], np.degrees(np.unwrap(np.radians(trace["direction"]))))
+    elif trace["distance"][-1] >= 2 * DISTANCE_CAP:
+        # Cap entre les points de la trace situés DISTANCE_CAP mètres avant et après chaque image
+        distance = np.interp(instants, trace["temps"], trace["distance"])
+        avant = np.clip(distance - DISTANCE_CAP, 0, None)
+        apres = np.clip(distance + DISTANCE_CAP, None, trace["distance"][-1])
+        dx = np.interp(apres, trace["distance"], trace["x"]) - np.interp(avant, trace["distance"], trace["x"])
+        dy = np.interp(apres, trace["distance"], trace["y"]) - np.interp(avant, trace["distance"], trace["y"])
+        cap = np.degrees(np.arctan2(dx, dy))
+    else:
+        cap = None
+    if cap is not None:
+        cap = np.mod(cap + decalage_cap, 360.0)
+    return latitude, longitude, cap
+
+# ----------------------------------------------------------------------------- Extraction des images
+
+def _degres_dms(valeur):
+    valeur = abs(valeur)
+    degres = int(valeur)
+    minutes = int((valeur - degres) * 60)
+    return (degres, minutes, round((valeur - degres - minutes / 60) * 3600, 4))
+
+def _exif_image(entree):
+    """EXIF GPS de l'image extraite (relu par une réinitialisation des EXIF du dossier)."""
+    exif = Image.Exif()
+    if entree["date_time"]:
+        exif[306] = entree["date_time"]
+    if entree["modele_appareil"]:
+        exif[272] = entree["modele_appareil"]
+    gps = {1: "N" if entree["latitude"] >= 0 else "S", 2: _degres_dms(entree["latitude"]),
+           3: "E" if entree["longitude"] >= 0 else "W", 4: _degres_dms(entree["longitude"])}
+    if entree["direction"] is not None:
+        gps.update({16: "T", 17: round(entree["direction"], 2)})
+    exif[0x8825] = gps
+    return exif
+
+def _extraire_bloc(chemin_video, dossier_sortie, bloc, qualite, signaler):
+    """Décode un bloc d'images voisines : un repositionnement puis lecture continue (grab sans décodage des images sautées)."""
+    import cv2
+    capture = cv2.VideoCapture(chemin_video)
+    position = None
+    try:
+        for indice_image, nom, entree in bloc:
+            if position is None or not 0 <= indice_image - position <= SAUT_MAX_IMAGES:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, indice_image)
+                position = indice_image
+            while position < indice_image:
+                capture.grab()
+                position += 1
+            ok, image = capture.read()
+            position += 1
+            if not ok:
+                print(f"Image {indice_image} illisible dans {os.path.basename(chemin_video)}")
+                continue
+            # Une seule image décodée à la fois par bloc : mémoire bornée quelle que soit la durée de la vidéo
+            Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)).save(
+                os.path.join(dossier_sortie, nom), quality=qualite, exif=_exif_image(entree))
+            signaler(nom, entree)
+    finally:
+        capture.release()
+
+def extraire_images_video(chemin_video, dossier_sortie, chemin_trace=None, pas_temps=None, pas_distance=PAS_DISTANCE_DEFAUT,
+                          decalage_temps=0.0, decalage_cap=0.0, max_workers=None, qualite=QUALITE_JPEG, progression=None):
+    """
+    Extrait de la vidéo une image tous les pas_distance mètres (ou tous les pas_temps secondes), géolocalisée
+    par la trace (GPX / CSV, sinon télémétrie GoPro) : position interpolée, cap de la trace ou de déplacement
+    (+ decalage_cap pour une caméra non orientée vers l'avant).
+    Les images sont décodées par blocs d'images voisines répartis sur max_workers threads (OpenCV libère le GIL),
+    écrites en JPEG avec leurs EXIF GPS, et ajoutées à exif_data.json du dossier de sortie.
+    progression(extraites, total) est appelée après chaque image. Retourne les entrées EXIF ajoutées.
+    """
+    import cv2
+    import numpy as np
+
+    trace = caler_trace(lire_trace(chemin_video, chemin_trace), decalage_temps)
+    capture = cv2.VideoCapture(chemin_video)
+    if not capture.isOpened():
+        raise ValueError(f"Vidéo illisible : {chemin_video}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    nb_images = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+
+    instants = instants_extraction(trace, (nb_images - 1) / fps, pas_temps, pas_distance)
+    indices, uniques = np.unique(np.minimum(np.round(instants * fps).astype(int), nb_images - 1), return_index=True)
+    instants = instants[uniques]
+    latitude, longitude, cap = geolocaliser_instants(trace, instants, decalage_cap)
+
+    os.makedirs(dossier_sortie, exist_ok=True)
+    nom_video = os.path.splitext(os.path.basename(chemin_video))[0]
+    taches = []
+    for i, (indice_image, instant) in enumerate(zip(indices, instants)):
+        date = datetime.fromtimestamp(trace["debut"] + instant) if trace["debut"] is not None else None
+        taches.append((int(indice_image), f"{nom_video}_{i + 1:05d}.jpg", {
+            "latitude": float(latitude[i]),
+            "longitude": float(longitude[i]),
+            "direction": float(cap[i]) if cap is not None else None,
+            "image_format": "JPEG",
+            "date_time": date.strftime("%Y:%m:%d %H:%M:%S") if date else None,
+            "modele_appareil": trace["modele"]
+        }))
+
+    extraites = {}
+    verrou = threading.Lock()
+
+    def signaler(nom, entree):
+        with verrou:
+            extraites[nom] = entree
+            if progression:
+                progression(len(extraites), len(taches))
+
+    if not taches:
+        return extraites
+    nb_workers = max(1, min(max_workers or min(4, os.cpu_count() or 1), len(taches)))
+    # Blocs contigus : chaque thread ne se repositionne qu'une fois puis décode en continu
+    taille_bloc = math.ceil(len(taches) / nb_workers)
+    blocs = [taches[i:i + taille_bloc] for i in range(0, len(taches), taille_bloc)]
+    with ThreadPoolExecutor(max_workers=nb_workers) as pool:
+        for futur in [pool.submit(_extraire_bloc, chemin_video, dossier_sortie, bloc, qualite, signaler) for bloc in blocs]:
+            futur.result()
+
+    # Ajout à exif_data.json (les entrées des autres images du dossier sont conservées)
+    exif_file = os.path.join(dossier_sortie, "exif_data.json")
+    exif_data = {}
+    if os.path.exists(exif_file):
+        with open(exif_file, "r", encoding="utf-8") as f:
+            exif_data = json.load(f)
+    exif_data.update(dict(sorted(extraites.items())))
+    with open(f"{exif_file}.tmp", "w", encoding="utf-8") as f:
+        json.dump(exif_data, f, ensure_ascii=False, indent=2)
+    os.replace(f"{exif_file}.tmp", exif_file)
+    return extraites
@@ -10,6 +10,8 @@
 import streamlit.components.v1 as components
 from pathlib import Path
 import base64
+import json
+from utils.perf_utils import mesurer, noter_taille, perf_active
 
 _component_func = components.declare_component(
     "my_visu360",
@@ -33,8 +35,13 @@ def pannellum_viewer(
         hotspots = []
 
     # Encode l'image en base64 pour le frontend
-    with open(image_path, "rb") as f:
-        img_b64 = base64.b64encode(f.read()).decode()
+    with mesurer("pannellum_base64"):
+        with open(image_path, "rb") as f:
+            img_b64 = base64.b64encode(f.read()).decode()
+    if perf_active():
+        # Données envoyées au navigateur à chaque rerun : image encodée et hotspots
+        noter_taille("pannellum_image", len(img_b64) + 23)
+        noter_taille("pannellum_hotspots", len(json.dumps(hotspots, default=str)))
 
     # Appel du composant (Streamlit sérialise automatiquement les kwargs)
     return _component_func(